@@ -1,5 +1,4 @@
 
-
 library comfilter;
 use comfilter.all;
 
@@ -13,52 +12,48 @@ entity banked_shift_register is
     generic (
         name          : String;
         size          : Natural;
+        num_banks     : Natural := 2;
+        digit_bits    : Natural := 1;
         verbose_debug : Boolean := false);
     port (
-        reg_out             : out std_logic := '0';
+        reg_out             : out std_logic_vector(digit_bits - 1 downto 0) := (others => '0');
         negative_out        : out std_logic := '0';
         debug_out           : out std_logic_vector(size - 1 downto 0) := (others => '0');
         shift_right_in      : in std_logic := '0';
-        bank_select_in      : in std_logic := '0';
-        reg_in              : in std_logic := '0';
+        bank_select_in      : in Natural range 0 to num_banks - 1 := 0;
+        reg_in              : in std_logic_vector(digit_bits - 1 downto 0) := (others => '0');
         clock_in            : in std_logic := '0');
 end banked_shift_register;
 
 architecture structural of banked_shift_register is
-    signal reg_b0, negative_b0, shift_b0 : std_logic := '0';
-    signal reg_b1, negative_b1, shift_b1 : std_logic := '0';
-    signal debug_b0, debug_b1            : std_logic_vector(size - 1 downto 0) := (others => '0');
+    subtype t_value is std_logic_vector(size - 1 downto 0);
+    subtype t_digit is std_logic_vector(digit_bits - 1 downto 0);
+    type t_debug is array (0 to num_banks - 1) of t_value;
+    type t_digits is array (0 to num_banks - 1) of t_digit;
+    signal reg_b                        : t_digits := (others => (others => '0'));
+    signal negative_b, shift_b          : std_logic_vector(0 to num_banks - 1) := (others => '0');
+    signal debug_b                      : t_debug := (others => (others => '0'));
 begin
-    b0 : entity shift_register
-        generic map (
-            name => name & "_b0",
-            size => size,
-            verbose_debug => verbose_debug)
-        port map (
-            reg_out => reg_b0,
-            negative_out => negative_b0,
-            shift_right_in => shift_b0,
-            debug_out => debug_b0,
-            reg_in => reg_in,
-            clock_in => clock_in);
-
-    b1 : entity shift_register
-        generic map (
-            name => name & "_b1",
-            size => size,
-            verbose_debug => verbose_debug)
-        port map (
-            reg_out => reg_b1,
-            negative_out => negative_b1,
-            shift_right_in => shift_b1,
-            debug_out => debug_b1,
-            reg_in => reg_in,
-            clock_in => clock_in);
-
-    reg_out <= reg_b0 when bank_select_in = '0' else reg_b1;
-    negative_out <= negative_b0 when bank_select_in = '0' else negative_b1;
-    shift_b0 <= shift_right_in when bank_select_in = '0' else '0';
-    shift_b1 <= shift_right_in when bank_select_in = '1' else '0';
-    debug_out <= debug_b0 when bank_select_in = '0' else debug_b1;
+    banks : for bank in 0 to num_banks - 1 generate
+        b : entity shift_register
+            generic map (
+                name => name & "_b" & Integer'image(bank),
+                size => size,
+                digit_bits => digit_bits,
+                verbose_debug => verbose_debug)
+            port map (
+                reg_out => reg_b(bank),
+                negative_out => negative_b(bank),
+                shift_right_in => shift_b(bank),
+                debug_out => debug_b(bank),
+                reg_in => reg_in,
+                clock_in => clock_in);
+
+        shift_b(bank) <= shift_right_in when bank_select_in = bank else '0';
+    end generate banks;
+
+    reg_out <= reg_b(bank_select_in);
+    negative_out <= negative_b(bank_select_in);
+    debug_out <= debug_b(bank_select_in);
 end structural;
 
@@ -9,7 +9,11 @@ use filter_unit_settings.all;
 use debug_textio.all;
 
 entity filter_unit is
-    generic (print_outputs : Boolean := VERBOSE_DEBUG);
+    generic (print_outputs      : Boolean := VERBOSE_DEBUG;
+             trace_file         : String := "";
+             trace_first_sample : Natural := 0;
+             trace_last_sample  : Natural := Natural'high;
+             input_fifo_depth   : Natural := INPUT_FIFO_DEPTH);
     port (
         clock_in            : in std_logic := '0';
         reset_in            : in std_logic := '0';
@@ -18,6 +22,7 @@ entity filter_unit is
         input_strobe_in     : in std_logic := '0';
         input_data_in       : in std_logic_vector
             (FRACTIONAL_BITS + NON_FRACTIONAL_BITS - 1 downto 0) := (others => '0');
+        input_overflow_out  : out std_logic := '0';
         serial_ready_out    : out std_logic := '0';
         serial_data_out     : out std_logic := '0');
 end filter_unit;
@@ -44,6 +49,7 @@ architecture structural of filter_unit is
     signal SHIFT_R_RIGHT        : std_logic := '0';
     signal SHIFT_X_RIGHT        : std_logic := '0';
     signal SHIFT_Y_RIGHT        : std_logic := '0';
+    signal SIGN_EXTEND_A        : std_logic := '0';
 
     constant ASSERT_X_IS_ABS_O1 : std_logic_vector(3 downto 0) := x"1";
     constant ASSERT_A_HIGH_ZERO : std_logic_vector(3 downto 0) := x"2";
@@ -55,30 +61,61 @@ architecture structural of filter_unit is
 
     signal mux_select           : std_logic_vector(3 downto 0) := (others => '0');
     signal mux_strobe           : std_logic := '0';
+    signal bank_strobe          : std_logic := '0';
     signal debug_strobe         : std_logic := '0';
+    signal call_strobe          : std_logic := '0';
+    signal return_strobe        : std_logic := '0';
+    signal call_address         : std_logic_vector(UC_ADDR_BITS - 1 downto 0) := (others => '0');
     signal uc_code              : std_logic_vector(7 downto 0) := (others => '0');
+    signal decoder_code         : std_logic_vector(7 downto 0) := (others => '0');
     signal uc_valid             : std_logic := '0';
+    signal decoder_enable       : std_logic := '0';
+    signal digit_strobe         : std_logic := '0';
+    signal digit                : std_logic_vector(3 downto 0) := (others => '0');
+    signal uc_code_addr         : unsigned(UC_ADDR_BITS - 1 downto 0) := (others => '0');
 
-    signal bank_select          : std_logic := '0';
+    signal bank_select          : Natural range 0 to NUM_BANKS - 1 := 0;
     signal o1_is_negative       : std_logic := '0';
     signal y_is_negative        : std_logic := '0';
-    signal reg_out              : std_logic := '0';
-    signal r_out                : std_logic := '0';
-    signal y_out                : std_logic := '0';
-    signal o1_out               : std_logic := '0';
-    signal o2_out               : std_logic := '0';
-    signal x_out                : std_logic := '0';
-    signal l_out                : std_logic := '0';
-    signal i0_out               : std_logic := '0';
-    signal i1_out               : std_logic := '0';
-    signal i2_out               : std_logic := '0';
+    signal o2_is_negative       : std_logic := '0';
+    signal x_is_negative        : std_logic := '0';
+    signal l_is_negative        : std_logic := '0';
+    signal i1_is_negative       : std_logic := '0';
+    signal i2_is_negative       : std_logic := '0';
+    signal reg_is_negative      : std_logic := '0';
+
+    -- Each register shifts one digit of DIGIT_BITS bits per clock cycle
+    subtype t_digit is std_logic_vector(DIGIT_BITS - 1 downto 0);
+    signal zero_digit           : t_digit := (others => '0');
+    signal reg_out              : t_digit := (others => '0');
+    signal r_out                : t_digit := (others => '0');
+    signal y_out                : t_digit := (others => '0');
+    signal o1_out               : t_digit := (others => '0');
+    signal o2_out               : t_digit := (others => '0');
+    signal x_out                : t_digit := (others => '0');
+    signal l_out                : t_digit := (others => '0');
+    signal i0_out               : t_digit := (others => '0');
+    signal i1_out               : t_digit := (others => '0');
+    signal i2_out               : t_digit := (others => '0');
 
     signal l_debug_value        : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
     signal y_debug_value        : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
     signal x_debug_value        : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
     signal o1_debug_value       : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+    signal o2_debug_value       : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+    signal i0_debug_value       : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+
+    -- Input sample, either directly from the input or from the FIFO
+    signal sample_strobe        : std_logic := '0';
+    signal sample_data          : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+    signal sample_taken         : std_logic := '0';
+    signal i1_debug_value       : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+    signal i2_debug_value       : std_logic_vector(ALL_BITS - 1 downto 0) := (others => '0');
+    signal a_debug_value        : std_logic_vector(A_BITS - 1 downto 0) := (others => '0');
+    signal r_debug_value        : std_logic_vector(A_BITS - 1 downto 0) := (others => '0');
 begin
     zero <= '0';
+    zero_digit <= (others => '0');
 
     -- Control store and decoder
     cl_decoder : entity filter_unit_control_line_decoder
@@ -101,19 +138,38 @@ begin
                 SHIFT_R_RIGHT => SHIFT_R_RIGHT,
                 SHIFT_X_RIGHT => SHIFT_X_RIGHT,
                 SHIFT_Y_RIGHT => SHIFT_Y_RIGHT,
+                SIGN_EXTEND_A => SIGN_EXTEND_A,
                 mux_select => mux_select,
                 mux_strobe => mux_strobe,
+                bank_strobe => bank_strobe,
                 debug_strobe => debug_strobe,
-                enable_in => uc_valid,
-                code_in => uc_code);
+                call_strobe => call_strobe,
+                return_strobe => return_strobe,
+                call_address => call_address,
+                enable_in => decoder_enable,
+                code_in => decoder_code);
   
     -- Microcode unit
     uc : block
         signal uc_addr      : unsigned(UC_ADDR_BITS - 1 downto 0) := (others => '1');
         signal uc_addr_next : unsigned(UC_ADDR_BITS - 1 downto 0) := (others => '0');
-        signal bit_counter  : Natural range 0 to ALL_BITS - 1 := 0;
+        signal return_addr  : unsigned(UC_ADDR_BITS - 1 downto 0) := (others => '0');
+        signal bit_counter  : Natural range 0 to (ALL_BITS / DIGIT_BITS) - 1 := 0;
         signal more_bits    : std_logic := '0';
         signal uc_enable    : std_logic := '0';
+
+        -- REPEAT n (x"e0" .. x"fe") executes the last control code n more times
+        constant REPEAT_CODE    : unsigned(7 downto 0) := x"df";
+        signal last_code        : std_logic_vector(7 downto 0) := (others => '0');
+        signal repeat_strobe    : std_logic := '0';
+        -- MUL d (x"b1" .. x"bf") executes the last control code again, adding
+        -- d * A to R, and ADD d (x"d0" .. x"df") only adds d * A to R
+        signal mul_strobe       : std_logic := '0';
+        signal add_strobe       : std_logic := '0';
+        signal repeat_active    : std_logic := '0';
+        signal repeat_length    : unsigned(7 downto 0) := (others => '0');
+        signal repeat_counter   : unsigned(7 downto 0) := (others => '0');
+        signal more_repeats     : std_logic := '0';
     begin
         store : entity filter_unit_microcode_store 
             port map (
@@ -125,9 +181,41 @@ begin
         more_bits <= '1' when bit_counter /= 0 else '0';
         uc_enable <= '1' when RESTART = '1'
             else '1' when reset_in = '1'
-            else '0' when (LOAD_I0_FROM_INPUT and not input_strobe_in) = '1'
+            else '0' when (LOAD_I0_FROM_INPUT and not sample_strobe) = '1'
             else '0' when (REPEAT_FOR_ALL_BITS = '1' and more_bits = '1')
+            else '0' when more_repeats = '1'
             else '1';
+
+        repeat_strobe <= uc_valid when uc_code(7 downto 5) = "111" and uc_code /= x"ff" else '0';
+        mul_strobe <= uc_valid when uc_code(7 downto 4) = x"b" and uc_code(3 downto 0) /= x"0" else '0';
+        add_strobe <= uc_valid when uc_code(7 downto 4) = x"d" else '0';
+        decoder_code <= last_code when (repeat_strobe or mul_strobe) = '1' else uc_code;
+        decoder_enable <= uc_valid and not add_strobe;
+        digit_strobe <= mul_strobe or add_strobe;
+        digit <= uc_code(3 downto 0);
+        repeat_length <= unsigned(uc_code) - REPEAT_CODE;
+        -- The first cycle of REPEAT n is followed by n - 1 more
+        more_repeats <= '0' when repeat_strobe = '0'
+            else '1' when repeat_active = '0' and repeat_length /= 1
+            else '1' when repeat_active = '1' and repeat_counter /= 0
+            else '0';
+
+        process (clock_in) is
+        begin
+            if clock_in = '1' and clock_in'event then
+                if uc_valid = '1' and uc_code(7) = '0' then
+                    last_code <= uc_code;
+                end if;
+                repeat_active <= more_repeats;
+                if more_repeats = '1' then
+                    if repeat_active = '0' then
+                        repeat_counter <= repeat_length - 2;
+                    else
+                        repeat_counter <= repeat_counter - 1;
+                    end if;
+                end if;
+            end if;
+        end process;
         uc_addr_next <= uc_addr + 1;
 
         process (clock_in) is
@@ -139,8 +227,12 @@ begin
                     write (l, Integer'(ieee.numeric_std.to_integer(unsigned(uc_code))));
                     writeline (output, l);
                 end if;
-                bit_counter <= ALL_BITS - 1;
+                bit_counter <= (ALL_BITS / DIGIT_BITS) - 1;
                 uc_valid <= '1';
+                if uc_enable = '1' then
+                    -- Address of the next uc_code
+                    uc_code_addr <= uc_addr;
+                end if;
                 if reset_in = '1' or RESTART = '1' then
                     uc_addr <= (others => '0');
                     uc_valid <= '0'; -- Next uc_code won't be valid due to control flow
@@ -148,6 +240,24 @@ begin
                         write (l, String'("uc_addr -- reset"));
                         writeline (output, l);
                     end if;
+                elsif call_strobe = '1' then
+                    -- uc_addr is the address after the CALL
+                    return_addr <= uc_addr;
+                    uc_addr <= unsigned(call_address);
+                    uc_valid <= '0';
+                    if VERBOSE_DEBUG then
+                        write (l, String'("uc_addr -- call "));
+                        write (l, Integer'(ieee.numeric_std.to_integer(unsigned(call_address))));
+                        writeline (output, l);
+                    end if;
+                elsif return_strobe = '1' then
+                    uc_addr <= return_addr;
+                    uc_valid <= '0';
+                    if VERBOSE_DEBUG then
+                        write (l, String'("uc_addr -- return "));
+                        write (l, Integer'(ieee.numeric_std.to_integer(return_addr)));
+                        writeline (output, l);
+                    end if;
                 elsif uc_enable = '1' then
                     uc_addr <= uc_addr_next;
                     if VERBOSE_DEBUG then
@@ -179,12 +289,14 @@ begin
     x_register : block
         type x_select_enum is (PASSTHROUGH_REG_OUT, PASSTHROUGH_X, NEGATE_REG_OUT);
         signal x_select                     : x_select_enum := PASSTHROUGH_REG_OUT;
-        signal x_in_negate_reg_out, x_mux   : std_logic := '0';
-        signal negated                      : std_logic := '0';
+        signal x_mux                        : t_digit := (others => '0');
+        signal negated                      : t_digit := (others => '0');
     begin
         x_subtractor : entity subtractor
+            generic map (
+                    digit_bits => DIGIT_BITS)
             port map (
-                    x_in => zero,
+                    x_in => zero_digit,
                     y_in => reg_out,
                     reset_in => SET_X_IN_TO_ABS_O1_REG_OUT,
                     strobe_in => SHIFT_X_RIGHT,
@@ -199,13 +311,14 @@ begin
             generic map (
                     name => "X",
                     size => ALL_BITS,
+                    digit_bits => DIGIT_BITS,
                     verbose_debug => VERBOSE_DEBUG)
             port map (
                     reg_out => x_out,
                     shift_right_in => SHIFT_X_RIGHT,
                     reg_in => x_mux,
                     debug_out => x_debug_value,
-                    negative_out => open,
+                    negative_out => x_is_negative,
                     clock_in => clock_in);
 
         process (clock_in) is
@@ -228,9 +341,11 @@ begin
 
     -- Y register (special input via subtractor)
     y_register : block
-        signal y_in : std_logic := '0';
+        signal y_in : t_digit := (others => '0');
     begin
         y_subtractor : entity subtractor
+            generic map (
+                    digit_bits => DIGIT_BITS)
             port map (
                     x_in => x_out,
                     y_in => reg_out,
@@ -242,6 +357,7 @@ begin
             generic map (
                     name => "Y",
                     size => ALL_BITS,
+                    digit_bits => DIGIT_BITS,
                     verbose_debug => VERBOSE_DEBUG)
             port map (
                     reg_out => y_out,
@@ -264,12 +380,13 @@ begin
             if clock_in = '1' and clock_in'event then
                 print_i0 := false;
                 if LOAD_I0_FROM_INPUT = '1' then
-                    new_i0_value := input_data_in;
+                    new_i0_value := sample_data;
                     i0_value <= new_i0_value;
                     print_i0 := VERBOSE_DEBUG;
                 elsif SHIFT_I0_RIGHT = '1' then
-                    new_i0_value(ALL_BITS - 1) := reg_out;
-                    new_i0_value(ALL_BITS - 2 downto 0) := i0_value(ALL_BITS - 1 downto 1);
+                    new_i0_value(ALL_BITS - 1 downto ALL_BITS - DIGIT_BITS) := reg_out;
+                    new_i0_value(ALL_BITS - DIGIT_BITS - 1 downto 0) :=
+                        i0_value(ALL_BITS - 1 downto DIGIT_BITS);
                     i0_value <= new_i0_value;
                     print_i0 := VERBOSE_DEBUG;
                 end if;
@@ -280,7 +397,8 @@ begin
                 end if;
             end if;
         end process;
-        i0_out <= i0_value(0);
+        i0_out <= i0_value(DIGIT_BITS - 1 downto 0);
+        i0_debug_value <= i0_value;
     end block i0_register;
 
     -- Other registers
@@ -288,28 +406,34 @@ begin
         generic map (
                 name => "I1",
                 size => ALL_BITS,
+                digit_bits => DIGIT_BITS,
                 verbose_debug => VERBOSE_DEBUG)
         port map (
                 reg_out => i1_out,
                 shift_right_in => SHIFT_I1_RIGHT,
                 reg_in => reg_out,
-                negative_out => open,
+                debug_out => i1_debug_value,
+                negative_out => i1_is_negative,
                 clock_in => clock_in);
     i2_register : entity shift_register
         generic map (
                 name => "I2",
                 size => ALL_BITS,
+                digit_bits => DIGIT_BITS,
                 verbose_debug => VERBOSE_DEBUG)
         port map (
                 reg_out => i2_out,
                 shift_right_in => SHIFT_I2_RIGHT,
                 reg_in => reg_out,
-                negative_out => open,
+                debug_out => i2_debug_value,
+                negative_out => i2_is_negative,
                 clock_in => clock_in);
     o1_register : entity banked_shift_register
         generic map (
                 name => "O1",
                 size => ALL_BITS,
+                num_banks => NUM_BANKS,
+                digit_bits => DIGIT_BITS,
                 verbose_debug => VERBOSE_DEBUG)
         port map (
                 reg_out => o1_out,
@@ -323,18 +447,23 @@ begin
         generic map (
                 name => "O2",
                 size => ALL_BITS,
+                num_banks => NUM_BANKS,
+                digit_bits => DIGIT_BITS,
                 verbose_debug => VERBOSE_DEBUG)
         port map (
                 reg_out => o2_out,
                 shift_right_in => SHIFT_O2_RIGHT,
                 reg_in => reg_out,
                 bank_select_in => bank_select,
-                negative_out => open,
+                debug_out => o2_debug_value,
+                negative_out => o2_is_negative,
                 clock_in => clock_in);
     l_register : entity banked_shift_register
         generic map (
                 name => "L",
                 size => ALL_BITS,
+                num_banks => NUM_BANKS,
+                digit_bits => DIGIT_BITS,
                 verbose_debug => VERBOSE_DEBUG)
         port map (
                 reg_out => l_out,
@@ -342,14 +471,23 @@ begin
                 reg_in => reg_out,
                 bank_select_in => bank_select,
                 debug_out => l_debug_value,
-                negative_out => open,
+                negative_out => l_is_negative,
                 clock_in => clock_in);
 
     -- Adder and A, R registers
     ar_registers : block
         signal a_value : signed(A_BITS - 1 downto 0) := (others => '0');
         signal r_value : signed(A_BITS - 1 downto 0) := (others => '0');
+        signal a_in    : t_digit := (others => '0');
+        signal add_a   : std_logic := '0';
+        -- A is multiplied by a digit from MUL or ADD, otherwise by 1
+        signal a_factor : unsigned(DIGIT_BITS downto 0) := (others => '0');
     begin
+        a_in <= (others => reg_is_negative) when SIGN_EXTEND_A = '1' else reg_out;
+        add_a <= ADD_A_TO_R or digit_strobe;
+        a_factor <= '0' & unsigned(digit(DIGIT_BITS - 1 downto 0)) when digit_strobe = '1'
+            else to_unsigned(1, DIGIT_BITS + 1);
+
         process (clock_in) is
             variable l : line;
             variable new_a_value : signed(A_BITS - 1 downto 0) := (others => '0');
@@ -359,8 +497,9 @@ begin
             if clock_in = '1' and clock_in'event then
                 print_r := false;
                 if SHIFT_A_RIGHT = '1' then
-                    new_a_value(A_BITS - 1) := reg_out;
-                    new_a_value(A_BITS - 2 downto 0) := a_value(A_BITS - 1 downto 1);
+                    new_a_value(A_BITS - 1 downto A_BITS - DIGIT_BITS) := signed(a_in);
+                    new_a_value(A_BITS - DIGIT_BITS - 1 downto 0) :=
+                        a_value(A_BITS - 1 downto DIGIT_BITS);
                     a_value <= new_a_value;
                     if VERBOSE_DEBUG then
                         write (l, String'("A := "));
@@ -368,13 +507,14 @@ begin
                         writeline (output, l);
                     end if;
                 end if;
-                if ADD_A_TO_R = '1' then
-                    new_r_value := r_value + a_value;
+                if add_a = '1' then
+                    new_r_value := r_value + signed(resize(unsigned(a_value) * a_factor, A_BITS));
                     r_value <= new_r_value;
                     print_r := VERBOSE_DEBUG;
                 elsif SHIFT_R_RIGHT = '1' then
-                    new_r_value(A_BITS - 1) := '0';
-                    new_r_value(A_BITS - 2 downto 0) := r_value(A_BITS - 1 downto 1);
+                    new_r_value(A_BITS - 1 downto A_BITS - DIGIT_BITS) := (others => '0');
+                    new_r_value(A_BITS - DIGIT_BITS - 1 downto 0) :=
+                        r_value(A_BITS - 1 downto DIGIT_BITS);
                     r_value <= new_r_value;
                     print_r := VERBOSE_DEBUG;
                 end if;
@@ -397,15 +537,19 @@ begin
                 end if;
             end if;
         end process;
-        r_out <= r_value(0);
+        r_out <= std_logic_vector(r_value(DIGIT_BITS - 1 downto 0));
+        r_debug_value <= std_logic_vector(r_value);
+        a_debug_value <= std_logic_vector(a_value);
     end block ar_registers;
 
     -- Register multiplexer
     mux : block
-        signal reg_mux      : std_logic_vector(15 downto 0) := (others => '0');
+        type t_reg_mux is array (0 to 15) of t_digit;
+        signal reg_mux      : t_reg_mux := (others => (others => '0'));
+        signal negative_mux : std_logic_vector(15 downto 0) := (others => '0');
         signal mux_register : Natural range 0 to 15 := 0;
     begin
-        reg_mux(0) <= '0'; -- ZERO = 0
+        reg_mux(0) <= (others => '0'); -- ZERO = 0
         reg_mux(1) <= r_out; -- R = 1
         reg_mux(2) <= y_out; -- Y = 2
         reg_mux(3) <= o1_out; -- O1 = 3
@@ -415,9 +559,23 @@ begin
         reg_mux(7) <= i0_out; -- I0 = 7
         reg_mux(8) <= i1_out; -- I1 = 8
         reg_mux(9) <= i2_out; -- I2 = 9
-        reg_mux(15 downto 10) <= (others => '1'); -- ONE = 10
+        reg_mux(10 to 15) <= (others => (others => '1')); -- ONE = 10
         reg_out <= reg_mux(mux_register);
 
+        -- Sign of the selected register, for SIGN_EXTEND_A
+        negative_mux(0) <= '0';
+        negative_mux(1) <= r_debug_value(ALL_BITS - 1);
+        negative_mux(2) <= y_is_negative;
+        negative_mux(3) <= o1_is_negative;
+        negative_mux(4) <= o2_is_negative;
+        negative_mux(5) <= x_is_negative;
+        negative_mux(6) <= l_is_negative;
+        negative_mux(7) <= i0_debug_value(ALL_BITS - 1);
+        negative_mux(8) <= i1_is_negative;
+        negative_mux(9) <= i2_is_negative;
+        negative_mux(15 downto 10) <= (others => '1');
+        reg_is_negative <= negative_mux(mux_register);
+
         process (clock_in) is
             variable l : line;
         begin
@@ -425,9 +583,6 @@ begin
                 if mux_strobe = '1' then
                     mux_register <= ieee.numeric_std.to_integer(unsigned(mux_select));
                     case ieee.numeric_std.to_integer(unsigned(mux_select)) is
-                        when 14 =>
-                            -- bank switch
-                            bank_select <= not bank_select;
                         when 15 =>
                             -- L or X
                             if y_is_negative = '1' then
@@ -444,6 +599,14 @@ begin
                         writeline (output, l);
                     end if;
                 end if;
+                if bank_strobe = '1' then
+                    bank_select <= ieee.numeric_std.to_integer(unsigned(mux_select));
+                    if VERBOSE_DEBUG then
+                        write (l, String'("bank select = "));
+                        write (l, ieee.numeric_std.to_integer(unsigned(mux_select)));
+                        writeline (output, l);
+                    end if;
+                end if;
             end if;
         end process;
     end block mux;
@@ -484,11 +647,174 @@ begin
         end process;
     end block debug;
 
+    -- Execution trace, written if trace_file is set: see microops/exec_trace.py
+    -- for the format. Each record is written on the clock edge after the
+    -- operation executes, so that it has the new register values. This is
+    -- not elaborated for synthesis, as trace_file is empty by default.
+    trace : if trace_file /= "" generate
+        constant NUM_FIELDS     : Natural := 11;
+        constant SAMPLE_FIELD   : Natural := NUM_FIELDS - 1;
+        constant VALUE_BYTES    : Natural := 4 + (4 * Boolean'pos(A_BITS > 32));
+        subtype t_value is unsigned((VALUE_BYTES * 8) - 1 downto 0);
+        type t_values is array (0 to NUM_FIELDS - 1) of t_value;
+        type t_char_file is file of character;
+        signal executing        : std_logic := '0';
+    begin
+        -- Not executing while waiting for input or fetching after RESTART
+        executing <= uc_valid and not reset_in
+                        and not (LOAD_I0_FROM_INPUT and not sample_strobe);
+
+        process (clock_in) is
+            file trace_fd               : t_char_file;
+            variable is_open            : Boolean := false;
+            variable block_data         : line := null;
+            variable block_records      : Natural := 0;
+            variable block_bytes        : Natural := 0;
+            variable pending            : Boolean := false;
+            variable pending_restart    : Boolean := false;
+            variable pending_address    : Natural := 0;
+            variable pending_code       : std_logic_vector(7 downto 0) := (others => '0');
+            variable sample             : Natural := 0;
+            variable values             : t_values := (others => (others => '0'));
+            variable previous           : t_values := (others => (others => '0'));
+            variable mask               : Natural := 0;
+
+            procedure write_number (value : Natural; size : Natural) is
+                variable v : Natural := value;
+            begin
+                for i in 1 to size loop
+                    write (trace_fd, character'val(v mod 256));
+                    v := v / 256;
+                end loop;
+            end write_number;
+
+            procedure put_number (value : Natural; size : Natural) is
+                variable v : Natural := value;
+            begin
+                for i in 1 to size loop
+                    std.textio.write (block_data, character'val(v mod 256));
+                    v := v / 256;
+                end loop;
+                block_bytes := block_bytes + size;
+            end put_number;
+
+            procedure put_value (value : t_value) is
+            begin
+                for i in 0 to VALUE_BYTES - 1 loop
+                    std.textio.write (block_data, character'val(ieee.numeric_std.to_integer(
+                                            value((i * 8) + 7 downto i * 8))));
+                end loop;
+                block_bytes := block_bytes + VALUE_BYTES;
+            end put_value;
+
+            procedure flush_block is
+            begin
+                if block_records /= 0 then
+                    write_number (block_records, 4);
+                    write_number (block_bytes, 4);
+                    for i in block_data'range loop
+                        write (trace_fd, block_data(i));
+                    end loop;
+                end if;
+                std.textio.deallocate (block_data);
+                block_data := new String'("");
+                block_records := 0;
+                block_bytes := 0;
+            end flush_block;
+        begin
+            if clock_in = '1' and clock_in'event then
+                if not is_open then
+                    file_open (trace_fd, trace_file, WRITE_MODE);
+                    write (trace_fd, 'C');
+                    write (trace_fd, 'F');
+                    write (trace_fd, 'T');
+                    write (trace_fd, 'R');
+                    write_number (1, 1); -- version
+                    write_number (NUM_FIELDS, 1);
+                    write_number (VALUE_BYTES, 1);
+                    block_data := new String'("");
+                    is_open := true;
+                end if;
+
+                -- Record the operation executed in the previous cycle
+                if pending and sample >= trace_first_sample and sample < trace_last_sample then
+                    values(0) := resize(unsigned(r_debug_value), t_value'length);
+                    values(1) := resize(unsigned(y_debug_value), t_value'length);
+                    values(2) := resize(unsigned(o1_debug_value), t_value'length);
+                    values(3) := resize(unsigned(o2_debug_value), t_value'length);
+                    values(4) := resize(unsigned(x_debug_value), t_value'length);
+                    values(5) := resize(unsigned(l_debug_value), t_value'length);
+                    values(6) := resize(unsigned(i0_debug_value), t_value'length);
+                    values(7) := resize(unsigned(i1_debug_value), t_value'length);
+                    values(8) := resize(unsigned(i2_debug_value), t_value'length);
+                    values(9) := resize(unsigned(a_debug_value), t_value'length);
+                    values(SAMPLE_FIELD) := to_unsigned(sample, t_value'length);
+                    mask := 0;
+                    for i in NUM_FIELDS - 1 downto 0 loop
+                        mask := mask * 2;
+                        if block_records = 0 or values(i) /= previous(i) then
+                            mask := mask + 1;
+                        end if;
+                    end loop;
+                    put_number (pending_address, 2);
+                    put_number (ieee.numeric_std.to_integer(unsigned(pending_code)), 1);
+                    put_number (mask, 2);
+                    for i in 0 to NUM_FIELDS - 1 loop
+                        if block_records = 0 or values(i) /= previous(i) then
+                            put_value (values(i));
+                        end if;
+                    end loop;
+                    previous := values;
+                    block_records := block_records + 1;
+                end if;
+                if pending and pending_restart then
+                    flush_block;
+                end if;
+
+                pending := executing = '1';
+                if executing = '1' then
+                    if LOAD_I0_FROM_INPUT = '1' then
+                        sample := sample + 1;
+                    end if;
+                    pending_restart := RESTART = '1';
+                    pending_address := ieee.numeric_std.to_integer(uc_code_addr);
+                    pending_code := uc_code;
+                end if;
+            end if;
+        end process;
+    end generate trace;
+
+    -- Input: without a FIFO, a sample is only accepted while waiting in
+    -- LOAD_I0_FROM_INPUT, and is lost otherwise
+    no_fifo : if input_fifo_depth = 0 generate
+        sample_strobe <= input_strobe_in;
+        sample_data <= input_data_in;
+        input_ready_out <= LOAD_I0_FROM_INPUT;
+    end generate no_fifo;
+
+    fifo : if input_fifo_depth > 0 generate
+        -- The sample is taken in the cycle where LOAD_I0_FROM_INPUT completes
+        sample_taken <= LOAD_I0_FROM_INPUT and sample_strobe and not reset_in;
+
+        f : entity input_fifo
+            generic map (
+                depth => input_fifo_depth,
+                data_bits => ALL_BITS)
+            port map (
+                write_strobe_in => input_strobe_in,
+                write_data_in => input_data_in,
+                write_ready_out => input_ready_out,
+                overflow_out => input_overflow_out,
+                read_strobe_in => sample_taken,
+                read_ready_out => sample_strobe,
+                read_data_out => sample_data,
+                reset_in => reset_in,
+                clock_in => clock_in);
+    end generate fifo;
 
     -- Output
     serial_data_out <= y_is_negative;
     serial_ready_out <= SEND_Y_TO_OUTPUT;
-    input_ready_out <= LOAD_I0_FROM_INPUT;
     restart_debug_out <= RESTART;
 end structural;
 
@@ -9,6 +9,14 @@ use filter_unit_settings.all;
 use debug_textio.all;
 
 entity ghdl_test_top_level is
+    generic (trace_file         : String := "";
+             trace_first_sample : Natural := 0;
+             trace_last_sample  : Natural := Natural'high;
+             wave_file          : String := "";
+             wave_first_sample  : Natural := 0;
+             wave_last_sample   : Natural := Natural'high;
+             wave_signals       : String := "";
+             deadline           : Natural := 2000);
 end ghdl_test_top_level;
 
 architecture structural of ghdl_test_top_level is
@@ -35,7 +43,10 @@ begin
                 reset_out => reset);
 
     test_filter_unit : entity filter_unit
-        generic map (print_outputs => true)
+        generic map (print_outputs => true,
+                trace_file => trace_file,
+                trace_first_sample => trace_first_sample,
+                trace_last_sample => trace_last_sample)
         port map (clock_in => clock,
                 reset_in => reset,
                 input_strobe_in => input_strobe,
@@ -45,12 +56,307 @@ begin
                 serial_ready_out => data_strobe,
                 serial_data_out => data_value);
 
+    -- Waveform of the signals named in wave_signals (separated by commas, or
+    -- all signals if empty), written to wave_file in VCD format. Values are
+    -- only written while the sample number (counted as in the trace) is from
+    -- wave_first_sample to wave_last_sample - 1, so the rest of the simulation
+    -- runs at full speed, and the file only contains the part of interest.
+    -- There is one value per clock cycle: the value sampled at a rising edge
+    -- is timed from the previous edge.
+    -- The signals are internal to filter_unit, and are reached through
+    -- VHDL-2008 external names, so filter_unit itself has no waveform code.
+    -- This generate must follow test_filter_unit, which is elaborated first.
+    wave : if wave_file /= "" generate
+        alias uc_code_addr                     is <<signal .ghdl_test_top_level.test_filter_unit.uc_code_addr : unsigned(UC_ADDR_BITS - 1 downto 0)>>;
+        alias uc_code                          is <<signal .ghdl_test_top_level.test_filter_unit.uc_code : std_logic_vector(7 downto 0)>>;
+        alias uc_valid                         is <<signal .ghdl_test_top_level.test_filter_unit.uc_valid : std_logic>>;
+        alias digit                            is <<signal .ghdl_test_top_level.test_filter_unit.digit : std_logic_vector(3 downto 0)>>;
+        alias mux_select                       is <<signal .ghdl_test_top_level.test_filter_unit.mux_select : std_logic_vector(3 downto 0)>>;
+        alias bank_select                      is <<signal .ghdl_test_top_level.test_filter_unit.bank_select : Natural range 0 to NUM_BANKS - 1>>;
+        alias sample_strobe                    is <<signal .ghdl_test_top_level.test_filter_unit.sample_strobe : std_logic>>;
+        alias sample_data                      is <<signal .ghdl_test_top_level.test_filter_unit.sample_data : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias r_debug_value                    is <<signal .ghdl_test_top_level.test_filter_unit.r_debug_value : std_logic_vector(A_BITS - 1 downto 0)>>;
+        alias a_debug_value                    is <<signal .ghdl_test_top_level.test_filter_unit.a_debug_value : std_logic_vector(A_BITS - 1 downto 0)>>;
+        alias y_debug_value                    is <<signal .ghdl_test_top_level.test_filter_unit.y_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias o1_debug_value                   is <<signal .ghdl_test_top_level.test_filter_unit.o1_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias o2_debug_value                   is <<signal .ghdl_test_top_level.test_filter_unit.o2_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias x_debug_value                    is <<signal .ghdl_test_top_level.test_filter_unit.x_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias l_debug_value                    is <<signal .ghdl_test_top_level.test_filter_unit.l_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias i0_debug_value                   is <<signal .ghdl_test_top_level.test_filter_unit.i0_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias i1_debug_value                   is <<signal .ghdl_test_top_level.test_filter_unit.i1_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias i2_debug_value                   is <<signal .ghdl_test_top_level.test_filter_unit.i2_debug_value : std_logic_vector(ALL_BITS - 1 downto 0)>>;
+        alias ADD_A_TO_R                       is <<signal .ghdl_test_top_level.test_filter_unit.ADD_A_TO_R : std_logic>>;
+        alias LOAD_I0_FROM_INPUT               is <<signal .ghdl_test_top_level.test_filter_unit.LOAD_I0_FROM_INPUT : std_logic>>;
+        alias REPEAT_FOR_ALL_BITS              is <<signal .ghdl_test_top_level.test_filter_unit.REPEAT_FOR_ALL_BITS : std_logic>>;
+        alias RESTART                          is <<signal .ghdl_test_top_level.test_filter_unit.RESTART : std_logic>>;
+        alias SEND_Y_TO_OUTPUT                 is <<signal .ghdl_test_top_level.test_filter_unit.SEND_Y_TO_OUTPUT : std_logic>>;
+        alias SET_X_IN_TO_ABS_O1_REG_OUT       is <<signal .ghdl_test_top_level.test_filter_unit.SET_X_IN_TO_ABS_O1_REG_OUT : std_logic>>;
+        alias SET_X_IN_TO_REG_OUT              is <<signal .ghdl_test_top_level.test_filter_unit.SET_X_IN_TO_REG_OUT : std_logic>>;
+        alias SET_X_IN_TO_X_AND_CLEAR_Y_BORROW is <<signal .ghdl_test_top_level.test_filter_unit.SET_X_IN_TO_X_AND_CLEAR_Y_BORROW : std_logic>>;
+        alias SHIFT_A_RIGHT                    is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_A_RIGHT : std_logic>>;
+        alias SHIFT_I0_RIGHT                   is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_I0_RIGHT : std_logic>>;
+        alias SHIFT_I1_RIGHT                   is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_I1_RIGHT : std_logic>>;
+        alias SHIFT_I2_RIGHT                   is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_I2_RIGHT : std_logic>>;
+        alias SHIFT_L_RIGHT                    is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_L_RIGHT : std_logic>>;
+        alias SHIFT_O1_RIGHT                   is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_O1_RIGHT : std_logic>>;
+        alias SHIFT_O2_RIGHT                   is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_O2_RIGHT : std_logic>>;
+        alias SHIFT_R_RIGHT                    is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_R_RIGHT : std_logic>>;
+        alias SHIFT_X_RIGHT                    is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_X_RIGHT : std_logic>>;
+        alias SHIFT_Y_RIGHT                    is <<signal .ghdl_test_top_level.test_filter_unit.SHIFT_Y_RIGHT : std_logic>>;
+        alias SIGN_EXTEND_A                    is <<signal .ghdl_test_top_level.test_filter_unit.SIGN_EXTEND_A : std_logic>>;
+
+        constant NUM_PROBES     : Natural := 41;
+        subtype t_value is std_logic_vector(63 downto 0);
+        type t_values is array (0 to NUM_PROBES - 1) of t_value;
+        type t_flags is array (0 to NUM_PROBES - 1) of Boolean;
+        signal executing        : std_logic := '0';
+
+        function probe_name (index : Natural) return String is
+        begin
+            case index is
+                when 0 => return "SAMPLE";
+                when 1 => return "uc_code_addr";
+                when 2 => return "uc_code";
+                when 3 => return "uc_valid";
+                when 4 => return "digit";
+                when 5 => return "mux_select";
+                when 6 => return "bank_select";
+                when 7 => return "input_wait";
+                when 8 => return "input_strobe_in";
+                when 9 => return "sample_strobe";
+                when 10 => return "sample_data";
+                when 11 => return "serial_data_out";
+                when 12 => return "R";
+                when 13 => return "A";
+                when 14 => return "Y";
+                when 15 => return "O1";
+                when 16 => return "O2";
+                when 17 => return "X";
+                when 18 => return "L";
+                when 19 => return "I0";
+                when 20 => return "I1";
+                when 21 => return "I2";
+                when 22 => return "ADD_A_TO_R";
+                when 23 => return "LOAD_I0_FROM_INPUT";
+                when 24 => return "REPEAT_FOR_ALL_BITS";
+                when 25 => return "RESTART";
+                when 26 => return "SEND_Y_TO_OUTPUT";
+                when 27 => return "SET_X_IN_TO_ABS_O1_REG_OUT";
+                when 28 => return "SET_X_IN_TO_REG_OUT";
+                when 29 => return "SET_X_IN_TO_X_AND_CLEAR_Y_BORROW";
+                when 30 => return "SHIFT_A_RIGHT";
+                when 31 => return "SHIFT_I0_RIGHT";
+                when 32 => return "SHIFT_I1_RIGHT";
+                when 33 => return "SHIFT_I2_RIGHT";
+                when 34 => return "SHIFT_L_RIGHT";
+                when 35 => return "SHIFT_O1_RIGHT";
+                when 36 => return "SHIFT_O2_RIGHT";
+                when 37 => return "SHIFT_R_RIGHT";
+                when 38 => return "SHIFT_X_RIGHT";
+                when 39 => return "SHIFT_Y_RIGHT";
+                when others => return "SIGN_EXTEND_A";
+            end case;
+        end probe_name;
+
+        function probe_width (index : Natural) return Natural is
+        begin
+            case index is
+                when 0 => return 32;
+                when 1 => return UC_ADDR_BITS;
+                when 2 => return 8;
+                when 4 | 5 | 6 => return 4;
+                when 10 => return ALL_BITS;
+                when 12 | 13 => return A_BITS;
+                when 14 to 21 => return ALL_BITS;
+                when others => return 1;
+            end case;
+        end probe_width;
+
+        function get_selected return t_flags is
+            constant names  : String := "," & wave_signals & ",";
+            variable result : t_flags := (others => wave_signals'length = 0);
+        begin
+            for index in 0 to NUM_PROBES - 1 loop
+                for i in names'low to names'high - probe_name(index)'length - 1 loop
+                    if names(i to i + probe_name(index)'length + 1) = "," & probe_name(index) & "," then
+                        result(index) := true;
+                    end if;
+                end loop;
+            end loop;
+            return result;
+        end get_selected;
+
+        function to_value (value : std_logic_vector) return t_value is
+        begin
+            return std_logic_vector(resize(unsigned(value), t_value'length));
+        end to_value;
+
+        function to_value (value : std_logic) return t_value is
+            variable result : t_value := (others => '0');
+        begin
+            result(0) := value;
+            return result;
+        end to_value;
+
+        constant selected       : t_flags := get_selected;
+    begin
+        assert A_BITS <= t_value'length;
+
+        -- As in the trace
+        executing <= uc_valid and not reset
+                        and not (LOAD_I0_FROM_INPUT and not sample_strobe);
+
+        process (clock) is
+            file wave_fd                : std.textio.text;
+            variable l                  : std.textio.line;
+            variable is_open            : Boolean := false;
+            variable in_window          : Boolean := false;
+            variable first_record       : Boolean := true;
+            variable time_written       : Boolean := false;
+            variable sample             : Natural := 0;
+            variable edge_time          : Natural := 0;
+            variable values             : t_values := (others => (others => '0'));
+            variable previous           : t_values := (others => (others => '0'));
+
+            function probe_id (index : Natural) return character is
+            begin
+                return character'val(character'pos('!') + index);
+            end probe_id;
+
+            procedure put_line (text : String) is
+            begin
+                std.textio.write (l, text);
+                std.textio.writeline (wave_fd, l);
+            end put_line;
+
+            procedure put_time is
+            begin
+                std.textio.write (l, String'("#"));
+                std.textio.write (l, edge_time);
+                std.textio.writeline (wave_fd, l);
+            end put_time;
+        begin
+            if clock = '1' and clock'event then
+                if not is_open then
+                    file_open (wave_fd, wave_file, WRITE_MODE);
+                    put_line ("$timescale 1 ns $end");
+                    put_line ("$scope module filter_unit $end");
+                    for index in 0 to NUM_PROBES - 1 loop
+                        if selected(index) then
+                            std.textio.write (l, String'("$var wire "));
+                            std.textio.write (l, probe_width(index));
+                            std.textio.write (l, String'(" ") & probe_id(index) & " ");
+                            std.textio.write (l, probe_name(index) & " $end");
+                            std.textio.writeline (wave_fd, l);
+                        end if;
+                    end loop;
+                    put_line ("$upscope $end");
+                    put_line ("$enddefinitions $end");
+                    is_open := true;
+                end if;
+
+                -- The sample number for the cycle in which the sample is loaded
+                -- is the number of that sample
+                if executing = '1' and LOAD_I0_FROM_INPUT = '1' then
+                    sample := sample + 1;
+                end if;
+
+                if sample >= wave_first_sample and sample < wave_last_sample then
+                    values(0) := std_logic_vector(to_unsigned(sample, t_value'length));
+                    values(1) := to_value(std_logic_vector(uc_code_addr));
+                    values(2) := to_value(uc_code);
+                    values(3) := to_value(uc_valid);
+                    values(4) := to_value(digit);
+                    values(5) := to_value(mux_select);
+                    values(6) := std_logic_vector(to_unsigned(bank_select, t_value'length));
+                    values(7) := to_value(LOAD_I0_FROM_INPUT and not sample_strobe);
+                    values(8) := to_value(input_strobe);
+                    values(9) := to_value(sample_strobe);
+                    values(10) := to_value(sample_data);
+                    values(11) := to_value(data_value);
+                    values(12) := to_value(r_debug_value);
+                    values(13) := to_value(a_debug_value);
+                    values(14) := to_value(y_debug_value);
+                    values(15) := to_value(o1_debug_value);
+                    values(16) := to_value(o2_debug_value);
+                    values(17) := to_value(x_debug_value);
+                    values(18) := to_value(l_debug_value);
+                    values(19) := to_value(i0_debug_value);
+                    values(20) := to_value(i1_debug_value);
+                    values(21) := to_value(i2_debug_value);
+                    values(22) := to_value(ADD_A_TO_R);
+                    values(23) := to_value(LOAD_I0_FROM_INPUT);
+                    values(24) := to_value(REPEAT_FOR_ALL_BITS);
+                    values(25) := to_value(RESTART);
+                    values(26) := to_value(SEND_Y_TO_OUTPUT);
+                    values(27) := to_value(SET_X_IN_TO_ABS_O1_REG_OUT);
+                    values(28) := to_value(SET_X_IN_TO_REG_OUT);
+                    values(29) := to_value(SET_X_IN_TO_X_AND_CLEAR_Y_BORROW);
+                    values(30) := to_value(SHIFT_A_RIGHT);
+                    values(31) := to_value(SHIFT_I0_RIGHT);
+                    values(32) := to_value(SHIFT_I1_RIGHT);
+                    values(33) := to_value(SHIFT_I2_RIGHT);
+                    values(34) := to_value(SHIFT_L_RIGHT);
+                    values(35) := to_value(SHIFT_O1_RIGHT);
+                    values(36) := to_value(SHIFT_O2_RIGHT);
+                    values(37) := to_value(SHIFT_R_RIGHT);
+                    values(38) := to_value(SHIFT_X_RIGHT);
+                    values(39) := to_value(SHIFT_Y_RIGHT);
+                    values(40) := to_value(SIGN_EXTEND_A);
+
+                    time_written := false;
+                    for index in 0 to NUM_PROBES - 1 loop
+                        if selected(index) and (first_record or values(index) /= previous(index)) then
+                            if not time_written then
+                                put_time;
+                                time_written := true;
+                            end if;
+                            if probe_width(index) = 1 then
+                                std.textio.write (l, std_logic'image(values(index)(0))(2));
+                            else
+                                std.textio.write (l, 'b');
+                                for i in probe_width(index) - 1 downto 0 loop
+                                    std.textio.write (l, std_logic'image(values(index)(i))(2));
+                                end loop;
+                                std.textio.write (l, ' ');
+                            end if;
+                            std.textio.write (l, probe_id(index));
+                            std.textio.writeline (wave_fd, l);
+                        end if;
+                    end loop;
+                    previous := values;
+                    first_record := false;
+                    in_window := true;
+                elsif in_window then
+                    -- End of the window: the time of the end of the last cycle
+                    put_time;
+                    file_close (wave_fd);
+                    in_window := false;
+                end if;
+                edge_time := now / 1 ns;
+            end if;
+        end process;
+    end generate wave;
+
     process is
         variable l : line;
         variable copy : unsigned (1 downto 0) := "00";
         variable time_between_restarts : Natural := 0;
         variable time_between_inputs   : Natural := 0;
-        constant deadline              : Natural := 2000;
+        -- Cycle count for event lines, compared with cycle_model.py
+        variable cycle                 : Natural := 0;
+        variable was_ready             : std_logic := '0';
+
+        procedure print_event (name : String; value : Integer) is
+        begin
+            write (l, String'("Event "));
+            write (l, name);
+            write (l, String'(" "));
+            write (l, cycle);
+            write (l, String'(" "));
+            write (l, value);
+            writeline (output, l);
+        end print_event;
 
         procedure print_times is
         begin
@@ -64,10 +370,15 @@ begin
             assert (data_strobe and input_strobe) = '0';
             time_between_inputs := time_between_inputs + 1;
             time_between_restarts := time_between_restarts + 1;
+            if input_ready = '1' and was_ready = '0' then
+                print_event ("ready", 0);
+            end if;
+            was_ready := input_ready;
             if input_ready = '1' and input_strobe = '1' then
                 write (l, String'("Data in = "));
                 write (l, Integer'(ieee.numeric_std.to_integer(signed(input_value))));
                 writeline (output, l);
+                print_event ("load", ieee.numeric_std.to_integer(unsigned(input_value)));
                 time_between_inputs := 0;
             end if;
             if input_ready = '0' and input_strobe = '1' then
@@ -98,11 +409,14 @@ begin
                 copy (0) := data_value;
                 write (l, Integer'(ieee.numeric_std.to_integer(signed(copy))));
                 writeline (output, l);
+                print_event ("output", ieee.numeric_std.to_integer(unsigned(copy)));
             end if;
             if restart_debug = '1' then
+                print_event ("restart", 0);
                 print_times;
                 time_between_restarts := 0;
             end if;
+            cycle := cycle + 1;
             wait until clock = '1' and clock'event;
         end loop;
         write (l, String'("THE END"));
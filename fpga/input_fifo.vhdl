@@ -0,0 +1,84 @@
+library ieee;
+use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
+
+library comfilter;
+use comfilter.all;
+
+-- Input sample FIFO for filter_unit. Samples arriving while the program
+-- is running are held here instead of being lost; the filter unit takes
+-- the oldest one when it next reaches LOAD_I0_FROM_INPUT. A sample written
+-- while the FIFO is full is dropped and overflow_out is pulsed.
+--
+-- The head of the FIFO is always presented on read_data_out (first word
+-- fall through), so a sample written in one clock cycle can be read in the
+-- next. See input_fifo.py for the timing model.
+
+entity input_fifo is
+    generic (
+        depth               : Natural := 2;
+        data_bits           : Natural := 16);
+    port (
+        write_strobe_in     : in std_logic := '0';
+        write_data_in       : in std_logic_vector(data_bits - 1 downto 0) := (others => '0');
+        write_ready_out     : out std_logic := '0';
+        overflow_out        : out std_logic := '0';
+        read_strobe_in      : in std_logic := '0';
+        read_ready_out      : out std_logic := '0';
+        read_data_out       : out std_logic_vector(data_bits - 1 downto 0) := (others => '0');
+        reset_in            : in std_logic := '0';
+        clock_in            : in std_logic := '0');
+end input_fifo;
+
+architecture structural of input_fifo is
+    subtype t_index is Natural range 0 to depth - 1;
+    type t_storage is array (t_index) of std_logic_vector(data_bits - 1 downto 0);
+    signal storage      : t_storage := (others => (others => '0'));
+    signal read_index   : t_index := 0;
+    signal write_index  : t_index := 0;
+    signal count        : Natural range 0 to depth := 0;
+    signal is_empty     : std_logic := '1';
+    signal is_full      : std_logic := '0';
+begin
+    is_empty <= '1' when count = 0 else '0';
+    is_full <= '1' when count = depth else '0';
+
+    process (clock_in) is
+        variable do_read    : Boolean := false;
+        variable do_write   : Boolean := false;
+    begin
+        if clock_in = '1' and clock_in'event then
+            -- A full FIFO can accept a write in the same cycle as a read
+            do_read := read_strobe_in = '1' and is_empty = '0';
+            do_write := write_strobe_in = '1' and (is_full = '0' or do_read);
+            overflow_out <= '0';
+            if write_strobe_in = '1' and not do_write then
+                overflow_out <= '1';
+            end if;
+
+            if do_read then
+                read_index <= (read_index + 1) mod depth;
+            end if;
+            if do_write then
+                storage(write_index) <= write_data_in;
+                write_index <= (write_index + 1) mod depth;
+            end if;
+            if do_write and not do_read then
+                count <= count + 1;
+            elsif do_read and not do_write then
+                count <= count - 1;
+            end if;
+
+            if reset_in = '1' then
+                read_index <= 0;
+                write_index <= 0;
+                count <= 0;
+                overflow_out <= '0';
+            end if;
+        end if;
+    end process;
+
+    read_data_out <= storage(read_index);
+    read_ready_out <= not is_empty;
+    write_ready_out <= not is_full;
+end structural;
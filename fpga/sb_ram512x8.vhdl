@@ -0,0 +1,61 @@
+library ieee;
+use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
+
+-- Simulation model of the iCE40 SB_RAM512x8 block RAM, for testing the
+-- microcode store written by dump_lattice_rom (filter_unit_microcode_store.vhdl)
+-- with GHDL. Only the parts used there are modelled: the byte at address
+-- a is bits (a mod 32) * 8 + 7 .. (a mod 32) * 8 of INIT_(a / 32), and a read
+-- is registered on RCLK when RCLKE and RE are both '1'. Writes are ignored.
+-- Synthesis uses the primitive from the vendor library instead.
+
+entity SB_RAM512x8 is
+    generic (
+        INIT_0 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_1 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_2 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_3 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_4 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_5 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_6 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_7 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_8 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_9 : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_A : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_B : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_C : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_D : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_E : std_logic_vector(255 downto 0) := (others => '0');
+        INIT_F : std_logic_vector(255 downto 0) := (others => '0'));
+    port (
+        RDATA       : out std_logic_vector (7 downto 0) := (others => '0');
+        RADDR       : in std_logic_vector (8 downto 0);
+        WADDR       : in std_logic_vector (8 downto 0);
+        WDATA       : in std_logic_vector (7 downto 0);
+        RCLKE       : in std_logic;
+        RCLK        : in std_logic;
+        RE          : in std_logic;
+        WCLKE       : in std_logic;
+        WCLK        : in std_logic;
+        WE          : in std_logic);
+end SB_RAM512x8;
+
+architecture behavioural of SB_RAM512x8 is
+    subtype t_row is std_logic_vector(255 downto 0);
+    type t_rows is array (0 to 15) of t_row;
+    constant rows : t_rows := (INIT_0, INIT_1, INIT_2, INIT_3, INIT_4, INIT_5, INIT_6, INIT_7,
+                               INIT_8, INIT_9, INIT_A, INIT_B, INIT_C, INIT_D, INIT_E, INIT_F);
+begin
+    process (RCLK) is
+        variable address : Natural range 0 to 511 := 0;
+        variable row     : t_row := (others => '0');
+    begin
+        if RCLK = '1' and RCLK'event then
+            if RCLKE = '1' and RE = '1' then
+                address := to_integer(unsigned(RADDR));
+                row := rows(address / 32);
+                RDATA <= row(((address mod 32) * 8) + 7 downto (address mod 32) * 8);
+            end if;
+        end if;
+    end process;
+end architecture behavioural;
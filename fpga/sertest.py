@@ -22,7 +22,11 @@ def sync(ser: serial.Serial) -> None:
             return
 
 def main() -> None:
-    ser = serial.serial_for_url(PORT, do_not_open=True, exclusive=True)
+    port = PORT
+    if len(sys.argv) > 1:
+        port = sys.argv[1]
+
+    ser = serial.serial_for_url(port, do_not_open=True, exclusive=True)
     ser.baudrate = 115200
     ser.bytesize = 8
     ser.parity = "N"
@@ -36,7 +40,7 @@ def main() -> None:
         print("Setup error", str(e))
         sys.exit(1)
 
-    print(f"connected to {PORT}", flush=True)
+    print(f"connected to {port}", flush=True)
     sync(ser)
     
     print("connected to FPGA", flush=True)
@@ -11,13 +11,14 @@ entity shift_register is
     generic (
         name          : String;
         size          : Natural;
+        digit_bits    : Natural := 1;
         verbose_debug : Boolean := false);
     port (
-        reg_out             : out std_logic := '0';
+        reg_out             : out std_logic_vector(digit_bits - 1 downto 0) := (others => '0');
         negative_out        : out std_logic := '0';
         debug_out           : out std_logic_vector(size - 1 downto 0) := (others => '0');
         shift_right_in      : in std_logic := '0';
-        reg_in              : in std_logic := '0';
+        reg_in              : in std_logic_vector(digit_bits - 1 downto 0) := (others => '0');
         clock_in            : in std_logic := '0');
 end shift_register;
 
@@ -30,12 +31,14 @@ begin
     begin
         if clock_in = '1' and clock_in'event then
             -- check for metastable states:
-            assert reg_in = '1' or reg_in = '0';
+            for i in reg_in'range loop
+                assert reg_in(i) = '1' or reg_in(i) = '0';
+            end loop;
             assert shift_right_in = '1' or shift_right_in = '0';
 
             if shift_right_in = '1' then
-                new_value(size - 1) := reg_in;
-                new_value(size - 2 downto 0) := value(size - 1 downto 1);
+                new_value(size - 1 downto size - digit_bits) := reg_in;
+                new_value(size - digit_bits - 1 downto 0) := value(size - 1 downto digit_bits);
                 value <= new_value;
                 if verbose_debug then
                     write (l, name);
@@ -48,7 +51,7 @@ begin
     end process;
 
     debug_out <= value;
-    reg_out <= value(0);
+    reg_out <= value(digit_bits - 1 downto 0);
     negative_out <= value(size - 1);
 
 end structural;
@@ -0,0 +1,349 @@
+from func_hardware import (
+        OperationList, ControlOperation, ControlLine, ControlLines, CodeTable,
+    )
+from fpga_hardware import (
+        FPGAOperationList,
+    )
+from synth_report import (
+        parse_yosys_stat,
+    )
+from pathlib import Path
+import argparse, random, shutil, subprocess, tempfile, typing
+
+# Choose the encoding of control words for a program, i.e. which control
+# lines have a dedicated bit and which value of the enumerated field is
+# used for each combination of the other control lines, so that the
+# generated control line decoder is as small as possible.
+#
+# The cost model counts 4-input LUTs (as in the iCE40). Each line with a
+# dedicated bit needs one LUT (the bit AND control_line_enable). Each
+# enumerated line is a function of the field bits that it depends on, plus
+# control_line_enable, which is decomposed by Shannon expansion until each
+# part fits in a LUT. Sharing of logic between lines is not modelled.
+#
+# The model is only an estimate, and not a bound: with yosys 0.70, the
+# default demodulator encoding is 36 LUTs as estimated, but encodings which
+# the model prefers are 6 to 16 LUTs larger after synthesis, because ABC
+# does not find the decomposition that the model assumes. So the model
+# only proposes candidates. optimise_encoding synthesises each candidate,
+# and the default encoding, with yosys (or yowasp-yosys) synth_ice40, keeps
+# the one with the fewest LUTs, and then improves it by hill climbing on
+# the synthesised LUT count. Each synthesis takes about 2s.
+
+CONTROL_WORD_BITS = 7   # bit 7 selects mux/bank/debug operations
+LUT_INPUTS = 4
+NOT_DEDICATED = {ControlLine.RESTART, ControlLine.NOTHING}
+DEFAULT_MOVES = 400
+DEFAULT_SYNTH_MOVES = 50
+
+class DecoderCost(typing.NamedTuple):
+    luts: int
+    depth: int
+
+Combination = typing.FrozenSet[ControlLine]
+
+class Encoding:
+    def __init__(self, dedicated: typing.List[ControlLine],
+                 codes: typing.Dict[Combination, int]) -> None:
+        self.dedicated = dedicated
+        self.codes = codes          # enumerated field value for each combination
+        self.field_bits = CONTROL_WORD_BITS - len(dedicated)
+        self.cost = decoder_cost(self)
+        # LUTs after synthesis, if known (see synthesise_decoder)
+        self.luts: typing.Optional[int] = None
+
+    def table(self) -> typing.Dict[str, int]:
+        # In the form used by CodeTable
+        return {','.join(sorted(cl.name for cl in combination)): value
+                for (combination, value) in self.codes.items()}
+
+    def code_table(self) -> CodeTable:
+        code_table = CodeTable()
+        code_table.set_encoding(self.dedicated, self.table())
+        return code_table
+
+    def __str__(self) -> str:
+        dedicated = ", ".join(cl.name for cl in self.dedicated) or "none"
+        synthesised = f", {self.luts} LUTs after synthesis" if self.luts is not None else ""
+        return (f"{len(self.codes)} codes in {self.field_bits} bits, dedicated: {dedicated}, "
+                f"estimated {self.cost.luts} LUTs, depth {self.cost.depth}{synthesised}")
+
+def get_encoding(code_table: CodeTable) -> Encoding:
+    # The encoding currently used by a code table
+    codes = {frozenset(ControlLine[name] for name in key.split(",") if name != ""): value
+             for (key, value) in code_table.table.items()}
+    return Encoding([cl for (cl, bit) in code_table.dedicated], codes)
+
+def support(tt: int, num_bits: int) -> typing.List[int]:
+    # Bits of the code that a function (given as a truth table) depends on
+    result = []
+    for i in range(num_bits):
+        mask = SELECT_ZERO[num_bits][i]
+        shift = 1 << i
+        if (tt & mask) != ((tt >> shift) & mask):
+            result.append(i)
+    return result
+
+def cofactors(tt: int, num_bits: int, i: int) -> typing.Tuple[int, int]:
+    # Functions with bit i of the code fixed at 0 and 1
+    mask = SELECT_ZERO[num_bits][i]
+    shift = 1 << i
+    low = tt & mask
+    high = (tt >> shift) & mask
+    return (low | (low << shift), high | (high << shift))
+
+def make_select_zero(num_bits: int) -> typing.List[int]:
+    # For each bit i, a truth table which is 1 wherever bit i of the code is 0
+    return [sum(1 << code for code in range(1 << num_bits) if not (code & (1 << i)))
+            for i in range(num_bits)]
+
+SELECT_ZERO = [make_select_zero(num_bits) for num_bits in range(CONTROL_WORD_BITS + 1)]
+
+def function_cost(tt: int, num_bits: int, extra_inputs: int,
+                  memo: typing.Dict[typing.Tuple[int, int, int], DecoderCost]) -> DecoderCost:
+    # LUTs needed for a function of the code bits and some extra inputs
+    key = (tt, num_bits, extra_inputs)
+    if key in memo:
+        return memo[key]
+    bits = support(tt, num_bits)
+    if (len(bits) + extra_inputs) <= 1:
+        cost = DecoderCost(0, 0)    # a constant or a wire
+    elif (len(bits) + extra_inputs) <= LUT_INPUTS:
+        cost = DecoderCost(1, 1)
+    else:
+        # Shannon expansion: a LUT selects between the cofactors for one bit,
+        # and also takes the extra inputs, so the cofactors do not
+        best: typing.Optional[DecoderCost] = None
+        for i in bits:
+            (f0, f1) = cofactors(tt, num_bits, i)
+            c0 = function_cost(f0, num_bits, 0, memo)
+            c1 = function_cost(f1, num_bits, 0, memo)
+            c = DecoderCost(1 + c0.luts + c1.luts, 1 + max(c0.depth, c1.depth))
+            if (best is None) or (c < best):
+                best = c
+        assert best is not None
+        cost = best
+    memo[key] = cost
+    return cost
+
+def line_truth_tables(encoding: Encoding) -> typing.Dict[ControlLine, int]:
+    tables: typing.Dict[ControlLine, int] = {}
+    for (combination, value) in encoding.codes.items():
+        for cl in combination:
+            tables[cl] = tables.get(cl, 0) | (1 << value)
+    # RESTART is also decoded from every unused code
+    unused = ((1 << (1 << encoding.field_bits)) - 1)
+    for value in encoding.codes.values():
+        unused &= ~(1 << value)
+    tables[ControlLine.RESTART] = tables.get(ControlLine.RESTART, 0) | unused
+    return tables
+
+MEMO: typing.Dict[typing.Tuple[int, int, int], DecoderCost] = {}
+
+def decoder_cost(encoding: Encoding) -> DecoderCost:
+    luts = 1        # control_line_enable
+    depth = 0
+    for cl in encoding.dedicated:
+        luts += 1
+        depth = max(depth, 1)
+    for (cl, tt) in line_truth_tables(encoding).items():
+        if cl in encoding.dedicated:
+            continue
+        cost = function_cost(tt, encoding.field_bits, 1, MEMO)
+        luts += cost.luts
+        depth = max(depth, cost.depth)
+    return DecoderCost(luts, depth + 1)
+
+def choose_dedicated(combinations: typing.Set[Combination],
+                     num_dedicated: int) -> typing.List[ControlLine]:
+    # Greedily choose lines which leave the fewest distinct combinations
+    # of the other lines; ties are broken by how often the line is used
+    dedicated: typing.List[ControlLine] = []
+    candidates = sorted({cl for combination in combinations for cl in combination}
+                        - NOT_DEDICATED, key=lambda cl: cl.name)
+    for i in range(num_dedicated):
+        best: typing.Optional[typing.Tuple[int, int, str]] = None
+        for cl in candidates:
+            if cl in dedicated:
+                continue
+            removed = set(dedicated + [cl])
+            remaining = len({combination - removed for combination in combinations})
+            uses = sum(1 for combination in combinations if cl in combination)
+            score = (remaining, -uses, cl.name)
+            if (best is None) or (score < best):
+                best = score
+        if best is None:
+            break
+        dedicated.append(ControlLine[best[2]])
+    return dedicated
+
+def assign_codes(combinations: typing.Set[Combination], dedicated: typing.List[ControlLine],
+                 r: random.Random, moves: int) -> typing.Optional[Encoding]:
+    # Assign field values by hill climbing from a sequential assignment:
+    # each move swaps two combinations or moves one to an unused value
+    field_bits = CONTROL_WORD_BITS - len(dedicated)
+    remaining = sorted({combination - set(dedicated) for combination in combinations},
+                       key=lambda c: (len(c), sorted(cl.name for cl in c)))
+    if len(remaining) > (1 << field_bits):
+        return None
+    codes = {combination: value for (value, combination) in enumerate(remaining)}
+    best = Encoding(dedicated, codes)
+    for i in range(moves):
+        candidate = random_move(best, r)
+        if candidate.cost <= best.cost:
+            best = candidate
+    return best
+
+def random_move(encoding: Encoding, r: random.Random) -> Encoding:
+    # Swap two combinations, or move one to an unused value
+    codes = dict(encoding.codes)
+    combination = r.choice(list(codes))
+    value = r.randrange(1 << encoding.field_bits)
+    for (other, other_value) in codes.items():
+        if other_value == value:
+            codes[other] = codes[combination]
+            break
+    codes[combination] = value
+    return Encoding(encoding.dedicated, codes)
+
+def candidates(combinations: typing.Iterable[ControlLines],
+               moves: int = DEFAULT_MOVES, seed: int = 1) -> typing.List[Encoding]:
+    # The encoding with the lowest estimated cost for each number of
+    # dedicated bits, and for the default dedicated lines
+    all_combinations = {frozenset(c) for c in combinations} | {frozenset()}
+    r = random.Random(seed)
+    dedicated_lines = [choose_dedicated(all_combinations, num_dedicated)
+                       for num_dedicated in range(CONTROL_WORD_BITS)]
+    dedicated_lines.append([cl for (cl, bit) in CodeTable().dedicated])
+    result = []
+    for dedicated in dedicated_lines:
+        encoding = assign_codes(all_combinations, dedicated, r, moves)
+        if encoding is not None:
+            result.append(encoding)
+    return result
+
+def optimise(combinations: typing.Iterable[ControlLines],
+             moves: int = DEFAULT_MOVES, seed: int = 1) -> Encoding:
+    # The encoding with the lowest estimated cost
+    found = candidates(combinations, moves, seed)
+    if len(found) == 0:
+        raise ValueError("Too many codes are required")
+    return min(found, key=lambda encoding: encoding.cost)
+
+def optimise_encoding(ops: OperationList, moves: int = DEFAULT_MOVES,
+                      synth_moves: int = DEFAULT_SYNTH_MOVES, seed: int = 1) -> Encoding:
+    # Choose an encoding for all of the control operations in ops, by the
+    # number of LUTs after synthesis. The default encoding is kept unless
+    # another is smaller.
+    if find_yosys() is None:
+        raise Exception("yosys is needed to choose an encoding")
+    found: typing.List[Encoding] = []
+    if not ops.code_table.fixed:
+        try:
+            ops.get_memory_image()
+            found.append(get_encoding(ops.code_table))
+        except ValueError:
+            # The program does not fit the default encoding
+            pass
+    found += candidates([op.controls for op in ops if isinstance(op, ControlOperation)],
+                        moves, seed)
+    if len(found) == 0:
+        raise ValueError("Too many codes are required")
+    best: typing.Optional[Encoding] = None
+    for encoding in found:
+        encoding.luts = synthesise_decoder(encoding.code_table())
+        if (best is None) or (encoding.luts < best.luts):
+            best = encoding
+    assert (best is not None) and (best.luts is not None)
+    r = random.Random(seed)
+    for i in range(synth_moves):
+        candidate = random_move(best, r)
+        candidate.luts = synthesise_decoder(candidate.code_table())
+        if candidate.luts <= best.luts:
+            best = candidate
+    ops.code_table.set_encoding(best.dedicated, best.table())
+    return best
+
+def dump_decoder_verilog(code_table: CodeTable, fd: typing.IO) -> None:
+    # The control line part of the decoder, which is the part that the cost
+    # model covers, as Verilog so that yosys can read it without GHDL. It is
+    # equivalent to the control line outputs of dump_control_line_decoder.
+    lines = [cl for cl in sorted(ControlLine, key = lambda cl: cl.name)
+             if cl != ControlLine.NOTHING]
+    field_bits = code_table.field_bits
+    fd.write("module decoder (input enable_in, input [7:0] code_in")
+    for cl in lines:
+        fd.write(f",\n    output reg {cl.name}")
+    fd.write(");\n")
+    fd.write("wire control_line_enable = enable_in & ~code_in[7];\n")
+    fd.write("always @(*) begin\n")
+    for cl in lines:
+        fd.write(f"    {cl.name} = 1'b0;\n")
+    dedicated = set()
+    for (cl, bit) in code_table.dedicated:
+        fd.write(f"    {cl.name} = code_in[{bit.bit_length() - 1}] & control_line_enable;\n")
+        dedicated.add(cl)
+    fd.write(f"    case (code_in[{field_bits - 1}:0])\n")
+    for (value, key) in sorted((value, key) for (key, value) in code_table.table.items()):
+        fd.write(f"    {field_bits}'d{value}: begin\n")
+        for name in key.split(","):
+            if (name != "") and (ControlLine[name] not in dedicated):
+                fd.write(f"        {name} = control_line_enable;\n")
+        fd.write("    end\n")
+    fd.write("    default: RESTART = control_line_enable;\n")
+    fd.write("    endcase\n")
+    fd.write("end\n")
+    fd.write("endmodule\n")
+
+def find_yosys() -> typing.Optional[str]:
+    # yosys itself, or the YoWASP build from PyPI
+    for name in ["yosys", "yowasp-yosys"]:
+        if shutil.which(name) is not None:
+            return name
+    return None
+
+def synthesise_decoder(code_table: CodeTable) -> int:
+    # Number of LUTs in the control line part of the decoder after synthesis
+    # for iCE40
+    yosys = find_yosys()
+    if yosys is None:
+        raise Exception("yosys is not available")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "decoder.v"
+        with open(path, "wt") as fd:
+            dump_decoder_verilog(code_table, fd)
+        subprocess.check_call([yosys, "-q", "-l", "yosys.log", "-p",
+                    f"read_verilog {path.name}; synth_ice40 -top decoder; stat"],
+                    cwd=tmp_dir)
+        with open(Path(tmp_dir) / "yosys.log", "rt", encoding="utf-8") as fd:
+            return parse_yosys_stat(fd.read())["SB_LUT4"]
+
+def main() -> None:
+    from filter_implementation import demodulator, multi_channel_demodulator
+    from cycle_report import make_channels
+
+    parser = argparse.ArgumentParser(description="Optimise control word encoding")
+    parser.add_argument("--moves", type=int, default=DEFAULT_MOVES,
+                        help="hill climbing moves on the estimated cost, for each candidate")
+    parser.add_argument("--synth-moves", type=int, default=DEFAULT_SYNTH_MOVES,
+                        help="hill climbing moves on the synthesised LUT count")
+    args = parser.parse_args()
+
+    programs: typing.List[typing.Tuple[str, typing.Callable[[OperationList], None]]] = [
+        ("demodulator", demodulator),
+        ("4 channel demodulator",
+            lambda ops: multi_channel_demodulator(ops, make_channels(ops.settings, 4))),
+    ]
+    for (name, generate) in programs:
+        print(f"{name}:")
+        ops = FPGAOperationList()
+        generate(ops)
+        ops.get_memory_image()
+        encoding = get_encoding(ops.code_table)
+        encoding.luts = synthesise_decoder(ops.code_table)
+        print(f"  {'default':10s} {encoding}")
+        encoding = optimise_encoding(ops, args.moves, args.synth_moves)
+        print(f"  {'optimised':10s} {encoding}")
+
+if __name__ == "__main__":
+    main()
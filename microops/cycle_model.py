@@ -0,0 +1,295 @@
+from func_hardware import (
+        OperationList,
+    )
+from func_execute import (
+        FuncExecutor, Kind, NextStep, execute_lane, execute_run,
+        LOAD_I0_FROM_INPUT, SEND_Y_TO_OUTPUT, REPEAT_FOR_ALL_BITS, RESTART, RETURN_ADDRESS,
+        I0, I1, I2, X, Y, X_OTHER_LANE, REPEAT_COUNTER,
+    )
+from filter_implementation import (
+        demodulator, goertzel_demodulator,
+    )
+from test_vector import (
+        TestVector,
+    )
+import argparse, collections, time, typing
+
+# Clock-level model of filter_unit.vhdl. The datapath is FuncExecutor's:
+# each step of its loop is one clock cycle in which an operation executes.
+# The cycles in which nothing executes are added as in the hardware:
+#
+#  - Fetch bubbles: the microcode store has one cycle of latency, so the
+#    cycle after RESTART, CALL or RETURN (and the first cycle after reset)
+#    fetches the next operation and executes nothing.
+#  - Handshake: input_ready_out rises in the first cycle of
+#    LOAD_I0_FROM_INPUT, which waits until the cycle in which
+#    input_strobe_in is '1'. This cycle is chosen by the input source,
+#    either the GHDL test bench (ghdl_test.make_test_bench), which raises
+#    the strobe in the cycle after ready rises, or strobes at given times,
+#    through the input FIFO if Settings.input_fifo_depth is non-zero.
+#
+# Cycle 0 is the first cycle after reset. Every event is recorded with its
+# cycle, so that timing can be compared with GHDL (see ghdl_test), which
+# prints the same events.
+#
+# No event can happen within a run of cycles repeating one operation
+# (REPEAT_FOR_ALL_BITS or REPEAT n) which only shifts, so such a run is
+# executed in one step (see func_execute.execute_run), and the cycle
+# count advanced by its length, as in OperationList.cycle_count(). Only
+# the samples in the window given to CycleExecutor are executed cycle by
+# cycle, as FuncExecutor does.
+
+# Cycles from input_ready_out rising to input_strobe_in with the test bench
+BENCH_STROBE_DELAY = 1
+
+class CycleEvents:
+    def __init__(self) -> None:
+        self.ready: typing.List[int] = []                   # input_ready_out rises
+        self.loads: typing.List[typing.Tuple[int, int]] = []     # (cycle, input value)
+        self.outputs: typing.List[typing.Tuple[int, int]] = []   # (cycle, serial_data_out)
+        self.restarts: typing.List[int] = []                # RESTART executes
+        self.dropped: typing.List[int] = []                 # index of each lost input
+        self.busy_cycles = 0        # an operation executes
+        self.bubble_cycles = 0      # fetching after reset, RESTART, CALL or RETURN
+        self.wait_cycles = 0        # waiting for input in LOAD_I0_FROM_INPUT
+
+    @property
+    def total_cycles(self) -> int:
+        return self.busy_cycles + self.bubble_cycles + self.wait_cycles
+
+    def timeline(self) -> typing.List[typing.Tuple[int, str, int]]:
+        # All events in time order as (cycle, name, value)
+        events = ([(cycle, "ready", 0) for cycle in self.ready]
+                  + [(cycle, "load", value) for (cycle, value) in self.loads]
+                  + [(cycle, "output", value) for (cycle, value) in self.outputs]
+                  + [(cycle, "restart", 0) for cycle in self.restarts])
+        events.sort()
+        return events
+
+class BenchInput:
+    # The GHDL test bench: every input is accepted, one cycle after ready
+    def __init__(self, in_values: typing.Sequence[int]) -> None:
+        self.reverse_in_values = list(reversed(in_values))
+
+    def remaining(self) -> int:
+        return len(self.reverse_in_values)
+
+    def load(self, ready_cycle: int, events: CycleEvents) -> typing.Optional[typing.Tuple[int, int]]:
+        # Returns (cycle, value) for the next input, or None if there are no more
+        if len(self.reverse_in_values) == 0:
+            return None
+        return (ready_cycle + BENCH_STROBE_DELAY, self.reverse_in_values.pop())
+
+class StrobeInput:
+    # A one-cycle strobe for each input at the given time. Without a FIFO,
+    # an input is lost unless the filter unit is waiting for it. A FIFO
+    # entry can be taken in the cycle after it is written (see input_fifo.vhdl).
+    def __init__(self, in_values: typing.Sequence[int], strobe_times: typing.Sequence[int],
+                 depth: int) -> None:
+        assert len(in_values) == len(strobe_times)
+        self.in_values = in_values
+        self.strobe_times = strobe_times
+        self.depth = depth
+        self.index = 0
+        self.waiting: typing.Deque[int] = collections.deque()
+
+    def arrive(self, before: int, events: CycleEvents) -> None:
+        # Inputs with strobes before the given cycle enter the FIFO, or are lost
+        while self.index < len(self.strobe_times) and self.strobe_times[self.index] < before:
+            if len(self.waiting) < self.depth:
+                self.waiting.append(self.index)
+            else:
+                events.dropped.append(self.index)
+            self.index += 1
+
+    def remaining(self) -> int:
+        return len(self.waiting) + len(self.strobe_times) - self.index
+
+    def load(self, ready_cycle: int, events: CycleEvents) -> typing.Optional[typing.Tuple[int, int]]:
+        self.arrive(ready_cycle, events)
+        if len(self.waiting) != 0:
+            index = self.waiting.popleft()
+            cycle = ready_cycle
+        elif self.index < len(self.strobe_times):
+            index = self.index
+            self.index += 1
+            cycle = self.strobe_times[index] + (1 if self.depth != 0 else 0)
+        else:
+            return None
+        # A strobe in the same cycle as the load is written after the read
+        self.arrive(cycle, events)
+        return (cycle, self.in_values[index])
+
+InputSource = typing.Union[BenchInput, StrobeInput]
+
+class CycleExecutor(FuncExecutor):
+    # As FuncExecutor, with the clock cycle of each event. Register state,
+    # the current operation and the cycle number are kept between calls to
+    # run(), which returns at RESTART when all of the inputs have been
+    # consumed, or when the program needs an input and none remains.
+    # window = (first sample, last sample): samples first .. last - 1,
+    # numbered as in the trace (see exec_trace), are executed cycle by cycle.
+    def __init__(self, ops: OperationList, debug_outputs: bool = True,
+                 window: typing.Optional[typing.Tuple[int, int]] = None) -> None:
+        FuncExecutor.__init__(self, ops, debug_outputs)
+        self.events = CycleEvents()
+        self.op_index = 0
+        self.cycle = 1
+        self.events.bubble_cycles = 1
+        self.window = window if window is not None else (0, 0)
+
+    def run(self, in_values: typing.List[int],
+            strobe_times: typing.Optional[typing.Sequence[int]] = None) -> typing.List[int]:
+        source: InputSource
+        if strobe_times is None:
+            source = BenchInput(in_values)
+        else:
+            source = StrobeInput(in_values, strobe_times, self.settings.input_fifo_depth)
+        return self.run_source(source)
+
+    def run_source(self, source: InputSource) -> typing.List[int]:
+        events = self.events
+        reg_files = self.lane_reg_files
+        reg_file = reg_files[0]
+        other_lanes = range(1, len(reg_files))
+        programs = self.lane_programs
+        program = programs[0]
+        program_size = len(program)
+        settings = self.settings
+        y_sign_shift = settings.all_bits - 1
+        out_values: typing.List[int] = []
+        debug_values = out_values if self.debug_outputs else []
+        reverse_in_values: typing.List[int] = []
+        op_index = self.op_index
+        cycle = self.cycle
+        jump_index = 0
+        (first_sample, last_sample) = self.window
+        # Runs are executed at once outside the window, and with one lane
+        # (the lanes exchange X in every cycle)
+        whole_runs = not (other_lanes or (first_sample <= len(events.loads) < last_sample))
+        while op_index < program_size:
+            (kind, payload) = program[op_index]
+            if kind == Kind.COMMENT:
+                # Not encoded, so never fetched
+                op_index += 1
+                continue
+
+            if kind == Kind.CONTROL:
+                mask = payload
+            elif kind in (Kind.REPEAT, Kind.MULTIPLY):
+                mask = payload[0]
+            else:
+                mask = 0
+            if mask & LOAD_I0_FROM_INPUT:
+                events.ready.append(cycle)
+                load = source.load(cycle, events)
+                if load is None:
+                    # Wait here for the input given to the next run()
+                    events.ready.pop()
+                    break
+                (load_cycle, value) = load
+                events.wait_cycles += load_cycle - cycle
+                events.loads.append((load_cycle, value))
+                cycle = load_cycle
+                reverse_in_values.append(value)
+                whole_runs = not (other_lanes or (first_sample <= len(events.loads) < last_sample))
+            if mask & SEND_Y_TO_OUTPUT:
+                events.outputs.append((cycle, (reg_file[Y] >> y_sign_shift) & 1))
+
+            run_cycles = 1
+            if whole_runs and (reg_file[REPEAT_COUNTER] == 0):
+                if (kind == Kind.CONTROL) and (mask & REPEAT_FOR_ALL_BITS):
+                    run_cycles = settings.all_digits
+                elif (kind == Kind.REPEAT) and not (mask & REPEAT_FOR_ALL_BITS):
+                    run_cycles = payload[1]
+
+            if kind == Kind.ILLEGAL:
+                raise Exception(f"Illegal instruction at address {op_index}")
+            elif kind == Kind.CALL:
+                reg_file[RETURN_ADDRESS] = op_index + 1
+                jump_index = payload
+                next_step = NextStep.JUMP
+            elif kind == Kind.RETURN:
+                jump_index = reg_file[RETURN_ADDRESS]
+                next_step = NextStep.JUMP
+            elif (run_cycles > 1) and execute_run(mask, run_cycles, reg_file, settings):
+                # RESTART only takes effect at the end of REPEAT_FOR_ALL_BITS
+                if (kind == Kind.CONTROL) and (mask & RESTART):
+                    next_step = NextStep.RESTART
+                else:
+                    next_step = NextStep.NEXT
+            else:
+                run_cycles = 1
+                if other_lanes and kind in (Kind.CONTROL, Kind.REPEAT, Kind.MULTIPLY):
+                    x_values = [lane_reg_file[X] for lane_reg_file in reg_files]
+                    for (lane, lane_reg_file) in enumerate(reg_files):
+                        lane_reg_file[X_OTHER_LANE] = x_values[-1 - lane]
+                next_step = execute_lane(kind, payload, reg_file, reverse_in_values,
+                                         out_values, debug_values, settings)
+                for lane in other_lanes:
+                    lane_reg_file = reg_files[lane]
+                    (lane_kind, lane_payload) = programs[lane][op_index]
+                    execute_lane(lane_kind, lane_payload, lane_reg_file, reverse_in_values,
+                                 out_values, debug_values, settings)
+                    lane_reg_file[I0] = reg_file[I0]
+                    lane_reg_file[I1] = reg_file[I1]
+                    lane_reg_file[I2] = reg_file[I2]
+
+            events.busy_cycles += run_cycles
+            cycle += run_cycles
+            if next_step == NextStep.RESTART:
+                events.restarts.append(cycle - 1)
+                events.bubble_cycles += 1
+                cycle += 1
+                op_index = 0
+                if source.remaining() == 0:
+                    break
+            elif next_step == NextStep.NEXT:
+                op_index += 1
+            elif next_step == NextStep.JUMP:
+                events.bubble_cycles += 1
+                cycle += 1
+                op_index = jump_index
+        else:
+            # Gone over the end of the program
+            raise Exception("Program must end in RESTART")
+
+        self.samples_loaded = len(events.loads)
+        self.op_index = op_index
+        self.cycle = cycle
+        return out_values
+
+def run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
+    return CycleExecutor(ops).run(in_values)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Clock-level simulation of filter_unit")
+    parser.add_argument("--goertzel", action="store_true")
+    parser.add_argument("--samples", type=int, default=4000)
+    parser.add_argument("--window", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="execute samples FIRST .. LAST - 1 cycle by cycle")
+    args = parser.parse_args()
+
+    ops = OperationList()
+    (goertzel_demodulator if args.goertzel else demodulator)(ops)
+    test_vector = TestVector(args.samples)
+    window = (args.window[0], args.window[1]) if args.window is not None else None
+    executor = CycleExecutor(ops, debug_outputs=False, window=window)
+    start_time = time.monotonic()
+    executor.run(test_vector.in_values)
+    elapsed = time.monotonic() - start_time
+    events = executor.events
+    restarts = events.restarts
+    periods = [cycle1 - cycle0 for (cycle0, cycle1) in zip(restarts, restarts[1:])]
+    latency = [output_cycle - load_cycle for ((load_cycle, _), (output_cycle, _))
+               in zip(events.loads, events.outputs)]
+    print(f"{len(events.loads)} samples, {events.total_cycles} cycles: "
+          f"{events.busy_cycles} busy, {events.bubble_cycles} fetching, "
+          f"{events.wait_cycles} waiting for input")
+    print(f"cycles between restarts {min(periods, default=0)} .. {max(periods, default=0)}, "
+          f"program {ops.cycle_count()}")
+    print(f"input to output {min(latency, default=0)} .. {max(latency, default=0)} cycles")
+    print(f"{events.total_cycles / max(elapsed, 1e-9):1.0f} cycles/s simulated")
+
+if __name__ == "__main__":
+    main()
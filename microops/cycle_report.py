@@ -0,0 +1,56 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, get_preset,
+    )
+from func_hardware import (
+        OperationList, MAX_BANKS,
+    )
+from filter_implementation import (
+        multi_channel_demodulator, Channel,
+    )
+import sys, typing
+
+CLOCK_FREQUENCY_HZ = 96e6
+
+def make_channels(settings: Settings, num_channels: int) -> typing.List[Channel]:
+    # Channel pairs are placed below the first pair, with the same spacing
+    spacing = settings.upper_frequency - settings.lower_frequency
+    return [(settings.upper_frequency - (2.0 * spacing * i),
+             settings.lower_frequency - (2.0 * spacing * i))
+            for i in range(num_channels)]
+
+def main() -> None:
+    # cycle_report.py [clock frequency] [preset]
+    clock_frequency = CLOCK_FREQUENCY_HZ
+    if len(sys.argv) > 1:
+        clock_frequency = float(sys.argv[1])
+    settings = DEFAULT_SETTINGS
+    if len(sys.argv) > 2:
+        settings = get_preset(sys.argv[2])
+    # The dual datapath (see Settings.lanes) filters both frequencies of each
+    # channel at once, and is compared with the banked design
+    dual_settings = settings.replace("dual", lanes=2)
+
+    cycles_per_sample = clock_frequency / settings.sample_rate
+    print(f"Clock {clock_frequency / 1e6:1.1f} MHz, sample rate {settings.sample_rate} Hz: "
+          f"{cycles_per_sample:1.0f} cycles per sample")
+    print("channels banks ROM bytes (without REPEAT)   cycles  max sample rate  fits"
+          "  dual: cycles saving  fits")
+    for num_channels in range(1, (MAX_BANKS // 2) + 1):
+        channels = make_channels(settings, num_channels)
+        ops = OperationList(settings)
+        multi_channel_demodulator(ops, channels)
+        no_repeat_ops = OperationList(settings, repeats=False)
+        multi_channel_demodulator(no_repeat_ops, channels)
+        dual_ops = OperationList(dual_settings)
+        multi_channel_demodulator(dual_ops, channels)
+        cycles = ops.cycle_count()
+        dual_cycles = dual_ops.cycle_count()
+        fits = "yes" if cycles <= cycles_per_sample else "no"
+        dual_fits = "yes" if dual_cycles <= cycles_per_sample else "no"
+        print(f"{num_channels:8d} {ops.num_banks:5d} {len(ops.get_memory_image()):9d} "
+              f"{len(no_repeat_ops.get_memory_image()):17d} "
+              f"{cycles:8d} {clock_frequency / cycles:13.0f} Hz  {fits:4s}"
+              f"  {dual_cycles:12d} {100.0 * (cycles - dual_cycles) / cycles:5.1f}%  {dual_fits}")
+
+if __name__ == "__main__":
+    main()
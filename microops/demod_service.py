@@ -0,0 +1,269 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, PRESETS, get_preset,
+    )
+from filter_implementation import (
+        Detector,
+    )
+from signal_model import (
+        generate_signal, pcm_to_fixed, SerialDecoder, count_bit_errors,
+    )
+from word_model import (
+        WordDemodulator,
+    )
+from latency import (
+        percentile,
+    )
+from concurrent.futures import Executor, ProcessPoolExecutor
+import argparse, array, asyncio, bisect, random, sys, time, typing
+
+# Demodulation service: each connection (TCP or UNIX socket) carries one
+# stream of samples, which is demodulated with its own state, and the
+# results are streamed back. The demodulator is the word-level model of
+# the microcode program (word_model), executed in a process pool.
+#
+# Protocol: the client sends one line
+#   COMFILTER/1 <preset> <biquad|goertzel> <frames|bits>
+# then raw signed 16-bit little-endian PCM, then closes its side of the
+# connection. The server replies "OK" or "ERROR <message>", then one line
+# per result:
+#   frames: <sample> <byte in hex>       for each decoded byte
+#   bits:   <sample> <bit>               for each change of output bit
+# where <sample> is the index of the sample which produced the result, and
+# finally "END <number of samples>".
+#
+# Each connection has at most one block in the process pool, and the next
+# block is not read from the socket until the results of the previous one
+# have been sent, so a client which sends faster than it can be served, or
+# does not read its results, is held back by flow control.
+
+PROTOCOL = "COMFILTER/1"
+MODES = ["frames", "bits"]
+BLOCK_SAMPLES = 4096
+BYTES_PER_SAMPLE = 2
+DEFAULT_PORT = 7021
+
+class StreamState:
+    # Everything needed to continue demodulating one stream; it is passed
+    # to a worker process with each block, and returned updated
+    def __init__(self, settings: Settings, detector: Detector, mode: str) -> None:
+        self.settings = settings
+        self.mode = mode
+        self.demodulator = WordDemodulator(settings, detector)
+        self.decoder = SerialDecoder(settings)
+        self.samples = 0
+        self.bit = -1
+
+def process_block(state: StreamState, data: bytes) -> typing.Tuple[StreamState, str]:
+    samples = array.array("h")
+    samples.frombytes(data)
+    if sys.byteorder != "little":
+        samples.byteswap()
+    sign_shift = state.settings.all_bits - 1
+    bits = [y >> sign_shift for y in state.demodulator.run(pcm_to_fixed(samples, state.settings))]
+    lines: typing.List[str] = []
+    if state.mode == "frames":
+        received = state.decoder.decode(bits)
+        for (byte, sample) in zip(received, state.decoder.byte_samples):
+            lines.append(f"{sample} {byte:02x}\n")
+        state.decoder.byte_samples.clear()
+    else:
+        for (i, bit) in enumerate(bits):
+            if bit != state.bit:
+                lines.append(f"{state.samples + i} {bit}\n")
+                state.bit = bit
+    state.samples += len(bits)
+    return (state, "".join(lines))
+
+def parse_header(line: str) -> StreamState:
+    fields = line.split()
+    if (len(fields) != 4) or (fields[0] != PROTOCOL):
+        raise ValueError(f"Expected '{PROTOCOL} <preset> <detector> <mode>'")
+    (protocol, preset, detector, mode) = fields
+    if detector.upper() not in Detector.__members__:
+        raise ValueError(f"Unknown detector '{detector}'")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}'")
+    return StreamState(get_preset(preset), Detector[detector.upper()], mode)
+
+class Server:
+    def __init__(self, executor: Executor) -> None:
+        self.executor = executor
+        self.connections = 0
+        self.active = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self.active += 1
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                state = parse_header((await reader.readline()).decode("ascii", "replace"))
+            except ValueError as e:
+                writer.write(f"ERROR {e}\n".encode("ascii"))
+                return
+            writer.write(b"OK\n")
+            pending = b""
+            while True:
+                data = await reader.read(BLOCK_SAMPLES * BYTES_PER_SAMPLE)
+                if len(data) == 0:
+                    break
+                data = pending + data
+                whole = len(data) - (len(data) % BYTES_PER_SAMPLE)
+                pending = data[whole:]
+                (state, results) = await loop.run_in_executor(
+                        self.executor, process_block, state, data[:whole])
+                writer.write(results.encode("ascii"))
+                await writer.drain()
+            writer.write(f"END {state.samples}\n".encode("ascii"))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+async def start_server(server: Server, address: str) -> asyncio.AbstractServer:
+    # address is a path for a UNIX socket, or [host]:port for TCP
+    if ":" in address:
+        (host, port) = address.rsplit(":", 1)
+        return await asyncio.start_server(server.handle, host or None, int(port))
+    return await asyncio.start_unix_server(server.handle, address)
+
+async def open_connection(address: str) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if ":" in address:
+        (host, port) = address.rsplit(":", 1)
+        return await asyncio.open_connection(host or "localhost", int(port))
+    return await asyncio.open_unix_connection(address)
+
+async def serve(address: str, processes: typing.Optional[int]) -> None:
+    with ProcessPoolExecutor(processes) as executor:
+        server = Server(executor)
+        async with await start_server(server, address) as listener:
+            print(f"Listening on {address}", flush=True)
+            await listener.serve_forever()
+
+class StreamResult:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.samples = 0
+        self.received = b""
+        self.latency: typing.List[float] = []   # seconds, for each decoded byte
+        self.bit_errors = 0
+        self.error: typing.Optional[str] = None
+
+async def run_stream(address: str, settings: Settings, detector: Detector,
+                     data: bytes, realtime: bool) -> StreamResult:
+    # Send the signal for the data, as fast as possible or at the sample
+    # rate, and receive frames. The latency of each frame is the time from
+    # sending the block containing its final sample to receiving the frame.
+    result = StreamResult(data)
+    pcm = generate_signal(data, settings)
+    payload = array.array("h", pcm)
+    if sys.byteorder != "little":
+        payload.byteswap()
+    encoded = payload.tobytes()
+    (reader, writer) = await open_connection(address)
+    writer.write(f"{PROTOCOL} {settings.name} {detector.name.lower()} frames\n".encode("ascii"))
+    response = (await reader.readline()).decode("ascii").strip()
+    if response != "OK":
+        result.error = response
+        writer.close()
+        return result
+
+    block_ends: typing.List[int] = []
+    send_times: typing.List[float] = []
+
+    async def send() -> None:
+        start_time = time.monotonic()
+        for start in range(0, len(pcm), BLOCK_SAMPLES):
+            end = min(start + BLOCK_SAMPLES, len(pcm))
+            if realtime:
+                delay = start_time + (end / settings.sample_rate) - time.monotonic()
+                if delay > 0.0:
+                    await asyncio.sleep(delay)
+            writer.write(encoded[start * BYTES_PER_SAMPLE:end * BYTES_PER_SAMPLE])
+            await writer.drain()
+            block_ends.append(end)
+            send_times.append(time.monotonic())
+        writer.write_eof()
+
+    sender = asyncio.create_task(send())
+    received = bytearray()
+    while True:
+        line = (await reader.readline()).decode("ascii")
+        fields = line.split()
+        if (len(fields) == 0) or (fields[0] == "END"):
+            if len(fields) == 2:
+                result.samples = int(fields[1])
+            break
+        (sample, byte) = (int(fields[0]), int(fields[1], 16))
+        received.append(byte)
+        block = bisect.bisect_right(block_ends, sample)
+        if block < len(send_times):
+            result.latency.append(time.monotonic() - send_times[block])
+    await sender
+    writer.close()
+    result.received = bytes(received)
+    result.bit_errors = count_bit_errors(data, result.received[:len(data)])
+    return result
+
+async def run_load(address: str, settings: Settings, detector: Detector, num_streams: int,
+                   num_bytes: int, realtime: bool, seed: int = 1) -> typing.Tuple[typing.List[StreamResult], float]:
+    r = random.Random(seed)
+    streams = [bytes(r.randrange(256) for i in range(num_bytes)) for j in range(num_streams)]
+    start_time = time.monotonic()
+    results = await asyncio.gather(*[run_stream(address, settings, detector, data, realtime)
+                                     for data in streams])
+    return (list(results), time.monotonic() - start_time)
+
+def report_load(results: typing.List[StreamResult], elapsed: float, settings: Settings) -> bool:
+    total_samples = sum(result.samples for result in results)
+    all_latency = [int(value * 1e6) for result in results for value in result.latency]
+    print(f"{len(results)} streams, {total_samples} samples in {elapsed:.2f}s: "
+          f"{total_samples / elapsed:.0f} samples/s, "
+          f"{total_samples / elapsed / settings.sample_rate:.1f}x real time")
+    for p in [50, 90, 99, 100]:
+        value = percentile(all_latency, p)
+        if value is not None:
+            print(f"  latency {'p' + str(p) if p != 100 else 'max':4s} {value / 1000.0:8.1f} ms")
+    ok = True
+    for (i, result) in enumerate(results):
+        if (result.error is not None) or (result.bit_errors != 0):
+            print(f"  stream {i}: {result.error or ''} {result.bit_errors} bit errors")
+            ok = False
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Demodulation service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="run the server")
+    serve_parser.add_argument("address", nargs="?", default=f"localhost:{DEFAULT_PORT}",
+                              help="[host]:port or UNIX socket path")
+    serve_parser.add_argument("--processes", type=int, default=None)
+    load_parser = subparsers.add_parser("load", help="measure throughput and latency")
+    load_parser.add_argument("address", nargs="?", default=f"localhost:{DEFAULT_PORT}")
+    load_parser.add_argument("--streams", type=int, default=4)
+    load_parser.add_argument("--bytes", type=int, default=16, help="bytes per stream")
+    load_parser.add_argument("--preset", default=DEFAULT_SETTINGS.name,
+                             help=f"any of: {', '.join(PRESETS)}")
+    load_parser.add_argument("--detector", choices=[d.name.lower() for d in Detector],
+                             default=Detector.BIQUAD.name.lower())
+    load_parser.add_argument("--realtime", action="store_true",
+                             help="send at the sample rate rather than as fast as possible")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args.address, args.processes))
+        else:
+            settings = get_preset(args.preset)
+            (results, elapsed) = asyncio.run(run_load(
+                    args.address, settings, Detector[args.detector.upper()],
+                    args.streams, args.bytes, args.realtime))
+            if not report_load(results, elapsed, settings):
+                sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from settings import (
+        DEFAULT_SETTINGS, PRESETS, get_preset,
+    )
+from func_hardware import (
+        OperationList, CommentOperation,
+    )
+from filter_implementation import (
+        demodulator, goertzel_demodulator,
+    )
+from signal_model import (
+        generate_signal, reference_demodulator,
+    )
+from width_sweep import (
+        Generator, SweepResult, evaluate,
+    )
+from concurrent.futures import ProcessPoolExecutor
+import argparse, sys, typing
+
+# Compare the demodulator programs on the same corpus: cycles per sample,
+# ROM size, multiplications per sample and bit error rate, with each
+# program executed by FuncExecutor. "match ref" is agreement with the
+# floating-point (biquad) reference demodulator in signal_model.
+
+GENERATORS: typing.Dict[str, Generator] = {
+    "biquad": demodulator,
+    "goertzel": goertzel_demodulator,
+}
+
+def count_multiplications(ops: OperationList) -> int:
+    return sum(1 for op in ops if isinstance(op, CommentOperation)
+               and op.comment.startswith("Multiplication begins"))
+
+def benchmark(preset: str, data: bytes,
+              processes: typing.Optional[int] = None) -> typing.Dict[str, SweepResult]:
+    settings = get_preset(preset)
+    pcm = generate_signal(data, settings)
+    reference_bits = reference_demodulator(pcm, settings)
+    names = list(GENERATORS)
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(evaluate,
+                                [settings] * len(names),
+                                [pcm] * len(names),
+                                [data] * len(names),
+                                [reference_bits] * len(names),
+                                [GENERATORS[name] for name in names]))
+    return dict(zip(names, results))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare demodulator programs")
+    parser.add_argument("presets", nargs="*", default=[DEFAULT_SETTINGS.name],
+                        help=f"any of: {', '.join(PRESETS)}")
+    parser.add_argument("--data", default="test_data",
+                        help="file containing bytes to transmit")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.data, "rb") as fd:
+        data = fd.read()
+
+    failed = False
+    for preset in args.presets:
+        print(get_preset(preset))
+        print("  program    cycles  ROM bytes  multiplies  bit errors       BER  match ref  run time")
+        for (name, result) in benchmark(preset, data, args.processes).items():
+            ops = OperationList(result.settings)
+            GENERATORS[name](ops)
+            print(f"  {name:8s} {result.cycles:8d} {result.rom_bytes:10d} "
+                  f"{count_multiplications(ops):11d} ", end="")
+            if result.overflow:
+                print("  overflow")
+                failed = True
+                continue
+            print(f"{result.bit_errors:11d} {result.bit_error_rate:9.4f} "
+                  f"{result.reference_match * 100.0:9.2f}% {result.run_time:8.1f}s")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
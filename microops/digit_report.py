@@ -0,0 +1,57 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, PRESETS, MAX_DIGIT_BITS, get_preset,
+    )
+from fpga_hardware import (
+        FPGAOperationList,
+    )
+from filter_implementation import (
+        demodulator, goertzel_demodulator,
+    )
+from cycle_report import (
+        CLOCK_FREQUENCY_HZ,
+    )
+import argparse, typing
+
+# Cycles per sample and ROM space of the filter unit for each number of
+# bits shifted per clock cycle. Wider digits need fewer cycles, but each
+# register input, the subtractors and the adder for R become wider, and
+# R += A * digit needs a small multiplier. LUTs and Fmax are not reported:
+# the digit-serial RTL has not been simulated or synthesised yet, so use
+# synth_report once it has.
+
+GENERATORS = {
+    "biquad": demodulator,
+    "goertzel": goertzel_demodulator,
+}
+
+def digit_sizes(settings: Settings) -> typing.List[int]:
+    return [digit_bits for digit_bits in range(1, MAX_DIGIT_BITS + 1)
+            if (settings.all_bits % digit_bits) == 0]
+
+def report(settings: Settings, name: str) -> None:
+    for digit_bits in digit_sizes(settings):
+        digit_settings = settings.replace(settings.name, digit_bits=digit_bits)
+        ops = FPGAOperationList(digit_settings)
+        GENERATORS[name](ops)
+        cycles = ops.cycle_count()
+        print(f"{settings.name:10s} {name:8s} {digit_bits:5d} {digit_settings.a_bits:6d} "
+              f"{len(ops.get_memory_image()):9d} {cycles:7d} "
+              f"{CLOCK_FREQUENCY_HZ / cycles:13.0f} Hz")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cycles and resources for each digit size")
+    parser.add_argument("presets", nargs="*", default=[DEFAULT_SETTINGS.name],
+                        help=f"any of: {', '.join(PRESETS)}")
+    parser.add_argument("--detector", choices=list(GENERATORS), nargs="+",
+                        default=list(GENERATORS))
+    args = parser.parse_args()
+
+    print(f"Clock {CLOCK_FREQUENCY_HZ / 1e6:1.1f} MHz")
+    print(f"{'preset':10s} {'detector':8s} digit A bits ROM bytes  cycles  max sample rate")
+    for preset in args.presets:
+        settings = get_preset(preset)
+        for name in args.detector:
+            report(settings, name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+from func_hardware import (
+        Register, OperationList,
+    )
+from settings import (
+        Settings, DEFAULT_SETTINGS,
+    )
+import argparse, collections, struct, sys, typing
+
+# Binary execution trace, written by FuncExecutor and by filter_unit.vhdl
+# (trace_file generic), so that the two can be compared cycle by cycle.
+#
+# Header: "CFTR", version (1 byte), number of fields (1 byte),
+#         bytes per field value (1 byte)
+# Then a sequence of blocks, one for each pass through the program
+# (ending with the RESTART operation):
+#   number of records (4 bytes), number of bytes in the records (4 bytes)
+# Each record is a clock cycle in which an operation executes (not
+# including cycles waiting for input or fetching after RESTART):
+#   address (2 bytes), code (1 byte), mask (2 bytes),
+#   then the new value of each field whose bit is set in the mask.
+# Field values are those after the operation has executed. Each field is
+# only written when it differs from the previous record; the first record
+# in each block contains every field, so blocks can be compared without
+# being decoded. Everything is little-endian.
+#
+# Fields are the registers in TRACE_REGISTERS followed by the sample
+# number: the number of inputs loaded so far, including any loaded by
+# this operation. Only records for samples in the window
+# first_sample <= sample < last_sample are written.
+
+MAGIC = b"CFTR"
+VERSION = 1
+TRACE_REGISTERS = [
+    Register.R, Register.Y, Register.O1, Register.O2, Register.X,
+    Register.L, Register.I0, Register.I1, Register.I2, Register.A,
+]
+FIELD_NAMES = [reg.name for reg in TRACE_REGISTERS] + ["SAMPLE"]
+NUM_FIELDS = len(FIELD_NAMES)
+SAMPLE_FIELD = NUM_FIELDS - 1
+HEADER = struct.Struct("<4sBBB")
+BLOCK_HEADER = struct.Struct("<II")
+RECORD_HEADER = struct.Struct("<HBH")
+VALUE_FORMAT = {4: "I", 8: "Q"}
+NO_LIMIT = (1 << 31) - 1
+CONTEXT_RECORDS = 8
+
+def get_value_bytes(settings: Settings) -> int:
+    return 4 if settings.a_bits <= 32 else 8
+
+class TraceRecord(typing.NamedTuple):
+    index: int
+    address: int
+    code: int
+    values: typing.Tuple[int, ...]
+
+    @property
+    def sample(self) -> int:
+        return self.values[SAMPLE_FIELD]
+
+class TraceWriter:
+    def __init__(self, filename: str, settings: Settings = DEFAULT_SETTINGS,
+                 first_sample: int = 0, last_sample: int = NO_LIMIT) -> None:
+        self.fd = open(filename, "wb")
+        self.first_sample = first_sample
+        self.last_sample = last_sample
+        self.value_bytes = get_value_bytes(settings)
+        self.value_format = VALUE_FORMAT[self.value_bytes]
+        self.previous: typing.Optional[typing.List[int]] = None
+        self.block = bytearray()
+        self.block_records = 0
+        self.fd.write(HEADER.pack(MAGIC, VERSION, NUM_FIELDS, self.value_bytes))
+
+    def write(self, address: int, code: int, values: typing.List[int],
+              end_of_block: bool) -> None:
+        # values has one entry per field, including the sample number
+        if self.first_sample <= values[SAMPLE_FIELD] < self.last_sample:
+            previous = self.previous
+            if previous is None:
+                mask = (1 << NUM_FIELDS) - 1
+                changed = values
+            else:
+                mask = 0
+                changed = []
+                for (i, value) in enumerate(values):
+                    if previous[i] != value:
+                        mask |= 1 << i
+                        changed.append(value)
+            self.previous = values
+            self.block.extend(RECORD_HEADER.pack(address, code, mask))
+            self.block.extend(struct.pack(f"<{len(changed)}{self.value_format}", *changed))
+            self.block_records += 1
+        if end_of_block:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.block_records != 0:
+            self.fd.write(BLOCK_HEADER.pack(self.block_records, len(self.block)))
+            self.fd.write(self.block)
+        self.block.clear()
+        self.block_records = 0
+        self.previous = None
+
+    def close(self) -> None:
+        self.flush()
+        self.fd.close()
+
+class TraceError(Exception):
+    pass
+
+class TraceReader:
+    # Reads one block at a time, so the whole file is never loaded
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.fd = open(filename, "rb")
+        header = self.fd.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise TraceError(f"{filename}: no header")
+        (magic, version, num_fields, self.value_bytes) = HEADER.unpack(header)
+        if ((magic != MAGIC) or (version != VERSION) or (num_fields != NUM_FIELDS)
+                or (self.value_bytes not in VALUE_FORMAT)):
+            raise TraceError(f"{filename}: not a version {VERSION} trace")
+        self.value = struct.Struct("<" + VALUE_FORMAT[self.value_bytes])
+        self.index = 0      # index of the first record in the next block
+
+    def read_block(self) -> typing.Optional[typing.Tuple[int, int, bytes]]:
+        # Returns (index of first record, number of records, encoded records)
+        header = self.fd.read(BLOCK_HEADER.size)
+        if len(header) == 0:
+            return None
+        if len(header) != BLOCK_HEADER.size:
+            raise TraceError(f"{self.filename}: truncated")
+        (num_records, size) = BLOCK_HEADER.unpack(header)
+        data = self.fd.read(size)
+        if len(data) != size:
+            raise TraceError(f"{self.filename}: truncated")
+        index = self.index
+        self.index += num_records
+        return (index, num_records, data)
+
+    def decode_block(self, index: int, num_records: int, data: bytes) -> typing.List[TraceRecord]:
+        records: typing.List[TraceRecord] = []
+        values = [0] * NUM_FIELDS
+        offset = 0
+        for i in range(num_records):
+            (address, code, mask) = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            field = 0
+            while mask:
+                if mask & 1:
+                    (values[field],) = self.value.unpack_from(data, offset)
+                    offset += self.value_bytes
+                mask >>= 1
+                field += 1
+            records.append(TraceRecord(index + i, address, code, tuple(values)))
+        if offset != len(data):
+            raise TraceError(f"{self.filename}: bad block at record {index}")
+        return records
+
+    def __iter__(self) -> typing.Iterator[TraceRecord]:
+        block = self.read_block()
+        while block is not None:
+            yield from self.decode_block(*block)
+            block = self.read_block()
+
+    def close(self) -> None:
+        self.fd.close()
+
+def print_record(name: str, record: typing.Optional[TraceRecord],
+                 other: typing.Optional[TraceRecord] = None) -> None:
+    if record is None:
+        print(f"  {name}: end of trace")
+        return
+    print(f"  {name}: cycle {record.index} sample {record.sample} "
+          f"address {record.address} code {record.code:02x}")
+    line = []
+    for (i, field) in enumerate(FIELD_NAMES[:SAMPLE_FIELD]):
+        differs = (other is not None) and (other.values[i] != record.values[i])
+        line.append(f"{field}={record.values[i]:x}{'*' if differs else ''}")
+    print("    " + " ".join(line))
+
+class Divergence(typing.NamedTuple):
+    context: typing.List[TraceRecord]
+    a: typing.Optional[TraceRecord]
+    b: typing.Optional[TraceRecord]
+
+def find_divergence(filename_a: str, filename_b: str) -> typing.Optional[Divergence]:
+    # Find the first record where two traces differ, with preceding context.
+    # Blocks are only decoded if they differ. Returns None if the traces are the same.
+    reader_a = TraceReader(filename_a)
+    reader_b = TraceReader(filename_b)
+    if reader_a.value_bytes != reader_b.value_bytes:
+        raise TraceError("Traces have different value sizes")
+    previous: typing.Optional[typing.Tuple[int, int, bytes]] = None
+    block_a = reader_a.read_block()
+    block_b = reader_b.read_block()
+    while block_a == block_b:
+        if block_a is None:
+            return None
+        previous = block_a
+        block_a = reader_a.read_block()
+        block_b = reader_b.read_block()
+
+    # Decode the differing blocks to find the first different record
+    context: typing.List[TraceRecord] = []
+    if previous is not None:
+        context = reader_a.decode_block(*previous)[-CONTEXT_RECORDS:]
+    records_a = reader_a.decode_block(*block_a) if block_a is not None else []
+    records_b = reader_b.decode_block(*block_b) if block_b is not None else []
+    reader_a.close()
+    reader_b.close()
+    for i in range(max(len(records_a), len(records_b))):
+        a = records_a[i] if i < len(records_a) else None
+        b = records_b[i] if i < len(records_b) else None
+        if (a is None) or (b is None) or (a[1:] != b[1:]):
+            return Divergence(context[-CONTEXT_RECORDS:], a, b)
+        context.append(a)
+    raise TraceError("Blocks differ but records are the same")
+
+def print_divergence(divergence: Divergence, ops: typing.Optional[OperationList] = None) -> None:
+    disassembly: typing.Dict[int, str] = {}
+    if ops is not None:
+        disassembly = {op.address: str(op) for op in ops if op.encode() is not None}
+    first = divergence.a if divergence.a is not None else divergence.b
+    assert first is not None
+    print(f"First divergence after {first.index} identical cycles")
+    print("Context:")
+    for record in divergence.context:
+        print(f"  cycle {record.index} sample {record.sample} address {record.address} "
+              f"{disassembly.get(record.address, '')}")
+    print("Divergent cycle (* marks differences):")
+    if first.address in disassembly:
+        print(f"  {disassembly[first.address]}")
+    print_record("A", divergence.a, divergence.b)
+    print_record("B", divergence.b, divergence.a)
+
+def run_python(filename: str, num_samples: int, first_sample: int, last_sample: int) -> None:
+    from filter_implementation import demodulator
+    from func_execute import FuncExecutor
+    from test_vector import TestVector
+
+    ops = OperationList()
+    demodulator(ops)
+    trace = TraceWriter(filename, ops.settings, first_sample, last_sample)
+    FuncExecutor(ops, trace=trace).run(TestVector(num_samples).in_values)
+    trace.close()
+
+def run_ghdl(filename: str, num_samples: int, first_sample: int, last_sample: int) -> None:
+    from fpga_hardware import FPGAOperationList
+    from filter_implementation import demodulator
+    from ghdl_test import ghdl_run_ops
+    from test_vector import TestVector
+    from pathlib import Path
+
+    ops = FPGAOperationList()
+    demodulator(ops)
+    ghdl_run_ops(ops, TestVector(num_samples).in_values,
+                 trace=(str(Path(filename).absolute()), first_sample, last_sample))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Execution traces")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="trace the demodulator using the test vector")
+    run.add_argument("backend", choices=["python", "ghdl"])
+    run.add_argument("trace_file")
+    run.add_argument("--samples", type=int, default=4000)
+    run.add_argument("--first", type=int, default=0)
+    run.add_argument("--last", type=int, default=NO_LIMIT)
+    compare = subparsers.add_parser("compare", help="find the first difference")
+    compare.add_argument("trace_a")
+    compare.add_argument("trace_b")
+    compare.add_argument("--demodulator", action="store_true",
+                         help="disassemble addresses as the demodulator program")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.backend == "python":
+            run_python(args.trace_file, args.samples, args.first, args.last)
+        else:
+            run_ghdl(args.trace_file, args.samples, args.first, args.last)
+    else:
+        ops: typing.Optional[OperationList] = None
+        if args.demodulator:
+            from filter_implementation import demodulator
+            ops = OperationList()
+            demodulator(ops)
+        divergence = find_divergence(args.trace_a, args.trace_b)
+        if divergence is None:
+            print("Traces are the same")
+        else:
+            print_divergence(divergence, ops)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,41 @@
-
 from settings import (
-        UPPER_FREQUENCY,
-        LOWER_FREQUENCY,
-        BAUD_RATE,
-        FRACTIONAL_BITS,
-        RC_DECAY_PER_BIT,
-        FILTER_WIDTH,
-        SAMPLE_RATE,
         FILTER_UNIT_PREFIX,
+        Settings, DEFAULT_SETTINGS, get_preset,
     )
 from func_hardware import (
         get_shift_line, Debug, MuxCode,
         OperationList, Register, ControlLine,
-        ALL_BITS, A_BITS, R_BITS,
     )
 from fpga_hardware import (
         FPGAOperationList,
     )
-import enum, math, typing
+import argparse, cmath, enum, math, typing
 
-def make_fixed(value: float) -> int:
+def make_fixed(value: float, settings: Settings) -> int:
     assert abs(value) < 2.0
-    ivalue = int(math.floor((value * (1 << FRACTIONAL_BITS)) + 0.5))
+    ivalue = int(math.floor((value * (1 << settings.fractional_bits)) + 0.5))
     if ivalue < 0:
-        ivalue += 1 << ALL_BITS
-    assert 0 <= ivalue < (1 << ALL_BITS)
+        ivalue += 1 << settings.all_bits
+    assert 0 <= ivalue < (1 << settings.all_bits)
     return ivalue
 
-def make_float(ivalue: int) -> float:
-    assert 0 <= ivalue < (1 << ALL_BITS)
-    if ivalue >= (1 << (ALL_BITS - 1)):
-        ivalue -= 1 << ALL_BITS
-    return ivalue / float(1 << FRACTIONAL_BITS)
+def make_float(ivalue: int, settings: Settings) -> float:
+    assert 0 <= ivalue < (1 << settings.all_bits)
+    if ivalue >= (1 << (settings.all_bits - 1)):
+        ivalue -= 1 << settings.all_bits
+    return ivalue / float(1 << settings.fractional_bits)
 
 def fixed_multiply(ops: OperationList, source: Register, value: float) -> None:
-    ivalue = make_fixed(value)
-    negative = ivalue & (1 << (ALL_BITS - 1))
+    if ops.settings.digit_bits > 1:
+        digit_multiply(ops, source, [value] * ops.settings.lanes)
+        return
+
+    all_bits = ops.settings.all_bits
+    a_bits = ops.settings.a_bits
+    ivalue = make_fixed(value, ops.settings)
+    negative = ivalue & (1 << (all_bits - 1))
     if negative:
-        ivalue |= ((1 << ALL_BITS) - 1) << ALL_BITS
+        ivalue |= ((1 << all_bits) - 1) << all_bits
 
     ops.comment(f"Multiplication begins: {source.name} * {value:1.6f} ({ivalue:04x})")
 
@@ -59,33 +57,141 @@ def fixed_multiply(ops: OperationList, source: Register, value: float) -> None:
 
     # Do the first part of the multiplication, shifting data in from the source register
     # Stop before shifting the final source register (sign extend)
-    for i in range(ALL_BITS - 2):
+    for i in range(all_bits - 2):
         ivalue = ivalue << 1
-        if ivalue & (1 << A_BITS):
+        if ivalue & (1 << a_bits):
             ops.add(ControlLine.ADD_A_TO_R, get_shift_line(source), ControlLine.SHIFT_A_RIGHT)
         else:
             ops.add(get_shift_line(source), ControlLine.SHIFT_A_RIGHT)
 
     # Do the second part of the multiplication, now that everything from the source register is present
-    for i in range(A_BITS - (ALL_BITS - 2) - 1):
+    for i in range(a_bits - (all_bits - 2) - 1):
         ivalue = ivalue << 1
-        if ivalue & (1 << A_BITS):
+        if ivalue & (1 << a_bits):
             ops.add(ControlLine.ADD_A_TO_R, ControlLine.SHIFT_A_RIGHT)
         else:
             ops.add(ControlLine.SHIFT_A_RIGHT)
 
     # The third part of the multiplication restores the source register state
     ivalue = ivalue << 1
-    if ivalue & (1 << A_BITS):
+    if ivalue & (1 << a_bits):
         ops.add(ControlLine.ADD_A_TO_R, ControlLine.SHIFT_A_RIGHT, get_shift_line(source))
     else:
         ops.add(ControlLine.SHIFT_A_RIGHT, get_shift_line(source))
 
     ops.comment(f"Multiplication complete: {source.name} * {value:1.6f}")
 
+def lane_multiply(ops: OperationList, source: Register, values: typing.Sequence[float]) -> None:
+    # R += source * values[i] in lane i. ADD_A_TO_R adds in every lane, so
+    # if the coefficients are all the same, this is fixed_multiply.
+    if all(value == values[0] for value in values):
+        fixed_multiply(ops, source, values[0])
+    else:
+        digit_multiply(ops, source, values)
+
+def digit_multiply(ops: OperationList, source: Register, values: typing.Sequence[float]) -> None:
+    # As fixed_multiply, for a datapath which shifts a digit of digit_bits
+    # bits in each cycle. A is loaded from the source one digit at a time
+    # (least significant first) and then sign extended, so that after j
+    # shifts, A is source * 2^(a_bits - (j * digit_bits)), modulo 2^a_bits.
+    # Before each shift, A is multiplied by the matching digit of the
+    # coefficient and added to R, which forms the product modulo 2^a_bits.
+    # The coefficient is scaled up by the digits added to the fractional
+    # bits of R (see Settings). values has the coefficient for each lane,
+    # and the digits for all lanes are packed into each MUL and ADD digit.
+    settings = ops.settings
+    digit_bits = settings.digit_bits
+    digit_mask = (1 << digit_bits) - 1
+    a_digits = settings.a_bits // digit_bits
+    if len(values) != settings.lanes:
+        raise ValueError(f"A coefficient is needed for each of {settings.lanes} lanes")
+    # digits[j] is multiplied by A after j shifts
+    digits = [0 for j in range(a_digits + 1)]
+    one = 0
+    names: typing.List[str] = []
+    for (lane, value) in enumerate(values):
+        ivalue = make_fixed(value, settings)
+        if ivalue & (1 << (settings.all_bits - 1)):
+            ivalue -= 1 << settings.all_bits
+        ivalue = (ivalue << (settings.r_fractional_bits - settings.fractional_bits)) & (
+                    (1 << settings.a_bits) - 1)
+        for j in range(1, a_digits + 1):
+            digits[j] |= ((ivalue >> (settings.a_bits - (j * digit_bits))) & digit_mask) << (
+                            lane * digit_bits)
+        one |= 1 << (lane * digit_bits)
+        names.append(f"{value:1.6f} ({ivalue:x})")
+    value_names = " / ".join(names)
+
+    ops.comment(f"Multiplication begins: {source.name} * {value_names}")
+
+    # Clear A
+    ops.mux(Register.ZERO)
+    for j in range(a_digits):
+        ops.add(ControlLine.SHIFT_A_RIGHT)
+    ops.debug(Debug.ASSERT_A_LOW_ZERO)
+    ops.debug(Debug.ASSERT_A_HIGH_ZERO)
+
+    # Shift in each digit of the source, which restores the source register
+    # state, then sign extend
+    ops.mux(source)
+    load = [ControlLine.SHIFT_A_RIGHT, get_shift_line(source)]
+    extend = [ControlLine.SHIFT_A_RIGHT, ControlLine.SIGN_EXTEND_A]
+    for j in range(1, a_digits + 1):
+        lines = load if j <= settings.all_digits else extend
+        digit = digits[j - 1]
+        if j in (1, settings.all_digits + 1):
+            # The first shift of each part is a control operation, which can
+            # only add A once (in every lane)
+            if digit not in (0, one):
+                ops.add_multiple(digit)
+            ops.add(lines, [ControlLine.ADD_A_TO_R] if digit == one else [])
+        elif digit != 0:
+            ops.multiply(digit)
+        else:
+            ops.add(lines)
+
+    # Final addition
+    if digits[a_digits] != 0:
+        ops.add_multiple(digits[a_digits])
+
+    ops.comment(f"Multiplication complete: {source.name} * {value_names}")
+
+def add_scaled_reg_to_R(ops: OperationList, source: Register, shift: int) -> None:
+    # R += source * 2^-shift, without a multiplication: A is loaded with the
+    # source, aligned and sign extended, so that a single addition is needed
+    settings = ops.settings
+    all_bits = settings.all_bits
+    low_zeros = settings.fractional_bits - shift
+    if not (0 <= shift <= settings.fractional_bits):
+        raise ValueError(f"Cannot scale by 2^-{shift}")
+    if settings.digit_bits > 1:
+        # The alignment is not a whole number of digits in general, but a
+        # multiplication by a power of two has few non-zero digits
+        digit_multiply(ops, source, [2.0 ** -shift] * settings.lanes)
+        return
+
+    ops.comment(f"Scaled addition: R += {source.name} * 2^-{shift}")
+
+    # Low bits of A are zero
+    ops.mux(Register.ZERO)
+    for i in range(low_zeros):
+        ops.add(ControlLine.SHIFT_A_RIGHT)
+
+    # Shift data in from the source register, stopping before the final bit (sign extend)
+    ops.mux(source)
+    for i in range(all_bits - 1):
+        ops.add(ControlLine.SHIFT_A_RIGHT, get_shift_line(source))
+    for i in range(settings.a_bits - low_zeros - (all_bits - 1)):
+        ops.add(ControlLine.SHIFT_A_RIGHT)
+
+    # Add, and restore the source register state
+    ops.add(ControlLine.ADD_A_TO_R, get_shift_line(source))
+
 def move_R_to_reg(ops: OperationList, target: Register) -> None:
+    settings = ops.settings
+
     # Discard low bits of R
-    for i in range(FRACTIONAL_BITS):
+    for i in range(settings.r_fractional_bits // settings.digit_bits):
         ops.add(ControlLine.SHIFT_R_RIGHT)
 
     # Move result bits of R to target
@@ -94,7 +200,8 @@ def move_R_to_reg(ops: OperationList, target: Register) -> None:
             ControlLine.REPEAT_FOR_ALL_BITS)
 
     # Discard high bits of R (if any)
-    for i in range(R_BITS - (FRACTIONAL_BITS + ALL_BITS)):
+    for i in range((settings.r_bits - (settings.r_fractional_bits + settings.all_bits))
+                   // settings.digit_bits):
         ops.add(ControlLine.SHIFT_R_RIGHT)
 
     # R should be zero again here!
@@ -112,25 +219,40 @@ def move_reg_to_reg(ops: OperationList, source: Register, target: Register) -> N
         ops.add(ControlLine.SET_X_IN_TO_REG_OUT)
     ops.add(get_shift_line(target), get_shift_line(source), ControlLine.REPEAT_FOR_ALL_BITS)
 
-def filter_step(ops: OperationList, a1: float, a2: float, b0: float, b2: float) -> None:
+def filter_output(ops: OperationList) -> None:
+    # O2 = O1, O1 = R
+    move_reg_to_reg(ops, Register.O1, Register.O2)
+    move_reg_to_reg(ops, Register.R, Register.O1)
+
+def filter_step(ops: OperationList, a1: float, a2: float, b0: float, b2: float,
+                output: bool = True) -> None:
+    lane_filter_step(ops, [(a1, a2, b0, b2)], output)
+
+def lane_filter_step(ops: OperationList,
+                     coefficients: typing.Sequence[typing.Tuple[float, float, float, float]],
+                     output: bool = True) -> None:
+    # As filter_step, with (a1, a2, b0, b2) for each lane
+    (a1, a2, b0, b2) = zip(*coefficients)
+
     # R should be zero here!
     ops.debug(Debug.ASSERT_R_ZERO)
 
     # R += i0 * b0
-    fixed_multiply(ops, Register.I0, b0)
+    lane_multiply(ops, Register.I0, b0)
     # R += i2 * b2
-    fixed_multiply(ops, Register.I2, b2)
+    lane_multiply(ops, Register.I2, b2)
     # R -= o1 * a1
-    fixed_multiply(ops, Register.O1, -a1)
+    lane_multiply(ops, Register.O1, [-a for a in a1])
     # R -= o2 * a2
-    fixed_multiply(ops, Register.O2, -a2)
+    lane_multiply(ops, Register.O2, [-a for a in a2])
 
-    move_reg_to_reg(ops, Register.O1, Register.O2)
-    move_reg_to_reg(ops, Register.R, Register.O1)
+    if output:
+        filter_output(ops)
 
-def compute_bandpass_filter(frequency: float, width: float) -> typing.Tuple[float, float, float, float]:
+def compute_bandpass_filter(frequency: float, width: float,
+        sample_rate: float) -> typing.Tuple[float, float, float, float]:
     # Compute filter parameters
-    w0 = (2.0 * math.pi * frequency) / SAMPLE_RATE
+    w0 = (2.0 * math.pi * frequency) / sample_rate
     alpha = math.sin(w0) / (2.0 * (frequency / width))
     b0 =   alpha
     b2 =  -alpha
@@ -143,18 +265,85 @@ def compute_bandpass_filter(frequency: float, width: float) -> typing.Tuple[floa
     a1 /= a0
     return (a1, a2, b0, b2)
 
-def bandpass_filter(ops: OperationList, frequency: float, width: float) -> None:
+def bandpass_filter(ops: OperationList, frequency: float, width: float,
+                    output: bool = True) -> None:
     ops.comment(f"Bandpass filter for {frequency:1.0f} Hz")
-    filter_step(ops, *compute_bandpass_filter(frequency, width))
+    (a1, a2, b0, b2) = compute_bandpass_filter(frequency, width, ops.settings.sample_rate)
+    filter_step(ops, a1, a2, b0, b2, output)
+
+def resonator_gain(frequency: float, radius: float, sample_rate: float) -> float:
+    # Gain at the given frequency of 1 / (1 + a1 z^-1 + a2 z^-2) with poles
+    # at radius * exp(+/- jw)
+    w0 = (2.0 * math.pi * frequency) / sample_rate
+    return 1.0 / ((1.0 - radius) * abs(1.0 - (radius * cmath.exp(-2.0j * w0))))
+
+def compute_goertzel_detectors(frequencies: typing.Sequence[float], width: float,
+        sample_rate: float) -> typing.Tuple[int, typing.List[typing.Tuple[float, float]]]:
+    # The Goertzel recurrence s = x + 2 cos(w) s1 - s2 is a resonator with
+    # poles on the unit circle. As the program has no branches, the block
+    # reset of the Goertzel algorithm is not possible, so the poles are moved
+    # inside the unit circle to the radius of the bandpass filter poles:
+    #   s = (x * 2^-shift) - (a1 * s1) - (a2 * s2)
+    # The input is scaled by a power of two (so no multiplication is needed)
+    # which is the same for every frequency, and the gains are then made
+    # equal by reducing the radius (widening) the filters with more gain,
+    # so that the levels can be compared.
+    radii = [math.sqrt(compute_bandpass_filter(frequency, width, sample_rate)[1])
+             for frequency in frequencies]
+    gains = [resonator_gain(frequency, radius, sample_rate)
+             for (frequency, radius) in zip(frequencies, radii)]
+    shift = max(0, int(math.ceil(math.log2(max(gains)))))
+    target = min(gains)
+
+    detectors: typing.List[typing.Tuple[float, float]] = []
+    for (frequency, radius) in zip(frequencies, radii):
+        # Gain increases with radius
+        low = 0.0
+        high = radius
+        for i in range(60):
+            middle = (low + high) / 2.0
+            if resonator_gain(frequency, middle, sample_rate) < target:
+                low = middle
+            else:
+                high = middle
+        radius = (low + high) / 2.0
+        w0 = (2.0 * math.pi * frequency) / sample_rate
+        detectors.append((-2.0 * radius * math.cos(w0), radius * radius))
+    return (shift, detectors)
+
+def goertzel_filter(ops: OperationList, frequency: float, shift: int, a1: float, a2: float,
+                    output: bool = True) -> None:
+    ops.comment(f"Goertzel resonator for {frequency:1.0f} Hz")
+    lane_goertzel_step(ops, shift, [(a1, a2)], output)
+
+def lane_goertzel_step(ops: OperationList, shift: int,
+                       detectors: typing.Sequence[typing.Tuple[float, float]],
+                       output: bool = True) -> None:
+    # As goertzel_filter, with (a1, a2) for each lane
+    (a1, a2) = zip(*detectors)
+    ops.debug(Debug.ASSERT_R_ZERO)
 
-def rc_filter(ops: OperationList) -> None:
-    bit_samples = SAMPLE_RATE / BAUD_RATE
+    # R += i0 * 2^-shift
+    add_scaled_reg_to_R(ops, Register.I0, shift)
+    # R -= o1 * a1
+    lane_multiply(ops, Register.O1, [-a for a in a1])
+    # R -= o2 * a2
+    lane_multiply(ops, Register.O2, [-a for a in a2])
+
+    if output:
+        filter_output(ops)
+
+def rc_decay_factor(settings: Settings) -> float:
+    bit_samples = settings.sample_rate / settings.baud_rate
     # This is the time constant, like k = 1 / RC for a capacitor discharging
     # Note: Level is y = exp(-kt) at time t, assuming level was 1.0 at time 0
-    # The level should be reduced from 1.0 to RC_DECAY_PER_BIT during each bit
-    time_constant = math.log(RC_DECAY_PER_BIT) / -bit_samples
+    # The level should be reduced from 1.0 to rc_decay_per_bit during each bit
+    time_constant = math.log(settings.rc_decay_per_bit) / -bit_samples
     # Each transition from t to t+1 is a multiplication by exp(-k)
-    decay = math.exp(-time_constant)
+    return math.exp(-time_constant)
+
+def rc_filter(ops: OperationList) -> None:
+    decay = rc_decay_factor(ops.settings)
 
     # decay L register
     ops.comment("Decay L register")
@@ -184,13 +373,15 @@ def set_X_to_abs_O1(ops: OperationList) -> None:
 
     ops.debug(Debug.ASSERT_X_IS_ABS_O1)
 
-def set_Y_to_X_minus_reg(ops: OperationList, source: Register) -> None:
-    # Operation: Y = X - reg
+def set_Y_to_X_minus_reg(ops: OperationList, source: typing.Union[Register, MuxCode]) -> None:
+    # Operation: Y = X - reg. X_OTHER_LANE has no shift line, as that X
+    # register shifts along with this one.
     ops.comment(f"set Y = X - {source.name}")
     ops.mux(source)
     ops.add(ControlLine.SET_X_IN_TO_X_AND_CLEAR_Y_BORROW)
     ops.add(ControlLine.SHIFT_X_RIGHT, ControlLine.SHIFT_Y_RIGHT,
-            get_shift_line(source), ControlLine.REPEAT_FOR_ALL_BITS)
+            [get_shift_line(source)] if isinstance(source, Register) else [],
+            ControlLine.REPEAT_FOR_ALL_BITS)
 
 def move_X_to_L_if_Y_is_not_negative(ops: OperationList) -> None:
     # if Y is non-negative, then X >= L: so, set L = X = X
@@ -201,43 +392,136 @@ def move_X_to_L_if_Y_is_not_negative(ops: OperationList) -> None:
     ops.add(ControlLine.SHIFT_L_RIGHT, ControlLine.SHIFT_X_RIGHT,
             ControlLine.REPEAT_FOR_ALL_BITS)
 
-def demodulator(ops: OperationList) -> None:
-    # Load new input
-    ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+Channel = typing.Tuple[float, float]
+
+class Detector(enum.Enum):
+    BIQUAD = enum.auto()        # bandpass filters: four multiplications each
+    GOERTZEL = enum.auto()      # resonators: two multiplications each
+
+GoertzelDetectors = typing.Tuple[int, typing.Sequence[typing.Tuple[float, float]]]
+
+def tone_filter(ops: OperationList, detector: Detector, frequencies: typing.Sequence[float],
+                goertzel: GoertzelDetectors, output: bool = True) -> None:
+    # Filter for each lane: goertzel is the shift and the (a1, a2) for each lane
+    settings = ops.settings
+    names = "/".join(f"{frequency:1.0f}" for frequency in frequencies)
+    (shift, detectors) = goertzel
+    if detector == Detector.BIQUAD:
+        ops.comment(f"Bandpass filter for {names} Hz")
+        lane_filter_step(ops, [compute_bandpass_filter(frequency, settings.filter_width,
+                                                       settings.sample_rate)
+                               for frequency in frequencies], output)
+    else:
+        ops.comment(f"Goertzel resonator for {names} Hz")
+        lane_goertzel_step(ops, shift, detectors, output)
 
-    # Apply both filters
-    # Use first bank for O1, O2, L
-    bandpass_filter(ops, UPPER_FREQUENCY, FILTER_WIDTH)
+def filter_output_and_rc(ops: OperationList) -> None:
+    filter_output(ops)
     rc_filter(ops)
-    ops.debug(Debug.SEND_O1_TO_OUTPUT)
-    ops.debug(Debug.SEND_L_TO_OUTPUT)
 
-    # Use second bank for O1S, O2S, LS
-    ops.mux(MuxCode.BANK_SWITCH)
-    bandpass_filter(ops, LOWER_FREQUENCY, FILTER_WIDTH)
-    rc_filter(ops)
+def tone_level(ops: OperationList, detector: Detector, frequencies: typing.Sequence[float],
+               goertzel: GoertzelDetectors, subroutines: bool) -> None:
+    # Filter, then update L in the selected bank, for each lane. Only the
+    # multiplications in the filter depend on the frequency, so the rest can
+    # be shared by every bank as a subroutine, which is parameterised by the
+    # RC decay. The filter itself is inlined for each bank: its coefficients
+    # are the adds of the multiplications, and the bank select only selects
+    # O1, O2 and L, so one filter subroutine for all banks is not possible.
+    if subroutines:
+        tone_filter(ops, detector, frequencies, goertzel, False)
+        ops.call(f"Filter output and RC filter (decay {rc_decay_factor(ops.settings):1.6f})",
+                 filter_output_and_rc)
+    else:
+        tone_filter(ops, detector, frequencies, goertzel)
+        rc_filter(ops)
     ops.debug(Debug.SEND_O1_TO_OUTPUT)
     ops.debug(Debug.SEND_L_TO_OUTPUT)
 
-    # Operation: X = LS
-    move_reg_to_reg(ops, Register.L, Register.X)
+def multi_channel_demodulator(ops: OperationList, channels: typing.Sequence[Channel],
+                              detector: Detector = Detector.BIQUAD,
+                              subroutines: bool = False) -> None:
+    # Each channel is a pair of (upper, lower) frequencies, producing one
+    # output bit per sample. The upper filter for channel i uses bank 2i
+    # for O1, O2, L and the lower filter uses bank 2i + 1. If subroutines
+    # is set, code which is the same for every bank is called as a
+    # subroutine, which saves ROM space but costs a few cycles per call.
+    #
+    # With two lanes (see Settings.lanes) both filters are applied at once:
+    # lane 0 filters the lower frequency and lane 1 the upper, and channel i
+    # uses bank i in both lanes.
+    if len(channels) == 0:
+        raise ValueError("At least one channel is required")
+    lanes = ops.settings.lanes
+    banks_per_channel = 1 if lanes > 1 else 2
+
+    # Load new input
+    ops.add(ControlLine.LOAD_I0_FROM_INPUT)
 
-    # Back to first bank
-    ops.mux(MuxCode.BANK_SWITCH)
+    # On restart, the bank is still selected from the last channel
+    bank = (len(channels) - 1) * banks_per_channel
 
-    # Operation: Y = X - L
-    set_Y_to_X_minus_reg(ops, Register.L)
-    ops.debug(Debug.ASSERT_Y_IS_X_MINUS_L)
+    for (i, (upper_frequency, lower_frequency)) in enumerate(channels):
+        (shift, (upper_goertzel, lower_goertzel)) = compute_goertzel_detectors(
+                [upper_frequency, lower_frequency], ops.settings.filter_width,
+                ops.settings.sample_rate)
 
-    # if Y is non-negative, then LS >= L: so, lower frequency signal is stronger
-    # if Y is negative, then LS < L: so, upper frequency signal is stronger
-    ops.add(ControlLine.SEND_Y_TO_OUTPUT)
+        if bank != (i * banks_per_channel):
+            bank = i * banks_per_channel
+            ops.bank(bank)
 
-    # ready for next input
-    move_reg_to_reg(ops, Register.I1, Register.I2)
-    move_reg_to_reg(ops, Register.I0, Register.I1)
+        if lanes > 1:
+            # Apply both filters
+            tone_level(ops, detector, [lower_frequency, upper_frequency],
+                       (shift, [lower_goertzel, upper_goertzel]), subroutines)
+
+            # Operation: X = L (in each lane)
+            move_reg_to_reg(ops, Register.L, Register.X)
+
+            # Operation: Y = X - X (other lane), which is lower L - upper L in lane 0
+            set_Y_to_X_minus_reg(ops, MuxCode.X_OTHER_LANE)
+            ops.add(ControlLine.SEND_Y_TO_OUTPUT)
+            continue
+
+        # Apply both filters
+        tone_level(ops, detector, [upper_frequency], (shift, [upper_goertzel]), subroutines)
+
+        ops.bank(bank + 1)
+        tone_level(ops, detector, [lower_frequency], (shift, [lower_goertzel]), subroutines)
+
+        # Operation: X = L (lower)
+        move_reg_to_reg(ops, Register.L, Register.X)
+
+        # Back to upper bank
+        ops.bank(bank)
+
+        # Operation: Y = X - L (upper)
+        set_Y_to_X_minus_reg(ops, Register.L)
+        ops.debug(Debug.ASSERT_Y_IS_X_MINUS_L)
+
+        # if Y is non-negative, then lower L >= upper L: so, lower frequency signal is stronger
+        # if Y is negative, then lower L < upper L: so, upper frequency signal is stronger
+        ops.add(ControlLine.SEND_Y_TO_OUTPUT)
+
+    # ready for next input (the resonators do not use previous inputs)
+    if detector == Detector.BIQUAD:
+        move_reg_to_reg(ops, Register.I1, Register.I2)
+        move_reg_to_reg(ops, Register.I0, Register.I1)
     ops.add(ControlLine.RESTART)
 
+def demodulator(ops: OperationList) -> None:
+    multi_channel_demodulator(ops, [(ops.settings.upper_frequency,
+                                     ops.settings.lower_frequency)])
+
+def goertzel_demodulator(ops: OperationList) -> None:
+    # Alternative to demodulator with fewer cycles per sample
+    multi_channel_demodulator(ops, [(ops.settings.upper_frequency,
+                                     ops.settings.lower_frequency)], Detector.GOERTZEL)
+
+def compact_demodulator(ops: OperationList) -> None:
+    # Alternative to demodulator with less ROM space, using subroutines
+    multi_channel_demodulator(ops, [(ops.settings.upper_frequency,
+                                     ops.settings.lower_frequency)], subroutines=True)
+
 def multiply_accumulate(ops: OperationList, test_values: typing.List[float]) -> None:
     # For testing: multiply-accumulate
     ops.comment(f"Begin multiply_accumulate with {test_values}")
@@ -283,8 +567,27 @@ def multiply_accumulate_via_regs(ops: OperationList, test_values: typing.List[fl
     ops.debug(Debug.SEND_O1_TO_OUTPUT)
 
 def main() -> None:
-    ops = FPGAOperationList()
-    demodulator(ops)
+    parser = argparse.ArgumentParser(description="Generate the demodulator for filter_unit")
+    parser.add_argument("preset", nargs="?", default=DEFAULT_SETTINGS.name)
+    parser.add_argument("--digit-bits", type=int)
+    parser.add_argument("--subroutines", action="store_true",
+                        help="share the filter output code as a subroutine")
+    parser.add_argument("--optimise-encoding", action="store_true",
+                        help="choose the control word encoding with the fewest LUTs "
+                             "after synthesis (see code_optimiser)")
+    args = parser.parse_args()
+
+    settings = get_preset(args.preset)
+    if args.digit_bits is not None:
+        settings = settings.replace(settings.name, digit_bits=args.digit_bits)
+    ops = FPGAOperationList(settings)
+    if args.subroutines:
+        compact_demodulator(ops)
+    else:
+        demodulator(ops)
+    if args.optimise_encoding:
+        from code_optimiser import optimise_encoding
+        print(optimise_encoding(ops))
     ops.generate(FILTER_UNIT_PREFIX)
 
 if __name__ == "__main__":
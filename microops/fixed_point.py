@@ -0,0 +1,144 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS,
+    )
+from filter_implementation import (
+        make_fixed,
+    )
+import math, typing
+
+# Arrays of fixed-point values in the format of the filter registers: each
+# value is stored as an unsigned integer of settings.all_bits bits, which
+# is the two's complement representation of value * 2^fractional_bits.
+# Conversions and arithmetic work on the whole array at once, so that tests
+# with many values do not spend their time in make_fixed and make_float.
+#
+# Arithmetic wraps, as the registers do. Multiplication matches the micro
+# operations: the complete product is formed in R, then R is moved to a
+# register, discarding the low fractional_bits (rounding towards minus
+# infinity) and wrapping.
+
+class FixedArray:
+    def __init__(self, raw: typing.Iterable[int], settings: Settings = DEFAULT_SETTINGS) -> None:
+        self.settings = settings
+        self.raw = list(raw)
+
+    @classmethod
+    def from_float(cls, values: typing.Iterable[float], settings: Settings = DEFAULT_SETTINGS,
+                   saturate: bool = False) -> "FixedArray":
+        # Round to nearest; out of range values raise OverflowError unless saturate is set
+        scale = float(1 << settings.fractional_bits)
+        (low, high) = get_limits(settings)
+        ivalues = [int(math.floor((value * scale) + 0.5)) for value in values]
+        if saturate:
+            ivalues = [min(max(ivalue, low), high) for ivalue in ivalues]
+        elif (len(ivalues) != 0) and ((min(ivalues) < low) or (max(ivalues) > high)):
+            raise OverflowError(f"Value out of range for {settings.all_bits} bit fixed point")
+        return cls.from_signed(ivalues, settings)
+
+    @classmethod
+    def from_signed(cls, ivalues: typing.Iterable[int],
+                    settings: Settings = DEFAULT_SETTINGS) -> "FixedArray":
+        # Two's complement wrapping
+        mask = (1 << settings.all_bits) - 1
+        return cls([ivalue & mask for ivalue in ivalues], settings)
+
+    @classmethod
+    def from_int16(cls, samples: typing.Iterable[int],
+                   settings: Settings = DEFAULT_SETTINGS) -> "FixedArray":
+        # 16-bit PCM, as sigdec: full scale is +/- 0.5
+        mask = (1 << settings.all_bits) - 1
+        shift = 16 - settings.fractional_bits
+        if shift >= 0:
+            return cls([(sample >> shift) & mask for sample in samples], settings)
+        else:
+            return cls([(sample << -shift) & mask for sample in samples], settings)
+
+    def to_signed(self) -> typing.List[int]:
+        sign = 1 << (self.settings.all_bits - 1)
+        return [value - ((value & sign) << 1) for value in self.raw]
+
+    def to_float(self) -> typing.List[float]:
+        scale = 1.0 / float(1 << self.settings.fractional_bits)
+        return [value * scale for value in self.to_signed()]
+
+    def to_int16(self) -> typing.List[int]:
+        # Inverse of from_int16, saturating
+        shift = 16 - self.settings.fractional_bits
+        if shift >= 0:
+            samples = [value << shift for value in self.to_signed()]
+        else:
+            samples = [value >> -shift for value in self.to_signed()]
+        return [min(max(sample, -0x8000), 0x7fff) for sample in samples]
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __getitem__(self, index: slice) -> "FixedArray":
+        return FixedArray(self.raw[index], self.settings)
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, FixedArray) and (self.raw == other.raw)
+                and (self.settings.all_bits == other.settings.all_bits)
+                and (self.settings.fractional_bits == other.settings.fractional_bits))
+
+    def __add__(self, other: "FixedArray") -> "FixedArray":
+        self.check_compatible(other)
+        mask = (1 << self.settings.all_bits) - 1
+        return FixedArray([(a + b) & mask for (a, b) in zip(self.raw, other.raw)], self.settings)
+
+    def __sub__(self, other: "FixedArray") -> "FixedArray":
+        self.check_compatible(other)
+        mask = (1 << self.settings.all_bits) - 1
+        return FixedArray([(a - b) & mask for (a, b) in zip(self.raw, other.raw)], self.settings)
+
+    def __abs__(self) -> "FixedArray":
+        # As the X register input: the most negative value is unchanged
+        return FixedArray.from_signed([abs(value) for value in self.to_signed()], self.settings)
+
+    def sign_bits(self) -> typing.List[int]:
+        shift = self.settings.all_bits - 1
+        return [value >> shift for value in self.raw]
+
+    def check_compatible(self, other: "FixedArray") -> None:
+        if len(self) != len(other):
+            raise ValueError("Arrays have different lengths")
+        if ((self.settings.all_bits != other.settings.all_bits)
+                or (self.settings.fractional_bits != other.settings.fractional_bits)):
+            raise ValueError("Arrays have different formats")
+
+    def in_range(self, limit: float) -> bool:
+        # True if every value is strictly within +/- limit
+        scaled = limit * float(1 << self.settings.fractional_bits)
+        return all(abs(value) < scaled for value in self.to_signed())
+
+    def max_error(self, expect: typing.Union["FixedArray", typing.Sequence[float]]) -> float:
+        # Largest absolute difference from expected values; 0.0 if empty
+        if isinstance(expect, FixedArray):
+            self.check_compatible(expect)
+            expect = expect.to_float()
+        elif len(expect) != len(self):
+            raise ValueError("Arrays have different lengths")
+        return max((abs(a - b) for (a, b) in zip(self.to_float(), expect)), default=0.0)
+
+def get_limits(settings: Settings) -> typing.Tuple[int, int]:
+    # Smallest and largest signed integer representation
+    return (-(1 << (settings.all_bits - 1)), (1 << (settings.all_bits - 1)) - 1)
+
+def multiply_accumulate(terms: typing.Sequence[typing.Tuple[FixedArray, float]],
+                        settings: Settings = DEFAULT_SETTINGS) -> FixedArray:
+    # Elementwise sum of each array multiplied by its coefficient, as the
+    # micro operations compute it: the coefficients are converted by
+    # make_fixed, the sum of the products is exact (modulo 2^r_bits) and then
+    # moved from R to a register
+    sign = 1 << (settings.all_bits - 1)
+    r_mask = (1 << settings.r_bits) - 1
+    mask = (1 << settings.all_bits) - 1
+    total: typing.Optional[typing.List[int]] = None
+    for (array, coefficient) in terms:
+        c = make_fixed(coefficient, settings)
+        c -= (c & sign) << 1
+        products = [value * c for value in array.to_signed()]
+        total = products if total is None else [a + b for (a, b) in zip(total, products)]
+    if total is None:
+        return FixedArray([], settings)
+    return FixedArray([((r & r_mask) >> settings.fractional_bits) & mask for r in total], settings)
@@ -1,21 +1,24 @@
 
 from func_hardware import (
             OperationList, CodeTable, ControlLine,
-            ALL_BITS, A_BITS
         )
 from settings import (
-            FRACTIONAL_BITS, NON_FRACTIONAL_BITS, DEBUG,
-            DATA_BITS, BAUD_RATE, SAMPLE_RATE,
+            DEBUG, DEFAULT_SETTINGS, Settings,
         )
 import typing
 
 UNUSED_CODE = 0xff
+# Each SB_RAM512x8 block holds 512 bytes of microcode
+ROM_BLOCK_ADDR_BITS = 9
+ROM_BLOCK_SIZE = 1 << ROM_BLOCK_ADDR_BITS
 
 class FPGACodeTable(CodeTable):
-    def dump_control_line_decoder(self, fd: typing.IO, prefix: str) -> None:
+    def dump_control_line_decoder(self, fd: typing.IO, prefix: str,
+                                  uc_addr_bits: int = ROM_BLOCK_ADDR_BITS) -> None:
         fd.write(f"""
 library ieee;
 use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
 
 entity {prefix}_control_line_decoder is port (
 """)
@@ -27,7 +30,11 @@ entity {prefix}_control_line_decoder is port (
         fd.write(f"""
 mux_select          : out std_logic_vector(3 downto 0);
 mux_strobe          : out std_logic;
+bank_strobe         : out std_logic;
 debug_strobe        : out std_logic;
+call_strobe         : out std_logic;
+return_strobe       : out std_logic;
+call_address        : out std_logic_vector({uc_addr_bits - 1} downto 0);
 enable_in           : in std_logic;
 code_in             : in std_logic_vector(7 downto 0));
 end {prefix}_control_line_decoder;
@@ -35,22 +42,37 @@ architecture structural of {prefix}_control_line_decoder is
     signal control_line_enable : std_logic;
 begin
     control_line_enable <= enable_in and not code_in(7);
-    mux_strobe <= enable_in and code_in(7) and not code_in(6);
+    mux_strobe <= enable_in and code_in(7) and not code_in(6) and not code_in(5) and not code_in(4);
+    bank_strobe <= enable_in and code_in(7) and not code_in(6) and not code_in(5) and code_in(4);
+    call_strobe <= enable_in and code_in(7) and not code_in(6) and code_in(5) and not code_in(4);
+    return_strobe <= enable_in and code_in(7) and not code_in(6) and code_in(5) and code_in(4);
     debug_strobe <= enable_in and code_in(7) and code_in(6);
     mux_select <= code_in(3 downto 0);
-    REPEAT_FOR_ALL_BITS <= code_in(6) and control_line_enable;
-    SHIFT_A_RIGHT <= code_in(5) and control_line_enable;
 """)
-        lines.remove(ControlLine.REPEAT_FOR_ALL_BITS)
-        lines.remove(ControlLine.SHIFT_A_RIGHT)
+        # Subroutine entry points; undefined subroutines go to the last
+        # address, which is unused unless the ROM is full
+        fd.write("""
+process (code_in) is begin
+case code_in (3 downto 0) is
+""")
+        for (number, address) in enumerate(self.entry_points):
+            fd.write(f'when "{number:04b}" => call_address <= '
+                     f'std_logic_vector(to_unsigned({address}, {uc_addr_bits}));\n')
+        fd.write("""when others => call_address <= (others => '1');
+end case;
+end process;
+""")
+        for (cl, bit) in self.dedicated:
+            fd.write(f"    {cl.name} <= code_in({bit.bit_length() - 1}) and control_line_enable;\n")
+            lines.remove(cl)
         fd.write("""
 process (code_in, control_line_enable) is begin
 """)
         for cl in lines:
             fd.write(f"{cl.name} <= '0';\n")
-        fd.write("case code_in (4 downto 0) is\n")
+        fd.write(f"case code_in ({self.field_bits - 1} downto 0) is\n")
         for (value, key) in sorted((value, key) for (key, value) in self.table.items()):
-            fd.write(f'when "{value:05b}" =>\n')
+            fd.write(f'when "{value:0{self.field_bits}b}" =>\n')
             if key == "":
                 fd.write("  null;\n")
             else:
@@ -64,6 +86,13 @@ end structural;
 
 
 class FPGAOperationList(OperationList):
+    def __init__(self, settings: Settings = DEFAULT_SETTINGS, repeats: bool = True) -> None:
+        # The dual datapath (Settings.lanes) is only in the Python models:
+        # filter_unit.vhdl has one lane until the RTL has been simulated
+        if settings.lanes != 1:
+            raise ValueError("filter_unit.vhdl has only one lane")
+        OperationList.__init__(self, settings, repeats)
+
     def make_code_table(self) -> CodeTable:
         return FPGACodeTable()
 
@@ -82,32 +111,38 @@ class FPGAOperationList(OperationList):
         uc_addr_bits = 0
         while (1 << uc_addr_bits) < size:
             uc_addr_bits += 1
-        return max(9, uc_addr_bits)
+        return max(ROM_BLOCK_ADDR_BITS, uc_addr_bits)
 
     def dump_settings(self, fd: typing.IO, prefix: str) -> None:
         memory = self.get_memory_image()
         uc_addr_bits = self.get_uc_addr_bits(len(memory))
+        settings = self.settings
         fd.write(f"""package {prefix}_settings is
-constant FRACTIONAL_BITS : Natural := {FRACTIONAL_BITS};
-constant NON_FRACTIONAL_BITS : Natural := {NON_FRACTIONAL_BITS};
+constant FRACTIONAL_BITS : Natural := {settings.fractional_bits};
+constant NON_FRACTIONAL_BITS : Natural := {settings.non_fractional_bits};
 constant UC_ADDR_BITS : Natural := {uc_addr_bits};
-constant ALL_BITS : Natural := {ALL_BITS};
-constant A_BITS : Natural := {A_BITS};
+constant ALL_BITS : Natural := {settings.all_bits};
+constant DIGIT_BITS : Natural := {settings.digit_bits};
+constant INPUT_FIFO_DEPTH : Natural := {settings.input_fifo_depth};
+constant A_BITS : Natural := {settings.a_bits};
+constant NUM_BANKS : Natural := {self.num_banks};
 constant VERBOSE_DEBUG : Boolean := {DEBUG > 1};
-constant DATA_BITS : Natural := {DATA_BITS};
-constant BAUD_RATE : Real := {BAUD_RATE:1.1f};
-constant SAMPLE_RATE : Real := {SAMPLE_RATE:1.1f};
+constant DATA_BITS : Natural := {settings.data_bits};
+constant BAUD_RATE : Real := {settings.baud_rate:1.1f};
+constant SAMPLE_RATE : Real := {float(settings.sample_rate):1.1f};
 
 end package {prefix}_settings;\n""")
 
     def dump_control_line_decoder(self, fd: typing.IO, prefix: str) -> None:
-        self.code_table.dump_control_line_decoder(fd, prefix)
+        memory = self.get_memory_image()
+        self.code_table.dump_control_line_decoder(fd, prefix, self.get_uc_addr_bits(len(memory)))
 
     def dump_lattice_rom(self, fd: typing.IO, prefix: str) -> None:
         memory = self.get_memory_image()
         uc_addr_bits = self.get_uc_addr_bits(len(memory))
         fd.write(f"""library ieee;
 use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
 entity {prefix}_microcode_store is port (
         uc_data_out : out std_logic_vector (7 downto 0) := (others => '0');
         uc_addr_in  : in std_logic_vector ({uc_addr_bits - 1} downto 0) := (others => '0');
@@ -150,10 +185,13 @@ architecture structural of {prefix}_microcode_store is
     end component SB_RAM512x8;
 """)
 
-        block_size = 512
-        num_blocks = (len(memory) + block_size - 1) // block_size
+        num_blocks = max(1, (len(memory) + ROM_BLOCK_SIZE - 1) // ROM_BLOCK_SIZE)
         for block in range(num_blocks):
             fd.write(f"signal uc_data_{block} : std_logic_vector(7 downto 0) := (others => '0');\n")
+        if num_blocks > 1:
+            # Block containing the address that was read
+            fd.write(f"signal block_select : Natural range 0 to "
+                     f"{(1 << (uc_addr_bits - ROM_BLOCK_ADDR_BITS)) - 1} := 0;\n")
         fd.write(f"begin\n")
 
         row_size = 32
@@ -185,13 +223,22 @@ WDATA => unused(7 downto 0),
 WCLK => clock_in,
 WCLKE => unused(0),
 WE => unused(0));\n""")
-        if uc_addr_bits <= 9:
+        if num_blocks == 1:
             fd.write("uc_data_out <= uc_data_0;\n")
         else:
-            fd.write("uc_data_out <=\n")
+            # Each block RAM registers its output, so the block number is
+            # registered alongside, and selects the output in the next cycle
+            fd.write(f"""process (clock_in) is
+begin
+    if clock_in = '1' and clock_in'event then
+        if enable_in = '1' then
+            block_select <= to_integer(unsigned(uc_addr_in({uc_addr_bits - 1} downto {ROM_BLOCK_ADDR_BITS})));
+        end if;
+    end if;
+end process;
+uc_data_out <=\n""")
             for block in range(num_blocks):
-                fd.write(f"uc_data_{block} when conv_integer("
-                        f"uc_addr_in(uc_addr_bits - 1 downto 9)) = {block} else\n")
+                fd.write(f"uc_data_{block} when block_select = {block} else\n")
             fd.write(f"x\"{UNUSED_CODE:02x}\";\n")
         fd.write("end structural;\n")
 
@@ -17,16 +17,18 @@ from test_vector import (
 from func_test import (
         compare_demodulator_output,
     )
+from virtual_fpga import (
+        SerialPort, VIRTUAL_SERIAL_PORT, make_virtual_serial,
+    )
 
 from pathlib import Path
-import typing, sys, struct, math
-import serial
+import typing, sys, struct, math, time
 
 
 class TestError(Exception):
     pass
 
-def sync(ser: serial.Serial) -> None:
+def sync(ser: SerialPort) -> None:
     while True:
         # flush input
         data = ser.read(100)
@@ -42,18 +44,15 @@ def sync(ser: serial.Serial) -> None:
         if data == b"12":
             return
 
-def main() -> None:
-    print("Create demodulator")
-    ops = FPGAOperationList()
-    demodulator(ops)
-    ops.generate(FILTER_UNIT_PREFIX)
-
-    print("Read test vector")
-    test_vector = TestVector(int(1e9))
-
+def open_serial_port(port: str) -> SerialPort:
+    if port == VIRTUAL_SERIAL_PORT:
+        # Python model of the FPGA, for testing without hardware
+        virtual = make_virtual_serial(timeout=2.0)
+        virtual.open()
+        return virtual
 
-    print("Open serial port", flush=True)
-    ser = serial.serial_for_url(SERIAL_PORT, do_not_open=True, exclusive=True)
+    import serial
+    ser = serial.serial_for_url(port, do_not_open=True, exclusive=True)
     ser.baudrate = 115200
     ser.bytesize = 8
     ser.parity = "N"
@@ -65,7 +64,24 @@ def main() -> None:
         ser.open()
     except serial.SerialException as e:
         raise TestError("Serial setup error " + str(e))
-        sys.exit(1)
+    return ser
+
+def main() -> None:
+    port = SERIAL_PORT
+    if len(sys.argv) > 1:
+        port = sys.argv[1]
+
+    print("Create demodulator")
+    ops = FPGAOperationList()
+    demodulator(ops)
+    ops.generate(FILTER_UNIT_PREFIX)
+
+    print("Read test vector")
+    test_vector = TestVector(int(1e9))
+
+
+    print(f"Open serial port {port}", flush=True)
+    ser = open_serial_port(port)
 
     print("Synchronise", flush=True)
     sync(ser)
@@ -73,6 +89,7 @@ def main() -> None:
 
     max_block_size = 500
     out_values = []
+    start_time = time.monotonic()
     for i in range(0, len(test_vector.in_values), max_block_size):
         print(f"Data capture {i}", flush=True)
         block = []
@@ -96,6 +113,10 @@ def main() -> None:
             raise TestError(f"Expected {block_size} bytes, received {len(data)}")
 
 
+    elapsed = time.monotonic() - start_time
+    print(f"Captured {len(out_values)} samples in {elapsed:1.2f} s "
+          f"({len(out_values) / max(elapsed, 1e-9):1.0f} samples/s)", flush=True)
+
     print("Compare", flush=True)
     out_vector = test_vector.substitute_new_out_bits(out_values)
     compare_demodulator_output(test_vector, out_vector)
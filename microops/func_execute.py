@@ -1,15 +1,22 @@
-
 from func_hardware import (
         ControlLine, ControlLines,
         OperationList, Register, ControlOperation,
         DebugOperation, Debug, MuxOperation, MuxCode,
-        SHIFT_CONTROL_LINE,
-        ALL_BITS, A_BITS, R_BITS,
+        BankOperation, CallOperation, ReturnOperation, RepeatOperation,
+        MultiplyOperation, AddOperation, SHIFT_CONTROL_LINE, BANKED_REGISTERS, MAX_BANKS,
+    )
+from settings import (
+        DEBUG, Settings,
     )
-from settings import DEBUG
 from filter_implementation import (
         make_float,
     )
+from profiler import (
+        Profiler,
+    )
+from exec_trace import (
+        TraceWriter, TRACE_REGISTERS,
+    )
 import enum, typing
 
 class XSelect(enum.Enum):
@@ -27,171 +34,623 @@ class SpecialRegister(enum.Enum):
     MUX_SELECT = -102
     REPEAT_COUNTER = -103
     X_BORROW = -104
+    BANK_SELECT = -105
+    RETURN_ADDRESS = -106
+    X_OTHER_LANE = -107
+
+class Kind(enum.IntEnum):
+    # The kind of each program entry, which is a (kind, payload) tuple
+    CONTROL = 0     # payload is the control mask
+    MUX = 1         # payload is the MuxCode
+    DEBUG = 2       # payload is the Debug code
+    COMMENT = 3     # not encoded, so never executed by the hardware
+    BANK = 4        # payload is the bank number
+    ILLEGAL = 5
+    CALL = 6        # payload is the index of the subroutine
+    RETURN = 7
+    REPEAT = 8      # payload is the control mask and count
+    MULTIPLY = 9    # payload is the control mask and digit
+    ADD = 10        # payload is the digit
+
+ProgramEntry = typing.Tuple[Kind, typing.Any]
 
 class NextStep(enum.Enum):
     NEXT = enum.auto()
     REPEAT = enum.auto()
     RESTART = enum.auto()
+    JUMP = enum.auto()
 
-RegFile = typing.Dict[typing.Union[Register, SpecialRegister], int]
+# The register file is a list indexed by REG_INDEX. Enum members are slow
+# to hash, so the simulator never uses them as keys while running.
+RegFile = typing.List[int]
+AnyRegister = typing.Union[Register, SpecialRegister]
+REG_INDEX: typing.Dict[AnyRegister, int] = {}
+for _r in list(Register) + list(SpecialRegister):
+    REG_INDEX[_r] = len(REG_INDEX)
+INDEX_TO_REGISTER: typing.List[AnyRegister] = list(REG_INDEX.keys())
 NUMBER_TO_REGISTER = {r.value: r for r in Register}
 
-def execute_control(controls: ControlLines, inf: RegFile,
+R = REG_INDEX[Register.R]
+Y = REG_INDEX[Register.Y]
+O1 = REG_INDEX[Register.O1]
+O2 = REG_INDEX[Register.O2]
+X = REG_INDEX[Register.X]
+L = REG_INDEX[Register.L]
+I0 = REG_INDEX[Register.I0]
+A = REG_INDEX[Register.A]
+X_SELECT = REG_INDEX[SpecialRegister.X_SELECT]
+Y_BORROW = REG_INDEX[SpecialRegister.Y_BORROW]
+MUX_SELECT = REG_INDEX[SpecialRegister.MUX_SELECT]
+REPEAT_COUNTER = REG_INDEX[SpecialRegister.REPEAT_COUNTER]
+X_BORROW = REG_INDEX[SpecialRegister.X_BORROW]
+BANK_SELECT = REG_INDEX[SpecialRegister.BANK_SELECT]
+RETURN_ADDRESS = REG_INDEX[SpecialRegister.RETURN_ADDRESS]
+X_OTHER_LANE = REG_INDEX[SpecialRegister.X_OTHER_LANE]
+I1 = REG_INDEX[Register.I1]
+I2 = REG_INDEX[Register.I2]
+
+# Banked registers are copied to and from storage at the end of the
+# register file when the bank changes
+BANKED_INDEX = [REG_INDEX[reg] for reg in BANKED_REGISTERS]
+BANK_STORAGE = len(REG_INDEX)
+TRACE_INDEX = [REG_INDEX[reg] for reg in TRACE_REGISTERS]
+REG_FILE_SIZE = BANK_STORAGE + (MAX_BANKS * len(BANKED_INDEX))
+
+# Control lines are tested as bits within an integer mask
+CONTROL_BIT = {cl: 1 << cl.value for cl in ControlLine}
+ADD_A_TO_R = CONTROL_BIT[ControlLine.ADD_A_TO_R]
+SET_X_IN_TO_X_AND_CLEAR_Y_BORROW = CONTROL_BIT[ControlLine.SET_X_IN_TO_X_AND_CLEAR_Y_BORROW]
+SET_X_IN_TO_REG_OUT = CONTROL_BIT[ControlLine.SET_X_IN_TO_REG_OUT]
+SET_X_IN_TO_ABS_O1_REG_OUT = CONTROL_BIT[ControlLine.SET_X_IN_TO_ABS_O1_REG_OUT]
+SHIFT_A_RIGHT = CONTROL_BIT[ControlLine.SHIFT_A_RIGHT]
+SHIFT_X_RIGHT = CONTROL_BIT[ControlLine.SHIFT_X_RIGHT]
+SHIFT_Y_RIGHT = CONTROL_BIT[ControlLine.SHIFT_Y_RIGHT]
+SHIFT_R_RIGHT = CONTROL_BIT[ControlLine.SHIFT_R_RIGHT]
+REPEAT_FOR_ALL_BITS = CONTROL_BIT[ControlLine.REPEAT_FOR_ALL_BITS]
+RESTART = CONTROL_BIT[ControlLine.RESTART]
+LOAD_I0_FROM_INPUT = CONTROL_BIT[ControlLine.LOAD_I0_FROM_INPUT]
+SEND_Y_TO_OUTPUT = CONTROL_BIT[ControlLine.SEND_Y_TO_OUTPUT]
+SIGN_EXTEND_A = CONTROL_BIT[ControlLine.SIGN_EXTEND_A]
+
+# With more than one lane, only lane 0 loads I0 and sends Y to the output
+LANE_0_ONLY = LOAD_I0_FROM_INPUT | SEND_Y_TO_OUTPUT
+
+# Generic registers are those with no special input
+GENERIC_SHIFT = [(REG_INDEX[reg], CONTROL_BIT[cl])
+                 for (reg, cl) in SHIFT_CONTROL_LINE.items()
+                 if reg not in (Register.R, Register.A, Register.X, Register.Y)]
+GENERIC_SHIFT_MASK = 0
+for (_, _bit) in GENERIC_SHIFT:
+    GENERIC_SHIFT_MASK |= _bit
+
+# The shift control line of each register which has one, by index
+SHIFT_BIT = {REG_INDEX[reg]: CONTROL_BIT[cl] for (reg, cl) in SHIFT_CONTROL_LINE.items()}
+
+# Control lines with an effect in each cycle other than a shift, so that
+# a run of cycles with any of these is not executed at once (see execute_run)
+NOT_RUN_MASK = (SEND_Y_TO_OUTPUT | SET_X_IN_TO_X_AND_CLEAR_Y_BORROW
+                | SET_X_IN_TO_REG_OUT | SET_X_IN_TO_ABS_O1_REG_OUT
+                | LOAD_I0_FROM_INPUT | SIGN_EXTEND_A)
+
+def control_mask(controls: ControlLines) -> int:
+    mask = 0
+    for cl in controls:
+        mask |= CONTROL_BIT[cl]
+    return mask
+
+def new_reg_file() -> RegFile:
+    reg_file = [0 for i in range(REG_FILE_SIZE)]
+    # Every bit of ONE is 1, whatever the width
+    reg_file[REG_INDEX[Register.ONE]] = -1
+    return reg_file
+
+def execute_control(mask: int, reg_file: RegFile,
         reverse_in_values: typing.List[int],
-        out_values: typing.List[int]) -> typing.Tuple[NextStep, RegFile]:
-    outf = dict(inf)
-    mux_select = inf[SpecialRegister.MUX_SELECT]
-    reg_out = inf[NUMBER_TO_REGISTER[mux_select]] & 1
-
-    if ControlLine.ADD_A_TO_R in controls:
-        outf[Register.R] = (inf[Register.R] + inf[Register.A]) & (1 << R_BITS) - 1
-    if ControlLine.SET_X_IN_TO_X_AND_CLEAR_Y_BORROW in controls:
-        outf[SpecialRegister.X_SELECT] = XSelect.PASSTHROUGH_X.value
-        outf[SpecialRegister.Y_BORROW] = 0
-    if ControlLine.SET_X_IN_TO_REG_OUT in controls:
-        outf[SpecialRegister.X_SELECT] = XSelect.PASSTHROUGH_REG_OUT.value
-    if ControlLine.SET_X_IN_TO_ABS_O1_REG_OUT in controls:
-        if inf[Register.O1] >> (ALL_BITS - 1):
-            outf[SpecialRegister.X_SELECT] = XSelect.NEGATE_REG_OUT.value
+        out_values: typing.List[int],
+        settings: Settings) -> NextStep:
+    # The register file is updated in place, so any value that is both
+    # read and written by this operation is captured first. Each shift
+    # moves one digit of digit_bits bits.
+    digit_bits = settings.digit_bits
+    digit_mask = (1 << digit_bits) - 1
+    reg_out = reg_file[reg_file[MUX_SELECT]] & digit_mask
+    x_select = reg_file[X_SELECT]
+    y_borrow = reg_file[Y_BORROW]
+    x_borrow = reg_file[X_BORROW]
+    x_digit = reg_file[X] & digit_mask
+    all_bits = settings.all_bits
+
+    if mask & SEND_Y_TO_OUTPUT:
+        out_values.append(reg_file[Y])
+    if mask & ADD_A_TO_R:
+        reg_file[R] = (reg_file[R] + reg_file[A]) & ((1 << settings.r_bits) - 1)
+    if mask & SET_X_IN_TO_X_AND_CLEAR_Y_BORROW:
+        reg_file[X_SELECT] = XSelect.PASSTHROUGH_X.value
+        reg_file[Y_BORROW] = 0
+    if mask & SET_X_IN_TO_REG_OUT:
+        reg_file[X_SELECT] = XSelect.PASSTHROUGH_REG_OUT.value
+    if mask & SET_X_IN_TO_ABS_O1_REG_OUT:
+        if reg_file[O1] >> (all_bits - 1):
+            reg_file[X_SELECT] = XSelect.NEGATE_REG_OUT.value
         else:
-            outf[SpecialRegister.X_SELECT] = XSelect.PASSTHROUGH_REG_OUT.value
-        outf[SpecialRegister.X_BORROW] = 0
-    if ControlLine.LOAD_I0_FROM_INPUT in controls:
-        outf[Register.I0] = reverse_in_values.pop()
-    if ControlLine.SEND_Y_TO_OUTPUT in controls:
-        out_values.append(inf[Register.Y])
+            reg_file[X_SELECT] = XSelect.PASSTHROUGH_REG_OUT.value
+        reg_file[X_BORROW] = 0
+    if mask & LOAD_I0_FROM_INPUT:
+        reg_file[I0] = reverse_in_values.pop()
 
     # Shift for generic registers
-    for (reg, cl) in SHIFT_CONTROL_LINE.items():
-        if cl in controls:
-            outf[reg] = (inf[reg] | (reg_out << ALL_BITS)) >> 1
+    if mask & GENERIC_SHIFT_MASK:
+        for (index, bit) in GENERIC_SHIFT:
+            if mask & bit:
+                reg_file[index] = (reg_file[index] | (reg_out << all_bits)) >> digit_bits
 
     # Shift for some registers is special
-    if ControlLine.SHIFT_R_RIGHT in controls:
+    if (mask & SHIFT_R_RIGHT) and not (mask & ADD_A_TO_R):
         # R register always shift in zero
-        outf[Register.R] = inf[Register.R] >> 1
-    if ControlLine.SHIFT_A_RIGHT in controls:
-        # A register is wider
-        outf[Register.A] = (inf[Register.A] | (reg_out << A_BITS)) >> 1
-    if ControlLine.SHIFT_X_RIGHT in controls:
+        reg_file[R] >>= digit_bits
+    if mask & SHIFT_A_RIGHT:
+        # A register is wider, and may be sign extended from the selected register
+        a_in = reg_out
+        if mask & SIGN_EXTEND_A:
+            a_in = digit_mask if (reg_file[reg_file[MUX_SELECT]] >> (all_bits - 1)) & 1 else 0
+        reg_file[A] = (reg_file[A] | (a_in << settings.a_bits)) >> digit_bits
+    if mask & SHIFT_Y_RIGHT:
+        # Y register has a special function input (subtract)
+        (y_in, reg_file[Y_BORROW]) = subtractor(x_digit, reg_out, y_borrow, digit_bits)
+        reg_file[Y] = (reg_file[Y] | (y_in << all_bits)) >> digit_bits
+    if mask & SHIFT_X_RIGHT:
         # X register has a special function input (passthrough/abs)
-        if inf[SpecialRegister.X_SELECT] == XSelect.PASSTHROUGH_REG_OUT.value:
+        if x_select == XSelect.PASSTHROUGH_REG_OUT.value:
             x_in = reg_out
-        elif inf[SpecialRegister.X_SELECT] == XSelect.PASSTHROUGH_X.value:
-            x_in = inf[Register.X] & 1
-        elif inf[SpecialRegister.X_SELECT] == XSelect.NEGATE_REG_OUT.value:
-            (x_in, outf[SpecialRegister.X_BORROW]) = subtractor(
+        elif x_select == XSelect.PASSTHROUGH_X.value:
+            x_in = x_digit
+        elif x_select == XSelect.NEGATE_REG_OUT.value:
+            (x_in, reg_file[X_BORROW]) = subtractor(
                 0,
                 reg_out,
-                inf[SpecialRegister.X_BORROW])
+                x_borrow,
+                digit_bits)
         else:
             assert False
-        outf[Register.X] = (inf[Register.X] | ((x_in & 1) << ALL_BITS)) >> 1
-    if ControlLine.SHIFT_Y_RIGHT in controls:
-        # Y register has a special function input (subtract)
-        (y_in, outf[SpecialRegister.Y_BORROW]) = subtractor(
-            inf[Register.X] & 1,
-            reg_out,
-            inf[SpecialRegister.Y_BORROW])
-        outf[Register.Y] = (inf[Register.Y] | ((y_in & 1) << ALL_BITS)) >> 1
-    if ControlLine.REPEAT_FOR_ALL_BITS in controls:
-        outf[SpecialRegister.REPEAT_COUNTER] = (inf[SpecialRegister.REPEAT_COUNTER] + 1) % ALL_BITS
-        if outf[SpecialRegister.REPEAT_COUNTER] != 0:
-            return (NextStep.REPEAT, outf)
-
-    if ControlLine.RESTART in controls:
-        return (NextStep.RESTART, outf)
-    return (NextStep.NEXT, outf)
-
-def subtractor(x_in: int, y_in: int, b_in) -> typing.Tuple[int, int]:
-    d_out = (x_in ^ y_in ^ b_in) & 1
-    if y_in and b_in:
-        b_out = 1
-    elif y_in or b_in:
-        b_out = not x_in
-    else:
-        b_out = 0
-    assert b_out == int(x_in < (y_in + b_in))
-    return (d_out, b_out)
+        reg_file[X] = (reg_file[X] | (x_in << all_bits)) >> digit_bits
+    if mask & REPEAT_FOR_ALL_BITS:
+        reg_file[REPEAT_COUNTER] = (reg_file[REPEAT_COUNTER] + 1) % settings.all_digits
+        if reg_file[REPEAT_COUNTER] != 0:
+            return NextStep.REPEAT
+
+    if mask & RESTART:
+        return NextStep.RESTART
+    return NextStep.NEXT
+
+def execute_repeat(mask: int, count: int, reg_file: RegFile,
+        reverse_in_values: typing.List[int],
+        out_values: typing.List[int],
+        settings: Settings) -> NextStep:
+    # REPEAT count: the previous control operation is executed count times
+    execute_control(mask, reg_file, reverse_in_values, out_values, settings)
+    reg_file[REPEAT_COUNTER] = (reg_file[REPEAT_COUNTER] + 1) % count
+    if reg_file[REPEAT_COUNTER] != 0:
+        return NextStep.REPEAT
+    return NextStep.NEXT
+
+def execute_multiply(mask: int, digit: int, reg_file: RegFile,
+        reverse_in_values: typing.List[int],
+        out_values: typing.List[int],
+        settings: Settings) -> NextStep:
+    # MUL digit: R += digit * A, then the previous control operation, whose
+    # mask excludes ADD_A_TO_R and SHIFT_R_RIGHT (see multiply_mask)
+    reg_file[R] = (reg_file[R] + (digit * reg_file[A])) & ((1 << settings.r_bits) - 1)
+    return execute_control(mask, reg_file, reverse_in_values, out_values, settings)
+
+def multiply_mask(mask: int) -> int:
+    # As in the hardware, the addition for MUL replaces ADD_A_TO_R, and R
+    # is not shifted in the same cycle as an addition
+    return mask & ~(ADD_A_TO_R | SHIFT_R_RIGHT)
+
+def execute_run(mask: int, count: int, reg_file: RegFile, settings: Settings) -> bool:
+    # The same control operation for count cycles, with the same result as
+    # count calls to execute_control, but with each register shifted by all
+    # of the digits at once. Returns False, having done nothing, if the
+    # operation does something in each cycle other than shift or add
+    # (NOT_RUN_MASK), or if the selected register would be read after its
+    # own digits have gone. REPEAT_FOR_ALL_BITS and RESTART are left to
+    # the caller.
+    if (mask & NOT_RUN_MASK) or ((mask & ADD_A_TO_R) and (reg_file[MUX_SELECT] == R)):
+        return False
+    all_bits = settings.all_bits
+    digit_bits = settings.digit_bits
+    shift = count * digit_bits
+    run_mask = (1 << shift) - 1
+
+    # The digits read from the selected register and from X during the run,
+    # as a single value with the first digit lowest
+    reg_in = run_input(reg_file[MUX_SELECT], reg_file, mask, shift, settings)
+    x_in = run_input(X, reg_file, mask, shift, settings) if mask & (SHIFT_X_RIGHT | SHIFT_Y_RIGHT) else 0
+    if (reg_in is None) or (x_in is None):
+        return False
+
+    if mask & GENERIC_SHIFT_MASK:
+        for (index, bit) in GENERIC_SHIFT:
+            if mask & bit:
+                reg_file[index] = (reg_file[index] | (reg_in << all_bits)) >> shift
+    if mask & ADD_A_TO_R:
+        # R is not shifted, and A is added in each cycle before it shifts
+        if mask & SHIFT_A_RIGHT:
+            a_mask = (1 << settings.a_bits) - 1
+            a_in = reg_file[A] | (reg_in << settings.a_bits)
+            total = sum((a_in >> (i * digit_bits)) & a_mask for i in range(count))
+        else:
+            total = reg_file[A] * count
+        reg_file[R] = (reg_file[R] + total) & ((1 << settings.r_bits) - 1)
+    elif mask & SHIFT_R_RIGHT:
+        reg_file[R] >>= shift
+    if mask & SHIFT_A_RIGHT:
+        reg_file[A] = (reg_file[A] | (reg_in << settings.a_bits)) >> shift
+    if mask & SHIFT_Y_RIGHT:
+        d = x_in - reg_in - reg_file[Y_BORROW]
+        reg_file[Y_BORROW] = int(d < 0)
+        reg_file[Y] = (reg_file[Y] | ((d & run_mask) << all_bits)) >> shift
+    if mask & SHIFT_X_RIGHT:
+        x_select = reg_file[X_SELECT]
+        if x_select == XSelect.PASSTHROUGH_REG_OUT.value:
+            new_x_in = reg_in
+        elif x_select == XSelect.PASSTHROUGH_X.value:
+            new_x_in = x_in
+        elif x_select == XSelect.NEGATE_REG_OUT.value:
+            d = 0 - reg_in - reg_file[X_BORROW]
+            reg_file[X_BORROW] = int(d < 0)
+            new_x_in = d & run_mask
+        else:
+            assert False
+        reg_file[X] = (reg_file[X] | (new_x_in << all_bits)) >> shift
+    return True
+
+def run_input(index: int, reg_file: RegFile, mask: int, shift: int,
+              settings: Settings) -> typing.Optional[int]:
+    # The digits read from the low end of a register during a run of shift
+    # bits (see execute_run), or None if they include digits shifted in
+    # during the run
+    digit_bits = settings.digit_bits
+    value = reg_file[index]
+    if not (mask & SHIFT_BIT.get(index, 0)):
+        # Not shifted, so the same digit is read in every cycle
+        return (value & ((1 << digit_bits) - 1)) * (((1 << shift) - 1) // ((1 << digit_bits) - 1))
+    if index == R:
+        # R always shifts in zero
+        return value & ((1 << shift) - 1)
+    width = settings.a_bits if index == A else settings.all_bits
+    if shift > width:
+        return None
+    return value & ((1 << shift) - 1)
+
+def subtractor(x_in: int, y_in: int, b_in: int, digit_bits: int = 1) -> typing.Tuple[int, int]:
+    # One digit of x - y, with borrow in and out
+    d = x_in - y_in - b_in
+    return (d & ((1 << digit_bits) - 1), int(d < 0))
 
-def execute_mux(source: MuxCode, inf: RegFile) -> typing.Tuple[NextStep, RegFile]:
-    outf = dict(inf)
+def execute_mux(source: MuxCode, reg_file: RegFile, settings: Settings) -> NextStep:
     if source == MuxCode.L_OR_X:
-        if inf[Register.Y] >> (ALL_BITS - 1):
-            outf[SpecialRegister.MUX_SELECT] = Register.L.value # Y negative, use L
+        if reg_file[Y] >> (settings.all_bits - 1):
+            reg_file[MUX_SELECT] = L # Y negative, use L
         else:
-            outf[SpecialRegister.MUX_SELECT] = Register.X.value # Y non-negative, use X
-    elif source == MuxCode.BANK_SWITCH:
-        outf[Register.L], outf[Register.LS] = inf[Register.LS], inf[Register.L]
-        outf[Register.O1], outf[Register.O1S] = inf[Register.O1S], inf[Register.O1]
-        outf[Register.O2], outf[Register.O2S] = inf[Register.O2S], inf[Register.O2]
+            reg_file[MUX_SELECT] = X # Y non-negative, use X
+    elif source == MuxCode.X_OTHER_LANE:
+        # The other lane's X is copied here before each operation (see run_lanes)
+        reg_file[MUX_SELECT] = X_OTHER_LANE if settings.lanes > 1 else X
     else:
         assert source.value in NUMBER_TO_REGISTER, source.value
-        outf[SpecialRegister.MUX_SELECT] = source.value
+        reg_file[MUX_SELECT] = REG_INDEX[NUMBER_TO_REGISTER[source.value]]
+
+    return NextStep.NEXT
+
+def execute_bank(bank: int, reg_file: RegFile) -> NextStep:
+    base = BANK_STORAGE + (reg_file[BANK_SELECT] * len(BANKED_INDEX))
+    for (i, index) in enumerate(BANKED_INDEX):
+        reg_file[base + i] = reg_file[index]
+    base = BANK_STORAGE + (bank * len(BANKED_INDEX))
+    for (i, index) in enumerate(BANKED_INDEX):
+        reg_file[index] = reg_file[base + i]
+    reg_file[BANK_SELECT] = bank
+    return NextStep.NEXT
+
+def execute_lane(kind: Kind, payload: typing.Any, reg_file: RegFile,
+        reverse_in_values: typing.List[int],
+        out_values: typing.List[int],
+        debug_values: typing.List[int],
+        settings: Settings) -> NextStep:
+    # One operation in one lane (see FuncExecutor.run_lanes), for the
+    # kinds which use the datapath
+    if kind == Kind.CONTROL:
+        return execute_control(payload, reg_file, reverse_in_values, out_values, settings)
+    elif kind == Kind.REPEAT:
+        return execute_repeat(payload[0], payload[1], reg_file,
+                              reverse_in_values, out_values, settings)
+    elif kind == Kind.MULTIPLY:
+        return execute_multiply(payload[0], payload[1], reg_file,
+                                reverse_in_values, out_values, settings)
+    elif kind == Kind.ADD:
+        reg_file[R] = (reg_file[R] + (payload * reg_file[A])) & ((1 << settings.r_bits) - 1)
+    elif kind == Kind.MUX:
+        execute_mux(payload, reg_file, settings)
+    elif kind == Kind.BANK:
+        execute_bank(payload, reg_file)
+    elif kind == Kind.DEBUG:
+        execute_debug(payload, reg_file, debug_values, settings)
+    return NextStep.NEXT
 
-    return (NextStep.NEXT, outf)
+def lane_entry(entry: ProgramEntry, lane: int, settings: Settings) -> ProgramEntry:
+    # The program entry for one lane: MUL and ADD use the lane's digit, and
+    # only lane 0 loads I0 and sends Y to the output
+    (kind, payload) = entry
+    shift = lane * settings.digit_bits
+    digit_mask = (1 << settings.digit_bits) - 1
+    keep = ~LANE_0_ONLY if lane != 0 else -1
+    if kind == Kind.CONTROL:
+        return (Kind.CONTROL, payload & keep)
+    elif kind == Kind.REPEAT:
+        return (Kind.REPEAT, (payload[0] & keep, payload[1]))
+    elif kind == Kind.MULTIPLY:
+        return (Kind.MULTIPLY, (payload[0] & keep, (payload[1] >> shift) & digit_mask))
+    elif kind == Kind.ADD:
+        return (Kind.ADD, (payload >> shift) & digit_mask)
+    return entry
 
-def execute_debug(debug: Debug, inf: RegFile,
-        out_values: typing.List[int]) -> None:
+def execute_debug(debug: Debug, reg_file: RegFile,
+        out_values: typing.List[int], settings: Settings) -> None:
+    all_bits = settings.all_bits
     if debug == Debug.ASSERT_X_IS_ABS_O1:
-        assert abs(make_float(inf[Register.O1])) == make_float(inf[Register.X])
+        assert abs(make_float(reg_file[O1], settings)) == make_float(reg_file[X], settings)
     if debug == Debug.ASSERT_A_HIGH_ZERO:
-        assert (inf[Register.A] >> ALL_BITS) == 0
+        assert (reg_file[A] >> all_bits) == 0
     if debug == Debug.ASSERT_A_LOW_ZERO:
-        assert (inf[Register.A] & ((1 << ALL_BITS) - 1)) == 0
+        assert (reg_file[A] & ((1 << all_bits) - 1)) == 0
     if debug == Debug.ASSERT_R_ZERO:
-        assert inf[Register.R] == 0
+        assert reg_file[R] == 0
     if debug == Debug.ASSERT_Y_IS_X_MINUS_L:
-        assert inf[Register.Y] == ((inf[Register.X] - inf[Register.L]) & ((1 << ALL_BITS) - 1))
+        assert reg_file[Y] == ((reg_file[X] - reg_file[L]) & ((1 << all_bits) - 1))
     if debug == Debug.SEND_O1_TO_OUTPUT:
-        out_values.append(inf[Register.O1])
+        out_values.append(reg_file[O1])
     if debug == Debug.SEND_L_TO_OUTPUT:
-        out_values.append(inf[Register.L])
+        out_values.append(reg_file[L])
 
-def run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
-    reg_file: RegFile = {}
-    for gr in Register:
-        reg_file[gr] = 0
-    for sr in SpecialRegister:
-        reg_file[sr] = 0
-    reg_file[Register.ONE] = 1
-    op_index = 0
-    out_values: typing.List[int] = []
-    reverse_in_values = list(reversed(in_values))
-    while op_index < len(ops):
-        op = ops[op_index]
-        next_step = NextStep.NEXT
-        if isinstance(op, ControlOperation):
+class FuncExecutor:
+    # Executes a program one input at a time, keeping the register state
+    # between calls to run(), as the hardware does between input samples.
+    # If debug_outputs is False, SEND_O1_TO_OUTPUT and SEND_L_TO_OUTPUT
+    # produce nothing, so only the values that the hardware would
+    # send to the serial output are returned. If a Profiler is given,
+    # the cycles spent at each address are counted. If a TraceWriter is
+    # given, each executed cycle is written to it.
+    def __init__(self, ops: OperationList, debug_outputs: bool = True,
+                 profiler: typing.Optional[Profiler] = None,
+                 trace: typing.Optional[TraceWriter] = None) -> None:
+        self.ops = ops
+        self.settings = ops.settings
+        self.reg_file = new_reg_file()
+        self.debug_outputs = debug_outputs
+        self.profile = profiler.attach(ops) if profiler is not None else None
+        # Index in self.profile.iterations for each entry in the program
+        self.profile_slots = self.profile.slots(ops) if self.profile is not None else []
+        self.trace = trace
+        self.samples_loaded = 0
+        # Program entries are (kind, payload), see Kind
+        self.program: typing.List[ProgramEntry] = []
+        # (address, code) for each entry in the program, used for traces
+        self.locations: typing.List[typing.Tuple[int, typing.Optional[int]]] = []
+        for op in ops:
+            if isinstance(op, ControlOperation):
+                self.program.append((Kind.CONTROL, control_mask(op.controls)))
+            elif isinstance(op, MuxOperation):
+                self.program.append((Kind.MUX, op.source))
+            elif isinstance(op, DebugOperation):
+                self.program.append((Kind.DEBUG, op.debug))
+            elif isinstance(op, BankOperation):
+                self.program.append((Kind.BANK, op.bank))
+            elif isinstance(op, RepeatOperation):
+                self.program.append((Kind.REPEAT, (control_mask(op.controls), op.count)))
+            elif isinstance(op, MultiplyOperation):
+                self.program.append((Kind.MULTIPLY, (multiply_mask(control_mask(op.controls)), op.digit)))
+            elif isinstance(op, AddOperation):
+                self.program.append((Kind.ADD, op.digit))
+            elif isinstance(op, CallOperation):
+                self.program.append((Kind.CALL, op.subroutine.index))
+            elif isinstance(op, ReturnOperation):
+                self.program.append((Kind.RETURN, None))
+            else:
+                self.program.append((Kind.COMMENT, None))
+            self.locations.append((op.address, op.encode()))
+        self.init_lanes()
+
+    def init_lanes(self) -> None:
+        # With more than one lane, each lane has a register file and a copy
+        # of the program; lane 0 uses self.reg_file
+        settings = self.settings
+        self.lane_reg_files = [self.reg_file]
+        self.lane_programs = [self.program]
+        if settings.lanes > 1:
+            self.lane_reg_files += [new_reg_file() for lane in range(1, settings.lanes)]
+            self.lane_programs = [[lane_entry(entry, lane, settings) for entry in self.program]
+                                  for lane in range(settings.lanes)]
+
+    def run(self, in_values: typing.List[int]) -> typing.List[int]:
+        # Run the program from the beginning, restarting it until all of
+        # the inputs have been consumed
+        if self.settings.lanes > 1:
+            return self.run_lanes(in_values)
+        reg_file = self.reg_file
+        settings = self.settings
+        program = self.program
+        program_size = len(program)
+        out_values: typing.List[int] = []
+        debug_values = out_values if self.debug_outputs else []
+        reverse_in_values = list(reversed(in_values))
+        iterations = self.profile.iterations if self.profile is not None else None
+        slots = self.profile_slots
+        op_index = 0
+        jump_index = 0
+        while op_index < program_size:
+            (kind, payload) = program[op_index]
+            if iterations is not None:
+                iterations[slots[op_index]] += 1
             if DEBUG > 1:
-                print(f"  op: {op.address} {op}")
-            previous_reg_file = reg_file
-            (next_step, reg_file) = execute_control(op.controls,
-                previous_reg_file, reverse_in_values, out_values)
+                self.print_step(op_index)
+                previous_reg_file = list(reg_file)
+
+            if kind == Kind.CONTROL:
+                next_step = execute_control(payload, reg_file, reverse_in_values, out_values, settings)
+            elif kind == Kind.REPEAT:
+                next_step = execute_repeat(payload[0], payload[1], reg_file,
+                                           reverse_in_values, out_values, settings)
+            elif kind == Kind.MULTIPLY:
+                next_step = execute_multiply(payload[0], payload[1], reg_file,
+                                             reverse_in_values, out_values, settings)
+            elif kind == Kind.ADD:
+                reg_file[R] = (reg_file[R] + (payload * reg_file[A])) & ((1 << settings.r_bits) - 1)
+                next_step = NextStep.NEXT
+            elif kind == Kind.MUX:
+                next_step = execute_mux(payload, reg_file, settings)
+            elif kind == Kind.BANK:
+                next_step = execute_bank(payload, reg_file)
+            elif kind == Kind.ILLEGAL:
+                raise Exception(f"Illegal instruction at address {op_index}")
+            elif kind == Kind.CALL:
+                # The return register holds the index of the next operation
+                reg_file[RETURN_ADDRESS] = op_index + 1
+                jump_index = payload
+                next_step = NextStep.JUMP
+            elif kind == Kind.RETURN:
+                jump_index = reg_file[RETURN_ADDRESS]
+                next_step = NextStep.JUMP
+            else:
+                if kind == Kind.DEBUG:
+                    execute_debug(payload, reg_file, debug_values, settings)
+                next_step = NextStep.NEXT
+
             if DEBUG > 1:
-                for r in reg_file.keys():
-                    if reg_file[r] != previous_reg_file[r]:
-                        print(f"   reg {r.name}: {previous_reg_file[r]:08x} -> {reg_file[r]:08x}")
+                self.print_changes(previous_reg_file)
+            if (self.trace is not None) and (kind != Kind.COMMENT):
+                self.trace_step(op_index, self.samples_loaded
+                                + len(in_values) - len(reverse_in_values),
+                                next_step == NextStep.RESTART)
 
-        elif isinstance(op, MuxOperation):
+            if next_step == NextStep.RESTART:
+                if self.profile is not None:
+                    self.profile.restarts += 1
+                if len(reverse_in_values) == 0:
+                    self.samples_loaded += len(in_values)
+                    return out_values
+                else:
+                    op_index = 0
+            elif next_step == NextStep.NEXT:
+                op_index += 1
+            elif next_step == NextStep.JUMP:
+                op_index = jump_index
+
+        # Gone over the end of the program
+        raise Exception("Program must end in RESTART")
+
+    def run_lanes(self, in_values: typing.List[int]) -> typing.List[int]:
+        # As run, with more than one lane. Each operation is executed by each
+        # lane in turn, and lane 0 decides the next step. I0, I1 and I2 are
+        # shared, so the other lanes take lane 0's values after each
+        # operation, and X_OTHER_LANE is set from the X registers before it.
+        reg_files = self.lane_reg_files
+        reg_file = reg_files[0]
+        other_lanes = range(1, len(reg_files))
+        settings = self.settings
+        programs = self.lane_programs
+        program_size = len(self.program)
+        out_values: typing.List[int] = []
+        debug_values = out_values if self.debug_outputs else []
+        reverse_in_values = list(reversed(in_values))
+        iterations = self.profile.iterations if self.profile is not None else None
+        slots = self.profile_slots
+        op_index = 0
+        jump_index = 0
+        while op_index < program_size:
+            (kind, payload) = programs[0][op_index]
+            if iterations is not None:
+                iterations[slots[op_index]] += 1
             if DEBUG > 1:
-                print(f"  op: {op.address} {op}")
-            previous_reg_file = reg_file
-            (next_step, reg_file) = execute_mux(op.source, previous_reg_file)
-        elif isinstance(op, DebugOperation):
+                self.print_step(op_index)
+                previous_reg_file = list(reg_file)
+
+            if kind in (Kind.CONTROL, Kind.REPEAT, Kind.MULTIPLY):
+                x_values = [lane_reg_file[X] for lane_reg_file in reg_files]
+                for (lane, lane_reg_file) in enumerate(reg_files):
+                    lane_reg_file[X_OTHER_LANE] = x_values[-1 - lane]
+            if kind == Kind.ILLEGAL:
+                raise Exception(f"Illegal instruction at address {op_index}")
+            elif kind == Kind.CALL:
+                reg_file[RETURN_ADDRESS] = op_index + 1
+                jump_index = payload
+                next_step = NextStep.JUMP
+            elif kind == Kind.RETURN:
+                jump_index = reg_file[RETURN_ADDRESS]
+                next_step = NextStep.JUMP
+            else:
+                next_step = execute_lane(kind, payload, reg_file, reverse_in_values,
+                                         out_values, debug_values, settings)
+                for lane in other_lanes:
+                    lane_reg_file = reg_files[lane]
+                    (lane_kind, lane_payload) = programs[lane][op_index]
+                    execute_lane(lane_kind, lane_payload, lane_reg_file, reverse_in_values,
+                                 out_values, debug_values, settings)
+                    lane_reg_file[I0] = reg_file[I0]
+                    lane_reg_file[I1] = reg_file[I1]
+                    lane_reg_file[I2] = reg_file[I2]
+
             if DEBUG > 1:
-                print(f" op: {op.address} {op}")
-            execute_debug(op.debug, reg_file, out_values)
+                self.print_changes(previous_reg_file)
+            if (self.trace is not None) and (kind != Kind.COMMENT):
+                self.trace_step(op_index, self.samples_loaded
+                                + len(in_values) - len(reverse_in_values),
+                                next_step == NextStep.RESTART)
+
+            if next_step == NextStep.RESTART:
+                if self.profile is not None:
+                    self.profile.restarts += 1
+                if len(reverse_in_values) == 0:
+                    self.samples_loaded += len(in_values)
+                    return out_values
+                else:
+                    op_index = 0
+            elif next_step == NextStep.NEXT:
+                op_index += 1
+            elif next_step == NextStep.JUMP:
+                op_index = jump_index
+
+        # Gone over the end of the program
+        raise Exception("Program must end in RESTART")
+
+    def trace_step(self, op_index: int, sample: int, end_of_block: bool) -> None:
+        assert self.trace is not None
+        (address, code) = self.locations[op_index]
+        assert code is not None
+        values = [self.reg_file[index] for index in TRACE_INDEX]
+        values.append(sample)
+        self.trace.write(address, code, values, end_of_block)
+
+    def print_step(self, op_index: int) -> None:
+        op = self.ops[op_index]
+        if isinstance(op, (ControlOperation, MuxOperation, BankOperation,
+                           CallOperation, ReturnOperation, RepeatOperation,
+                           MultiplyOperation, AddOperation)):
+            print(f"  op: {op.address} {op}")
+        elif isinstance(op, DebugOperation):
+            print(f" op: {op.address} {op}")
         else:
-            if DEBUG > 1:
-                print(f" {op}")
+            print(f" {op}")
 
-        if next_step == NextStep.RESTART:
-            if len(reverse_in_values) == 0:
-                return out_values
-            else:
-                op_index = 0
-        elif next_step == NextStep.NEXT:
-            op_index += 1
+    def print_changes(self, previous_reg_file: RegFile) -> None:
+        for (index, value) in enumerate(self.reg_file):
+            if value != previous_reg_file[index]:
+                if index < BANK_STORAGE:
+                    name = INDEX_TO_REGISTER[index].name
+                else:
+                    (bank, i) = divmod(index - BANK_STORAGE, len(BANKED_INDEX))
+                    name = f"{BANKED_REGISTERS[i].name}_b{bank}"
+                print(f"   reg {name}: {previous_reg_file[index]:08x} -> {value:08x}")
 
-    # Gone over the end of the program
-    raise Exception("Program must end in RESTART")
+def run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
+    return FuncExecutor(ops).run(in_values)
@@ -1,12 +1,12 @@
 
 from settings import (
-        FRACTIONAL_BITS,
-        NON_FRACTIONAL_BITS,
+        Settings, DEFAULT_SETTINGS,
     )
 import enum, typing
 
-ALL_BITS = FRACTIONAL_BITS + NON_FRACTIONAL_BITS
-A_BITS = R_BITS = (FRACTIONAL_BITS * 2) + NON_FRACTIONAL_BITS
+# Register sizes for the default settings; see Settings for others
+ALL_BITS = DEFAULT_SETTINGS.all_bits
+A_BITS = R_BITS = DEFAULT_SETTINGS.a_bits
 
 class MuxCode(enum.Enum):
     ZERO = 0
@@ -20,7 +20,9 @@ class MuxCode(enum.Enum):
     I1 = 8
     I2 = 9
     ONE = 10
-    BANK_SWITCH = 14
+    # X register of the other lane (see Settings.lanes); with one lane,
+    # this is the X register
+    X_OTHER_LANE = 11
     L_OR_X = 15
 
 class Register(enum.Enum):
@@ -36,9 +38,6 @@ class Register(enum.Enum):
     I2 = MuxCode.I2.value
     ONE = MuxCode.ONE.value
     # Hidden registers
-    LS = -1
-    O1S = -2
-    O2S = -3
     A = -4
 
 class ControlLine(enum.Enum):
@@ -60,6 +59,7 @@ class ControlLine(enum.Enum):
     RESTART = enum.auto()
     LOAD_I0_FROM_INPUT = enum.auto()
     SEND_Y_TO_OUTPUT = enum.auto()
+    SIGN_EXTEND_A = enum.auto()
     NOTHING = enum.auto()
 
 class Debug(enum.Enum):
@@ -71,6 +71,42 @@ class Debug(enum.Enum):
     SEND_O1_TO_OUTPUT = 6
     SEND_L_TO_OUTPUT = 7
 
+# O1, O2 and L have a copy in each bank, selected by a BankOperation
+BANKED_REGISTERS = [Register.O1, Register.O2, Register.L]
+MAX_BANKS = 16
+
+# CALL n jumps to the entry address of subroutine n, saving the return
+# address in a single return register, so subroutines cannot call others.
+# CALL and RETURN each take one cycle, plus one cycle to fetch the next
+# operation from the new address, as for RESTART.
+MAX_SUBROUTINES = 16
+CALL_CODE = 0xa0
+RETURN_CODE = 0xb0
+CALL_CYCLES = 2
+RETURN_CYCLES = 2
+
+# REPEAT n executes the previous control operation n more times, taking
+# n cycles, so that a run of identical operations needs only two bytes.
+# It is encoded as REPEAT_CODE + n, using the debug codes which are not
+# decoded as debug operations. Operations which repeat for all bits, wait
+# for input or restart are never repeated.
+REPEAT_CODE = 0xdf
+MAX_REPEAT = 0xfe - REPEAT_CODE
+
+# Multiplication with digits of more than one bit (see Settings.digit_bits)
+# adds a multiple of A to R. MUL d executes the previous control operation
+# again, adding d * A to R in place of ADD_A_TO_R, and ADD d only adds d * A
+# to R. Each takes one cycle. MUL d uses the RETURN codes other than
+# RETURN_CODE itself. With more than one lane, d holds one digit for each
+# lane, with lane 0 in the low digit_bits bits, so that each lane adds a
+# different multiple of its own A: this is how lanes use different
+# coefficients while executing the same operations.
+MUL_CODE = 0xb0
+ADD_CODE = 0xd0
+MAX_DIGIT = 0xf
+NOT_REPEATED = {ControlLine.REPEAT_FOR_ALL_BITS, ControlLine.LOAD_I0_FROM_INPUT,
+                ControlLine.RESTART}
+
 SHIFT_CONTROL_LINE = {
     Register.A : ControlLine.SHIFT_A_RIGHT,
     Register.X : ControlLine.SHIFT_X_RIGHT,
@@ -84,26 +120,93 @@ SHIFT_CONTROL_LINE = {
     Register.R : ControlLine.SHIFT_R_RIGHT,
 }
 
-ControlLines = typing.Set[ControlLine]
+ControlLines = typing.AbstractSet[ControlLine]
 ControlLineTree = typing.Union[ControlLines, ControlLine, typing.Sequence]
 
+# Each combination of control lines used by an operation is interned: there
+# is one frozenset for each combination, found from its bitmask, and shared
+# by every operation which uses it. So combinations can be compared with
+# "is", and each is encoded only once (see CodeTable.encode).
+CONTROL_LINE_BIT = {cl: 1 << i for (i, cl) in enumerate(ControlLine)}
+INTERNED_CONTROLS: typing.Dict[int, typing.FrozenSet[ControlLine]] = {}
+
+def get_control_line_mask(controls_tree: typing.Iterable[ControlLineTree]) -> int:
+    mask = 0
+    for cl in controls_tree:
+        if isinstance(cl, ControlLine):
+            mask |= CONTROL_LINE_BIT[cl]
+        elif isinstance(cl, (list, tuple, set, frozenset)):
+            mask |= get_control_line_mask(cl)
+        else:
+            raise ValueError("Unknown ControlLine type")
+    return mask
+
+def intern_controls(mask: int) -> typing.FrozenSet[ControlLine]:
+    controls = INTERNED_CONTROLS.get(mask)
+    if controls is None:
+        controls = frozenset(cl for (cl, bit) in CONTROL_LINE_BIT.items() if mask & bit)
+        INTERNED_CONTROLS[mask] = controls
+    return controls
+
 class CodeTable:
     def __init__(self) -> None:
         self.table: typing.Dict[str, int] = {"": 0}
+        # Control lines with a dedicated bit in each control word; the other
+        # control lines are enumerated in the low field_bits bits
+        self.dedicated: typing.List[typing.Tuple[ControlLine, int]] = [
+            (ControlLine.REPEAT_FOR_ALL_BITS, 0x40),
+            (ControlLine.SHIFT_A_RIGHT, 0x20),
+        ]
+        self.field_bits = 5
+        self.fixed = False
+        # Entry address of each subroutine, decoded from CALL n; this is
+        # set when the program is laid out (see OperationList.layout)
+        self.entry_points: typing.List[int] = []
+        # Code for each combination of control lines already encoded
+        self.codes: typing.Dict[typing.FrozenSet[ControlLine], int] = {}
+        # Incremented when the encoding is replaced
+        self.version = 0
+
+    def set_encoding(self, dedicated: typing.Sequence[ControlLine],
+                     table: typing.Dict[str, int]) -> None:
+        # Use an encoding chosen in advance (see code_optimiser), in which
+        # dedicated bits are allocated downwards from 0x40
+        if len(dedicated) > 6:
+            raise ValueError("Too many dedicated control lines")
+        if ControlLine.RESTART in dedicated:
+            # RESTART is also decoded from every unused code
+            raise ValueError("RESTART cannot have a dedicated bit")
+        self.dedicated = [(cl, 0x40 >> i) for (i, cl) in enumerate(dedicated)]
+        self.field_bits = 7 - len(dedicated)
+        self.table = dict(table)
+        self.fixed = True
+        self.codes = {}
+        self.version += 1
+        if max(self.table.values()) >= (1 << self.field_bits):
+            raise ValueError("Too many codes are required")
 
     def encode(self, controls: ControlLines) -> int:
-        controls = set(controls)
+        if not isinstance(controls, frozenset):
+            controls = frozenset(controls)
+        code = self.codes.get(controls)
+        if code is None:
+            code = self.encode_new(controls)
+            self.codes[controls] = code
+        return code
+
+    def encode_new(self, controls: ControlLines) -> int:
+        remaining = set(controls)
         flag = 0
-        if ControlLine.REPEAT_FOR_ALL_BITS in controls:
-            flag |= 0x40
-            controls.discard(ControlLine.REPEAT_FOR_ALL_BITS)
-        if ControlLine.SHIFT_A_RIGHT in controls:
-            flag |= 0x20
-            controls.discard(ControlLine.SHIFT_A_RIGHT)
-        key = ','.join(sorted(c.name for c in controls))
+        for (cl, bit) in self.dedicated:
+            if cl in remaining:
+                flag |= bit
+                remaining.discard(cl)
+        key = ','.join(sorted(c.name for c in remaining))
         if key not in self.table:
+            if self.fixed:
+                raise ValueError(f"No code for {key} in the encoding")
             self.table[key] = len(self.table)
-            if self.table[key] >= 0x20:
+            if self.table[key] >= (1 << self.field_bits):
                 raise ValueError("Too many codes are required")
         return self.table[key] | flag
 
@@ -124,10 +227,11 @@ class Operation:
         return "<base>"
 
     def dump_code(self, fd: typing.IO) -> None:
-        if self.encode() is None:
+        code = self.encode()
+        if code is None:
             fd.write(f'        # {self}\n')
         else:
-            fd.write(f'{self.address:3d}  {self.encode():3d} {self}\n')
+            fd.write(f'{self.address:3d}  {code:3d} {self}\n')
 
     def encode(self) -> typing.Optional[int]:
         return None
@@ -175,43 +279,191 @@ class MuxOperation(Operation):
     def encode(self) -> typing.Optional[int]:
         return 0x80 | self.source.value
 
+class RepeatOperation(Operation):
+    def __init__(self, controls: ControlLines, address: int) -> None:
+        Operation.__init__(self, address)
+        self.controls = controls
+        self.count = 1
+
+    def __str__(self) -> str:
+        return f"REPEAT {self.count}"
+
+    def encode(self) -> typing.Optional[int]:
+        return REPEAT_CODE + self.count
+
+class MultiplyOperation(Operation):
+    def __init__(self, controls: ControlLines, digit: int, address: int) -> None:
+        Operation.__init__(self, address)
+        self.controls = controls
+        self.digit = digit
+
+    def __str__(self) -> str:
+        return f"MUL {self.digit}"
+
+    def encode(self) -> typing.Optional[int]:
+        return MUL_CODE | self.digit
+
+class AddOperation(Operation):
+    def __init__(self, digit: int, address: int) -> None:
+        Operation.__init__(self, address)
+        self.digit = digit
+
+    def __str__(self) -> str:
+        return f"ADD {self.digit} * A"
+
+    def encode(self) -> typing.Optional[int]:
+        return ADD_CODE | self.digit
+
+class BankOperation(Operation):
+    def __init__(self, bank: int, address: int) -> None:
+        Operation.__init__(self, address)
+        self.bank = bank
+
+    def __str__(self) -> str:
+        return f"SET BANK {self.bank}"
+
+    def encode(self) -> typing.Optional[int]:
+        return 0x90 | self.bank
+
+class Subroutine:
+    def __init__(self, name: str, number: int) -> None:
+        self.name = name
+        self.number = number
+        self.operations: typing.List[Operation] = []
+        self.calls = 0
+        # Set by OperationList.layout
+        self.address = 0
+        self.index = 0
+
+    @property
+    def size(self) -> int:
+        # ROM bytes, including RETURN
+        return len([op for op in self.operations if not isinstance(op, CommentOperation)])
+
+    @property
+    def saved(self) -> int:
+        # ROM bytes saved, compared to a copy of the subroutine (without
+        # RETURN) in place of each CALL
+        return ((self.size - 1) * self.calls) - self.size - self.calls
+
+class CallOperation(Operation):
+    def __init__(self, subroutine: Subroutine, address: int) -> None:
+        Operation.__init__(self, address)
+        self.subroutine = subroutine
+
+    def __str__(self) -> str:
+        return f"CALL {self.subroutine.number} ({self.subroutine.name})"
+
+    def encode(self) -> typing.Optional[int]:
+        return CALL_CODE | self.subroutine.number
+
+class ReturnOperation(Operation):
+    def __str__(self) -> str:
+        return "RETURN"
+
+    def encode(self) -> typing.Optional[int]:
+        return RETURN_CODE
+
 class OperationList:
-    def __init__(self) -> None:
+    def __init__(self, settings: Settings = DEFAULT_SETTINGS, repeats: bool = True) -> None:
+        self.settings = settings
+        # If repeats is set, runs of identical control operations are
+        # replaced by one operation followed by REPEAT
+        self.repeats = repeats
+        # The main program; subroutines are placed after it in the ROM
         self.operations: typing.List[Operation] = []
+        self.subroutines: typing.Dict[str, Subroutine] = {}
         self.code_table = self.make_code_table()
         self.address = 0
+        # New operations are appended to self.target, which is a subroutine
+        # while the subroutine is being generated
+        self.target = self.operations
+        self.current: typing.Optional[Subroutine] = None
+        # Incremented by each change to the program; the layout, memory
+        # image and cycle count are kept until the next change
+        self.version = 0
+        self.layout_version = -1
+        self.all_operations: typing.List[Operation] = []
+        self.memory_image_key = (-1, -1)
+        self.memory_image = b""
+        self.cycle_count_key = (-1, -1)
+        self.cycles = 0
 
     def make_code_table(self) -> CodeTable:
         return CodeTable()
 
     def __len__(self) -> int:
-        return len(self.operations)
+        return len(self.layout())
 
     def __getitem__(self, index: int) -> Operation:
-        return self.operations[index]
+        return self.layout()[index]
+
+    def layout(self) -> typing.List[Operation]:
+        # Main program followed by each subroutine: subroutine addresses are
+        # assigned here, as the main program may grow after they are generated
+        if self.version == self.layout_version:
+            return self.all_operations
+        all_operations = list(self.operations)
+        address = len([op for op in self.operations if not isinstance(op, CommentOperation)])
+        for sub in self.subroutines.values():
+            sub.address = address
+            sub.index = len(all_operations)
+            for op in sub.operations:
+                op.address = address
+                if not isinstance(op, CommentOperation):
+                    address += 1
+            all_operations.extend(sub.operations)
+        self.code_table.entry_points = [sub.address for sub in self.subroutines.values()]
+        self.layout_version = self.version
+        self.all_operations = all_operations
+        return all_operations
+
+    def append(self, op: Operation) -> None:
+        self.target.append(op)
+        self.version += 1
+        if not isinstance(op, CommentOperation):
+            self.address += 1
 
     def add(self, *controls_tree: ControlLineTree) -> None:
-        control_lines: ControlLines = set()
-
-        def collector(cl: ControlLineTree) -> None:
-            if isinstance(cl, ControlLine):
-                control_lines.add(cl)
-            elif isinstance(cl, list) or isinstance(cl, tuple) or isinstance(cl, set):
-                for cl2 in cl:
-                    collector(cl2)
-            else:
-                raise ValueError("Unknown ControlLine type")
-
-        collector(controls_tree)
-        self.operations.append(ControlOperation(control_lines, self.code_table, self.address))
-        self.address += 1
+        control_lines = intern_controls(get_control_line_mask(controls_tree))
+        if self.repeats and (len(self.target) != 0) and not (control_lines & NOT_REPEATED):
+            previous = self.target[-1]
+            if (isinstance(previous, (ControlOperation, RepeatOperation, MultiplyOperation))
+                    and (previous.controls is control_lines)):
+                if isinstance(previous, RepeatOperation) and (previous.count < MAX_REPEAT):
+                    previous.count += 1
+                    self.version += 1
+                else:
+                    self.append(RepeatOperation(previous.controls, self.address))
+                return
+
+        self.append(ControlOperation(control_lines, self.code_table, self.address))
    
+    def multiply(self, digit: int) -> None:
+        # Execute the previous control operation again, adding digit * A to R
+        previous = self.target[-1] if len(self.target) != 0 else None
+        if (not isinstance(previous, (ControlOperation, RepeatOperation, MultiplyOperation))
+                or (previous.controls & NOT_REPEATED)):
+            raise ValueError("MUL must follow a control operation which can be repeated")
+        self.check_digit(digit)
+        self.append(MultiplyOperation(previous.controls, digit, self.address))
+
+    def add_multiple(self, digit: int) -> None:
+        # Add digit * A to R
+        self.check_digit(digit)
+        self.append(AddOperation(digit, self.address))
+
+    def check_digit(self, digit: int) -> None:
+        settings = self.settings
+        if not (1 <= digit < min(MAX_DIGIT + 1, 1 << (settings.digit_bits * settings.lanes))):
+            raise ValueError(f"Digit {digit} is not possible with "
+                             f"{settings.digit_bits} bit digits and {settings.lanes} lanes")
+
     def debug(self, debug: Debug) -> None:
-        self.operations.append(DebugOperation(debug, self.address))
-        self.address += 1
+        self.append(DebugOperation(debug, self.address))
    
     def comment(self, text: str) -> None:
-        self.operations.append(CommentOperation(text, self.address))
+        self.append(CommentOperation(text, self.address))
    
     def mux(self, source: typing.Union[MuxCode, Register]) -> None:
         if isinstance(source, Register):
@@ -220,11 +472,76 @@ class OperationList:
         if not isinstance(source, MuxCode):
             raise ValueError("Unknown Register or MuxCode")
        
-        self.operations.append(MuxOperation(source, self.address))
-        self.address += 1
+        self.append(MuxOperation(source, self.address))
+
+    def bank(self, bank: int) -> None:
+        if not (0 <= bank < MAX_BANKS):
+            raise ValueError(f"Bank must be in the range 0 .. {MAX_BANKS - 1}")
+
+        self.append(BankOperation(bank, self.address))
+
+    def call(self, name: str, body: typing.Callable[["OperationList"], None]) -> None:
+        # Call the subroutine with this name. The first call generates the
+        # subroutine by calling body, so subroutines which are parameterised
+        # (e.g. by coefficients) should include the parameters in the name.
+        if self.current is not None:
+            raise ValueError("Subroutines cannot call subroutines")
+        sub = self.subroutines.get(name)
+        if sub is None:
+            if len(self.subroutines) >= MAX_SUBROUTINES:
+                raise ValueError(f"No more than {MAX_SUBROUTINES} subroutines are possible")
+            sub = Subroutine(name, len(self.subroutines))
+            self.subroutines[name] = sub
+            (main_target, main_address) = (self.target, self.address)
+            (self.target, self.address, self.current) = (sub.operations, 0, sub)
+            try:
+                self.comment(f"Subroutine {sub.number}: {name}")
+                body(self)
+                self.append(ReturnOperation(self.address))
+            except Exception:
+                del self.subroutines[name]
+                self.version += 1
+                raise
+            finally:
+                (self.target, self.address, self.current) = (main_target, main_address, None)
+        sub.calls += 1
+        self.append(CallOperation(sub, self.address))
+
+    @property
+    def num_banks(self) -> int:
+        return max([op.bank + 1 for op in self
+                    if isinstance(op, BankOperation)] + [1])
+
+    def cycle_count(self) -> int:
+        # Clock cycles from one RESTART to the next, excluding any time
+        # spent waiting for input: each operation takes one cycle unless it
+        # repeats for all bits (one cycle per digit), and RESTART is followed by one cycle in which
+        # the first operation is fetched again
+        self.layout()
+        key = (self.version, self.settings.all_digits)
+        if key != self.cycle_count_key:
+            self.cycles = 1 + self.static_cycles(self.operations)
+            self.cycle_count_key = key
+        return self.cycles
+
+    def static_cycles(self, operations: typing.Iterable[Operation]) -> int:
+        cycles = 0
+        for op in operations:
+            if isinstance(op, ControlOperation) and (
+                    ControlLine.REPEAT_FOR_ALL_BITS in op.controls):
+                cycles += self.settings.all_digits
+            elif isinstance(op, CallOperation):
+                cycles += CALL_CYCLES + self.static_cycles(op.subroutine.operations)
+            elif isinstance(op, ReturnOperation):
+                cycles += RETURN_CYCLES
+            elif isinstance(op, RepeatOperation):
+                cycles += op.count
+            elif op.encode() is not None:
+                cycles += 1
+        return cycles
 
     def __iter__(self) -> typing.Iterator[Operation]:
-        for op in self.operations:
+        for op in self.layout():
             yield op
 
     def generate(self, prefix: str) -> None:
@@ -233,18 +550,28 @@ class OperationList:
 
     def dump_code(self, fd: typing.IO) -> None:
         fd.write("Disassembly\n\n")
-        for op in self.operations:
+        for op in self:
             op.dump_code(fd)
         fd.write("\n\nCode table\n\n")
         self.code_table.dump_code(fd)
+        if len(self.subroutines) != 0:
+            fd.write("\n\nSubroutines\n\n")
+            for sub in self.subroutines.values():
+                fd.write(f"{sub.number:3d} address {sub.address:4d} size {sub.size:4d} "
+                         f"calls {sub.calls:3d} {sub.name}\n")
 
     def get_memory_image(self) -> bytes:
-        memory: typing.List[int] = []
-        for op in self.operations:
-            code = op.encode()
-            if code is not None:
-                memory.append(code)
-        return bytes(memory)
+        self.layout()
+        key = (self.version, self.code_table.version)
+        if key != self.memory_image_key:
+            memory: typing.List[int] = []
+            for op in self.all_operations:
+                code = op.encode()
+                if code is not None:
+                    memory.append(code)
+            self.memory_image = bytes(memory)
+            self.memory_image_key = key
+        return self.memory_image
 
 def get_shift_line(target: Register) -> ControlLine:
     if not isinstance(target, Register):
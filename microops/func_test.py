@@ -8,24 +8,53 @@ from filter_implementation import (
         multiply_accumulate, filter_step, demodulator,
         multiply_accumulate_via_regs, move_reg_to_reg,
         set_X_to_abs_O1, set_Y_to_X_minus_reg,
-        move_X_to_L_if_Y_is_not_negative,
+        move_X_to_L_if_Y_is_not_negative, multi_channel_demodulator,
+        add_scaled_reg_to_R, goertzel_demodulator, Detector,
+        compact_demodulator, lane_multiply,
     )
 from pattern_test_implementation import (
         output_pattern_from_input,
     )
 from settings import (
         FRACTIONAL_BITS, NON_FRACTIONAL_BITS, FUNC_TEST_SCALE, DEBUG,
+        UPPER_FREQUENCY, LOWER_FREQUENCY,
+        DEFAULT_SETTINGS, PRESETS,
     )
+from fixed_point import (
+        FixedArray,
+    )
+import fixed_point
 from test_vector import (
-        TestVector, OutVector,
+        TestVector, OutVector, OUT_VALUES_PER_IN_VALUE,
+    )
+from virtual_fpga import (
+        make_virtual_serial,
+    )
+import spdif_model
+import signal_model
+from profiler import (
+        Profiler,
     )
 import func_execute
-import random, typing, struct, sys
+import func_hardware
+import exec_trace
+import rom_execute
+import code_optimiser
+import synth_report
+import latency
+import word_model
+import stream_decoder
+import demod_service
+import input_fifo
+import fpga_hardware
+import cycle_report
+import cycle_model
+import asyncio, concurrent.futures, contextlib, io, math, random, re, typing, struct, sys, tempfile, os
 
 ACCEPTABLE_ERROR = (1.0 / (1 << (FRACTIONAL_BITS - 4)))
 VERY_SMALL_ERROR = (1.0 / (1 << FRACTIONAL_BITS)) * 1.01
 RunOps = typing.Callable[[OperationList, typing.List[int]], typing.List[int]]
-MakeOps = typing.Callable[[], OperationList]
+MakeOps = typing.Callable[..., OperationList]
 
 
 def test_output_pattern_from_input(run_ops: RunOps, make_ops: MakeOps) -> None:
@@ -60,6 +89,7 @@ def test_repeat_and_reset(run_ops: RunOps, make_ops: MakeOps) -> None:
         "RESTART immediately follows a NOP, and is the end of the program",
         "RESTART immediately follows a repeated NOP, and is the end of the program",
         "RESTART immediately follows a register move, and is the end of the program",
+        "RESTART immediately follows a REPEAT, and is the end of the program",
         ]
     for i in range(len(test_case_name)):
         title = f"Test case {i}: {test_case_name[i]}"
@@ -80,6 +110,9 @@ def test_repeat_and_reset(run_ops: RunOps, make_ops: MakeOps) -> None:
             ops.add()
         elif i == 3:
             ops.add(ControlLine.REPEAT_FOR_ALL_BITS)
+        elif i == 5:
+            ops.add()
+            ops.add()
         ops.add(ControlLine.RESTART)
 
         if i == 0:
@@ -98,6 +131,7 @@ def test_multiply_accumulate(r: random.Random, num_multiply_tests: int, run_ops:
         if DEBUG > 0:
             print(f"Test multiply accumulate {i}", flush=True)
         ops = make_ops()
+        settings = ops.settings
         expect = 0.0
         v1f_list: typing.List[float] = []
         v0i_list: typing.List[int] = []
@@ -106,10 +140,10 @@ def test_multiply_accumulate(r: random.Random, num_multiply_tests: int, run_ops:
                 v0s, v1s = 1.99, 1.0
             else:
                 v0s, v1s = 1.0, 1.99
-            v0i = make_fixed((r.random() * 2.0 * v0s) - v0s)
-            v1i = make_fixed((r.random() * 2.0 * v1s) - v1s)
-            v0f = make_float(v0i)
-            v1f = make_float(v1i)
+            v0i = make_fixed((r.random() * 2.0 * v0s) - v0s, settings)
+            v1i = make_fixed((r.random() * 2.0 * v1s) - v1s, settings)
+            v0f = make_float(v0i, settings)
+            v1f = make_float(v1i, settings)
             if abs(expect + (v0f * v1f)) < 2.0:
                 expect += v0f * v1f
                 if DEBUG > 0:
@@ -127,22 +161,56 @@ def test_multiply_accumulate(r: random.Random, num_multiply_tests: int, run_ops:
         out_values = run_ops(ops, v0i_list)
         assert len(out_values) == 1
         ri = out_values[0]
-        rf = make_float(ri)
+        rf = make_float(ri, settings)
         error = abs(rf - expect)
         if DEBUG > 0:
-            print(f" result {rf:1.6f} {ri:04x} expect {expect:1.6f} {make_fixed(expect):04x}")
+            print(f" result {rf:1.6f} {ri:04x} expect {expect:1.6f} {make_fixed(expect, settings):04x}")
             print(f" error {error:1.6f} ops {len(ops)} via_regs {via_regs}")
         if via_regs:
             assert error < ACCEPTABLE_ERROR
         else:
             assert error < VERY_SMALL_ERROR
 
+def test_fixed_point(r: random.Random, num_values: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print("Test fixed point arrays", flush=True)
+    values = [(r.random() * 3.9) - 1.95 for i in range(num_values)]
+    array = FixedArray.from_float(values)
+    assert array.raw == [make_fixed(value, DEFAULT_SETTINGS) for value in values]
+    assert array.to_float() == [make_float(ivalue, DEFAULT_SETTINGS) for ivalue in array.raw]
+    assert array.max_error(values) <= (0.5 / (1 << FRACTIONAL_BITS))
+    pcm_range = FixedArray.from_float([value / 4.0 for value in values])
+    assert FixedArray.from_int16(pcm_range.to_int16()) == pcm_range
+    assert (array + array - array) == array
+
+    # Out of range values are detected or saturated, and arithmetic wraps
+    try:
+        FixedArray.from_float([0.0, 2.0])
+        assert False
+    except OverflowError:
+        pass
+    saturated = FixedArray.from_float([-3.0, 2.0], saturate=True)
+    assert saturated.raw == [1 << (ALL_BITS - 1), (1 << (ALL_BITS - 1)) - 1]
+    assert (saturated[1:] + FixedArray.from_float([1.0 / (1 << FRACTIONAL_BITS)])) == saturated[:1]
+    assert abs(saturated).raw == [1 << (ALL_BITS - 1), (1 << (ALL_BITS - 1)) - 1]
+
+    # Multiply-accumulate gives the same results as the micro operations
+    coefficients = [(r.random() * 3.9) - 1.95 for i in range(2)]
+    inputs = [FixedArray.from_float([(r.random() * 1.9) - 0.95 for i in range(num_values)])
+              for coefficient in coefficients]
+    ops = make_ops()
+    multiply_accumulate(ops, coefficients)
+    ops.add(ControlLine.RESTART)
+    in_values = [value for pair in zip(*[i.raw for i in inputs]) for value in pair]
+    expect = fixed_point.multiply_accumulate(list(zip(inputs, coefficients)))
+    assert run_ops(ops, in_values) == expect.raw
+
 def test_bandpass_filter(r: random.Random, num_filter_tests: int, run_ops: RunOps, make_ops: MakeOps) -> None:
     print(f"Test bandpass filter", flush=True)
     for i in range(num_filter_tests):
         if DEBUG > 0:
             print(f"Test bandpass filter {i}", flush=True)
         ops = make_ops()
+        settings = ops.settings
         a1 = ((r.random() * 1.2) - 0.6)
         a2 = ((r.random() * 1.2) - 0.6)
         b0 = ((r.random() * 1.2) - 0.6)
@@ -157,19 +225,19 @@ def test_bandpass_filter(r: random.Random, num_filter_tests: int, run_ops: RunOp
             attempts_left = 5
             while abs(o0) >= 1.99:
                 assert attempts_left > 0
-                i0i = make_fixed((r.random() * 2.0) - 1.0)
-                i0 = make_float(i0i)
+                i0i = make_fixed((r.random() * 2.0) - 1.0, settings)
+                i0 = make_float(i0i, settings)
                 o0 = i0*b0 + i2*b2 - o1*a1 - o2*a2
                 attempts_left -= 1
                 
             inputs.append(i0i)
             if DEBUG > 1:
-                print(f" step {j} i0 = {make_fixed(i0):04x} * {make_fixed(b0):04x}", end="")
-                print(f" i1 = {make_fixed(i1):04x} ", end="")
-                print(f" i2 = {make_fixed(i2):04x} * {make_fixed(b2):04x}", end="")
-                print(f" o1 = {make_fixed(o1):04x} * {make_fixed(-a1):04x}", end="")
-                print(f" o2 = {make_fixed(o2):04x} * {make_fixed(-a2):04x}", end="")
-                print(f" -> o0 = {make_fixed(o0):04x}")
+                print(f" step {j} i0 = {make_fixed(i0, settings):04x} * {make_fixed(b0, settings):04x}", end="")
+                print(f" i1 = {make_fixed(i1, settings):04x} ", end="")
+                print(f" i2 = {make_fixed(i2, settings):04x} * {make_fixed(b2, settings):04x}", end="")
+                print(f" o1 = {make_fixed(o1, settings):04x} * {make_fixed(-a1, settings):04x}", end="")
+                print(f" o2 = {make_fixed(o2, settings):04x} * {make_fixed(-a2, settings):04x}", end="")
+                print(f" -> o0 = {make_fixed(o0, settings):04x}")
             assert abs(o0) < 2.0
             ops.add(ControlLine.LOAD_I0_FROM_INPUT)
             filter_step(ops, a1, a2, b0, b2)
@@ -191,19 +259,18 @@ def test_bandpass_filter(r: random.Random, num_filter_tests: int, run_ops: RunOp
         out_values = run_ops(ops, inputs)
         assert len(out_values) == len(inputs)
         assert len(expect_values) == len(inputs)
-        for j in range(len(inputs)):
-            ri = out_values[j]
-            rf = make_float(ri)
-            i0 = make_float(inputs[j])
-            error = abs(rf - expect_values[j])
-            if DEBUG > 0:
+        if DEBUG > 0:
+            for (j, (i0, rf)) in enumerate(zip(FixedArray(inputs).to_float(),
+                                               FixedArray(out_values).to_float())):
+                error = abs(rf - expect_values[j])
                 print(f" step {j} input {i0:1.6f} result {rf:1.6f} expected {expect_values[j]:1.6f} error {error:1.6f}")
-            assert error < ACCEPTABLE_ERROR
+        assert FixedArray(out_values).max_error(expect_values) < ACCEPTABLE_ERROR
 
 def test_move_X_to_L_if_Y_is_not_negative(r: random.Random, num_update_tests: int, run_ops: RunOps, make_ops: MakeOps) -> None:
     print("Test move X to L if Y is not negative", flush=True)
     for i in range(num_update_tests):
         ops = make_ops()
+        settings = ops.settings
         inputs = []
 
         # Generate test values - must keep yf in range
@@ -213,16 +280,16 @@ def test_move_X_to_L_if_Y_is_not_negative(r: random.Random, num_update_tests: in
         attempts_left = 5
         while abs(yf) >= 1.99:
             assert attempts_left > 0
-            o1i = make_fixed((r.random() * 2.2) - 1.1)
-            li = make_fixed(r.random() * 1.1)
+            o1i = make_fixed((r.random() * 2.2) - 1.1, settings)
+            li = make_fixed(r.random() * 1.1, settings)
 
             # Calculate expected result
-            xf = abs(make_float(o1i))
-            yf = xf - make_float(li)
+            xf = abs(make_float(o1i, settings))
+            yf = xf - make_float(li, settings)
             attempts_left -= 1
 
-        xi = make_fixed(xf)
-        yi = make_fixed(yf)
+        xi = make_fixed(xf, settings)
+        yi = make_fixed(yf, settings)
         if DEBUG > 0:
             print(f" O1 = {o1i:04x} L = {li:04x} X = {xi:04x} Y = {yi:04x}", end="")
 
@@ -318,55 +385,977 @@ def test_demodulator(num_compare_tests: int, run_ops: RunOps, make_ops: MakeOps)
     compare_demodulator_output(test_vector, out_vector)
 
 
+def test_multi_channel_demodulator(num_compare_tests: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test multi-channel demodulator", flush=True)
+    # The second channel has the frequencies swapped, so it should have
+    # the same filter outputs in the opposite order, and the opposite Y
+    ops = make_ops()
+    multi_channel_demodulator(ops, [(UPPER_FREQUENCY, LOWER_FREQUENCY),
+                                    (LOWER_FREQUENCY, UPPER_FREQUENCY)])
+    assert ops.num_banks == 4
+
+    test_vector = TestVector(num_compare_tests)
+    all_values = run_ops(ops, test_vector.in_values)
+    values_per_channel = OUT_VALUES_PER_IN_VALUE
+    values_per_sample = values_per_channel * 2
+    assert len(all_values) == (len(test_vector.in_values) * values_per_sample)
+    first_channel: typing.List[int] = []
+    for i in range(0, len(all_values), values_per_sample):
+        first = all_values[i:i + values_per_channel]
+        second = all_values[i + values_per_channel:i + values_per_sample]
+        assert second[0:2] == first[2:4]
+        assert second[2:4] == first[0:2]
+        assert second[4] == ((- first[4]) & ((1 << ALL_BITS) - 1))
+        first_channel.extend(first)
+
+    # The first channel is the same as the single channel demodulator
+    compare_demodulator_output(test_vector, OutVector(first_channel))
+
+
+def test_settings(num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test settings", flush=True)
+    # Each configuration should detect a tone at its upper frequency
+    # as a 1 bit and a tone at its lower frequency as a 0 bit
+    all_settings = list(PRESETS.values())
+    all_settings.append(DEFAULT_SETTINGS.replace("current_12_bits", fractional_bits=12))
+    for settings in all_settings:
+        for (frequency, expect_bit) in [(settings.upper_frequency, 1),
+                                        (settings.lower_frequency, 0)]:
+            ops = make_ops(settings)
+            demodulator(ops)
+            in_values = FixedArray.from_float(
+                    [0.5 * math.sin((2.0 * math.pi * frequency * i) / settings.sample_rate)
+                     for i in range(num_samples)], settings).raw
+            out_vector = OutVector(run_ops(ops, in_values), settings)
+            assert len(out_vector.out_values) == num_samples
+            for item in out_vector.out_values[(num_samples * 3) // 4:]:
+                assert item.out_bit == expect_bit, settings.name
+
+
+def test_scaled_addition(r: random.Random, num_tests: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test scaled addition", flush=True)
+    # R += I0 * 2^-shift is exact, so the result is the input shifted
+    # right (arithmetic shift) after the low bits are discarded from R
+    for i in range(num_tests):
+        ops = make_ops()
+        settings = ops.settings
+        shift = r.randrange(settings.fractional_bits + 1)
+        in_value = r.randrange(1 << settings.all_bits)
+        signed_value = make_float(in_value, settings) * (1 << settings.fractional_bits)
+        expect = int(math.floor(signed_value / (1 << shift))) & ((1 << settings.all_bits) - 1)
+        ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+        add_scaled_reg_to_R(ops, Register.I0, shift)
+        move_reg_to_reg(ops, Register.R, Register.O1)
+        ops.debug(Debug.SEND_O1_TO_OUTPUT)
+        # I0 is unchanged
+        move_reg_to_reg(ops, Register.I0, Register.O1)
+        ops.debug(Debug.SEND_O1_TO_OUTPUT)
+        ops.add(ControlLine.RESTART)
+        out_values = run_ops(ops, [in_value])
+        assert out_values == [expect, in_value], (shift, in_value, out_values)
+
+def test_goertzel_demodulator(num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test Goertzel demodulator", flush=True)
+    # As test_settings, for the alternative demodulator
+    for settings in PRESETS.values():
+        for (frequency, expect_bit) in [(settings.upper_frequency, 1),
+                                        (settings.lower_frequency, 0)]:
+            ops = make_ops(settings)
+            goertzel_demodulator(ops)
+            in_values = FixedArray.from_float(
+                    [0.5 * math.sin((2.0 * math.pi * frequency * i) / settings.sample_rate)
+                     for i in range(num_samples)], settings).raw
+            out_vector = OutVector(run_ops(ops, in_values), settings)
+            assert len(out_vector.out_values) == num_samples
+            for item in out_vector.out_values[(num_samples * 3) // 4:]:
+                assert item.out_bit == expect_bit, settings.name
+
+def test_subroutines(num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test subroutines", flush=True)
+    # The demodulator using subroutines gives the same outputs as the
+    # demodulator without them, in less ROM space but a few more cycles
+    # for each call
+    ops = make_ops()
+    compact_demodulator(ops)
+    inline_ops = OperationList()
+    demodulator(inline_ops)
+    in_values = TestVector(num_samples).in_values
+    assert run_ops(ops, in_values) == func_execute.run_ops(inline_ops, in_values)
+
+    [sub] = ops.subroutines.values()
+    assert sub.calls == 2
+    assert ops.code_table.entry_points == [sub.address]
+    assert ops.get_memory_image()[sub.address + sub.size - 1] == 0xb0
+    assert len(ops.get_memory_image()) == len(inline_ops.get_memory_image()) - sub.saved
+    assert ops.cycle_count() == inline_ops.cycle_count() + (4 * sub.calls)
+
+    # The profile includes the cycle after each jump
+    profiler = Profiler()
+    func_execute.FuncExecutor(ops, profiler=profiler).run(in_values)
+    [profile] = profiler.programs.values()
+    assert profile.total_cycles() == ops.cycle_count() * num_samples
+
+    # Subroutines are shared by name, and cannot call subroutines
+    ops = make_ops()
+    ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+    for target in [Register.O1, Register.O2, Register.O1]:
+        ops.call(f"Move I0 to {target.name}",
+                 lambda ops: move_reg_to_reg(ops, Register.I0, target))
+        ops.debug(Debug.SEND_O1_TO_OUTPUT)
+    ops.call("Move O2 to O1", lambda ops: move_reg_to_reg(ops, Register.O2, Register.O1))
+    ops.debug(Debug.SEND_O1_TO_OUTPUT)
+    ops.add(ControlLine.RESTART)
+    assert len(ops.subroutines) == 3
+    assert run_ops(ops, [1, 2, 3]) == [1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3]
+    try:
+        ops.call("Nested", lambda ops: ops.call("Move O2 to O1", lambda ops: None))
+        assert False
+    except ValueError:
+        pass
+    assert len(ops.subroutines) == 3
+
+    # Undefined subroutines are illegal
+    assert rom_execute.decode(0xa0 | 3, ops.code_table) == (5, None)
+    assert rom_execute.decode(0xb0, ops.code_table) == (7, None)
+
+def test_repeat_operations(num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test repeat operations", flush=True)
+    # Runs of identical operations are replaced by REPEAT, which gives
+    # the same outputs in the same number of cycles
+    ops = make_ops()
+    demodulator(ops)
+    no_repeat_ops = OperationList(repeats=False)
+    demodulator(no_repeat_ops)
+    in_values = TestVector(num_samples).in_values
+    assert run_ops(ops, in_values) == func_execute.run_ops(no_repeat_ops, in_values)
+    assert ops.cycle_count() == no_repeat_ops.cycle_count()
+    assert len(ops.get_memory_image()) < (len(no_repeat_ops.get_memory_image()) * 2) // 3
+
+    # The same with more bits per cycle (see test_dual_datapath for two lanes)
+    settings = DEFAULT_SETTINGS.replace("digits_2", digit_bits=2)
+    ops = make_ops(settings)
+    demodulator(ops)
+    no_repeat_ops = OperationList(settings, repeats=False)
+    demodulator(no_repeat_ops)
+    assert any(isinstance(op, func_hardware.RepeatOperation) for op in ops)
+    assert run_ops(ops, in_values) == func_execute.run_ops(no_repeat_ops, in_values)
+    assert ops.cycle_count() == no_repeat_ops.cycle_count()
+
+    # Runs longer than MAX_REPEAT need more than one REPEAT
+    ops = make_ops()
+    ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+    ops.mux(Register.I0)
+    for i in range(ops.settings.all_bits * 7):
+        ops.add(ControlLine.SHIFT_I0_RIGHT, ControlLine.SHIFT_O1_RIGHT)
+    ops.debug(Debug.SEND_O1_TO_OUTPUT)
+    ops.add(ControlLine.RESTART)
+    counts = [op.count for op in ops if isinstance(op, func_hardware.RepeatOperation)]
+    (whole, part) = divmod((ops.settings.all_bits * 7) - 1, func_hardware.MAX_REPEAT)
+    assert counts == ([func_hardware.MAX_REPEAT] * whole) + [part]
+    in_values = [1, 0x1234, 0xfedc]
+    assert run_ops(ops, in_values) == in_values
+
+    # REPEAT must follow a control operation
+    try:
+        rom_execute.ROMExecutor(bytes([func_hardware.REPEAT_CODE + 1]),
+                                ops.code_table, ops.settings).run([0])
+        assert False
+    except Exception as e:
+        assert "Illegal" in str(e)
+
+def test_digit_serial(r: random.Random, num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test digit serial", flush=True)
+    # With more bits shifted per cycle, the programs give exactly the same
+    # outputs as with one bit, in fewer cycles
+    in_values = TestVector(num_samples).in_values
+    for (generator, detector) in [(demodulator, Detector.BIQUAD),
+                                  (goertzel_demodulator, Detector.GOERTZEL),
+                                  (compact_demodulator, Detector.BIQUAD)]:
+        expect = word_model.WordDemodulator(DEFAULT_SETTINGS, detector).run(in_values, True)
+        cycles = []
+        for digit_bits in [1, 2, 4]:
+            settings = DEFAULT_SETTINGS.replace(f"digits_{digit_bits}", digit_bits=digit_bits)
+            ops = make_ops(settings)
+            generator(ops)
+            if digit_bits > 1:
+                # So that REPEAT, MUL and ADD are all run (in GHDL by ghdl_test.py)
+                kinds = {type(op) for op in ops}
+                assert {func_hardware.RepeatOperation, func_hardware.MultiplyOperation,
+                        func_hardware.AddOperation} <= kinds, (generator.__name__, digit_bits)
+            assert run_ops(ops, in_values) == expect, (generator.__name__, digit_bits)
+            cycles.append(ops.cycle_count())
+        assert cycles == sorted(cycles, reverse=True) and cycles[0] > cycles[2]
+
+    # Multiplications by any coefficient, from any register
+    settings = DEFAULT_SETTINGS.replace("digits_4", digit_bits=4)
+    assert (settings.a_bits, settings.r_fractional_bits) == (32, 16)
+    for i in range(num_samples // 10):
+        test_values = [r.uniform(-1.99, 1.99) for j in range(3)] + [-1.99, 1.0]
+        in_values = [r.randrange(1 << ALL_BITS) for test_value in test_values]
+        outputs = []
+        for digit_bits in [1, 4]:
+            ops = make_ops(settings.replace("mac", digit_bits=digit_bits))
+            multiply_accumulate_via_regs(ops, test_values)
+            ops.add(ControlLine.RESTART)
+            outputs.append(run_ops(ops, in_values))
+        assert outputs[0] == outputs[1], test_values
+
+    # Digits must divide the register width
+    try:
+        DEFAULT_SETTINGS.replace("digits_3", digit_bits=3)
+        assert False
+    except ValueError:
+        pass
+
+    # MUL must follow a control operation and has a digit which fits
+    ops = make_ops(settings)
+    ops.mux(Register.ZERO)
+    for (digit, action) in [(1, ops.multiply), (16, ops.add_multiple)]:
+        try:
+            action(digit)
+            assert False
+        except ValueError:
+            pass
+    assert rom_execute.decode(0xb3, ops.code_table) == (func_execute.Kind.MULTIPLY, 3)
+    assert rom_execute.decode(0xd5, ops.code_table) == (func_execute.Kind.ADD, 5)
+    try:
+        rom_execute.ROMExecutor(bytes([0xb3]), ops.code_table, settings).run([0])
+        assert False
+    except Exception as e:
+        assert "Illegal" in str(e)
+
+def test_dual_datapath(r: random.Random, num_samples: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    print(f"Test dual datapath", flush=True)
+    # With two lanes, both filters of a channel are applied at once, giving
+    # the same outputs as the banked program in fewer cycles. Each debug
+    # output is sent by lane 0 (lower frequency), then lane 1 (upper).
+    in_values = TestVector(num_samples).in_values
+    channels = [(UPPER_FREQUENCY, LOWER_FREQUENCY), (19000.0, 18000.0)]
+    for (detector, digit_bits, subroutines) in [(Detector.BIQUAD, 1, False),
+                                                (Detector.BIQUAD, 2, False),
+                                                (Detector.GOERTZEL, 1, False),
+                                                (Detector.GOERTZEL, 2, False),
+                                                (Detector.BIQUAD, 1, True)]:
+        settings = DEFAULT_SETTINGS.replace(f"digits_{digit_bits}", digit_bits=digit_bits)
+        banked = make_ops(settings)
+        multi_channel_demodulator(banked, channels, detector, subroutines)
+        dual = make_ops(settings.replace("dual", lanes=2))
+        multi_channel_demodulator(dual, channels, detector, subroutines)
+        assert dual.num_banks == len(channels)
+        assert (dual.cycle_count() * 10) < (banked.cycle_count() * 6)
+
+        dual_values = run_ops(dual, in_values)
+        reordered: typing.List[int] = []
+        for i in range(0, len(dual_values), OUT_VALUES_PER_IN_VALUE):
+            (lower_o1, upper_o1, lower_l, upper_l, y) = dual_values[i:i + OUT_VALUES_PER_IN_VALUE]
+            reordered.extend([upper_o1, upper_l, lower_o1, lower_l, y])
+        assert reordered == run_ops(banked, in_values), (detector, digit_bits, subroutines)
+
+    settings = DEFAULT_SETTINGS.replace("dual", lanes=2)
+
+    # REPEAT gives the same outputs in the same number of cycles
+    ops = make_ops(settings)
+    demodulator(ops)
+    no_repeat_ops = OperationList(settings, repeats=False)
+    demodulator(no_repeat_ops)
+    assert any(isinstance(op, func_hardware.RepeatOperation) for op in ops)
+    assert run_ops(ops, in_values) == func_execute.run_ops(no_repeat_ops, in_values)
+    assert ops.cycle_count() == no_repeat_ops.cycle_count()
+
+    # Each lane multiplies by its own coefficient
+    for i in range(num_samples // 10):
+        test_values = [r.uniform(-1.99, 1.99), r.uniform(-1.99, 1.99)]
+        in_value = r.randrange(1 << ALL_BITS)
+        ops = make_ops(settings)
+        ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+        lane_multiply(ops, Register.I0, test_values)
+        move_reg_to_reg(ops, Register.R, Register.O1)
+        ops.debug(Debug.SEND_O1_TO_OUTPUT)
+        ops.add(ControlLine.RESTART)
+        expect = []
+        for test_value in test_values:
+            single = make_ops()
+            multiply_accumulate(single, [test_value])
+            single.add(ControlLine.RESTART)
+            expect.extend(run_ops(single, [in_value]))
+        assert run_ops(ops, [in_value]) == expect, test_values
+
+    # Both lanes share the digit of MUL and ADD
+    for (digit_bits, lanes) in [(4, 2), (1, 3)]:
+        try:
+            DEFAULT_SETTINGS.replace("lanes", digit_bits=digit_bits, lanes=lanes)
+            assert False
+        except ValueError:
+            pass
+    ops = make_ops(settings)
+    ops.add_multiple(3)
+    try:
+        ops.add_multiple(4)
+        assert False
+    except ValueError:
+        pass
+
 def compare_demodulator_output(test_vector: TestVector, out_vector: OutVector) -> None:
     assert len(test_vector.in_values) == len(test_vector.out_values)
     assert len(out_vector.out_values) == len(test_vector.out_values)
-    correct = 0
-    for i in range(len(test_vector.in_values)):
-        actual = out_vector.out_values[i]
-        expect = test_vector.out_values[i]
-        in_value = test_vector.in_values[i]
-
-        if DEBUG > 0:
-            print(f"step {i} in {in_value:04x}")
-        for (name, iexpect, iactual) in [
-                    ("upper_bp", expect.upper_bandpass, actual.upper_bandpass),
-                    ("upper_rc", expect.upper_rc, actual.upper_rc),
-                    ("lower_bp", expect.lower_bandpass, actual.lower_bandpass),
-                    ("lower_rc", expect.lower_rc, actual.lower_rc),
-                ]:
-            fexpect = make_float(iexpect)
-            factual = make_float(iactual)
-            if DEBUG > 0:
-                print(f" {name} expect {iexpect:04x} {fexpect:8.5f}", end="")
-                print(f" actual {iactual:04x} {factual:8.5f} ", end="")
-            error = abs(fexpect - factual)
-            if DEBUG > 0:
-                print(f" error {error:1.6f}")
-            assert error < VERY_SMALL_ERROR
+    fields = ["upper_bandpass", "upper_rc", "lower_bandpass", "lower_rc"]
+    for name in fields:
+        expect = FixedArray([getattr(item, name) for item in test_vector.out_values])
+        actual = FixedArray([getattr(item, name) for item in out_vector.out_values])
         if DEBUG > 0:
-            error = expect.out_bit ^ actual.out_bit
-            print(f" out bit  expect {expect.out_bit} actual {actual.out_bit} error {error} Y {actual.y:04x}")
-        if expect.out_bit == actual.out_bit:
-            correct += 1
-   
+            for (i, (fexpect, factual)) in enumerate(zip(expect.to_float(), actual.to_float())):
+                print(f"step {i} {name} expect {fexpect:8.5f} actual {factual:8.5f} "
+                      f"error {abs(fexpect - factual):1.6f}")
+        assert actual.max_error(expect) < VERY_SMALL_ERROR, name
+
+    correct = sum(int(expect.out_bit == actual.out_bit) for (expect, actual)
+                  in zip(test_vector.out_values, out_vector.out_values))
     print(f"{correct} bits out of {len(test_vector.in_values)} matched expectations")
     assert correct > (len(test_vector.in_values) * 0.99)
 
 
+def test_virtual_fpga(num_compare_tests: int) -> None:
+    print(f"Test virtual FPGA", flush=True)
+    ser = make_virtual_serial()
+    ser.open()
 
-def test_all(scale: int, run_ops: RunOps, make_ops: MakeOps) -> None:
+    # Echo, as used for synchronisation
+    ser.write(b"123")
+    assert ser.read(4) == b"123"
+
+    # Each sample produces one output bit
+    test_vector = TestVector(num_compare_tests)
+    ser.write(b"".join(b"T" + struct.pack(">H", value) for value in test_vector.in_values))
+    data = ser.read(len(test_vector.in_values) + 1)
+    assert len(data) == len(test_vector.in_values)
+    assert set(data) <= {0, 1}
+    out_vector = test_vector.substitute_new_out_bits(list(data))
+    correct = sum(int(expect.out_bit == actual.out_bit) for (expect, actual)
+                  in zip(test_vector.out_values, out_vector.out_values))
+    assert correct > (len(test_vector.in_values) * 0.99)
+
+    # Echo still works after the test
+    ser.write(b"12")
+    assert ser.read(2) == b"12"
+
+def test_spdif_model(r: random.Random, num_samples: int) -> None:
+    print(f"Test S/PDIF receive chain model", flush=True)
+    samples = [(r.randrange(1 << 16), r.randrange(1 << 16)) for i in range(num_samples)]
+    durations = spdif_model.render(spdif_model.encode(samples),
+                                   spdif_model.single_time(48000.0), 2.0, r)
+
+    # The first frame is lost while the receiver synchronises, and each
+    # subframe is only output when the next preamble arrives
+    receiver = spdif_model.Receiver()
+    subframes = receiver.decode_subframes(durations)
+    assert receiver.sync_losses == 0
+    left = [(data >> 12) & 0xffff for (strobe, data) in subframes
+            if strobe == spdif_model.Strobe.LEFT]
+    right = [(data >> 12) & 0xffff for (strobe, data) in subframes
+             if strobe == spdif_model.Strobe.RIGHT]
+    assert left == [sample[0] for sample in samples[1:]]
+    assert right == [sample[1] for sample in samples[1:-1]]
+
+    # Signal loss causes loss of sync, followed by recovery
+    index = len(durations) // 2
+    durations[index] = spdif_model.MAX_TRANSITION_TIME
+    receiver = spdif_model.Receiver()
+    left = receiver.decode(durations)
+    assert receiver.sync_losses == 1
+    assert (len(samples) - 4) < len(left) < (len(samples) - 1)
+    assert left[-10:] == [sample[0] for sample in samples[-10:]]
+
+def test_input_fifo(num_samples: int) -> None:
+    print(f"Test input FIFO model", flush=True)
+    # Left and right strobes from the S/PDIF model alternate, about half a
+    # frame apart: the preambles are detected at different points
+    frame_time = int(spdif_model.single_time(48000.0) * 128.0)
+    strobe_times = input_fifo.get_strobe_times(num_samples, 48000.0, 96e6, 2.0, True)
+    assert len(strobe_times) >= ((num_samples - 2) * 2)
+    for (time0, time1, time2) in zip(strobe_times, strobe_times[1:], strobe_times[2:]):
+        assert abs((time1 - time0) - (frame_time // 2)) <= (frame_time // 32)
+        assert abs((time2 - time0) - frame_time) <= 4
+    assert len(input_fifo.get_strobe_times(num_samples, 48000.0, 96e6, 2.0, False)) \
+                == ((len(strobe_times) + 1) // 2)
+
+    # With both channels, the default program of input_fifo.py is between the
+    # shorter and the mean strobe interval: drops fall as the FIFO deepens
+    ops = input_fifo.make_ops(input_fifo.DEMO_SETTINGS, input_fifo.DEMO_DETECTOR,
+                              input_fifo.DEMO_CHANNELS)
+    intervals = [time1 - time0 for (time0, time1) in zip(strobe_times, strobe_times[1:])]
+    assert min(intervals) < ops.cycle_count() < (sum(intervals) / len(intervals))
+    dropped = [len(input_fifo.simulate_fifo(strobe_times, ops.cycle_count(), depth).dropped)
+               for depth in [0, 1, 2]]
+    assert dropped[0] > (len(strobe_times) // 4)
+    assert dropped == sorted(dropped, reverse=True) and dropped[-1] == 0
+
+    # Pairs of strobes 10 cycles apart, with a program shorter than half a frame:
+    # without a FIFO, every second sample is lost
+    burst_times = [(i // 2) * 1000 + (i % 2) * 10 for i in range(num_samples)]
+    result = input_fifo.simulate_fifo(burst_times, 400, 0)
+    assert result.accepted == list(range(0, num_samples, 2))
+    assert result.dropped == list(range(1, num_samples, 2))
+    assert result.max_latency == 400
+    assert result.max_occupancy == 0
+
+    # One entry is enough; the second sample of each pair waits for the first
+    result = input_fifo.simulate_fifo(burst_times, 400, 1)
+    assert result.accepted == list(range(num_samples))
+    assert result.max_occupancy == 1
+    assert result.max_latency == (1 + 400 + 400 - 10)
+
+    # A program that is too long for both channels loses samples at any depth,
+    # and latency grows with depth
+    for depth in [0, 1, 2, 4]:
+        result = input_fifo.simulate_fifo(burst_times, 600, depth)
+        assert len(result.dropped) > 0, depth
+        assert result.max_occupancy == depth
+        assert result.max_latency <= (1 + (depth + 1) * 600), depth
+    assert input_fifo.simulate_fifo(burst_times, 600, 4).utilisation > 0.99
+
+    # Functional simulation: lost samples do not reach the program
+    settings = DEFAULT_SETTINGS.replace("fifo", input_fifo_depth=1)
+    ops = OperationList(settings)
+    demodulator(ops)
+    test_vector = TestVector(num_samples)
+    cycle_count = ops.cycle_count()
+    burst_times = [(i // 2) * cycle_count + (i % 2) for i in range(num_samples)]
+    (out_values, result) = input_fifo.run_with_fifo(
+                func_execute.FuncExecutor(ops, debug_outputs=False), test_vector.in_values, burst_times)
+    assert result.depth == 1
+    assert 0 < len(result.dropped) < num_samples
+    expect = func_execute.FuncExecutor(ops, debug_outputs=False).run(
+                [test_vector.in_values[index] for index in result.accepted])
+    assert out_values == expect
+
+    # Invalid depth
+    try:
+        DEFAULT_SETTINGS.replace("fifo", input_fifo_depth=-1)
+        assert False
+    except ValueError:
+        pass
+
+def test_signal_model(r: random.Random, num_bytes: int) -> None:
+    print(f"Test signal model", flush=True)
+    # Serial data encoded by the generator is recovered from the
+    # floating-point demodulator by the serial decoder
+    for settings in PRESETS.values():
+        data = bytes(r.randrange(256) for i in range(num_bytes))
+        pcm = signal_model.generate_signal(data, settings)
+        decoder = signal_model.SerialDecoder(settings)
+        received = decoder.decode(signal_model.reference_demodulator(pcm, settings))
+        assert signal_model.count_bit_errors(data, received[:len(data)]) == 0, settings.name
+
+def test_latency(r: random.Random, num_bytes: int) -> None:
+    print(f"Test latency", flush=True)
+    assert latency.percentile([], 50) is None
+    assert latency.percentile([3, 1, 2, 4], 50) == 2
+    assert latency.percentile([3, 1, 2, 4], 90) == 4
+    assert latency.percentile([5], 1) == 5
+    settings = DEFAULT_SETTINGS
+    samples_per_bit = int(settings.sample_rate / settings.baud_rate)
+    data = bytes(r.randrange(256) for i in range(num_bytes))
+
+    # Stop bits are found from the transmitted bits
+    bits = signal_model.generate_bits(data, settings)
+    stop_samples = latency.get_stop_bit_samples(data, settings, len(bits))
+    assert len(stop_samples) >= num_bytes
+    for start in stop_samples:
+        assert bits[start:start + samples_per_bit] == [1] * samples_per_bit
+
+    # Every transition is detected within a bit, and every frame soon after
+    result = latency.measure(settings, "reference", data)
+    assert 0 < result.transitions <= len(latency.get_transitions(bits))
+    assert result.missed == 0
+    assert len(result.comparator) == result.transitions
+    assert 0 < max(result.comparator) < samples_per_bit
+    assert len(result.framing) == result.frames == len(stop_samples)
+    assert 0 < max(result.framing) < (samples_per_bit * 2)
+    assert result.bit_errors == 0
+
+def test_stream_decoder(r: random.Random, num_samples: int, num_bytes: int) -> None:
+    print(f"Test stream decoder", flush=True)
+    # The word-level model has the same outputs as the demodulator programs
+    in_values = TestVector(num_samples).in_values
+    for (detector, generate) in [(Detector.BIQUAD, demodulator),
+                                 (Detector.GOERTZEL, goertzel_demodulator)]:
+        ops = OperationList()
+        generate(ops)
+        expect = func_execute.FuncExecutor(ops).run(in_values)
+        model = word_model.WordDemodulator(DEFAULT_SETTINGS, detector)
+        half = num_samples // 2
+        actual = model.run(in_values[:half], True) + model.run(in_values[half:], True)
+        assert expect == actual, detector.name
+
+    # Samples which do not fit in the ring buffer are dropped, if requested
+    ring = stream_decoder.RingBuffer(5, drop=True)
+    ring.write([1, 2, 3])
+    assert ring.read(2) == [1, 2]
+    ring.write([4, 5, 6, 7, 8])
+    assert ring.dropped == 1
+    assert ring.read(10) == [3, 4, 5, 6, 7]
+    ring.close()
+    assert ring.read(10) == []
+
+    # Bytes are decoded from a stream in small blocks
+    data = bytes(r.randrange(256) for i in range(num_bytes))
+    pcm = signal_model.generate_signal(data)
+    fd_in = io.BytesIO(struct.pack(f"<{len(pcm)}h", *pcm))
+    fd_out = io.StringIO()
+    stats = stream_decoder.decode_stream(fd_in, fd_out, buffer_samples=1000, block_samples=300)
+    assert stats.samples == len(pcm)
+    received = bytes(int(line.split()[1], 16) for line in fd_out.getvalue().splitlines())
+    assert received[:num_bytes] == data
+    times = [float(line.split()[0]) for line in fd_out.getvalue().splitlines()]
+    assert times == sorted(times)
+
+def test_demod_service(num_streams: int, num_bytes: int) -> None:
+    print(f"Test demodulation service", flush=True)
+    # Bits mode reports each change of output bit
+    state = demod_service.parse_header(f"{demod_service.PROTOCOL} current biquad bits")
+    pcm = signal_model.generate_signal(b"\x55")
+    (state, results) = demod_service.process_block(state, struct.pack(f"<{len(pcm)}h", *pcm))
+    changes = [tuple(int(field) for field in line.split()) for line in results.splitlines()]
+    assert changes[0] == (0, 0)
+    assert [bit for (sample, bit) in changes] == [i & 1 for i in range(len(changes))]
+    assert state.samples == len(pcm)
+
+    # Concurrent streams are decoded by the server
+    async def run() -> typing.Tuple[typing.List[demod_service.StreamResult], str]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            address = os.path.join(tmp_dir, "socket")
+            with concurrent.futures.ProcessPoolExecutor(2) as executor:
+                server = demod_service.Server(executor)
+                async with await demod_service.start_server(server, address):
+                    (results, elapsed) = await demod_service.run_load(
+                            address, DEFAULT_SETTINGS, Detector.BIQUAD, num_streams, num_bytes, False)
+                    (reader, writer) = await demod_service.open_connection(address)
+                    writer.write(b"HELLO\n")
+                    error = (await reader.readline()).decode("ascii")
+                    writer.close()
+                    assert server.connections == num_streams + 1
+                    return (results, error)
+
+    (results, error) = asyncio.run(run())
+    assert error.startswith("ERROR")
+    assert len(results) == num_streams
+    for result in results:
+        assert result.error is None
+        assert result.bit_errors == 0
+        assert result.received[:num_bytes] == result.data
+        assert len(result.latency) == len(result.received)
+
+def test_exec_trace(num_samples: int) -> None:
+    print(f"Test execution trace", flush=True)
+    # A change to one input is found as the first divergence
+    ops = OperationList()
+    demodulator(ops)
+    in_values = TestVector(num_samples).in_values
+    changed_sample = num_samples // 2
+    changed_values = list(in_values)
+    changed_values[changed_sample] ^= 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filenames = []
+        for values in [in_values, changed_values, in_values]:
+            filenames.append(os.path.join(tmp_dir, f"{len(filenames)}.trc"))
+            trace = exec_trace.TraceWriter(filenames[-1])
+            func_execute.FuncExecutor(ops, trace=trace).run(values)
+            trace.close()
+
+        # Every cycle is traced except the fetch after RESTART
+        records = list(exec_trace.TraceReader(filenames[0]))
+        assert len(records) == (ops.cycle_count() - 1) * num_samples
+        assert records[-1].sample == num_samples
+        assert exec_trace.find_divergence(filenames[0], filenames[2]) is None
+
+        divergence = exec_trace.find_divergence(filenames[0], filenames[1])
+        assert divergence is not None
+        assert divergence.a is not None and divergence.b is not None
+        assert divergence.a.index == divergence.b.index
+        assert divergence.a.sample == changed_sample + 1
+        assert divergence.a.address == records[0].address
+        assert len(divergence.context) == exec_trace.CONTEXT_RECORDS
+        assert divergence.context[-1].index == divergence.a.index - 1
+
+        # Windowing by sample
+        trace = exec_trace.TraceWriter(filenames[2], ops.settings, changed_sample, changed_sample + 2)
+        func_execute.FuncExecutor(ops, trace=trace).run(in_values)
+        trace.close()
+        window = list(exec_trace.TraceReader(filenames[2]))
+        assert window[0].sample == changed_sample
+        assert window[-1].sample == changed_sample + 1
+        assert ([record[1:] for record in window] ==
+                [record[1:] for record in records
+                 if changed_sample <= record.sample < (changed_sample + 2)])
+
+def test_rom_executor(num_compare_tests: int) -> None:
+    print(f"Test ROM executor", flush=True)
+    ops = OperationList()
+    demodulator(ops)
+    func_executor = func_execute.FuncExecutor(ops)
+    rom_executor = rom_execute.ROMExecutor(ops.get_memory_image(), ops.code_table, ops.settings)
+
+    # Each byte decodes to the operation that was encoded
+    assert rom_executor.program == [entry for entry in func_executor.program
+                                    if entry[0] != func_execute.Kind.COMMENT]
+
+    in_values = TestVector(num_compare_tests).in_values
+    assert rom_executor.run(in_values) == func_executor.run(in_values)
+
+    # Codes that are not generated are decoded as the hardware would
+    unused = len(ops.code_table.table)
+    assert rom_execute.decode(unused, ops.code_table) == (0, func_execute.control_mask({ControlLine.RESTART}))
+    assert rom_execute.decode(0x80 | 11, ops.code_table) == (1, MuxCode.X_OTHER_LANE)
+    assert rom_execute.decode(0x80 | 12, ops.code_table) == (1, MuxCode.ONE)
+    assert rom_execute.decode(0xc0 | 8, ops.code_table) == (2, None)
+    try:
+        rom_execute.ROMExecutor(bytes([0xff]), ops.code_table, ops.settings).run([0])
+        assert False
+    except Exception as e:
+        assert "Illegal" in str(e)
+
+def test_code_optimiser(num_compare_tests: int) -> None:
+    print(f"Test code optimiser", flush=True)
+    ops = OperationList()
+    demodulator(ops)
+    ops.get_memory_image()
+
+    # The Verilog used for synthesis follows the encoding
+    fd = io.StringIO()
+    code_optimiser.dump_decoder_verilog(ops.code_table, fd)
+    text = fd.getvalue()
+    for (cl, bit) in ops.code_table.dedicated:
+        assert f"{cl.name} = code_in[{bit.bit_length() - 1}] & control_line_enable;" in text
+    for value in ops.code_table.table.values():
+        assert f"{ops.code_table.field_bits}'d{value}: begin" in text
+    assert "default: RESTART = control_line_enable;" in text
+
+    if code_optimiser.find_yosys() is None:
+        print("  yosys is not available, so encodings are not chosen")
+        return
+
+    # The chosen encoding is no larger than the default after synthesis,
+    # and the memory image still executes correctly
+    default_luts = code_optimiser.synthesise_decoder(ops.code_table)
+    encoding = code_optimiser.optimise_encoding(ops, 100, 2)
+    assert encoding.luts is not None
+    assert encoding.luts <= default_luts
+    assert code_optimiser.synthesise_decoder(ops.code_table) == encoding.luts
+    in_values = TestVector(num_compare_tests).in_values
+    rom_executor = rom_execute.ROMExecutor(ops.get_memory_image(), ops.code_table, ops.settings)
+    assert rom_executor.run(in_values) == func_execute.FuncExecutor(ops).run(in_values)
+
+    # More combinations of control lines than the default encoding allows
+    shifts = [ControlLine.SHIFT_X_RIGHT, ControlLine.SHIFT_Y_RIGHT, ControlLine.SHIFT_L_RIGHT,
+              ControlLine.SHIFT_O1_RIGHT, ControlLine.SHIFT_O2_RIGHT, ControlLine.SHIFT_I1_RIGHT]
+    ops = OperationList()
+    for i in range(1 << len(shifts)):
+        ops.add([cl for (j, cl) in enumerate(shifts) if i & (1 << j)])
+    ops.add(ControlLine.RESTART)
+    try:
+        ops.get_memory_image()
+        assert False
+    except ValueError:
+        pass
+    code_optimiser.optimise_encoding(ops, 10, 0)
+    rom_executor = rom_execute.ROMExecutor(ops.get_memory_image(), ops.code_table, ops.settings)
+    assert rom_executor.program == [entry for entry in func_execute.FuncExecutor(ops).program]
+
+def test_profiler() -> None:
+    print(f"Test profiler", flush=True)
+    # Programs with the same ROM image share a profile, even if their
+    # comments differ, and each count is for the right operation
+    def make(comments: bool) -> OperationList:
+        ops = OperationList()
+        if comments:
+            ops.comment("Load")
+        ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+        if comments:
+            ops.comment("Move")
+        move_reg_to_reg(ops, Register.I0, Register.O1)
+        ops.debug(Debug.SEND_O1_TO_OUTPUT)
+        ops.add(ControlLine.RESTART)
+        return ops
+
+    profiler = Profiler()
+    plain = make(False)
+    commented = make(True)
+    assert plain.get_memory_image() == commented.get_memory_image()
+    assert func_execute.FuncExecutor(plain, profiler=profiler).run([1, 2, 3]) == [1, 2, 3]
+    assert func_execute.FuncExecutor(commented, profiler=profiler).run([4, 5]) == [4, 5]
+    [profile] = profiler.programs.values()
+    assert profile.restarts == 5
+    assert profile.never_executed() == []
+    assert [profile.executions(op) for op in profile.encoded()] == [5] * len(plain.get_memory_image())
+    assert profile.total_cycles() == plain.cycle_count() * 5
+
+def test_program_cache() -> None:
+    print(f"Test program cache", flush=True)
+    # The memory image and cycle count are kept until the program changes
+    ops = OperationList()
+    demodulator(ops)
+    memory = ops.get_memory_image()
+    cycles = ops.cycle_count()
+    assert ops.get_memory_image() is memory
+    ops.add(ControlLine.LOAD_I0_FROM_INPUT)
+    assert ops.get_memory_image() == memory + bytes([ops.code_table.encode(
+                                        {ControlLine.LOAD_I0_FROM_INPUT})])
+    assert ops.cycle_count() == cycles + 1
+
+    # Extending a REPEAT changes the program without adding an operation
+    ops = OperationList()
+    ops.add(ControlLine.SHIFT_X_RIGHT)
+    ops.add(ControlLine.SHIFT_X_RIGHT)
+    assert ops.get_memory_image()[1] == func_hardware.REPEAT_CODE + 1
+    ops.add(ControlLine.SHIFT_X_RIGHT)
+    assert ops.get_memory_image()[1] == func_hardware.REPEAT_CODE + 2
+    assert ops.cycle_count() == 4
+
+    # Each combination of control lines is shared, however it is given
+    ops = OperationList(repeats=False)
+    ops.add([ControlLine.SHIFT_X_RIGHT, ControlLine.SHIFT_Y_RIGHT])
+    ops.add(ControlLine.SHIFT_Y_RIGHT, (ControlLine.SHIFT_X_RIGHT, ))
+    ops.add({ControlLine.SHIFT_Y_RIGHT}, [[ControlLine.SHIFT_X_RIGHT]])
+    assert ops[0].controls is ops[1].controls is ops[2].controls
+    assert ops[0].controls == {ControlLine.SHIFT_X_RIGHT, ControlLine.SHIFT_Y_RIGHT}
+    try:
+        ops.add(ControlLine.SHIFT_X_RIGHT, "SHIFT_Y_RIGHT")
+        assert False
+    except ValueError:
+        pass
+
+def test_cycle_model(num_samples: int) -> None:
+    print(f"Test clock-level model", flush=True)
+    test_vector = TestVector(num_samples)
+    for (settings, generate) in [
+                (DEFAULT_SETTINGS, demodulator),
+                (DEFAULT_SETTINGS, goertzel_demodulator),
+                (DEFAULT_SETTINGS, compact_demodulator),
+                (DEFAULT_SETTINGS.replace("digit", digit_bits=2), demodulator),
+                (DEFAULT_SETTINGS.replace("dual", lanes=2), demodulator),
+            ]:
+        ops = OperationList(settings)
+        generate(ops)
+        name = f"{generate.__name__} {settings.name}"
+        cycle_count = ops.cycle_count()
+
+        # Same outputs as FuncExecutor, whether the inputs are given at once or in parts
+        executor = cycle_model.CycleExecutor(ops)
+        out_values = executor.run(test_vector.in_values[:10])
+        out_values += executor.run(test_vector.in_values[10:])
+        assert out_values == func_execute.FuncExecutor(ops).run(test_vector.in_values), name
+        events = executor.events
+
+        # Runs of cycles are executed at once, except within the window,
+        # with the same events and the same final state
+        stepped = cycle_model.CycleExecutor(ops, window=(3, 6))
+        assert stepped.run(test_vector.in_values) == out_values, name
+        assert stepped.events.timeline() == events.timeline(), name
+        assert stepped.reg_file == executor.reg_file, name
+
+        # With the test bench, each sample waits one cycle for input, and
+        # otherwise takes the cycles counted by cycle_count()
+        assert [cycle for (cycle, value) in events.loads] == [
+                    cycle + cycle_model.BENCH_STROBE_DELAY for cycle in events.ready], name
+        assert [value for (cycle, value) in events.loads] == test_vector.in_values, name
+        assert events.ready[0] == 1, name
+        period = cycle_count + cycle_model.BENCH_STROBE_DELAY
+        assert all((cycle1 - cycle0) == period for (cycle0, cycle1)
+                   in zip(events.restarts, events.restarts[1:])), name
+        assert events.wait_cycles == num_samples, name
+        assert (events.busy_cycles + events.bubble_cycles) == (1 + (num_samples * cycle_count)), name
+        assert events.total_cycles == executor.cycle, name
+
+        # One output per sample, a fixed time after the input
+        assert len(events.outputs) == num_samples, name
+        latency = {output_cycle - load_cycle for ((load_cycle, _), (output_cycle, _))
+                   in zip(events.loads, events.outputs)}
+        assert len(latency) == 1, name
+        assert [value for (cycle, value) in events.outputs] == [
+                    (y >> (settings.all_bits - 1)) & 1
+                    for y in func_execute.FuncExecutor(ops, debug_outputs=False).run(test_vector.in_values)]
+
+    # Inputs at given times are taken or lost as in the FIFO model (input_fifo.py)
+    burst_times = [100 + ((i // 2) * 1000) + ((i % 2) * 5) for i in range(num_samples)]
+    for (cycles, depth) in [(969, 0), (969, 1), (969, 2)]:
+        ops = OperationList(DEFAULT_SETTINGS.replace("fifo", input_fifo_depth=depth))
+        demodulator(ops)
+        executor = cycle_model.CycleExecutor(ops, debug_outputs=False)
+        out_values = executor.run(test_vector.in_values, burst_times)
+        result = input_fifo.simulate_fifo(burst_times, ops.cycle_count(), depth)
+        assert executor.events.dropped == result.dropped, depth
+        assert [cycle for (cycle, value) in executor.events.loads] == [
+                    latency + burst_times[index] - ops.cycle_count()
+                    for (index, latency) in zip(result.accepted, result.latency)], depth
+        assert out_values == func_execute.FuncExecutor(ops, debug_outputs=False).run(
+                    [test_vector.in_values[index] for index in result.accepted]), depth
+
+def test_execute_run(r: random.Random, num_tests: int) -> None:
+    print(f"Test execution of runs of cycles", flush=True)
+    # execute_run gives the same register file as executing the same
+    # operation cycle by cycle, or does nothing
+    shift_registers = list(func_execute.SHIFT_BIT)
+    select_registers = [func_execute.REG_INDEX[reg] for reg in Register]
+    control_bits = [func_execute.CONTROL_BIT[cl] for cl in ControlLine
+                    if cl not in (ControlLine.REPEAT_FOR_ALL_BITS, ControlLine.RESTART)]
+    executed = 0
+    for digit_bits in [1, 2, 4]:
+        settings = DEFAULT_SETTINGS.replace(f"digit{digit_bits}", digit_bits=digit_bits)
+        for i in range(num_tests):
+            reg_file = func_execute.new_reg_file()
+            for index in shift_registers:
+                reg_file[index] = r.getrandbits(settings.a_bits if index == func_execute.A
+                                                else settings.all_bits)
+            reg_file[func_execute.MUX_SELECT] = r.choice(select_registers)
+            reg_file[func_execute.X_SELECT] = r.choice(list(func_execute.XSelect)).value
+            reg_file[func_execute.Y_BORROW] = r.randrange(2)
+            reg_file[func_execute.X_BORROW] = r.randrange(2)
+            mask = 0
+            for bit in control_bits:
+                if r.random() < (0.03 if bit & func_execute.NOT_RUN_MASK else 0.3):
+                    mask |= bit
+            count = r.choice([2, 3, settings.all_digits, settings.all_digits + 1])
+
+            expect = list(reg_file)
+            for j in range(count):
+                func_execute.execute_control(mask, expect, [0] * count, [], settings)
+            actual = list(reg_file)
+            if func_execute.execute_run(mask, count, actual, settings):
+                assert actual == expect, (mask, count)
+                executed += 1
+            else:
+                assert actual == reg_file, (mask, count)
+    assert executed > (num_tests * 2)
+
+def test_lattice_rom() -> None:
+    print(f"Test Lattice microcode ROM", flush=True)
+    # The memory image is recovered from the SB_RAM512x8 INIT values, with
+    # one block for each 512 bytes and the block selected by the upper bits
+    # of the address, which is registered with the read
+    for num_channels in [1, 2, 3, 4]:
+        ops = fpga_hardware.FPGAOperationList()
+        multi_channel_demodulator(ops, cycle_report.make_channels(ops.settings, num_channels))
+        memory = ops.get_memory_image()
+        fd = io.StringIO()
+        ops.dump_lattice_rom(fd, "test")
+        text = fd.getvalue()
+
+        blocks = text.split("SB_RAM512x8 generic map")[1:]
+        num_blocks = (len(memory) + fpga_hardware.ROM_BLOCK_SIZE - 1) // fpga_hardware.ROM_BLOCK_SIZE
+        assert len(blocks) == num_blocks
+        rom = bytearray()
+        for block in blocks:
+            rows = re.findall(r'INIT_([0-9A-F]) => X"([0-9A-F]{64})"', block)
+            assert [int(i, 16) for (i, row) in rows] == list(range(16))
+            for (i, row) in rows:
+                rom.extend(reversed(bytes.fromhex(row)))
+        assert bytes(rom[:len(memory)]) == bytes(memory)
+        assert all(code == fpga_hardware.UNUSED_CODE for code in rom[len(memory):])
+
+        uc_addr_bits = ops.get_uc_addr_bits(len(memory))
+        assert (1 << uc_addr_bits) >= len(rom)
+        assert "uc_addr_bits" not in text
+        assert "conv_integer" not in text
+        if num_blocks > 1:
+            assert f"uc_addr_in({uc_addr_bits - 1} downto 9)" in text
+            assert f"uc_data_{num_blocks - 1} when block_select = {num_blocks - 1} else" in text
+        else:
+            assert "block_select" not in text
+
+def test_synth_report() -> None:
+    print(f"Test synthesis report", flush=True)
+    cells = synth_report.parse_yosys_stat(
+        "   Number of cells:   10\n     SB_CARRY   2\n     SB_DFF   3\n"
+        "     SB_DFFE   1\n     SB_LUT4   4\n")
+    assert cells == {"SB_LUT4": 4, "SB_CARRY": 2, "SB_RAM40_4K": 0,
+                     "SB_PLL40_CORE": 0, "SB_DFF*": 4}
+    cells = synth_report.parse_yosys_stat(
+        "       36 cells\n        2   SB_DFFE\n       34   SB_LUT4\n")
+    assert cells == {"SB_LUT4": 34, "SB_CARRY": 0, "SB_RAM40_4K": 0,
+                     "SB_PLL40_CORE": 0, "SB_DFF*": 2}
+    result = synth_report.parse_nextpnr_report({
+        "utilization": {"ICESTORM_LC": {"used": 50, "available": 7680},
+                        "ICESTORM_DSP": {"used": 0, "available": 0}},
+        "fmax": {"clock": {"achieved": 101.234, "constraint": 96.0}}})
+    assert result == {"utilisation": {"ICESTORM_LC": {"used": 50, "available": 7680}},
+                      "fmax_mhz": {"clock": 101.23}}
+    changed = {"utilisation": {"ICESTORM_LC": {"used": 40, "available": 7680}},
+               "fmax_mhz": {"clock": 101.23}}
+    assert synth_report.diff_results(result, result) == []
+    assert synth_report.diff_results(result, changed) == [
+        "utilisation.ICESTORM_LC.used: 50 -> 40 -10 (-20.0%)"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert synth_report.compare_with_baseline({"t": result}, {"t": result})
+        assert not synth_report.compare_with_baseline({"t": result}, {"t": changed})
+        assert not synth_report.compare_with_baseline({}, {"t": result})
+
+def test_all(scale: int, run_ops: RunOps, make_ops: MakeOps,
+             names: typing.Optional[typing.Sequence[str]] = None,
+             exclude: typing.Sequence[str] = ()) -> None:
+    # Run every test case, or only the named ones, except those excluded
     r = random.Random(3)
-    test_output_pattern_from_input(run_ops, make_ops)
-    test_repeat_and_reset(run_ops, make_ops)
-    test_multiply_accumulate(r, scale * 10, run_ops, make_ops)
-    test_bandpass_filter(r, scale * 10, run_ops, make_ops)
-    test_move_X_to_L_if_Y_is_not_negative(r, scale * 10, run_ops, make_ops)
-    test_set_Y_to_X_minus_reg(r, scale * 10, run_ops, make_ops)
-    test_demodulator(scale * 4000, run_ops, make_ops)
+    cases: typing.List[typing.Tuple[str, typing.Callable[[], None]]] = [
+        ("output_pattern", lambda: test_output_pattern_from_input(run_ops, make_ops)),
+        ("repeat_and_reset", lambda: test_repeat_and_reset(run_ops, make_ops)),
+        ("multiply_accumulate", lambda: test_multiply_accumulate(r, scale * 10, run_ops, make_ops)),
+        ("fixed_point", lambda: test_fixed_point(r, scale * 20, run_ops, make_ops)),
+        ("bandpass_filter", lambda: test_bandpass_filter(r, scale * 10, run_ops, make_ops)),
+        ("move_X_to_L", lambda: test_move_X_to_L_if_Y_is_not_negative(r, scale * 10, run_ops, make_ops)),
+        ("set_Y_to_X_minus_reg", lambda: test_set_Y_to_X_minus_reg(r, scale * 10, run_ops, make_ops)),
+        ("demodulator", lambda: test_demodulator(scale * 4000, run_ops, make_ops)),
+        ("multi_channel", lambda: test_multi_channel_demodulator(scale * 200, run_ops, make_ops)),
+        ("settings", lambda: test_settings(scale * 500, run_ops, make_ops)),
+        ("scaled_addition", lambda: test_scaled_addition(r, scale * 20, run_ops, make_ops)),
+        ("goertzel", lambda: test_goertzel_demodulator(scale * 500, run_ops, make_ops)),
+        ("subroutines", lambda: test_subroutines(scale * 200, run_ops, make_ops)),
+        ("repeat", lambda: test_repeat_operations(scale * 200, run_ops, make_ops)),
+        ("digit_serial", lambda: test_digit_serial(r, scale * 100, run_ops, make_ops)),
+        ("dual_datapath", lambda: test_dual_datapath(r, scale * 100, run_ops, make_ops)),
+    ]
+    all_names = [name for (name, _) in cases]
+    for name in list(names or []) + list(exclude):
+        if name not in all_names:
+            raise ValueError(f"Unknown test case {name}, expected one of: {', '.join(all_names)}")
+    for (name, case) in cases:
+        if ((names is None) or (name in names)) and (name not in exclude):
+            case()
 
 def main() -> None:
+    if "--profile" in sys.argv:
+        # Profile and coverage for all of the programs run by test_all
+        profiler = Profiler()
+        def profile_run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
+            return func_execute.FuncExecutor(ops, profiler=profiler).run(in_values)
+        test_all(FUNC_TEST_SCALE, profile_run_ops, OperationList)
+        profiler.generate("generated/func_test_profile")
+        profiler.dump_coverage(sys.stdout)
+        return
+    if "--cycle" in sys.argv:
+        # Execute each program with the clock-level model
+        test_all(FUNC_TEST_SCALE, cycle_model.run_ops, OperationList)
+        return
+    if "--rom" in sys.argv:
+        # Execute the memory image of each program instead of the operations
+        test_all(FUNC_TEST_SCALE, rom_execute.run_rom_ops, OperationList)
+        return
+
     test_all(FUNC_TEST_SCALE, func_execute.run_ops, OperationList)
+    test_virtual_fpga(FUNC_TEST_SCALE * 400)
+    test_spdif_model(random.Random(4), FUNC_TEST_SCALE * 200)
+    test_input_fifo(FUNC_TEST_SCALE * 100)
+    test_cycle_model(FUNC_TEST_SCALE * 50)
+    test_execute_run(random.Random(8), FUNC_TEST_SCALE * 200)
+    test_lattice_rom()
+    test_signal_model(random.Random(5), FUNC_TEST_SCALE * 4)
+    test_latency(random.Random(6), FUNC_TEST_SCALE * 4)
+    test_stream_decoder(random.Random(7), FUNC_TEST_SCALE * 500, FUNC_TEST_SCALE * 4)
+    test_demod_service(FUNC_TEST_SCALE * 3, FUNC_TEST_SCALE * 2)
+    test_exec_trace(FUNC_TEST_SCALE * 50)
+    test_rom_executor(FUNC_TEST_SCALE * 400)
+    test_code_optimiser(FUNC_TEST_SCALE * 400)
+    test_profiler()
+    test_program_cache()
+    test_synth_report()
 
 if __name__ == "__main__":
     try:
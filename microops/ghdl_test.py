@@ -1,26 +1,52 @@
 
 from fpga_hardware import (
-        FPGAOperationList,
+        FPGAOperationList, ROM_BLOCK_SIZE,
+    )
+from filter_implementation import (
+        multi_channel_demodulator, demodulator, goertzel_demodulator,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+from rom_execute import (
+        ROMExecutor,
+    )
+from cycle_report import (
+        make_channels,
+    )
+from test_vector import (
+        TestVector,
+    )
+from cycle_model import (
+        CycleExecutor, CycleEvents,
     )
 from func_hardware import (
-        ALL_BITS, OperationList,
+        OperationList,
     )
 from settings import (
         GHDL_TEST_SCALE, DEBUG, FILTER_UNIT_PREFIX,
+        Settings, DEFAULT_SETTINGS,
     )
 import func_test
 
 from pathlib import Path
-import subprocess, typing, sys, struct, math
+import subprocess, typing, sys, struct, math, time
 
 RFLAGS = ["--assert-level=note"]
+# VHDL-2008 for the external names used by the waveform writer in the test bench
+STD_FLAGS = ["--std=08"]
 FPGA_DIR = Path("fpga").absolute()
 GHDL_OUTPUT = Path("generated/ghdl_output.txt").absolute()
 CLOCK_FREQUENCY_HZ = 100e6
 CLOCK_PERIOD_NS = int(math.floor(1e9 / CLOCK_FREQUENCY_HZ))
 
-def make_test_bench(in_values: typing.List[int], prefix: str) -> None:
+def make_test_bench(in_values: typing.List[int], prefix: str,
+                    settings: Settings = DEFAULT_SETTINGS,
+                    sample_cycles: typing.Optional[typing.Sequence[int]] = None) -> None:
     # generate test bench
+    # sample_cycles: present each sample for one cycle in the given clock
+    # cycle (after reset), as a real source would, instead of waiting for
+    # input_ready
     with open(f"generated/{prefix}_signal_generator.vhdl", "wt") as fd:
         fd.write(f"""
 library ieee;
@@ -40,7 +66,7 @@ entity {prefix}_signal_generator is
         reset_out           : out std_logic;
         input_ready_in      : in std_logic;
         restart_debug_in    : in std_logic;
-        value_out           : out std_logic_vector({ALL_BITS - 1} downto 0)
+        value_out           : out std_logic_vector({settings.all_bits - 1} downto 0)
     );
 end {prefix}_signal_generator;
 
@@ -51,7 +77,7 @@ architecture structural of {prefix}_signal_generator is
     signal clock : std_logic := '0';
     signal v, c, r : std_logic := '0';
 begin
-    value_out <= p({ALL_BITS - 1} downto 0);
+    value_out <= p({settings.all_bits - 1} downto 0);
     clock_out <= clock;
     strobe_out <= v;
     c <= clock;
@@ -86,11 +112,22 @@ begin
         reset_out <= '0';
         wait until c = '1' and c'event;
 """)
-        for value in in_values:
-            fd.write("""wait until r = '1' and c = '1' and c'event; """)
-            fd.write(f"""p <= x"{value:04x}"; v <= '1'; """)
-            fd.write("""wait until c = '1' and c'event; """)
-            fd.write(f"""p <= g; v <= '0'; wait until r = '0' and c = '1' and c'event;\n""")
+        if sample_cycles is None:
+            for value in in_values:
+                fd.write("""wait until r = '1' and c = '1' and c'event; """)
+                fd.write(f"""p <= x"{value:04x}"; v <= '1'; """)
+                fd.write("""wait until c = '1' and c'event; """)
+                fd.write(f"""p <= g; v <= '0'; wait until r = '0' and c = '1' and c'event;\n""")
+        else:
+            # Each sample is presented in its cycle, ready or not
+            cycle = 0
+            for (value, sample_cycle) in zip(in_values, sample_cycles):
+                fd.write(f"""for i in 1 to {sample_cycle - cycle - 1} loop """
+                         """wait until c = '1' and c'event; end loop; """)
+                fd.write(f"""p <= x"{value:04x}"; v <= '1'; """)
+                fd.write("""wait until c = '1' and c'event; """)
+                fd.write("""p <= g; v <= '0';\n""")
+                cycle = sample_cycle
 
         fd.write(f"""
         if VERBOSE_DEBUG then
@@ -108,31 +145,69 @@ begin
 end structural;
 """)
 
-def ghdl_run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
+def ghdl_run_ops(ops: OperationList, in_values: typing.List[int],
+                 trace: typing.Optional[typing.Tuple[str, int, int]] = None,
+                 lattice_rom: bool = False,
+                 events: typing.Optional[CycleEvents] = None,
+                 sample_cycles: typing.Optional[typing.Sequence[int]] = None,
+                 waveform: typing.Optional[typing.Tuple[str, int, int, typing.Sequence[str]]] = None,
+                 ) -> typing.List[int]:
+    # trace = (trace file, first sample, last sample) to write an execution trace
+    # lattice_rom: use the SB_RAM512x8 microcode store (with a simulation model)
+    # rather than the behavioural one
+    # events: filled in with the cycle of each event printed by the test bench
+    # sample_cycles: pace the input (see make_test_bench)
+    # waveform = (VCD file, first sample, last sample, signal names) to write
+    # the named signals (or all, if none are named) for samples first .. last - 1,
+    # with the sample numbers of the trace (see ghdl_test_top_level.vhdl)
     prefix = FILTER_UNIT_PREFIX
     ops.generate(prefix)
-    make_test_bench(in_values=in_values, prefix=prefix)
-    subprocess.check_call(["ghdl", "--remove"], cwd=FPGA_DIR)
-    subprocess.check_call(["ghdl", "-a", "--work=comfilter",
+    make_test_bench(in_values=in_values, prefix=prefix, settings=ops.settings,
+                    sample_cycles=sample_cycles)
+    if lattice_rom:
+        rom_files = ["sb_ram512x8.vhdl", f"../generated/{prefix}_microcode_store.vhdl"]
+    else:
+        rom_files = [f"../generated/{prefix}_microcode_store.test.vhdl"]
+    subprocess.check_call(["ghdl", "--remove"] + STD_FLAGS, cwd=FPGA_DIR)
+    subprocess.check_call(["ghdl", "-a", "--work=comfilter"] + STD_FLAGS + [
             "debug_textio.vhdl",
             "debug_textio-body.vhdl",
             f"../generated/{prefix}_settings.vhdl",
             f"../generated/{prefix}_control_line_decoder.vhdl",
-            f"../generated/{prefix}_microcode_store.test.vhdl",
+            ] + rom_files + [
             f"../generated/{prefix}_signal_generator.vhdl",
             "shift_register.vhdl",
             "banked_shift_register.vhdl",
             "subtractor.vhdl",
+            "input_fifo.vhdl",
             "filter_unit.vhdl",
             "ghdl_test_top_level.vhdl",
             ], cwd=FPGA_DIR)
             
+    generics: typing.List[str] = []
+    if trace is not None:
+        (trace_file, first_sample, last_sample) = trace
+        generics = [f"-gtrace_file={trace_file}",
+                    f"-gtrace_first_sample={first_sample}",
+                    f"-gtrace_last_sample={last_sample}"]
+    if sample_cycles is not None:
+        # Waiting for the next sample is expected
+        longest_wait = max(cycle1 - cycle0 for (cycle0, cycle1) in zip([0] + list(sample_cycles),
+                                                                         sample_cycles))
+        generics.append(f"-gdeadline={longest_wait + ops.cycle_count()}")
+    if waveform is not None:
+        (wave_file, first_sample, last_sample, signals) = waveform
+        generics.extend([f"-gwave_file={Path(wave_file).absolute()}",
+                         f"-gwave_first_sample={first_sample}",
+                         f"-gwave_last_sample={last_sample}",
+                         f"-gwave_signals={','.join(signals)}"])
+
     with open(GHDL_OUTPUT, "wb") as fd:
-        rc = subprocess.call(["ghdl", "-r", "--work=comfilter", "ghdl_test_top_level"] + RFLAGS,
+        rc = subprocess.call(["ghdl", "-r", "--work=comfilter"] + STD_FLAGS + ["ghdl_test_top_level"] + RFLAGS + generics,
                 stdin=subprocess.DEVNULL, stdout=fd, cwd=FPGA_DIR)
 
     out_values: typing.List[int] = []
-    mask = (1 << ALL_BITS) - 1
+    mask = (1 << ops.settings.all_bits) - 1
     end_ok = False
     with open(GHDL_OUTPUT, "rt", encoding="utf-8") as fd:
         for line in fd:
@@ -143,6 +218,16 @@ def ghdl_run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List
                 out_values.append((int(fields[4]) + mask + 1) & mask)
             if (len(fields) == 2) and (fields[0] == "THE") and (fields[1] == "END"):
                 end_ok = True
+            if (len(fields) == 4) and (fields[0] == "Event") and (events is not None):
+                (name, cycle, value) = (fields[1], int(fields[2]), int(fields[3]))
+                if name == "ready":
+                    events.ready.append(cycle)
+                elif name == "load":
+                    events.loads.append((cycle, value))
+                elif name == "output":
+                    events.outputs.append((cycle, value))
+                elif name == "restart":
+                    events.restarts.append(cycle)
 
     if rc != 0:
         sys.exit(1)
@@ -150,11 +235,247 @@ def ghdl_run_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List
         print("Output does not contain 'THE END'")
         sys.exit(1)
 
+    if waveform is not None:
+        (wave_file, _, _, signals) = waveform
+        (names, _) = read_vcd(wave_file)
+        unknown = [name for name in signals if name not in names]
+        if len(unknown) != 0:
+            raise ValueError(f"Unknown signals for waveform: {', '.join(unknown)}")
+
     print(end="", flush=True)
     return out_values
 
+def read_vcd(wave_file: str) -> typing.Tuple[typing.List[str],
+                                            typing.Dict[str, typing.List[typing.Tuple[int, int]]]]:
+    # Signal names and the (time, value) changes of each signal, from a VCD
+    # file written by filter_unit.vhdl
+    names: typing.List[str] = []
+    changes: typing.Dict[str, typing.List[typing.Tuple[int, int]]] = {}
+    ids: typing.Dict[str, str] = {}
+    now = 0
+    with open(wave_file, "rt", encoding="utf-8") as fd:
+        for line in fd:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            if fields[0] == "$var":
+                (_, _, _, ident, name, _) = fields
+                ids[ident] = name
+                names.append(name)
+                changes[name] = []
+            elif fields[0].startswith("#"):
+                now = int(fields[0][1:])
+            elif fields[0].startswith("b"):
+                changes[ids[fields[1]]].append((now, int(fields[0][1:], 2)))
+            elif fields[0][0] in "01":
+                changes[ids[fields[0][1:]]].append((now, int(fields[0][0])))
+    return (names, changes)
+
+class CycleModelCheck:
+    # Runs each test with GHDL and with the clock-level model (cycle_model.py),
+    # which must produce the same outputs and the same events in the same
+    # cycles. The test bench counts cycles from a different point, so times
+    # are compared relative to the first event.
+    def __init__(self) -> None:
+        self.ghdl_time = 0.0
+        self.model_time = 0.0
+        self.cycles = 0
+
+    def run_ops(self, ops: OperationList, in_values: typing.List[int],
+                lattice_rom: bool = False) -> typing.List[int]:
+        ghdl_events = CycleEvents()
+        start_time = time.monotonic()
+        out_values = ghdl_run_ops(ops, in_values, events=ghdl_events, lattice_rom=lattice_rom)
+        self.ghdl_time += time.monotonic() - start_time
+
+        start_time = time.monotonic()
+        executor = CycleExecutor(ops)
+        model_out_values = executor.run(in_values)
+        self.model_time += time.monotonic() - start_time
+        self.cycles += executor.events.total_cycles
+
+        assert model_out_values == out_values
+        expect = relative_timeline(executor.events)
+        actual = relative_timeline(ghdl_events)
+        # The test bench may stop before the last event of the program
+        assert actual == expect[:len(actual)], first_difference(expect, actual)
+        assert len(actual) >= (len(expect) - 2)
+        return out_values
+
+    def print_speed(self) -> None:
+        print(f"Clock-level model: {self.cycles} cycles, {self.model_time:1.1f} s; "
+              f"GHDL {self.ghdl_time:1.1f} s; "
+              f"{self.ghdl_time / max(self.model_time, 1e-9):1.0f} times faster")
+
+def relative_timeline(events: CycleEvents) -> typing.List[typing.Tuple[int, str, int]]:
+    timeline = events.timeline()
+    first_cycle = timeline[0][0] if len(timeline) else 0
+    return [(cycle - first_cycle, name, value) for (cycle, name, value) in timeline]
+
+def first_difference(expect: typing.Sequence[typing.Any], actual: typing.Sequence[typing.Any]) -> str:
+    for (i, (e, a)) in enumerate(zip(expect, actual)):
+        if e != a:
+            return f"event {i}: model {e}, GHDL {a}"
+    return f"model has {len(expect)} events, GHDL has {len(actual)}"
+
+def sample_timelines(events: CycleEvents) -> typing.List[typing.List[typing.Tuple[int, str, int]]]:
+    # The events of each sample, up to and including its restart, with
+    # cycles relative to the previous restart (or the first event)
+    timeline = events.timeline()
+    samples: typing.List[typing.List[typing.Tuple[int, str, int]]] = [[]]
+    start = timeline[0][0] if len(timeline) else 0
+    for (cycle, name, value) in timeline:
+        samples[-1].append((cycle - start, name, value))
+        if name == "restart":
+            samples.append([])
+            start = cycle
+    return [sample for sample in samples if len(sample) != 0]
+
+def timeline_main(num_samples: int) -> None:
+    # Compare the timeline of each sample in GHDL with the clock-level model,
+    # and measure the speed of each. Exits with an error if any differ.
+    in_values = TestVector(num_samples).in_values
+    ok = True
+    for (name, generate) in [("biquad", demodulator), ("goertzel", goertzel_demodulator)]:
+        ops = FPGAOperationList()
+        generate(ops)
+        ghdl_events = CycleEvents()
+        start_time = time.monotonic()
+        ghdl_out_values = ghdl_run_ops(ops, in_values, events=ghdl_events)
+        ghdl_time = time.monotonic() - start_time
+
+        executor = CycleExecutor(ops)
+        start_time = time.monotonic()
+        model_out_values = executor.run(in_values)
+        model_time = time.monotonic() - start_time
+
+        ghdl_samples = sample_timelines(ghdl_events)
+        model_samples = sample_timelines(executor.events)
+        # The test bench may stop before the end of the last sample
+        compared = min(len(ghdl_samples) - 1, len(model_samples))
+        different = [i for i in range(compared) if ghdl_samples[i] != model_samples[i]]
+        print(f"{name}: {compared} samples, {len(different)} with different timelines, "
+              f"outputs {'match' if ghdl_out_values == model_out_values else 'differ'}")
+        if len(different) != 0:
+            i = different[0]
+            print(f"  sample {i}: {first_difference(model_samples[i], ghdl_samples[i])}")
+        ok = ok and (len(different) == 0) and (ghdl_out_values == model_out_values)
+        cycles = executor.events.total_cycles
+        print(f"  {cycles} cycles: model {cycles / max(model_time, 1e-9):1.0f} cycles/s, "
+              f"GHDL {cycles / max(ghdl_time, 1e-9):1.0f} cycles/s (including analysis), "
+              f"model {ghdl_time / max(model_time, 1e-9):1.1f} times faster")
+    if not ok:
+        sys.exit(1)
+
+def test_large_rom(num_samples: int, check: CycleModelCheck) -> None:
+    print(f"Test multi-block microcode ROM", flush=True)
+    # Programs of two and three SB_RAM512x8 blocks, executed from the
+    # Lattice microcode store, with the same outputs as ROMExecutor running
+    # the same memory image, and the same fetch timing as the clock-level
+    # model. Every sample fetches across each block boundary.
+    test_vector = TestVector(num_samples)
+    for (num_channels, num_blocks) in [(3, 2), (4, 3)]:
+        ops = FPGAOperationList()
+        multi_channel_demodulator(ops, make_channels(ops.settings, num_channels))
+        memory = ops.get_memory_image()
+        assert (ROM_BLOCK_SIZE * (num_blocks - 1)) < len(memory) <= (ROM_BLOCK_SIZE * num_blocks)
+        expect = ROMExecutor(memory, ops.code_table, ops.settings).run(test_vector.in_values)
+        assert expect == FuncExecutor(ops).run(test_vector.in_values), num_channels
+        actual = check.run_ops(ops, test_vector.in_values, lattice_rom=True)
+        assert actual == expect, num_channels
+
+def test_input_fifo(num_samples: int) -> None:
+    print(f"Test input FIFO", flush=True)
+    # Pairs of samples a few cycles apart, as the left and right samples from
+    # S/PDIF can be. The FIFO holds the second of each pair until the program
+    # is ready for it; without a FIFO it would be lost. The test bench stops
+    # at a lost sample, so only depths which lose nothing are run.
+    in_values = TestVector(num_samples).in_values
+    for depth in [0, 1, 2]:
+        ops = FPGAOperationList(DEFAULT_SETTINGS.replace("fifo", input_fifo_depth=depth))
+        demodulator(ops)
+        pair_period = (ops.cycle_count() + 10) * 2
+        sample_cycles = [100 + ((i // 2) * pair_period) + ((i % 2) * 3) for i in range(num_samples)]
+        model = CycleExecutor(ops)
+        expect = model.run(in_values, sample_cycles)
+        if depth == 0:
+            assert len(model.events.dropped) == (num_samples // 2)
+            continue
+        assert model.events.dropped == []
+        assert expect == FuncExecutor(ops).run(in_values)
+        ghdl_events = CycleEvents()
+        actual = ghdl_run_ops(ops, in_values, events=ghdl_events, sample_cycles=sample_cycles)
+        assert actual == expect, depth
+        # Each sample is taken from the FIFO as soon as the program is ready,
+        # so the restarts are at the same times (relative to the first)
+        model_restarts = [cycle - model.events.restarts[0] for cycle in model.events.restarts]
+        ghdl_restarts = [cycle - ghdl_events.restarts[0] for cycle in ghdl_events.restarts]
+        assert ghdl_restarts == model_restarts[:len(ghdl_restarts)], depth
+        assert len(ghdl_restarts) >= (len(model_restarts) - 1)
+
+def test_waveform(num_samples: int) -> None:
+    print(f"Test waveform capture", flush=True)
+    # Only the selected signals are written, and only for the selected samples
+    test_vector = TestVector(num_samples)
+    ops = FPGAOperationList()
+    demodulator(ops)
+    wave_file = "generated/ghdl_test_waveform.vcd"
+    (first_sample, last_sample) = (3, 5)
+    signals = ["SAMPLE", "LOAD_I0_FROM_INPUT", "I0", "uc_code_addr"]
+    expect = FuncExecutor(ops).run(test_vector.in_values)
+    actual = ghdl_run_ops(ops, test_vector.in_values,
+                          waveform=(wave_file, first_sample, last_sample, signals))
+    assert actual == expect
+    (names, changes) = read_vcd(wave_file)
+    assert names == signals
+    assert [value for (_, value) in changes["SAMPLE"]] == list(range(first_sample, last_sample))
+    # Samples are numbered from 1, and each is in I0 after it is loaded
+    mask = (1 << ops.settings.all_bits) - 1
+    i0_values = set(value for (_, value) in changes["I0"])
+    for sample in range(first_sample, last_sample):
+        assert (test_vector.in_values[sample - 1] & mask) in i0_values
+    # One cycle per sample period executes LOAD_I0_FROM_INPUT, plus the wait
+    period = changes["SAMPLE"][1][0] - changes["SAMPLE"][0][0]
+    assert period == ((ops.cycle_count() + 1) * CLOCK_PERIOD_NS)
+
+def waveform_main(argv: typing.List[str]) -> None:
+    # ghdl_test.py --waveform FIRST LAST [SIGNAL ...]: write a VCD file of the
+    # demodulator for samples FIRST .. LAST - 1
+    if len(argv) < 2:
+        print("Usage: ghdl_test.py --waveform FIRST LAST [SIGNAL ...]")
+        sys.exit(1)
+    (first_sample, last_sample) = (int(argv[0]), int(argv[1]))
+    wave_file = f"generated/{FILTER_UNIT_PREFIX}_waveform.vcd"
+    ops = FPGAOperationList()
+    demodulator(ops)
+    ghdl_run_ops(ops, TestVector(last_sample + 1).in_values,
+                 waveform=(wave_file, first_sample, last_sample, argv[2:]))
+    (names, changes) = read_vcd(wave_file)
+    print(f"Wrote {wave_file}: {Path(wave_file).stat().st_size} bytes, {len(names)} signals, "
+          f"{sum(len(values) for values in changes.values())} value changes, "
+          f"{last_sample - first_sample} samples of {ops.cycle_count() + 1} cycles")
+
 def main() -> None:
-    func_test.test_all(GHDL_TEST_SCALE, ghdl_run_ops, FPGAOperationList)
+    if "--timeline" in sys.argv:
+        timeline_main(GHDL_TEST_SCALE * 200)
+        return
+    if "--waveform" in sys.argv:
+        waveform_main(sys.argv[sys.argv.index("--waveform") + 1:])
+        return
+    check = CycleModelCheck()
+    # The dual datapath is not in filter_unit.vhdl (see FPGAOperationList)
+    exclude = ["dual_datapath"]
+    if "--case" in sys.argv:
+        # ghdl_test.py --case NAME ...: only the named cases of func_test.test_all
+        func_test.test_all(GHDL_TEST_SCALE, check.run_ops, FPGAOperationList,
+                           sys.argv[sys.argv.index("--case") + 1:], exclude)
+        check.print_speed()
+        return
+    func_test.test_all(GHDL_TEST_SCALE, check.run_ops, FPGAOperationList, exclude=exclude)
+    check.print_speed()
+    test_large_rom(GHDL_TEST_SCALE * 20, check)
+    test_input_fifo(GHDL_TEST_SCALE * 20)
+    test_waveform(GHDL_TEST_SCALE * 10)
 
 if __name__ == "__main__":
     try:
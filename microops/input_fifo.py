@@ -0,0 +1,177 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS,
+    )
+from func_hardware import (
+        OperationList,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+from filter_implementation import (
+        multi_channel_demodulator, Detector,
+    )
+from cycle_report import (
+        make_channels,
+    )
+from test_vector import (
+        TestVector,
+    )
+import spdif_model
+import argparse, collections, random, typing
+
+# Timing model of the input of filter_unit, with the optional FIFO in
+# input_fifo.vhdl. The program has no branches, so each sample keeps the
+# filter unit busy for ops.cycle_count() clock cycles from the cycle in which
+# LOAD_I0_FROM_INPUT takes it. Without a FIFO, a strobe is only accepted if
+# the filter unit is already waiting in LOAD_I0_FROM_INPUT. With a FIFO, a
+# sample can be taken in the cycle after it is written, and a strobe is only
+# lost if the FIFO is full.
+#
+# Strobe times come from the S/PDIF receive chain (spdif_model), where the
+# left and right strobes of each frame are about half a frame apart. At 48 kHz
+# and 96 MHz, they alternate about 984 and 1016 cycles apart, so a program
+# which fits the mean interval may still be too long for the shorter one.
+#
+# The default program was chosen for this demonstration, to sit near the
+# budget of 1000 cycles per sample, between the two intervals: four Goertzel
+# channels on the dual datapath with 2 bit digits, 987 cycles. Without a
+# FIFO, nearly half of the samples are lost; with a FIFO of any depth, none
+# are. None of the demodulators which filter_unit.vhdl can run (one lane,
+# 1 to 8 channels, either detector, 1, 2 or 4 bit digits, with or without
+# subroutines) takes from 984 to 1016 cycles, so none of them shows this.
+# The FIFO RTL is tested instead by ghdl_test.test_input_fifo, with pairs
+# of samples a few cycles apart.
+
+DEMO_SETTINGS = DEFAULT_SETTINGS.replace("fifo", lanes=2, digit_bits=2)
+DEMO_DETECTOR = Detector.GOERTZEL
+DEMO_CHANNELS = 4
+
+class FIFOResult:
+    def __init__(self, depth: int, cycles_per_sample: int) -> None:
+        self.depth = depth
+        self.cycles_per_sample = cycles_per_sample
+        self.accepted: typing.List[int] = []    # index of each sample taken
+        self.dropped: typing.List[int] = []     # index of each sample lost
+        self.latency: typing.List[int] = []     # strobe to end of program, per accepted sample
+        self.occupancy: typing.List[int] = []   # FIFO entries after each strobe
+        self.busy_cycles = 0
+        self.total_cycles = 0
+
+    @property
+    def max_occupancy(self) -> int:
+        return max(self.occupancy, default=0)
+
+    @property
+    def max_latency(self) -> int:
+        return max(self.latency, default=0)
+
+    @property
+    def utilisation(self) -> float:
+        return self.busy_cycles / max(self.total_cycles, 1)
+
+def simulate_fifo(strobe_times: typing.Sequence[int], cycles_per_sample: int,
+                  depth: int) -> FIFOResult:
+    result = FIFOResult(depth, cycles_per_sample)
+    waiting: typing.Deque[int] = collections.deque()   # start time of each queued sample
+    free_time = 0       # when the filter unit next reaches LOAD_I0_FROM_INPUT
+    for (index, time) in enumerate(strobe_times):
+        # Samples leave the FIFO when the filter unit takes them
+        while len(waiting) != 0 and waiting[0] <= time:
+            waiting.popleft()
+
+        if depth == 0:
+            accept = free_time <= time
+            start = time
+        else:
+            accept = len(waiting) < depth
+            start = max(free_time, time + 1)
+            if accept:
+                waiting.append(start)
+
+        if accept:
+            free_time = start + cycles_per_sample
+            result.accepted.append(index)
+            result.latency.append(free_time - time)
+            result.busy_cycles += cycles_per_sample
+        else:
+            result.dropped.append(index)
+        result.occupancy.append(len(waiting))
+
+    result.total_cycles = max(free_time, strobe_times[-1] if len(strobe_times) else 0)
+    return result
+
+def run_with_fifo(executor: FuncExecutor, in_values: typing.Sequence[int],
+                  strobe_times: typing.Sequence[int],
+                  depth: typing.Optional[int] = None) -> typing.Tuple[typing.List[int], FIFOResult]:
+    # Functional simulation with the input FIFO: the lost samples never reach
+    # the program. The depth defaults to the setting for the program.
+    ops = executor.ops
+    if depth is None:
+        depth = ops.settings.input_fifo_depth
+    result = simulate_fifo(strobe_times, ops.cycle_count(), depth)
+    return (executor.run([in_values[index] for index in result.accepted]), result)
+
+def get_strobe_times(num_samples: int, sample_rate: float, clock_frequency: float,
+                     jitter: float, stereo: bool) -> typing.List[int]:
+    # Time of each strobe from channel_decoder in clock cycles. Left samples
+    # only, as in receiver_main.vhdl, or both channels.
+    test_vector = TestVector(num_samples)
+    durations = spdif_model.render(
+            spdif_model.encode([(value, value) for value in test_vector.in_values]),
+            spdif_model.single_time(sample_rate, clock_frequency), jitter, random.Random(1))
+    return [time for (time, strobe, data) in spdif_model.Receiver().decode_timed(durations)
+            if stereo or strobe == spdif_model.Strobe.LEFT]
+
+def make_ops(settings: Settings, detector: Detector, num_channels: int) -> OperationList:
+    ops = OperationList(settings)
+    multi_channel_demodulator(ops, make_channels(settings, num_channels), detector)
+    return ops
+
+def report(strobe_times: typing.Sequence[int], cycles_per_sample: int,
+           depths: typing.Sequence[int], clock_frequency: float) -> None:
+    period = (strobe_times[-1] - strobe_times[0]) / max(len(strobe_times) - 1, 1)
+    print(f"{len(strobe_times)} strobes, mean interval {period:1.1f} cycles, "
+          f"program {cycles_per_sample} cycles, load {100.0 * cycles_per_sample / period:1.1f}%")
+    print("depth dropped  max occupancy  mean occupancy  max latency (cycles, us)  utilisation")
+    for depth in depths:
+        result = simulate_fifo(strobe_times, cycles_per_sample, depth)
+        mean_occupancy = sum(result.occupancy) / max(len(result.occupancy), 1)
+        print(f"{depth:5d} {len(result.dropped):7d} {result.max_occupancy:14d} "
+              f"{mean_occupancy:15.2f} {result.max_latency:13d} "
+              f"{1e6 * result.max_latency / clock_frequency:10.2f} "
+              f"{100.0 * result.utilisation:11.1f}%")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Input FIFO occupancy, latency and lost samples")
+    parser.add_argument("--clock", type=float, default=spdif_model.CLOCK_FREQUENCY_HZ,
+                        help="clock frequency (Hz)")
+    parser.add_argument("--sample-rate", type=float, default=float(DEFAULT_SETTINGS.sample_rate),
+                        help="S/PDIF sample rate (Hz)")
+    parser.add_argument("--detector", choices=[d.name.lower() for d in Detector],
+                        default=DEMO_DETECTOR.name.lower())
+    parser.add_argument("--channels", type=int, default=DEMO_CHANNELS, help="number of FSK channels")
+    parser.add_argument("--lanes", type=int, default=DEMO_SETTINGS.lanes)
+    parser.add_argument("--digit-bits", type=int, default=DEMO_SETTINGS.digit_bits)
+    parser.add_argument("--cycles", type=int, default=None,
+                        help="program length in cycles per sample (instead of generating it)")
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--samples", type=int, default=2000, help="number of S/PDIF frames")
+    parser.add_argument("--jitter", type=float, default=2.0, help="transition jitter (cycles)")
+    parser.add_argument("--left-only", action="store_true",
+                        help="strobe on left samples only (default: left and right)")
+    args = parser.parse_args()
+
+    cycles_per_sample = args.cycles
+    if cycles_per_sample is None:
+        settings = DEMO_SETTINGS.replace("fifo", lanes=args.lanes, digit_bits=args.digit_bits)
+        ops = make_ops(settings, Detector[args.detector.upper()], args.channels)
+        cycles_per_sample = ops.cycle_count()
+
+    print(f"Clock {args.clock / 1e6:1.1f} MHz, sample rate {args.sample_rate:1.0f} Hz, "
+          f"{'left' if args.left_only else 'left and right'} strobes")
+    report(get_strobe_times(args.samples, args.sample_rate, args.clock,
+                            args.jitter, not args.left_only),
+           cycles_per_sample, args.depths, args.clock)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, PRESETS, get_preset,
+    )
+from func_hardware import (
+        OperationList,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+from signal_model import (
+        BITS_PER_BYTE, generate_bits, generate_signal, get_repeated_bits,
+        pcm_to_fixed, reference_demodulator, SerialDecoder, count_bit_errors,
+    )
+from demodulator_benchmark import (
+        GENERATORS,
+    )
+from concurrent.futures import ProcessPoolExecutor
+import argparse, bisect, itertools, typing
+
+# Detection latency: how long after a bit transition in the FSK signal the
+# demodulator output (the sign of Y, from SEND_Y_TO_OUTPUT) changes to the
+# new bit, and how long after the start of each stop bit the serial decoder
+# produces the byte. Transition times are known from the signal generator.
+#
+# The comparator latency of a transition is measured to the first sample
+# from which the output is the new bit until the next transition. If there
+# is no such sample, the transition is missed. A transition is a glitch if
+# the output reaches the new bit earlier, but changes back. The framing
+# latency of a byte is measured from the start of its stop bit to the
+# first byte decoded within one frame time, if any, regardless of value.
+
+PERCENTILES = [50, 90, 99, 100]
+MODELS = ["reference"] + list(GENERATORS)
+
+class LatencyResult:
+    def __init__(self, settings: Settings, model: str) -> None:
+        self.settings = settings
+        self.model = model
+        self.transitions = 0
+        self.missed = 0
+        self.glitches = 0
+        self.comparator: typing.List[int] = []      # latency in samples
+        self.frames = 0
+        self.framing: typing.List[int] = []         # latency in samples
+        self.bit_errors = 0
+
+def get_transitions(bits: typing.Sequence[int]) -> typing.List[int]:
+    # Samples at which the transmitted bit changes
+    return [i for i in range(1, len(bits)) if bits[i] != bits[i - 1]]
+
+def get_stop_bit_samples(data: bytes, settings: Settings, num_samples: int) -> typing.List[int]:
+    # Sample at the start of the stop bit of each byte which is transmitted
+    # completely within num_samples (including repeats, but not idle bytes)
+    samples_per_bit = int(settings.sample_rate / settings.baud_rate)
+    leadin_samples = samples_per_bit * (BITS_PER_BYTE * 2)
+    frame_bits = BITS_PER_BYTE + 2
+    repeat_samples = len(get_repeated_bits(data)) * samples_per_bit
+    stop_samples: typing.List[int] = []
+    for repeat in itertools.count():
+        for i in range(len(data)):
+            start = leadin_samples + (repeat * repeat_samples) + (((i * frame_bits) + frame_bits - 1)
+                                                                   * samples_per_bit)
+            if (start + samples_per_bit) > num_samples:
+                return stop_samples
+            stop_samples.append(start)
+    return stop_samples
+
+def comparator_latency(bits: typing.Sequence[int], out_bits: typing.Sequence[int],
+                       result: LatencyResult) -> None:
+    settings = result.settings
+    samples_per_bit = int(settings.sample_rate / settings.baud_rate)
+    transitions = get_transitions(bits)
+    for (i, start) in enumerate(transitions):
+        end = transitions[i + 1] if (i + 1) < len(transitions) else len(bits)
+        if (end - start) < samples_per_bit:
+            # Cut short by the end of the signal
+            continue
+        new_bit = bits[start]
+        settled = end
+        while (settled > start) and (out_bits[settled - 1] == new_bit):
+            settled -= 1
+        result.transitions += 1
+        if settled == end:
+            result.missed += 1
+            continue
+        result.comparator.append(settled - start)
+        if new_bit in out_bits[start:settled]:
+            result.glitches += 1
+
+def get_out_bits(settings: Settings, model: str, pcm: typing.List[int]) -> typing.List[int]:
+    if model == "reference":
+        return reference_demodulator(pcm, settings)
+    ops = OperationList(settings)
+    GENERATORS[model](ops)
+    out_values = FuncExecutor(ops, debug_outputs=False).run(pcm_to_fixed(pcm, settings))
+    return [(y >> (settings.all_bits - 1)) & 1 for y in out_values]
+
+def measure(settings: Settings, model: str, data: bytes) -> LatencyResult:
+    result = LatencyResult(settings, model)
+    bits = generate_bits(data, settings)
+    pcm = generate_signal(data, settings)
+    out_bits = get_out_bits(settings, model, pcm)
+    comparator_latency(bits, out_bits[:len(bits)], result)
+
+    # Each transmitted byte is matched with the first byte decoded during
+    # the following frame time, if any
+    decoder = SerialDecoder(settings)
+    received = decoder.decode(out_bits)
+    frame_samples = int(settings.sample_rate / settings.baud_rate) * (BITS_PER_BYTE + 2)
+    stop_samples = get_stop_bit_samples(data, settings, len(bits))
+    result.frames = len(stop_samples)
+    for start in stop_samples:
+        i = bisect.bisect_left(decoder.byte_samples, start)
+        if (i < len(decoder.byte_samples)) and (decoder.byte_samples[i] < (start + frame_samples)):
+            result.framing.append(decoder.byte_samples[i] - start)
+    result.bit_errors = count_bit_errors(data, received[:len(data)])
+    return result
+
+def percentile(values: typing.Sequence[int], p: float) -> typing.Optional[int]:
+    # Nearest-rank percentile, or None if there are no values
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-(len(ordered) * p) // 100))
+    return ordered[int(rank) - 1]
+
+def format_percentiles(values: typing.Sequence[int], settings: Settings) -> str:
+    text = []
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        if value is None:
+            text.append(f"{'-':>6s}")
+        else:
+            text.append(f"{(value * 1000.0) / settings.sample_rate:6.2f}")
+    return " ".join(text)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure detection latency")
+    parser.add_argument("presets", nargs="*", default=[DEFAULT_SETTINGS.name],
+                        help=f"any of: {', '.join(PRESETS)}")
+    parser.add_argument("--model", choices=MODELS, default="biquad",
+                        help="reference (floating point) or a demodulator program")
+    parser.add_argument("--filter-width", type=float, nargs="+", default=[],
+                        help="FILTER_WIDTH values to try with each preset")
+    parser.add_argument("--rc-decay", type=float, nargs="+", default=[],
+                        help="RC_DECAY_PER_BIT values to try with each preset")
+    parser.add_argument("--data", default="test_data",
+                        help="file containing bytes to transmit")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.data, "rb") as fd:
+        data = fd.read()
+
+    all_settings: typing.List[Settings] = []
+    for preset in args.presets:
+        base = get_preset(preset)
+        for filter_width in (args.filter_width or [base.filter_width]):
+            for rc_decay in (args.rc_decay or [base.rc_decay_per_bit]):
+                all_settings.append(base.replace(f"{base.name}_w{filter_width:g}_d{rc_decay:g}",
+                                                 filter_width=filter_width,
+                                                 rc_decay_per_bit=rc_decay))
+
+    with ProcessPoolExecutor(args.processes) as pool:
+        results = list(pool.map(measure, all_settings,
+                                [args.model] * len(all_settings),
+                                [data] * len(all_settings)))
+
+    percentiles = " ".join(f"{'p' + str(p) if p != 100 else 'max':>6s}" for p in PERCENTILES)
+    print(f"Latency in ms, {args.model} model, {len(data)} bytes")
+    print(f"{'':30s} {'comparator':>59s} {'framing':>46s}")
+    print(f"{'configuration':30s} transitions missed glitches {percentiles}"
+          f" frames missed {percentiles} bit errors")
+    for result in results:
+        print(f"{result.settings.name:30s} {result.transitions:11d} {result.missed:6d} "
+              f"{result.glitches:8d} {format_percentiles(result.comparator, result.settings)} "
+              f"{result.frames:6d} {result.frames - len(result.framing):6d} "
+              f"{format_percentiles(result.framing, result.settings)} {result.bit_errors:10d}")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,28 @@
-import settings
+from settings import (
+        Settings, DEFAULT_SETTINGS, get_preset,
+    )
+import sys, typing
 
 
+def write_settings_h(fd: typing.IO, settings: Settings) -> None:
+    fd.write(f"""
+#define UPPER_FREQUENCY     {settings.upper_frequency:1.1f}
+#define LOWER_FREQUENCY     {settings.lower_frequency:1.1f}
+#define BAUD_RATE           {settings.baud_rate:1.1f}
+#define FRACTIONAL_BITS     {settings.fractional_bits:d}
+#define NON_FRACTIONAL_BITS {settings.non_fractional_bits:d}
+#define RC_DECAY_PER_BIT    {settings.rc_decay_per_bit:1.5f}
+#define FILTER_WIDTH        {settings.filter_width:1.1f}
+#define SAMPLE_RATE         {settings.sample_rate:d}
+#define DATA_BITS           {settings.data_bits:d}
+""")
+
 def main() -> None:
+    settings = DEFAULT_SETTINGS
+    if len(sys.argv) > 1:
+        settings = get_preset(sys.argv[1])
     with open("generated/settings.h", "wt", encoding="utf-8") as fd:
-        fd.write(f"""
-#define UPPER_FREQUENCY     {settings.UPPER_FREQUENCY:1.1f}
-#define LOWER_FREQUENCY     {settings.LOWER_FREQUENCY:1.1f}
-#define BAUD_RATE           {settings.BAUD_RATE:1.1f}
-#define FRACTIONAL_BITS     {settings.FRACTIONAL_BITS:d}
-#define NON_FRACTIONAL_BITS {settings.NON_FRACTIONAL_BITS:d}
-#define RC_DECAY_PER_BIT    {settings.RC_DECAY_PER_BIT:1.5f}
-#define FILTER_WIDTH        {settings.FILTER_WIDTH:1.1f}
-#define SAMPLE_RATE         {settings.SAMPLE_RATE:d}
-#define DATA_BITS           {settings.DATA_BITS:d}
-""")
+        write_settings_h(fd, settings)
 
 if __name__ == "__main__":
     main()
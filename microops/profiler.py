@@ -0,0 +1,182 @@
+from func_hardware import (
+        OperationList, Operation, ControlOperation, CommentOperation, ControlLine,
+        CallOperation, ReturnOperation, RepeatOperation,
+    )
+import json, typing
+
+# Execution profile for programs run by FuncExecutor. Each clock cycle
+# spent at an address is counted (so an operation which repeats for all
+# bits is counted once per bit). Runs of the same program, i.e. the same
+# ROM image, are added together. As programs with the same image may have
+# different comments, the counts are indexed by ROM address, and the
+# operations of the first program with the image are used for reports.
+
+class ProgramProfile:
+    def __init__(self, ops: OperationList, name: str) -> None:
+        self.ops = ops
+        self.name = name
+        # Indexed by ROM address, plus one more entry which counts the
+        # comments passed by the executor (see slots)
+        self.size = len(ops.get_memory_image())
+        self.iterations = [0 for address in range(self.size + 1)]
+        self.restarts = 0
+
+    def slots(self, ops: OperationList) -> typing.List[int]:
+        # Index in iterations for each operation of ops
+        return [op.address if op.encode() is not None else self.size for op in ops]
+
+    def encoded(self) -> typing.Iterator[Operation]:
+        for op in self.ops:
+            if op.encode() is not None:
+                yield op
+
+    def executions(self, op: Operation) -> int:
+        iterations = self.iterations[op.address]
+        if isinstance(op, ControlOperation) and (
+                ControlLine.REPEAT_FOR_ALL_BITS in op.controls):
+            return iterations // self.ops.settings.all_digits
+        if isinstance(op, RepeatOperation):
+            return iterations // op.count
+        return iterations
+
+    def cycles(self, op: Operation) -> int:
+        cycles = self.iterations[op.address]
+        if isinstance(op, ControlOperation) and (ControlLine.RESTART in op.controls):
+            # One more cycle is needed to fetch the first operation again
+            cycles += self.restarts
+        elif isinstance(op, (CallOperation, ReturnOperation)):
+            # Likewise after a jump
+            cycles += self.iterations[op.address]
+        return cycles
+
+    def total_cycles(self) -> int:
+        return sum(self.cycles(op) for op in self.encoded())
+
+    def never_executed(self) -> typing.List[int]:
+        return [op.address for op in self.encoded() if self.iterations[op.address] == 0]
+
+    def sections(self) -> typing.List[typing.Tuple[str, int, int]]:
+        # Total (cycles, executions) for the operations following each comment,
+        # in order of first appearance
+        totals: typing.Dict[str, typing.List[int]] = {}
+        section = "(start)"
+        for op in self.ops:
+            if isinstance(op, CommentOperation):
+                section = op.comment
+            elif op.encode() is not None:
+                total = totals.setdefault(section, [0, 0])
+                total[0] += self.cycles(op)
+                total[1] += self.executions(op)
+        return [(section, cycles, executions)
+                for (section, (cycles, executions)) in totals.items()]
+
+    def dump_code(self, fd: typing.IO) -> None:
+        # Disassembly annotated with executions, cycles and share of all cycles
+        total = max(self.total_cycles(), 1)
+        fd.write(f"Profile: {self.name}\n\n")
+        fd.write("   executions     cycles  share  addr code\n")
+        for op in self.ops:
+            code = op.encode()
+            if code is None:
+                fd.write(f'{"":36s}# {op}\n')
+                continue
+            cycles = self.cycles(op)
+            marker = "" if self.iterations[op.address] else "  <-- never executed"
+            fd.write(f"{self.executions(op):13d} {cycles:10d} {(cycles * 100.0) / total:5.1f}% "
+                     f"{op.address:4d} {code:4d} {op}{marker}\n")
+        fd.write("\n\nSections\n\n")
+        fd.write("     cycles  share  section\n")
+        for (section, cycles, executions) in self.sections():
+            fd.write(f"{cycles:11d} {(cycles * 100.0) / total:5.1f}%  {section}\n")
+        fd.write("\n")
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "name": self.name,
+            "total_cycles": self.total_cycles(),
+            "restarts": self.restarts,
+            "addresses": [
+                {
+                    "address": op.address,
+                    "code": op.encode(),
+                    "text": str(op),
+                    "executions": self.executions(op),
+                    "cycles": self.cycles(op),
+                }
+                for op in self.encoded()
+            ],
+            "sections": [
+                {"comment": section, "cycles": cycles, "executions": executions}
+                for (section, cycles, executions) in self.sections()
+            ],
+            "never_executed": self.never_executed(),
+        }
+
+class Profiler:
+    def __init__(self) -> None:
+        self.programs: typing.Dict[bytes, ProgramProfile] = {}
+
+    def attach(self, ops: OperationList) -> ProgramProfile:
+        image = ops.get_memory_image()
+        if image not in self.programs:
+            name = f"program {len(self.programs)}"
+            for op in ops:
+                if isinstance(op, CommentOperation):
+                    name = f"{name}: {op.comment}"
+                    break
+            self.programs[image] = ProgramProfile(ops, name)
+        return self.programs[image]
+
+    def dump_code(self, fd: typing.IO) -> None:
+        for profile in self.programs.values():
+            profile.dump_code(fd)
+
+    def dump_coverage(self, fd: typing.IO) -> None:
+        total = never = 0
+        for profile in self.programs.values():
+            addresses = profile.never_executed()
+            total += len(profile.ops.get_memory_image())
+            never += len(addresses)
+            if len(addresses) != 0:
+                fd.write(f"{profile.name}: never executed: "
+                         f"{', '.join(str(address) for address in addresses)}\n")
+        fd.write(f"{len(self.programs)} programs, {never} of {total} addresses never executed\n")
+
+    def dump_json(self, fd: typing.IO) -> None:
+        json.dump({"programs": [profile.to_json() for profile in self.programs.values()]},
+                  fd, indent=1)
+
+    def generate(self, path: str) -> None:
+        # Writes path.txt (annotated code and coverage) and path.json
+        with open(f"{path}.txt", "wt") as fd:
+            self.dump_code(fd)
+            self.dump_coverage(fd)
+        with open(f"{path}.json", "wt") as fd:
+            self.dump_json(fd)
+
+def main() -> None:
+    from filter_implementation import demodulator
+    from func_execute import FuncExecutor
+    from test_vector import TestVector
+    import argparse, sys
+
+    parser = argparse.ArgumentParser(description="Profile the demodulator program")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--output", metavar="PATH",
+                        help="write the profile to PATH.txt and PATH.json")
+    args = parser.parse_args()
+
+    ops = OperationList()
+    demodulator(ops)
+    profiler = Profiler()
+    FuncExecutor(ops, profiler=profiler).run(TestVector(args.samples).in_values)
+    if args.output is not None:
+        profiler.generate(args.output)
+    profiler.dump_coverage(sys.stdout)
+    print("Most expensive sections (cycles):")
+    for (section, cycles, executions) in sorted(
+            profiler.attach(ops).sections(), key=lambda s: -s[1])[:10]:
+        print(f"{cycles:10d} {section}")
+
+if __name__ == "__main__":
+    main()
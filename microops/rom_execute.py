@@ -0,0 +1,115 @@
+from func_hardware import (
+        OperationList, CodeTable, ControlLine, MuxCode, Debug,
+        CALL_CODE, RETURN_CODE, REPEAT_CODE, MAX_REPEAT, MUL_CODE, ADD_CODE,
+    )
+from fpga_hardware import (
+        UNUSED_CODE,
+    )
+from func_execute import (
+        FuncExecutor, Kind, ProgramEntry, control_mask, new_reg_file, multiply_mask,
+    )
+from exec_trace import (
+        TraceWriter,
+    )
+from settings import (
+        Settings,
+    )
+import typing
+
+# Executes a memory image rather than a list of Operations, so that the
+# encoding of each operation is tested. Each byte is decoded in the same
+# way as the control line decoder generated by FPGACodeTable, and the
+# register multiplexer, debug unit and microcode unit in filter_unit.vhdl.
+
+MUX_CODES = {code.value: code for code in MuxCode}
+DEBUG_CODES = {debug.value: debug for debug in Debug}
+
+def decode(code: int, code_table: CodeTable) -> ProgramEntry:
+    # Returns the (kind, payload) used by FuncExecutor for a byte
+    if code == UNUSED_CODE:
+        return (Kind.ILLEGAL, None)
+    if not (code & 0x80):
+        controls: typing.Set[ControlLine] = set()
+        for (cl, bit) in code_table.dedicated:
+            if code & bit:
+                controls.add(cl)
+        field = code & ((1 << code_table.field_bits) - 1)
+        for (key, value) in code_table.table.items():
+            if value == field:
+                controls.update(ControlLine[name] for name in key.split(",") if name != "")
+                break
+        else:
+            # "when others" in the decoder
+            controls.add(ControlLine.RESTART)
+        return (Kind.CONTROL, control_mask(controls))
+    if (code & 0xf0) == CALL_CODE:
+        # CALL to an undefined subroutine jumps to the unused code at the
+        # end of the address space
+        number = code & 0xf
+        if number >= len(code_table.entry_points):
+            return (Kind.ILLEGAL, None)
+        return (Kind.CALL, code_table.entry_points[number])
+    if code == RETURN_CODE:
+        return (Kind.RETURN, None)
+    if (code & 0xf0) == MUL_CODE:
+        # The control mask is that of the previous operation (see ROMExecutor)
+        return (Kind.MULTIPLY, code & 0xf)
+    if (code & 0xf0) == ADD_CODE:
+        return (Kind.ADD, code & 0xf)
+    if (REPEAT_CODE < code <= (REPEAT_CODE + MAX_REPEAT)):
+        # As MUL
+        return (Kind.REPEAT, code - REPEAT_CODE)
+    if not (code & 0x40):
+        if code & 0x10:
+            return (Kind.BANK, code & 0xf)
+        # Unused multiplexer inputs are all ONE
+        return (Kind.MUX, MUX_CODES.get(code & 0xf, MuxCode.ONE))
+    # Unused debug codes do nothing
+    return (Kind.DEBUG, DEBUG_CODES.get(code & 0xf, None))
+
+def make_dispatch_table(code_table: CodeTable) -> typing.List[ProgramEntry]:
+    return [decode(code, code_table) for code in range(256)]
+
+class ROMExecutor(FuncExecutor):
+    # Same as FuncExecutor, but the program is a memory image and
+    # the code table which was used to encode it
+    def __init__(self, memory: bytes, code_table: CodeTable, settings: Settings,
+                 debug_outputs: bool = True,
+                 trace: typing.Optional[TraceWriter] = None) -> None:
+        dispatch = make_dispatch_table(code_table)
+        self.memory = memory
+        self.settings = settings
+        self.reg_file = new_reg_file()
+        self.debug_outputs = debug_outputs
+        self.profile = None
+        self.profile_slots: typing.List[int] = []
+        self.trace = trace
+        self.samples_loaded = 0
+        self.program = [dispatch[code] for code in memory]
+        # REPEAT and MUL are illegal unless they follow a control operation,
+        # REPEAT or MUL, from which the control mask is taken. Only the low
+        # digit_bits bits of the digit for each lane are used by ADD and MUL.
+        digit_mask = (1 << (settings.digit_bits * settings.lanes)) - 1
+        last_mask: typing.Optional[int] = None
+        for (address, (kind, payload)) in enumerate(self.program):
+            if kind == Kind.CONTROL:
+                last_mask = payload
+                continue
+            if kind in (Kind.REPEAT, Kind.MULTIPLY) and (last_mask is None):
+                self.program[address] = (Kind.ILLEGAL, None)
+            elif kind == Kind.REPEAT:
+                self.program[address] = (Kind.REPEAT, (last_mask, payload))
+            elif kind == Kind.MULTIPLY:
+                self.program[address] = (Kind.MULTIPLY, (multiply_mask(last_mask), payload & digit_mask))
+            elif kind == Kind.ADD:
+                self.program[address] = (Kind.ADD, payload & digit_mask)
+            if kind not in (Kind.REPEAT, Kind.MULTIPLY):
+                last_mask = None
+        self.locations = [(address, code) for (address, code) in enumerate(memory)]
+        self.init_lanes()
+
+    def print_step(self, op_index: int) -> None:
+        print(f"  op: {op_index} {self.memory[op_index]:02x}")
+
+def run_rom_ops(ops: OperationList, in_values: typing.List[int]) -> typing.List[int]:
+    return ROMExecutor(ops.get_memory_image(), ops.code_table, ops.settings).run(in_values)
@@ -1,3 +1,5 @@
+import typing
+
 UPPER_FREQUENCY = 22000.0
 LOWER_FREQUENCY = 21000.0
 BAUD_RATE = 300.0
@@ -12,3 +14,120 @@ DEBUG = 0
 SERIAL_PORT = "COM3"
 FILTER_UNIT_PREFIX = "filter_unit"
 DATA_BITS = 16
+DIGIT_BITS = 1
+MAX_DIGIT_BITS = 4
+LANES = 1
+MAX_LANES = 2
+INPUT_FIFO_DEPTH = 0
+
+class Settings:
+    # One configuration of the demodulator. Program generation, simulation
+    # and generated files all take their parameters from a Settings object,
+    # so that many configurations can be used within one process.
+    def __init__(self,
+                 name: str,
+                 upper_frequency: float = UPPER_FREQUENCY,
+                 lower_frequency: float = LOWER_FREQUENCY,
+                 baud_rate: float = BAUD_RATE,
+                 fractional_bits: int = FRACTIONAL_BITS,
+                 non_fractional_bits: int = NON_FRACTIONAL_BITS,
+                 rc_decay_per_bit: float = RC_DECAY_PER_BIT,
+                 filter_width: float = FILTER_WIDTH,
+                 sample_rate: int = SAMPLE_RATE,
+                 data_bits: int = DATA_BITS,
+                 digit_bits: int = DIGIT_BITS,
+                 lanes: int = LANES,
+                 input_fifo_depth: int = INPUT_FIFO_DEPTH) -> None:
+        self.name = name
+        self.upper_frequency = upper_frequency
+        self.lower_frequency = lower_frequency
+        self.baud_rate = baud_rate
+        self.fractional_bits = fractional_bits
+        self.non_fractional_bits = non_fractional_bits
+        self.rc_decay_per_bit = rc_decay_per_bit
+        self.filter_width = filter_width
+        self.sample_rate = sample_rate
+        self.data_bits = data_bits
+        self.digit_bits = digit_bits
+        self.lanes = lanes
+        self.input_fifo_depth = input_fifo_depth
+
+        # Derived register sizes
+        self.all_bits = fractional_bits + non_fractional_bits
+        self.a_bits = self.r_bits = (fractional_bits * 2) + non_fractional_bits
+        self.r_fractional_bits = fractional_bits
+
+        # The datapath shifts digit_bits bits in each clock cycle. Products
+        # in R are scaled up so that the fractional bits to be discarded are
+        # a whole number of digits, and A and R are widened to match.
+        if not (1 <= digit_bits <= MAX_DIGIT_BITS) or (self.all_bits % digit_bits) != 0:
+            raise ValueError(f"{digit_bits} bit digits are not possible with "
+                             f"{self.all_bits} bit registers")
+        self.all_digits = self.all_bits // digit_bits
+        if digit_bits > 1:
+            self.r_fractional_bits += (-fractional_bits) % digit_bits
+            self.a_bits = self.r_bits = round_up(
+                    self.r_fractional_bits + fractional_bits + non_fractional_bits, digit_bits)
+
+        # With more than one lane, the datapath registers are duplicated and
+        # each lane filters a different frequency. The digit of MUL and ADD
+        # holds a digit for each lane, so it limits the digit size. Only the
+        # Python models have lanes: filter_unit.vhdl has one (see FPGAOperationList).
+        if not (1 <= lanes <= MAX_LANES):
+            raise ValueError(f"The number of lanes must be in the range 1 .. {MAX_LANES}")
+        if (lanes * digit_bits) > MAX_DIGIT_BITS:
+            raise ValueError(f"{digit_bits} bit digits are not possible with {lanes} lanes")
+
+        # Samples arriving while the program is running are held in a FIFO
+        # of this depth. With no FIFO they are lost (see input_fifo.py).
+        if input_fifo_depth < 0:
+            raise ValueError("The input FIFO depth cannot be negative")
+
+    def replace(self, name: str, **kwargs: typing.Any) -> "Settings":
+        # Copy with some parameters changed
+        params = dict(
+            upper_frequency=self.upper_frequency,
+            lower_frequency=self.lower_frequency,
+            baud_rate=self.baud_rate,
+            fractional_bits=self.fractional_bits,
+            non_fractional_bits=self.non_fractional_bits,
+            rc_decay_per_bit=self.rc_decay_per_bit,
+            filter_width=self.filter_width,
+            sample_rate=self.sample_rate,
+            data_bits=self.data_bits,
+            digit_bits=self.digit_bits,
+            lanes=self.lanes,
+            input_fifo_depth=self.input_fifo_depth)
+        params.update(kwargs)
+        return Settings(name, **params)
+
+    def __str__(self) -> str:
+        return (f"{self.name}: {self.upper_frequency:1.0f}/{self.lower_frequency:1.0f} Hz, "
+                f"{self.baud_rate:1.0f} baud, {self.fractional_bits}+{self.non_fractional_bits} bits, "
+                f"width {self.filter_width:1.0f} Hz, sample rate {self.sample_rate} Hz"
+                + (f", {self.digit_bits} bit digits" if self.digit_bits > 1 else "")
+                + (f", {self.lanes} lanes" if self.lanes > 1 else "")
+                + (f", input FIFO depth {self.input_fifo_depth}" if self.input_fifo_depth else ""))
+
+def round_up(value: int, multiple: int) -> int:
+    return ((value + multiple - 1) // multiple) * multiple
+
+DEFAULT_SETTINGS = Settings("current")
+
+# Note: the V.21 mark frequency is the lower one, so the output bit is
+# inverted with respect to Bell 103
+PRESETS: typing.Dict[str, Settings] = {
+    "current": DEFAULT_SETTINGS,
+    "bell103": DEFAULT_SETTINGS.replace("bell103",
+                upper_frequency=1270.0, lower_frequency=1070.0,
+                filter_width=100.0),
+    "v21": DEFAULT_SETTINGS.replace("v21",
+                upper_frequency=1180.0, lower_frequency=980.0,
+                filter_width=100.0),
+}
+
+def get_preset(name: str) -> Settings:
+    if name not in PRESETS:
+        raise ValueError(f"Unknown settings preset '{name}', "
+                         f"choose from {', '.join(PRESETS)}")
+    return PRESETS[name]
@@ -0,0 +1,184 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS,
+    )
+from fixed_point import (
+        FixedArray,
+    )
+import enum, math, typing
+
+# Python versions of parts of the C model (model/siggen.c and model/sigdec.cpp):
+# an FSK signal generator for serial data, the serial decoder which
+# recovers bytes from demodulator output bits, and a floating-point
+# demodulator for reference.
+
+BITS_PER_BYTE = 8
+BLOCK_SIZE = 1 << 8
+SILENT_TIME = 0.01
+INT16_MAX = 0x7fff
+
+def generate_bits(data: bytes, settings: Settings = DEFAULT_SETTINGS) -> typing.List[int]:
+    # Returns the bit transmitted at each sample of the active part of the
+    # signal (before the silence). Each byte has a start bit (0), 8 data
+    # bits (LSB first) and a stop bit (1). There is a lead-in of 1 bits.
+    # After the data, there is one idle byte, then the data repeats until
+    # the end of the final block.
+    samples_per_bit = int(settings.sample_rate / settings.baud_rate)
+    leadin_samples = samples_per_bit * (BITS_PER_BYTE * 2)
+    num_bits = (len(data) + 1) * (BITS_PER_BYTE + 2)
+    active_time = (leadin_samples + (samples_per_bit * num_bits)) / settings.sample_rate
+    num_active_blocks = int(math.ceil((settings.sample_rate * active_time) / BLOCK_SIZE))
+
+    repeated_bits = get_repeated_bits(data)
+    leadin_bits = leadin_samples // samples_per_bit
+
+    bits: typing.List[int] = []
+    for i in range(num_active_blocks * BLOCK_SIZE):
+        index = i // samples_per_bit
+        if index < leadin_bits:
+            bits.append(1)
+        else:
+            bits.append(repeated_bits[(index - leadin_bits) % len(repeated_bits)])
+    return bits
+
+def get_repeated_bits(data: bytes) -> typing.List[int]:
+    # The bits of each byte, then the idle byte
+    repeated_bits: typing.List[int] = []
+    for byte in data:
+        repeated_bits.append(0)
+        repeated_bits.extend((byte >> i) & 1 for i in range(BITS_PER_BYTE))
+        repeated_bits.append(1)
+    repeated_bits.extend([1] * (BITS_PER_BYTE + 2))
+    return repeated_bits
+
+def generate_signal(data: bytes, settings: Settings = DEFAULT_SETTINGS) -> typing.List[int]:
+    # Returns 16-bit PCM samples (as siggen) for the bits from generate_bits:
+    # each bit is 1 for the upper frequency, 0 for the lower frequency.
+    # The active part of the signal is followed by silence.
+    num_silent_blocks = int(math.ceil((settings.sample_rate * SILENT_TIME) / BLOCK_SIZE))
+    upper_delta = ((math.pi * 2.0) / settings.sample_rate) * settings.upper_frequency
+    lower_delta = ((math.pi * 2.0) / settings.sample_rate) * settings.lower_frequency
+
+    samples: typing.List[int] = []
+    angle = 0.0
+    for bit in generate_bits(data, settings):
+        angle += upper_delta if bit else lower_delta
+        if angle > (math.pi * 2.0):
+            angle -= math.pi * 2.0
+        samples.append(int(math.floor((math.sin(angle) * (INT16_MAX - 1)) + 0.5)))
+
+    samples.extend([0] * (num_silent_blocks * BLOCK_SIZE))
+    return samples
+
+def pcm_to_fixed(samples: typing.Sequence[int], settings: Settings = DEFAULT_SETTINGS) -> typing.List[int]:
+    # Convert 16-bit PCM to filter input values, as sigdec does: full scale is +/- 0.5
+    return FixedArray.from_int16(samples, settings).raw
+
+class SerialState(enum.Enum):
+    WAIT_HIGH = enum.auto()
+    WAIT_LOW = enum.auto()
+    WAIT_NEXT = enum.auto()
+    CHECK_START = enum.auto()
+    STOP = enum.auto()
+    STOP_ERROR = enum.auto()
+    START = enum.auto()
+    START_ERROR = enum.auto()
+    DATA_0 = enum.auto()
+    DATA_1 = enum.auto()
+
+class SerialDecoder:
+    # Recovers bytes from one demodulator output bit per sample, as
+    # serial_decode in sigdec.cpp. decode() may be called repeatedly.
+    # The index of the sample at which each byte was decoded is recorded
+    # in byte_samples.
+    def __init__(self, settings: Settings = DEFAULT_SETTINGS) -> None:
+        self.half_bit = int((settings.sample_rate / settings.baud_rate) / 2)
+        self.sample = 0
+        self.byte_samples: typing.List[int] = []
+        self.state = SerialState.WAIT_HIGH
+        self.sample_countdown = 0
+        self.byte_countdown = 0
+        self.byte = 0
+        self.errors = 0
+
+    def decode(self, bits: typing.Iterable[int]) -> bytes:
+        out = bytearray()
+        for bit in bits:
+            state = self.state
+            if state in (SerialState.STOP_ERROR, SerialState.STOP, SerialState.WAIT_HIGH):
+                # Wait for high (ready for start bit)
+                self.state = SerialState.WAIT_LOW if bit else SerialState.WAIT_HIGH
+            elif state in (SerialState.START_ERROR, SerialState.WAIT_LOW):
+                # Wait for low (start bit)
+                if not bit:
+                    self.state = SerialState.START
+                    self.sample_countdown = self.half_bit
+            elif state in (SerialState.START, SerialState.CHECK_START):
+                # Ensure start is maintained for half a bit
+                if bit:
+                    self.state = SerialState.START_ERROR
+                    self.errors += 1
+                else:
+                    self.sample_countdown -= 1
+                    if self.sample_countdown == 0:
+                        self.sample_countdown = self.half_bit * 2
+                        self.state = SerialState.WAIT_NEXT
+                        self.byte_countdown = BITS_PER_BYTE + 1
+                        self.byte = 0
+                    else:
+                        self.state = SerialState.CHECK_START
+            else:
+                self.sample_countdown -= 1
+                if self.sample_countdown == 0:
+                    self.sample_countdown = self.half_bit * 2
+                    self.byte_countdown -= 1
+                    if self.byte_countdown == 0:
+                        if bit:
+                            out.append(self.byte)
+                            self.byte_samples.append(self.sample)
+                            self.state = SerialState.STOP
+                        else:
+                            self.state = SerialState.STOP_ERROR
+                            self.errors += 1
+                    else:
+                        self.byte = self.byte >> 1
+                        if bit:
+                            self.byte |= 0x80
+                            self.state = SerialState.DATA_1
+                        else:
+                            self.state = SerialState.DATA_0
+                else:
+                    self.state = SerialState.WAIT_NEXT
+            self.sample += 1
+        return bytes(out)
+
+def count_bit_errors(sent: bytes, received: bytes) -> int:
+    # Bytes are compared in order; missing or extra bytes count as 8 errors each
+    errors = sum(bin(a ^ b).count("1") for (a, b) in zip(sent, received))
+    return errors + (abs(len(sent) - len(received)) * BITS_PER_BYTE)
+
+def reference_demodulator(samples: typing.Sequence[int],
+                          settings: Settings = DEFAULT_SETTINGS) -> typing.List[int]:
+    # Floating-point version of filter_implementation.demodulator:
+    # returns one output bit per PCM sample (1 = upper frequency)
+    from filter_implementation import compute_bandpass_filter
+
+    bit_samples = settings.sample_rate / settings.baud_rate
+    decay = math.exp(math.log(settings.rc_decay_per_bit) / bit_samples)
+    filters = [compute_bandpass_filter(frequency, settings.filter_width, settings.sample_rate)
+               for frequency in (settings.upper_frequency, settings.lower_frequency)]
+    state = [[0.0, 0.0, 0.0] for f in filters]   # o1, o2, level
+    i1 = i2 = 0.0
+    out_bits: typing.List[int] = []
+    for sample in samples:
+        i0 = sample / (INT16_MAX + 1) / 2.0
+        levels = []
+        for ((a1, a2, b0, b2), s) in zip(filters, state):
+            o0 = (i0 * b0) + (i2 * b2) - (s[0] * a1) - (s[1] * a2)
+            s[1] = s[0]
+            s[0] = o0
+            s[2] = max(s[2] * decay, abs(o0))
+            levels.append(s[2])
+        i2 = i1
+        i1 = i0
+        out_bits.append(int(levels[0] > levels[1]))
+    return out_bits
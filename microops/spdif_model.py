@@ -0,0 +1,430 @@
+from func_hardware import (
+        ALL_BITS, OperationList,
+    )
+from filter_implementation import (
+        demodulator,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+from test_vector import (
+        TestVector,
+    )
+import argparse, enum, random, sys, time, typing
+
+# Model of the S/PDIF receive chain in receiver_main.vhdl:
+#   input_decoder   - measures pulse lengths, classifies as 1X, 2X or 3X
+#   packet_decoder  - biphase mark decoding and B/M/W preamble sync
+#   channel_decoder - 32-bit subframe extraction, parity, left/right strobes
+#
+# The waveform is represented by the length of each pulse in clock cycles,
+# i.e. the time between transitions, which is what input_decoder measures.
+# Each stage consumes a whole block of its input at a time.
+#
+# The model is not real-time. There are about 96 pulses per stereo frame,
+# and each goes through all three stages in Python, so decoding runs at
+# about 5k samples/s against the 48 kHz of the hardware (and FuncExecutor
+# demodulates about 500 samples/s). It is for checking behaviour, such
+# as sync loss and strobe timing, not for live input.
+
+CLOCK_FREQUENCY_HZ = 96e6
+FRAMES_PER_BLOCK = 192
+SUBFRAME_BITS = 32
+
+# Pulse lengths (as pulse_length_out)
+ZERO = 0
+ONE = 1
+TWO = 2
+THREE = 3
+
+# input_decoder generics and constants
+ENOUGH_TRANSITIONS = 31
+MIN_TRANSITION_TIME = 4
+MAX_TRANSITION_TIME = 255
+TOO_MANY_THREES = 3
+MAX_LAST_SEEN = 63
+
+class Preamble(enum.Enum):
+    # Cells of each preamble, if the previous cell was 0
+    B = (1, 1, 1, 0, 1, 0, 0, 0)
+    M = (1, 1, 1, 0, 0, 0, 1, 0)
+    W = (1, 1, 1, 0, 0, 1, 0, 0)
+
+class Strobe(enum.Enum):
+    LEFT = enum.auto()
+    RIGHT = enum.auto()
+
+Subframe = typing.Tuple[Strobe, int]
+# A subframe with the clock cycle at which its strobe is produced
+TimedSubframe = typing.Tuple[int, Strobe, int]
+
+def make_subframe_bits(sample: int) -> int:
+    # Bits 4 .. 27 are 24-bit audio (LSB first), so the 16-bit sample is
+    # found at bits 12 .. 27, as used by receiver_main. V, U and C are zero.
+    # Bit 31 is even parity for bits 4 .. 30.
+    data = (sample & 0xffff) << 12
+    parity = bin(data).count("1") & 1
+    return data | (parity << 31)
+
+def encode(samples: typing.Sequence[typing.Tuple[int, int]]) -> typing.List[int]:
+    # Biphase mark encoding of stereo (left, right) samples.
+    # Returns the pulse lengths in units of X (the single time).
+    pulses: typing.List[int] = []
+    level = 0
+    length = 0
+    previous_cell = 0
+    for (frame, (left, right)) in enumerate(samples):
+        for (preamble, sample) in [
+                    (Preamble.B if (frame % FRAMES_PER_BLOCK) == 0 else Preamble.M, left),
+                    (Preamble.W, right),
+                ]:
+            # Preamble cells are levels, inverted if the previous level was 1
+            cells = [cell ^ level for cell in preamble.value]
+            level = cells[-1]
+            # Each data bit begins with a transition, and 1 has another in the middle
+            bits = make_subframe_bits(sample)
+            for i in range(4, SUBFRAME_BITS):
+                level ^= 1
+                cells.append(level)
+                level ^= (bits >> i) & 1
+                cells.append(level)
+            for cell in cells:
+                if length != 0 and cell != previous_cell:
+                    pulses.append(length)
+                    length = 0
+                length += 1
+                previous_cell = cell
+    pulses.append(length)
+    return pulses
+
+def render(pulses: typing.Sequence[int], single_time: float,
+           jitter: float = 0.0, r: typing.Optional[random.Random] = None) -> typing.List[int]:
+    # Convert pulse lengths in units of X to pulse lengths in clock cycles,
+    # as measured by a receiver whose clock is not related to the transmitter.
+    # Jitter is the maximum error in each transition time (in clock cycles).
+    r = r or random.Random(1)
+    durations: typing.List[int] = []
+    position = 0
+    previous_time = 0
+    for pulse in pulses:
+        position += pulse
+        time = int((position * single_time) + (r.uniform(-jitter, jitter) if jitter else 0.0) + 0.5)
+        durations.append(max(time - previous_time, 1))
+        previous_time = time
+    return durations
+
+class InputDecoder:
+    def __init__(self, enable_123_check: bool = True) -> None:
+        self.enable_123_check = enable_123_check
+        self.reset()
+        self.sync_losses = 0
+
+    def reset(self) -> None:
+        self.min_measured_time = MAX_TRANSITION_TIME
+        self.max_measured_time = MIN_TRANSITION_TIME
+        self.valid_transitions = 0
+        self.three_counter = 0
+        self.previous = [ZERO, ZERO, ZERO, ZERO]
+        self.last_seen = [0, 0, 0]
+
+    def decode(self, durations: typing.Sequence[int]) -> typing.List[int]:
+        # Returns the pulse length for each duration, or ZERO if not synchronised
+        out: typing.List[int] = []
+        for duration in durations:
+            duration = min(duration, MAX_TRANSITION_TIME)
+            invalid_333 = self.three_counter == TOO_MANY_THREES
+            invalid_212 = ((self.previous[0] in (ONE, TWO)) and (self.previous[1] == TWO)
+                           and (self.previous[2] == ONE) and (self.previous[3] == TWO))
+            invalid_123 = MAX_LAST_SEEN in self.last_seen
+            if (invalid_333 or invalid_212 or invalid_123
+                    or (duration == MAX_TRANSITION_TIME)
+                    or (duration < MIN_TRANSITION_TIME)):
+                # Pulse sequence or time is invalid - reset everything
+                if self.valid_transitions == ENOUGH_TRANSITIONS:
+                    self.sync_losses += 1
+                self.reset()
+            else:
+                if self.valid_transitions != ENOUGH_TRANSITIONS:
+                    self.valid_transitions += 1
+                self.max_measured_time = max(self.max_measured_time, duration)
+                self.min_measured_time = min(self.min_measured_time, duration)
+
+            # Thresholds: 4X ~ min + max
+            x4_0 = self.min_measured_time + self.max_measured_time
+            threshold_1_5 = (x4_0 * 3) // 8
+            threshold_2_5 = ((x4_0 * 5) // 8) % (MAX_TRANSITION_TIME + 1)
+            if threshold_1_5 >= duration:
+                pulse_length = ONE
+            elif threshold_2_5 >= duration:
+                pulse_length = TWO
+            else:
+                pulse_length = THREE
+
+            valid = self.valid_transitions == ENOUGH_TRANSITIONS
+            out.append(pulse_length if valid else ZERO)
+
+            # Consistency checks for the next transition
+            if self.valid_transitions == 0:
+                self.three_counter = 0
+                self.previous = [ZERO, ZERO, ZERO, ZERO]
+                self.last_seen = [0, 0, 0]
+                continue
+            if pulse_length == ONE:
+                self.three_counter = 0
+            elif pulse_length == THREE:
+                self.three_counter = min(self.three_counter + 1, TOO_MANY_THREES)
+            self.previous = self.previous[1:] + [pulse_length]
+            if self.enable_123_check:
+                for i in range(3):
+                    if (i + 1) == pulse_length:
+                        self.last_seen[i] = 0
+                    else:
+                        self.last_seen[i] = min(self.last_seen[i] + 1, MAX_LAST_SEEN)
+        return out
+
+class SyncState(enum.Enum):
+    NORMAL = enum.auto()
+    SKIP = enum.auto()
+    SYNC = enum.auto()
+    DESYNC = enum.auto()
+    B_HEADER = enum.auto()
+    B_FOOTER = enum.auto()
+    M_HEADER = enum.auto()
+    M_FOOTER = enum.auto()
+    W_HEADER = enum.auto()
+    W_FOOTER = enum.auto()
+
+# Each shift is (data, start); None indicates loss of sync
+Shift = typing.Optional[typing.Tuple[int, int]]
+
+class PacketDecoder:
+    def __init__(self) -> None:
+        self.sync_state = SyncState.DESYNC
+        self.synced = False
+
+    def decode(self, pulse_lengths: typing.Sequence[int]) -> typing.List[Shift]:
+        out: typing.List[Shift] = []
+        for pulse_length in pulse_lengths:
+            if pulse_length == ZERO:
+                # input_decoder is not synchronised: held in reset
+                if self.synced:
+                    out.append(None)
+                self.sync_state = SyncState.NORMAL
+                self.synced = False
+                continue
+
+            state = self.sync_state
+            if state == SyncState.NORMAL or state == SyncState.SKIP:
+                if pulse_length == THREE:
+                    self.sync_state = SyncState.SYNC
+                elif pulse_length == TWO and state == SyncState.NORMAL:
+                    out.append((0, 0))
+                elif pulse_length == ONE and state == SyncState.NORMAL:
+                    self.sync_state = SyncState.SKIP
+                    self.synced = True
+                    out.append((1, 0))
+                elif pulse_length == ONE:
+                    self.sync_state = SyncState.NORMAL
+                else:
+                    self.desync(out)
+            elif state == SyncState.SYNC:
+                if pulse_length == THREE:
+                    # M header: shift 0 (start), then 0, 1, 0
+                    self.sync_state = SyncState.M_HEADER
+                    out.append((0, 1))
+                elif pulse_length == TWO:
+                    # W header: shift 0 (start), then 1, 0, 0
+                    self.sync_state = SyncState.W_HEADER
+                    out.append((0, 1))
+                else:
+                    # B header: shift 1 (start), then 0, 0, 0
+                    self.sync_state = SyncState.B_HEADER
+                    out.append((1, 1))
+            elif state == SyncState.M_HEADER:
+                if pulse_length == ONE:
+                    self.sync_state = SyncState.M_FOOTER
+                    out.append((0, 0))
+                    out.append((1, 0))
+                else:
+                    self.desync(out)
+            elif state == SyncState.W_HEADER:
+                if pulse_length == ONE:
+                    self.sync_state = SyncState.W_FOOTER
+                    out.append((1, 0))
+                    out.append((0, 0))
+                else:
+                    self.desync(out)
+            elif state == SyncState.B_HEADER:
+                if pulse_length == ONE:
+                    self.sync_state = SyncState.B_FOOTER
+                    out.append((0, 0))
+                    out.append((0, 0))
+                else:
+                    self.desync(out)
+            elif state == SyncState.M_FOOTER:
+                self.footer(out, pulse_length == ONE)
+            elif state == SyncState.W_FOOTER:
+                self.footer(out, pulse_length == TWO)
+            elif state == SyncState.B_FOOTER:
+                self.footer(out, pulse_length == THREE)
+            elif state == SyncState.DESYNC:
+                if pulse_length == THREE:
+                    self.sync_state = SyncState.SYNC
+        return out
+
+    def footer(self, out: typing.List[Shift], expected: bool) -> None:
+        if expected:
+            self.sync_state = SyncState.NORMAL
+            out.append((0, 0))
+        else:
+            self.desync(out)
+
+    def desync(self, out: typing.List[Shift]) -> None:
+        self.sync_state = SyncState.DESYNC
+        if self.synced:
+            out.append(None)
+        self.synced = False
+
+class ChannelDecoder:
+    def __init__(self) -> None:
+        self.data = 0
+        self.parity = 0
+        self.synced = False
+        self.expect_right = False
+
+    def decode(self, shifts: typing.Sequence[Shift]) -> typing.List[Subframe]:
+        out: typing.List[Subframe] = []
+        for shift in shifts:
+            if shift is None:
+                # packet_decoder lost sync
+                self.synced = False
+                self.data = 0
+                self.parity = 0
+                continue
+
+            (data_in, start) = shift
+            if start:
+                preamble = self.data & 0xf
+                bm_packet = preamble in (0x1, 0x4)
+                w_packet = preamble == 0x2
+                if self.synced and self.parity:
+                    if bm_packet and not self.expect_right:
+                        out.append((Strobe.LEFT, self.data))
+                    elif w_packet and self.expect_right:
+                        out.append((Strobe.RIGHT, self.data))
+                self.synced = False
+                if self.parity and bm_packet:
+                    self.expect_right = True
+                    self.synced = True
+                elif self.parity and w_packet:
+                    self.expect_right = False
+                    self.synced = True
+                self.parity = data_in
+            else:
+                self.parity ^= data_in
+            self.data = (self.data >> 1) | (data_in << (SUBFRAME_BITS - 1))
+        return out
+
+class Receiver:
+    # The complete receive chain, producing 16-bit audio samples from the
+    # left channel (data bits 27 .. 12) as the filter unit receives them.
+    def __init__(self) -> None:
+        self.input_decoder = InputDecoder()
+        self.packet_decoder = PacketDecoder()
+        self.channel_decoder = ChannelDecoder()
+        self.time = 0
+
+    def decode_subframes(self, durations: typing.Sequence[int]) -> typing.List[Subframe]:
+        self.time += sum(durations)
+        return self.channel_decoder.decode(
+                    self.packet_decoder.decode(
+                        self.input_decoder.decode(durations)))
+
+    def decode_timed(self, durations: typing.Sequence[int]) -> typing.List[TimedSubframe]:
+        # As decode_subframes, but also returns the time of each strobe, which is
+        # the end of the pulse that starts the following preamble. The left and
+        # right strobes therefore arrive half a frame apart.
+        out: typing.List[TimedSubframe] = []
+        for (duration, pulse_length) in zip(durations, self.input_decoder.decode(durations)):
+            self.time += duration
+            for (strobe, data) in self.channel_decoder.decode(
+                        self.packet_decoder.decode([pulse_length])):
+                out.append((self.time, strobe, data))
+        return out
+
+    def decode(self, durations: typing.Sequence[int]) -> typing.List[int]:
+        return [(data >> 12) & 0xffff
+                for (strobe, data) in self.decode_subframes(durations)
+                if strobe == Strobe.LEFT]
+
+    @property
+    def sync_losses(self) -> int:
+        return self.input_decoder.sync_losses
+
+def single_time(sample_rate: float, clock_frequency: float = CLOCK_FREQUENCY_HZ) -> float:
+    # Two subframes of 64 single times per sample
+    return clock_frequency / (sample_rate * 128.0)
+
+def add_dropouts(durations: typing.List[int], num_dropouts: int,
+                 r: random.Random) -> typing.List[int]:
+    # Simulate loss of the optical signal at random points
+    durations = list(durations)
+    for i in range(num_dropouts):
+        index = r.randrange(len(durations) // 4, len(durations))
+        durations[index] = MAX_TRANSITION_TIME * 4
+    return durations
+
+def run_pipeline(samples: typing.List[int], sample_rate: float, jitter: float,
+                 num_dropouts: int, block_size: int = 1000) -> None:
+    r = random.Random(1)
+    ops = OperationList()
+    demodulator(ops)
+    executor = FuncExecutor(ops, debug_outputs=False)
+
+    start_time = time.monotonic()
+    durations = render(encode([(value, value) for value in samples]),
+                       single_time(sample_rate), jitter, r)
+    durations = add_dropouts(durations, num_dropouts, r)
+    encode_time = time.monotonic() - start_time
+
+    receiver = Receiver()
+    received: typing.List[int] = []
+    out_bits: typing.List[int] = []
+    decode_time = demodulate_time = 0.0
+    for i in range(0, len(durations), block_size):
+        start_time = time.monotonic()
+        block = receiver.decode(durations[i:i + block_size])
+        decode_time += time.monotonic() - start_time
+        received.extend(block)
+
+        start_time = time.monotonic()
+        if len(block) != 0:
+            out_bits.extend((y >> (ALL_BITS - 1)) & 1 for y in executor.run(block))
+        demodulate_time += time.monotonic() - start_time
+
+    print(f" jitter {jitter:1.1f} clocks, {num_dropouts} dropouts:")
+    print(f"  {len(samples)} samples sent, {len(received)} received, "
+          f"{receiver.sync_losses} sync losses")
+    print(f"  encode {len(samples) / max(encode_time, 1e-9):9.0f} samples/s")
+    print(f"  decode {len(received) / max(decode_time, 1e-9):9.0f} samples/s")
+    print(f"  demodulate {len(out_bits) / max(demodulate_time, 1e-9):9.0f} samples/s")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Model of the S/PDIF receive chain")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--sample-rate", type=float, default=48000.0)
+    args = parser.parse_args()
+
+    test_vector = TestVector(args.samples)
+    sample_rate = args.sample_rate
+    print(f"S/PDIF receive chain at {sample_rate:1.0f} Hz, "
+          f"single time {single_time(sample_rate):1.3f} clocks")
+    run_pipeline(test_vector.in_values, sample_rate, 0.0, 0)
+    run_pipeline(test_vector.in_values, sample_rate, 2.0, 0)
+    run_pipeline(test_vector.in_values, sample_rate, 2.0, 5)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,201 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, PRESETS, get_preset,
+    )
+from filter_implementation import (
+        Detector,
+    )
+from signal_model import (
+        pcm_to_fixed, SerialDecoder,
+    )
+from word_model import (
+        WordDemodulator,
+    )
+import argparse, array, sys, threading, time, typing
+
+# Real-time software decoder: raw PCM (signed 16-bit little-endian, mono,
+# at the sample rate of the settings) is read from stdin or a pipe, and
+# decoded bytes are written to stdout as they arrive, each with the time
+# of the sample at which it was decoded:
+#
+#   <seconds> <byte in hex>
+#
+# A reader thread makes bulk reads into a bounded ring buffer. If the
+# decoder falls behind and the buffer is full, the reader waits, so that
+# a producer writing to a pipe is held back; with --drop (for a live source
+# which cannot wait) new samples are dropped and counted instead. The
+# demodulator is the word-level model, which gives the same output bits as
+# the microcode program. Statistics are written to stderr.
+
+DEFAULT_BUFFER_SECONDS = 1.0
+DEFAULT_BLOCK_SAMPLES = 4096
+BYTES_PER_SAMPLE = 2
+
+class RingBuffer:
+    def __init__(self, capacity: int, drop: bool = False) -> None:
+        self.data = array.array("h", bytes(capacity * BYTES_PER_SAMPLE))
+        self.capacity = capacity
+        self.drop = drop
+        self.read_index = 0
+        self.occupancy = 0
+        self.max_occupancy = 0
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, samples: typing.Sequence[int]) -> None:
+        # Waits until all of the samples fit, or drops those which do not fit
+        with self.condition:
+            while len(samples) != 0:
+                while (self.occupancy == self.capacity) and not self.drop:
+                    self.condition.wait()
+                count = min(len(samples), self.capacity - self.occupancy)
+                write_index = (self.read_index + self.occupancy) % self.capacity
+                first = min(count, self.capacity - write_index)
+                self.data[write_index:write_index + first] = array.array("h", samples[:first])
+                self.data[0:count - first] = array.array("h", samples[first:count])
+                self.occupancy += count
+                self.max_occupancy = max(self.max_occupancy, self.occupancy)
+                self.condition.notify_all()
+                if self.drop:
+                    self.dropped += len(samples) - count
+                    break
+                samples = samples[count:]
+
+    def read(self, max_samples: int) -> typing.List[int]:
+        # Waits for at least one sample; returns [] at the end of the input
+        with self.condition:
+            while (self.occupancy == 0) and not self.closed:
+                self.condition.wait()
+            count = min(max_samples, self.occupancy)
+            first = min(count, self.capacity - self.read_index)
+            samples = self.data[self.read_index:self.read_index + first].tolist()
+            samples.extend(self.data[0:count - first].tolist())
+            self.read_index = (self.read_index + count) % self.capacity
+            self.occupancy -= count
+            self.condition.notify_all()
+            return samples
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+def read_input(fd: typing.BinaryIO, ring: RingBuffer, block_samples: int) -> None:
+    # Reader thread: bulk reads, keeping any odd byte for the next read
+    buffer = bytearray(block_samples * BYTES_PER_SAMPLE)
+    view = memoryview(buffer)
+    pending = 0
+    try:
+        while True:
+            size = fd.readinto(view[pending:])
+            if not size:
+                break
+            size += pending
+            whole = size - (size % BYTES_PER_SAMPLE)
+            samples = array.array("h")
+            samples.frombytes(view[:whole])
+            if sys.byteorder != "little":
+                samples.byteswap()
+            ring.write(samples)
+            pending = size - whole
+            buffer[:pending] = buffer[whole:size]
+    finally:
+        ring.close()
+
+class StreamStats:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.samples = 0
+        self.decoded = 0
+        self.processing_time = 0.0
+        self.start_time = time.monotonic()
+
+    def real_time_factor(self) -> float:
+        # Audio time divided by time spent decoding; at least 1.0 is needed
+        audio_time = self.samples / self.settings.sample_rate
+        return audio_time / self.processing_time if self.processing_time > 0.0 else 0.0
+
+    def report(self, ring: RingBuffer) -> str:
+        return (f"{self.samples / self.settings.sample_rate:.2f}s audio in "
+                f"{time.monotonic() - self.start_time:.2f}s, "
+                f"real-time factor {self.real_time_factor():.1f}, "
+                f"{self.decoded} bytes, buffer {ring.occupancy}/{ring.capacity} "
+                f"(max {ring.max_occupancy}), dropped {ring.dropped} samples")
+
+def decode_stream(fd_in: typing.BinaryIO, fd_out: typing.TextIO,
+                  settings: Settings = DEFAULT_SETTINGS,
+                  detector: Detector = Detector.BIQUAD,
+                  buffer_samples: typing.Optional[int] = None,
+                  block_samples: int = DEFAULT_BLOCK_SAMPLES,
+                  drop: bool = False,
+                  stats_interval: float = 0.0,
+                  fd_stats: typing.Optional[typing.TextIO] = None) -> StreamStats:
+    if buffer_samples is None:
+        buffer_samples = int(settings.sample_rate * DEFAULT_BUFFER_SECONDS)
+    ring = RingBuffer(buffer_samples, drop)
+    reader = threading.Thread(target=read_input, args=(fd_in, ring, block_samples), daemon=True)
+    reader.start()
+
+    demodulator = WordDemodulator(settings, detector)
+    decoder = SerialDecoder(settings)
+    stats = StreamStats(settings)
+    sign_shift = settings.all_bits - 1
+    next_report = time.monotonic() + stats_interval
+    samples = ring.read(block_samples)
+    while len(samples) != 0:
+        start_time = time.monotonic()
+        out_values = demodulator.run(pcm_to_fixed(samples, settings))
+        received = decoder.decode([y >> sign_shift for y in out_values])
+        stats.processing_time += time.monotonic() - start_time
+        stats.samples += len(samples)
+
+        for (byte, sample) in zip(received, decoder.byte_samples):
+            fd_out.write(f"{sample / settings.sample_rate:.6f} {byte:02x}\n")
+        if len(received) != 0:
+            fd_out.flush()
+            stats.decoded += len(received)
+            decoder.byte_samples.clear()
+
+        if (fd_stats is not None) and (stats_interval > 0.0) and (time.monotonic() >= next_report):
+            fd_stats.write(stats.report(ring) + "\n")
+            fd_stats.flush()
+            next_report += stats_interval
+        samples = ring.read(block_samples)
+
+    reader.join()
+    if fd_stats is not None:
+        fd_stats.write(stats.report(ring) + "\n")
+    return stats
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Decode raw 16-bit PCM from stdin")
+    parser.add_argument("--preset", default=DEFAULT_SETTINGS.name,
+                        help=f"any of: {', '.join(PRESETS)}")
+    parser.add_argument("--detector", choices=[d.name.lower() for d in Detector],
+                        default=Detector.BIQUAD.name.lower())
+    parser.add_argument("--input", default=None, help="read from a file instead of stdin")
+    parser.add_argument("--buffer-samples", type=int, default=None,
+                        help=f"ring buffer size (default {DEFAULT_BUFFER_SECONDS:g} seconds)")
+    parser.add_argument("--block-samples", type=int, default=DEFAULT_BLOCK_SAMPLES)
+    parser.add_argument("--drop", action="store_true",
+                        help="drop new samples when the buffer is full, instead of waiting")
+    parser.add_argument("--stats-interval", type=float, default=1.0,
+                        help="seconds between statistics reports (0 for the end only)")
+    args = parser.parse_args()
+
+    settings = get_preset(args.preset)
+    detector = Detector[args.detector.upper()]
+    if args.input is not None:
+        fd_in: typing.BinaryIO = open(args.input, "rb")
+    else:
+        fd_in = sys.stdin.buffer
+    try:
+        decode_stream(fd_in, sys.stdout, settings, detector, args.buffer_samples,
+                      args.block_samples, args.drop, args.stats_interval, sys.stderr)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        fd_in.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, PRESETS, get_preset,
+    )
+from func_hardware import (
+        OperationList, MAX_BANKS, CALL_CYCLES, RETURN_CYCLES,
+    )
+from filter_implementation import (
+        multi_channel_demodulator, Detector,
+    )
+from cycle_report import (
+        make_channels,
+    )
+import argparse
+
+# ROM space saved by generating the demodulator with subroutines, and the
+# cycles that this costs. Each call costs CALL_CYCLES + RETURN_CYCLES more
+# than a copy of the subroutine at the call site.
+#
+# Only the filter output moves and the RC filter are shared, so only 42 of
+# the 261 bytes of the one channel demodulator are saved. The filters are
+# most of the code, but cannot be shared between banks: the coefficients
+# are the shifts and adds of the microcode, and a bank only holds the
+# registers O1, O2 and L, so each filter has its own copy of the code.
+# Sharing one filter body between banks, parameterised by the bank select,
+# would need the coefficients in banked registers and an addition which
+# depends on a register digit, which the datapath does not have.
+
+LIMITATION = ("Only the filter output and RC filter are shared: each filter's coefficients\n"
+              "are in its microcode, not in a bank, so the filters themselves are not shared,\n"
+              "and most of the duplicated per-bank code remains.")
+
+CALL_COST = CALL_CYCLES + RETURN_CYCLES
+
+def build(settings: Settings, detector: Detector, num_channels: int,
+          subroutines: bool) -> OperationList:
+    ops = OperationList(settings)
+    multi_channel_demodulator(ops, make_channels(settings, num_channels),
+                              detector, subroutines)
+    return ops
+
+def report(settings: Settings, detector: Detector, num_channels: int) -> None:
+    inline_ops = build(settings, detector, num_channels, False)
+    ops = build(settings, detector, num_channels, True)
+    inline_size = len(inline_ops.get_memory_image())
+    size = len(ops.get_memory_image())
+    inline_cycles = inline_ops.cycle_count()
+    cycles = ops.cycle_count()
+    print(f"{settings.name:10s} {detector.name.lower():8s} {num_channels:8d} "
+          f"{inline_size:6d} {size:6d} {inline_size - size:5d} "
+          f"{inline_cycles:7d} {cycles:7d} {cycles - inline_cycles:+5d}")
+    for sub in ops.subroutines.values():
+        print(f"{'':36s}subroutine {sub.number}: {sub.size} bytes, {sub.calls} calls, "
+              f"saves {sub.saved} bytes, {CALL_COST} cycles per call: {sub.name}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ROM space saved by subroutines")
+    parser.add_argument("presets", nargs="*", default=[DEFAULT_SETTINGS.name],
+                        help=f"any of: {', '.join(PRESETS)}")
+    parser.add_argument("--channels", type=int, nargs="+", default=[1],
+                        help=f"numbers of channels, up to {MAX_BANKS // 2}")
+    args = parser.parse_args()
+
+    print(LIMITATION)
+    print(f"{'preset':10s} {'detector':8s} channels {'ROM bytes':>13s} {'saved':>5s} "
+          f"{'cycles':>15s} {'extra':>5s}")
+    for preset in args.presets:
+        settings = get_preset(preset)
+        for num_channels in args.channels:
+            for detector in Detector:
+                report(settings, detector, num_channels)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+from fpga_hardware import (
+        FPGAOperationList,
+    )
+from filter_implementation import (
+        demodulator,
+    )
+from settings import (
+        FILTER_UNIT_PREFIX, DEFAULT_SETTINGS, get_preset,
+    )
+from pathlib import Path
+import argparse, json, re, shutil, subprocess, sys, tempfile, typing
+
+# Synthesis, place and route for the generated microprogram with the fixed
+# VHDL, using GHDL (with the yosys plugin), yosys and nextpnr-ice40, in a
+# scratch directory. Resource use and timing are written as JSON and
+# compared with a stored baseline, so that the cost of a change to the
+# microcode, code table or datapath can be measured. With --check, the
+# exit status is an error unless every target matches the baseline.
+#
+# The behavioural microcode store (*.test.vhdl) is used, as yosys infers
+# block RAM from it; the Lattice SB_RAM512x8 wrapper is only available
+# in iCEcube2.
+
+FPGA_DIR = Path("fpga").absolute()
+GENERATED_DIR = Path("generated").absolute()
+BASELINE = FPGA_DIR / "synth_baseline.json"
+TOOLS = ["ghdl", "yosys", "nextpnr-ice40"]
+CLOCK_FREQUENCY_MHZ = 96.0
+YOSYS_CELLS = ["SB_LUT4", "SB_CARRY", "SB_RAM40_4K", "SB_PLL40_CORE"]
+
+FILTER_UNIT_FILES = [
+    "debug_textio.vhdl",
+    "debug_textio-body.vhdl",
+    f"{FILTER_UNIT_PREFIX}_settings.vhdl",
+    f"{FILTER_UNIT_PREFIX}_control_line_decoder.vhdl",
+    f"{FILTER_UNIT_PREFIX}_microcode_store.test.vhdl",
+    "shift_register.vhdl",
+    "banked_shift_register.vhdl",
+    "subtractor.vhdl",
+    "input_fifo.vhdl",
+    "filter_unit.vhdl",
+]
+
+class Target(typing.NamedTuple):
+    top: str
+    files: typing.List[str]     # in fpga/ or generated/, in analysis order
+    pcf: typing.Optional[str]
+
+TARGETS = {
+    # The filter unit alone, with its ports placed anywhere
+    "filter_unit": Target("filter_unit", FILTER_UNIT_FILES, None),
+    # The test design used with the board (see fpga_test.py)
+    "fpga_test": Target("fpga_test_project_top", FILTER_UNIT_FILES + [
+            "pulse_gen.vhdl",
+            "uart.vhdl",
+            "fpga_test_top_level.vhdl",
+            "fpga_test_project/fpga_test_project_pll.vhd",
+            "fpga_test_project/fpga_test_project_top.vhdl",
+        ], "fpga_test_project/ice40.pcf"),
+}
+
+def find_source(name: str) -> Path:
+    for directory in [FPGA_DIR, GENERATED_DIR]:
+        if (directory / name).is_file():
+            return directory / name
+    raise FileNotFoundError(name)
+
+def parse_yosys_stat(log: str) -> typing.Dict[str, int]:
+    # Cell counts from the last "stat" in a yosys log; older versions of
+    # yosys print the name before the count, newer versions after it
+    cells: typing.Dict[str, int] = {}
+    for (name1, count1, count2, name2) in re.findall(
+            r"^\s+(?:(SB_\w+)\s+(\d+)|(\d+)\s+(SB_\w+))\s*$", log, re.MULTILINE):
+        cells[name1 or name2] = int(count1 or count2)
+    flip_flops = sum(count for (name, count) in cells.items() if name.startswith("SB_DFF"))
+    result = {name: cells.get(name, 0) for name in YOSYS_CELLS}
+    result["SB_DFF*"] = flip_flops
+    return result
+
+def parse_nextpnr_report(report: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    # Utilisation and maximum frequency from "nextpnr-ice40 --report"
+    return {
+        "utilisation": {name: {"used": value["used"], "available": value["available"]}
+                        for (name, value) in report.get("utilization", {}).items()
+                        if value["used"] != 0},
+        "fmax_mhz": {clock: round(value["achieved"], 2)
+                     for (clock, value) in report.get("fmax", {}).items()},
+    }
+
+def synthesise(ops: FPGAOperationList, target: Target, work_dir: Path,
+               device: str, package: str) -> typing.Dict[str, typing.Any]:
+    ops.generate(FILTER_UNIT_PREFIX)
+    for name in target.files:
+        destination = work_dir / name
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(find_source(name), destination)
+
+    subprocess.check_call(["ghdl", "-a", "--work=comfilter"] + target.files, cwd=work_dir)
+    subprocess.check_call(["yosys", "-q", "-m", "ghdl", "-l", "yosys.log", "-p",
+                           f"ghdl --work=comfilter {target.top}; "
+                           f"synth_ice40 -top {target.top} -json {target.top}.json; stat"],
+                          cwd=work_dir, stdout=subprocess.DEVNULL)
+    nextpnr = ["nextpnr-ice40", f"--{device}", "--package", package,
+               "--json", f"{target.top}.json", "--asc", f"{target.top}.asc",
+               "--freq", str(CLOCK_FREQUENCY_MHZ), "--report", "report.json"]
+    if target.pcf is not None:
+        nextpnr.extend(["--pcf", target.pcf])
+    else:
+        nextpnr.append("--pcf-allow-unconstrained")
+    subprocess.check_call(nextpnr, cwd=work_dir, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+
+    with open(work_dir / "yosys.log", "rt", encoding="utf-8") as fd:
+        cells = parse_yosys_stat(fd.read())
+    with open(work_dir / "report.json", "rt", encoding="utf-8") as fd:
+        result = parse_nextpnr_report(json.load(fd))
+    result["cells"] = cells
+    return result
+
+def flatten(data: typing.Any, prefix: str = "") -> typing.Dict[str, float]:
+    # Numeric values in nested dictionaries, keyed by path
+    values: typing.Dict[str, float] = {}
+    if isinstance(data, dict):
+        for (key, value) in data.items():
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix[:-1]] = data
+    return values
+
+def diff_results(baseline: typing.Dict[str, typing.Any],
+                 result: typing.Dict[str, typing.Any]) -> typing.List[str]:
+    # One line for each value that differs from the baseline
+    old = flatten(baseline)
+    new = flatten(result)
+    lines = []
+    for key in sorted(set(old) | set(new)):
+        if key.endswith(".available"):
+            continue
+        if key not in old:
+            lines.append(f"{key}: {new[key]} (new)")
+        elif key not in new:
+            lines.append(f"{key}: removed (was {old[key]})")
+        elif old[key] != new[key]:
+            change = new[key] - old[key]
+            percent = f" ({(change * 100.0) / old[key]:+.1f}%)" if old[key] else ""
+            lines.append(f"{key}: {old[key]} -> {new[key]} {change:+g}{percent}")
+    return lines
+
+def compare_with_baseline(baseline: typing.Dict[str, typing.Any],
+                          results: typing.Dict[str, typing.Any]) -> bool:
+    # Print the differences from the baseline for each target, and return
+    # True if there are none. A target without a baseline is a difference.
+    same = True
+    for (name, result) in results.items():
+        print(f"{name}:")
+        if name not in baseline:
+            print("  no baseline (use --save-baseline to store one)")
+            for (key, value) in sorted(flatten(result).items()):
+                if not key.endswith(".available"):
+                    print(f"  {key}: {value}")
+            same = False
+            continue
+        lines = diff_results(baseline[name], result)
+        for line in lines:
+            print(f"  {line}")
+        if len(lines) == 0:
+            print("  same as baseline")
+        else:
+            same = False
+    return same
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Synthesis resource and timing report")
+    parser.add_argument("targets", nargs="*", default=list(TARGETS),
+                        help=f"any of: {', '.join(TARGETS)}")
+    parser.add_argument("--preset", default=DEFAULT_SETTINGS.name)
+    parser.add_argument("--optimise-encoding", action="store_true",
+                        help="choose the control word encoding with the fewest LUTs "
+                             "after synthesis (see code_optimiser)")
+    parser.add_argument("--device", default="hx8k")
+    parser.add_argument("--package", default="cb132")
+    parser.add_argument("--output", default="generated/synth_report.json")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with an error if the results differ from the baseline, "
+                             "or there is no baseline")
+    parser.add_argument("--work-dir", default=None,
+                        help="keep intermediate files here instead of a temporary directory")
+    args = parser.parse_args()
+
+    for name in args.targets:
+        if name not in TARGETS:
+            parser.error(f"Unknown target {name}")
+    missing = [tool for tool in TOOLS if shutil.which(tool) is None]
+    if len(missing) != 0:
+        # yowasp-yosys cannot be used, as it has no GHDL plugin
+        print(f"Not available: {', '.join(missing)} (yosys needs the GHDL plugin)")
+        sys.exit(1)
+
+    settings = get_preset(args.preset)
+    ops = FPGAOperationList(settings)
+    demodulator(ops)
+    if args.optimise_encoding:
+        from code_optimiser import optimise_encoding
+        optimise_encoding(ops)
+    program = {
+        "preset": args.preset,
+        "rom_bytes": len(ops.get_memory_image()),
+        "codes": len(ops.code_table.table),
+        "cycles": ops.cycle_count(),
+    }
+
+    results: typing.Dict[str, typing.Any] = {}
+    for name in args.targets:
+        print(f"Synthesis: {name}", flush=True)
+        if args.work_dir is not None:
+            work_dir = Path(args.work_dir) / name
+            work_dir.mkdir(parents=True, exist_ok=True)
+            result = synthesise(ops, TARGETS[name], work_dir, args.device, args.package)
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                result = synthesise(ops, TARGETS[name], Path(tmp_dir), args.device, args.package)
+        result["program"] = program
+        results[name] = result
+
+    with open(args.output, "wt", encoding="utf-8") as fd:
+        json.dump(results, fd, indent=1)
+
+    baseline: typing.Dict[str, typing.Any] = {}
+    if Path(args.baseline).is_file():
+        with open(args.baseline, "rt", encoding="utf-8") as fd:
+            baseline = json.load(fd)
+    same = compare_with_baseline(baseline, results)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "wt", encoding="utf-8") as fd:
+            json.dump(baseline, fd, indent=1)
+            fd.write("\n")
+    elif args.check and not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+from func_hardware import (
+        OperationList,
+    )
+from settings import (
+        Settings, DEFAULT_SETTINGS, get_preset,
+    )
+from filter_implementation import (
+        demodulator,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+import enum, os, sys, time, typing
+
+# Serial port "URL" which selects the virtual FPGA instead of a real device
+VIRTUAL_SERIAL_PORT = "virtual://"
+
+class SerialPort(typing.Protocol):
+    timeout: typing.Optional[float]
+
+    def read(self, size: int = 1) -> bytes: ...
+    def write(self, data: bytes) -> typing.Optional[int]: ...
+
+class TestState(enum.Enum):
+    READY = enum.auto()
+    LOAD_HIGH = enum.auto()
+    LOAD_LOW = enum.auto()
+
+class VirtualFPGA:
+    # Model of the serial protocol implemented by fpga_test_top_level.vhdl:
+    #   "T" followed by a 16-bit sample (high byte first) runs the filter unit
+    #   for one sample; the reply is the serial output bits shifted into
+    #   a byte, or "n" if there were none, or "o" if there were too many.
+    #   Any other byte is echoed.
+    def __init__(self, ops: OperationList) -> None:
+        self.executor = FuncExecutor(ops, debug_outputs=False)
+        self.all_bits = ops.settings.all_bits
+        self.state = TestState.READY
+        self.input_value = 0
+        self.num_samples = 0
+
+    def receive(self, data: bytes) -> bytes:
+        reply = bytearray()
+        for byte in data:
+            if self.state == TestState.READY:
+                if byte == ord("T"):
+                    self.state = TestState.LOAD_HIGH
+                else:
+                    reply.append(byte)
+            elif self.state == TestState.LOAD_HIGH:
+                self.input_value = byte << 8
+                self.state = TestState.LOAD_LOW
+            else:
+                self.input_value |= byte
+                self.state = TestState.READY
+                reply.append(self.run_sample(self.input_value))
+        return bytes(reply)
+
+    def run_sample(self, value: int) -> int:
+        all_bits = self.all_bits
+        out_values = self.executor.run([value & ((1 << all_bits) - 1)])
+        self.num_samples += 1
+        data = 0
+        count = 0
+        for y in out_values:
+            data = ((data << 1) | ((y >> (all_bits - 1)) & 1)) & 0xff
+            count = min(count + 1, 15)
+        if count == 0:
+            return ord("n")     # no data
+        elif count == 15:
+            return ord("o")     # overwhelming data
+        return data
+
+class VirtualSerial:
+    # In-process stand-in for a pyserial port connected to the virtual FPGA.
+    # A read() which cannot be satisfied waits for the timeout, as a real
+    # port would. Bytes in "garbage" are received before any replies, which
+    # simulates line noise from a board that has just been reset.
+    def __init__(self, fpga: VirtualFPGA, timeout: typing.Optional[float] = None,
+                 garbage: bytes = b"") -> None:
+        self.fpga = fpga
+        self.timeout = timeout
+        self.received = bytearray(garbage)
+        self.is_open = False
+        self.baudrate = 115200
+        self.bytesize = 8
+        self.parity = "N"
+        self.stopbits = 1
+        self.rtscts = False
+
+    def open(self) -> None:
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.received)
+
+    def reset_input_buffer(self) -> None:
+        self.received.clear()
+
+    def write(self, data: bytes) -> int:
+        assert self.is_open
+        self.received.extend(self.fpga.receive(data))
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        assert self.is_open
+        data = bytes(self.received[:size])
+        del self.received[:size]
+        if (len(data) < size) and self.timeout:
+            time.sleep(self.timeout)
+        return data
+
+def make_virtual_serial(timeout: typing.Optional[float] = None,
+                        settings: Settings = DEFAULT_SETTINGS) -> VirtualSerial:
+    ops = OperationList(settings)
+    demodulator(ops)
+    return VirtualSerial(VirtualFPGA(ops), timeout)
+
+def serve_pty(fpga: VirtualFPGA) -> None:
+    # Make the virtual FPGA available as a pseudo-terminal, so that tools
+    # which open a real serial port (e.g. fpga/sertest.py) can use it
+    import pty, tty
+    (master, slave) = pty.openpty()
+    tty.setraw(slave)
+    print(f"Virtual FPGA serial port: {os.ttyname(slave)}", flush=True)
+    while True:
+        data = os.read(master, 4096)
+        if len(data) == 0:
+            break
+        reply = fpga.receive(data)
+        if len(reply) != 0:
+            os.write(master, reply)
+
+def main() -> None:
+    # virtual_fpga.py [preset]
+    settings = get_preset(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SETTINGS
+    ops = OperationList(settings)
+    demodulator(ops)
+    serve_pty(VirtualFPGA(ops))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,115 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS, get_preset,
+    )
+from func_hardware import (
+        OperationList,
+    )
+from filter_implementation import (
+        demodulator,
+    )
+from func_execute import (
+        FuncExecutor,
+    )
+from signal_model import (
+        generate_signal, pcm_to_fixed, SerialDecoder,
+        count_bit_errors, reference_demodulator,
+    )
+from concurrent.futures import ProcessPoolExecutor
+import argparse, sys, time, typing
+
+# Find the narrowest datapath which demodulates a test signal with a
+# bit error rate no greater than the target. For each number of fractional
+# bits, the demodulator program is regenerated (with new coefficients)
+# and executed by FuncExecutor.
+
+class SweepResult:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.cycles = 0
+        self.rom_bytes = 0
+        self.overflow = False
+        self.bit_errors = 0
+        self.bit_error_rate = 1.0
+        self.reference_match = 0.0
+        self.run_time = 0.0
+
+Generator = typing.Callable[[OperationList], None]
+
+def evaluate(settings: Settings, pcm: typing.List[int], data: bytes,
+             reference_bits: typing.List[int],
+             generator: Generator = demodulator) -> SweepResult:
+    result = SweepResult(settings)
+    ops = OperationList(settings)
+    generator(ops)
+    result.cycles = ops.cycle_count()
+    result.rom_bytes = len(ops.get_memory_image())
+
+    start_time = time.monotonic()
+    try:
+        out_values = FuncExecutor(ops, debug_outputs=False).run(pcm_to_fixed(pcm, settings))
+    except AssertionError:
+        # A debug assertion fails if the datapath overflows
+        result.overflow = True
+        return result
+    result.run_time = time.monotonic() - start_time
+
+    out_bits = [(y >> (settings.all_bits - 1)) & 1 for y in out_values]
+    received = SerialDecoder(settings).decode(out_bits)
+    result.bit_errors = count_bit_errors(data, received[:len(data)])
+    result.bit_error_rate = result.bit_errors / (len(data) * 8)
+    result.reference_match = (sum(int(a == b) for (a, b) in zip(out_bits, reference_bits))
+                              / max(len(reference_bits), 1))
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sweep the number of fractional bits")
+    parser.add_argument("--preset", default=DEFAULT_SETTINGS.name,
+                        help="settings preset for everything except the word width")
+    parser.add_argument("--data", default="test_data",
+                        help="file containing bytes to transmit")
+    parser.add_argument("--min-bits", type=int, default=8)
+    parser.add_argument("--max-bits", type=int, default=DEFAULT_SETTINGS.fractional_bits)
+    parser.add_argument("--target-ber", type=float, default=0.0)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    base = get_preset(args.preset)
+    with open(args.data, "rb") as fd:
+        data = fd.read()
+    pcm = generate_signal(data, base)
+    reference_bits = reference_demodulator(pcm, base)
+    print(f"Base settings {base}")
+    print(f"Corpus: {len(data)} bytes, {len(pcm)} samples")
+
+    all_settings = [base.replace(f"{base.name}_{bits}", fractional_bits=bits)
+                    for bits in range(args.min_bits, args.max_bits + 1)]
+    with ProcessPoolExecutor(args.processes) as pool:
+        results = list(pool.map(evaluate, all_settings,
+                                [pcm] * len(all_settings),
+                                [data] * len(all_settings),
+                                [reference_bits] * len(all_settings)))
+
+    print("frac bits  all bits  cycles  ROM bytes  bit errors       BER  match ref  run time")
+    recommended: typing.Optional[SweepResult] = None
+    for result in results:
+        settings = result.settings
+        print(f"{settings.fractional_bits:9d} {settings.all_bits:9d} {result.cycles:7d} "
+              f"{result.rom_bytes:10d} ", end="")
+        if result.overflow:
+            print("  overflow")
+            continue
+        print(f"{result.bit_errors:11d} {result.bit_error_rate:9.4f} "
+              f"{result.reference_match * 100.0:9.2f}% {result.run_time:8.1f}s")
+        if (recommended is None) and (result.bit_error_rate <= args.target_ber):
+            recommended = result
+
+    if recommended is None:
+        print(f"No width meets the target BER {args.target_ber}")
+        sys.exit(1)
+
+    settings = recommended.settings
+    print(f"Recommended: FRACTIONAL_BITS = {settings.fractional_bits} "
+          f"(ALL_BITS = {settings.all_bits}), {recommended.cycles} cycles per sample")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from settings import (
+        Settings, DEFAULT_SETTINGS,
+    )
+from filter_implementation import (
+        Detector, make_fixed, compute_bandpass_filter, compute_goertzel_detectors,
+        rc_decay_factor,
+    )
+import typing
+
+# Word-level model of the demodulator programs (demodulator and
+# goertzel_demodulator in filter_implementation): each step of the program
+# is computed on whole register values rather than one bit per clock
+# cycle, giving the same outputs as FuncExecutor, but much faster.
+#
+# This is exact because the bit-serial multiplication adds the complete
+# product of the source register and the coefficient to R (modulo 2^r_bits)
+# and moving R to a register takes bits fractional_bits upwards.
+
+class WordDemodulator:
+    def __init__(self, settings: Settings = DEFAULT_SETTINGS,
+                 detector: Detector = Detector.BIQUAD) -> None:
+        self.settings = settings
+        self.detector = detector
+        frequencies = [settings.upper_frequency, settings.lower_frequency]
+
+        # Coefficients for the inputs (I0, I2) and outputs (O1, O2) of each
+        # filter, as signed integers
+        self.coefficients: typing.List[typing.Tuple[int, int, int, int]] = []
+        if detector == Detector.BIQUAD:
+            for frequency in frequencies:
+                (a1, a2, b0, b2) = compute_bandpass_filter(
+                        frequency, settings.filter_width, settings.sample_rate)
+                self.coefficients.append((self.signed(b0), self.signed(b2),
+                                          self.signed(-a1), self.signed(-a2)))
+        else:
+            (shift, detectors) = compute_goertzel_detectors(
+                    frequencies, settings.filter_width, settings.sample_rate)
+            for (a1, a2) in detectors:
+                self.coefficients.append((1 << (settings.fractional_bits - shift), 0,
+                                          self.signed(-a1), self.signed(-a2)))
+        self.decay = self.signed(rc_decay_factor(settings))
+
+        # State: inputs, then O1, O2 and L for each filter (as unsigned values)
+        self.i1 = self.i2 = 0
+        self.state = [[0, 0, 0] for frequency in frequencies]
+
+    def signed(self, value: float) -> int:
+        ivalue = make_fixed(value, self.settings)
+        if ivalue >> (self.settings.all_bits - 1):
+            ivalue -= 1 << self.settings.all_bits
+        return ivalue
+
+    def run(self, in_values: typing.Iterable[int], debug_outputs: bool = False) -> typing.List[int]:
+        # in_values and outputs are as FuncExecutor.run: Y for each input,
+        # preceded by O1 and L for each filter if debug_outputs is set
+        all_bits = self.settings.all_bits
+        fractional_bits = self.settings.fractional_bits
+        mask = (1 << all_bits) - 1
+        sign = 1 << (all_bits - 1)
+        r_mask = (1 << self.settings.r_bits) - 1
+        decay = self.decay
+        (upper, lower) = self.state
+        (upper_coefficients, lower_coefficients) = self.coefficients
+        i1 = self.i1
+        i2 = self.i2
+        out_values: typing.List[int] = []
+        for i0 in in_values:
+            si0 = i0 - ((i0 & sign) << 1)
+            si2 = i2 - ((i2 & sign) << 1)
+            for (s, (c0, c2, c3, c4)) in ((upper, upper_coefficients),
+                                         (lower, lower_coefficients)):
+                # Filter: R = (I0 * c0) + (I2 * c2) + (O1 * c3) + (O2 * c4)
+                (o1, o2, level) = s
+                r = ((si0 * c0) + (si2 * c2) + ((o1 - ((o1 & sign) << 1)) * c3)
+                     + ((o2 - ((o2 & sign) << 1)) * c4))
+                o2 = o1
+                o1 = ((r & r_mask) >> fractional_bits) & mask
+
+                # Decay L, then L = max(L, abs(O1))
+                level = ((((level - ((level & sign) << 1)) * decay) & r_mask)
+                         >> fractional_bits) & mask
+                x = ((- o1) & mask) if (o1 & sign) else o1
+                if not ((x - level) & sign):
+                    level = x
+                s[0] = o1
+                s[1] = o2
+                s[2] = level
+                if debug_outputs:
+                    out_values.append(o1)
+                    out_values.append(level)
+
+            # Y = L (lower) - L (upper)
+            out_values.append((lower[2] - upper[2]) & mask)
+            if self.detector == Detector.BIQUAD:
+                i2 = i1
+                i1 = i0
+        self.i1 = i1
+        self.i2 = i2
+        return out_values
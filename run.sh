@@ -19,6 +19,7 @@ cp fpga/banked_shift_register.vhdl $P
 cp fpga/filter_unit.vhdl $P
 cp fpga/shift_register.vhdl $P
 cp fpga/subtractor.vhdl $P
+cp fpga/input_fifo.vhdl $P
 cp fpga/debug_textio-body.vhdl $P
 cp fpga/debug_textio.vhdl $P
 cp $G/filter_unit_control_line_decoder.vhdl $P
@@ -46,6 +47,8 @@ $G/packetgen.exe wav $G/packet.wav 1 2 4 8 16 32 64 128 256 512
 
 # Functional test (Python only)
 python microops/func_test.py
+python microops/func_test.py --rom
+python microops/func_test.py --cycle
 
 # Test VHDL components without microcode
 generated/packetgen.exe vhdl generated/test_packet_signal.vhdl 0xc001
@@ -57,6 +60,9 @@ cd ..
 # Test VHDL components with microcode
 python microops/ghdl_test.py
 
+# Hardware test against the Python model of the FPGA (no board required)
+python microops/fpga_test.py virtual://
+
 # Hardware test (use with fpga_test_project_top_bitmap.bin)
 # python microops/fpga_test.py
 